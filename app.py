@@ -1,89 +1,37 @@
 from flask import Flask, request, Response
 import os
+import time
 from dotenv import load_dotenv
-import requests
-import traceback
 import logging
+import threading
 from twilio.twiml.messaging_response import MessagingResponse
 import json
-from database import init_db, get_user, create_user, update_user_medical_history, update_user_language
+import hmac
+from log_config import configure_logging, get_logging_stats, sampled
+from database import DatabaseUnavailableError, get_supabase_client, get_user, create_user, append_messages, get_recent_messages, update_user_language, get_database_stats
+from reply_dispatcher import get_reply_metrics, get_twilio_client, submit_message
+from llm_client import OPENAI_API_URL, chat_completion, get_session, stream_chat_completion
+from message_chunker import chunk_stream
+from session_store import create_session_store
+from context_window import build_context, count_message_tokens, estimate_tokens, get_context_stats
+from metrics import METRICS_ENABLED, record_usage, register_collector, render_metrics, request_span, span
+from prompts import get_prompt_prefix, load_prompts
+from circuit_breaker import CircuitOpenError, get_breaker_stats
+from rate_limit import ALLOWED, WARN, get_rate_limit_stats, get_rate_limiter
+from model_router import classify_turn, get_routing_stats, record_route, route_settings
+from idempotency import get_idempotency_stats, process_once
+from response_cache import RESPONSE_CACHE_ENABLED, get_response_cache, get_response_cache_stats, is_first_turn
+from medicine_catalog import get_catalog, load_catalog
+from onboarding import LANGUAGES, LANGUAGE_SELECTION_MESSAGE, ONBOARDING_FIELDS, PROFILE_FIELDS, get_flow, load_onboarding, pending_field
     
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, 
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Configure logging (see log_config.py for the production mode)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# Common Indian medicines by category
-COMMON_MEDICINES = {
-    "fever": [
-        {"name": "Crocin", "brand": "GSK", "generic": "Paracetamol"},
-        {"name": "Dolo 650", "brand": "Micro Labs", "generic": "Paracetamol"},
-        {"name": "Calpol", "brand": "GSK", "generic": "Paracetamol"},
-        {"name": "Sumo", "brand": "CFL Pharma", "generic": "Paracetamol"},
-        {"name": "Febrinil", "brand": "Aristo", "generic": "Paracetamol"}
-    ],
-    "headache": [
-        {"name": "Saridon", "brand": "Bayer", "generic": "Propyphenazone+Paracetamol"},
-        {"name": "Dart", "brand": "Cipla", "generic": "Paracetamol+Caffeine"},
-        {"name": "Disprin", "brand": "Reckitt", "generic": "Aspirin"},
-        {"name": "Combiflam", "brand": "Sanofi", "generic": "Ibuprofen+Paracetamol"}
-    ],
-    "cold": [
-        {"name": "Vicks Action 500", "brand": "P&G", "generic": "Paracetamol+Phenylephrine"},
-        {"name": "D'Cold Total", "brand": "Reckitt", "generic": "Paracetamol+Phenylephrine"},
-        {"name": "Coldarin", "brand": "Alkem", "generic": "Phenylephrine+Chlorpheniramine"},
-        {"name": "Sinarest", "brand": "Centaur", "generic": "Paracetamol+Phenylephrine+Caffeine"},
-        {"name": "Nasivion", "brand": "Merck", "generic": "Oxymetazoline"}
-    ],
-    "allergies": [
-        {"name": "Allegra", "brand": "Sanofi", "generic": "Fexofenadine"},
-        {"name": "Cetrizine", "brand": "Various", "generic": "Cetirizine"},
-        {"name": "Montek LC", "brand": "Sun Pharma", "generic": "Montelukast+Levocetirizine"},
-        {"name": "Avil", "brand": "Sanofi", "generic": "Pheniramine Maleate"},
-        {"name": "Teczine", "brand": "GSK", "generic": "Levocetirizine"}
-    ],
-    "stomach_pain": [
-        {"name": "Buscopan", "brand": "Sanofi", "generic": "Hyoscine Butylbromide"},
-        {"name": "Cyclopam", "brand": "Indoco", "generic": "Dicyclomine"},
-        {"name": "Meftal Spas", "brand": "Blue Cross", "generic": "Mefenamic Acid+Dicyclomine"},
-        {"name": "Spasmo Proxyvon", "brand": "Wockhardt", "generic": "Dicyclomine+Paracetamol"}
-    ],
-    "acidity": [
-        {"name": "Eno", "brand": "GSK", "generic": "Sodium Bicarbonate+Citric Acid"},
-        {"name": "Digene", "brand": "Abbott", "generic": "Magnesium Hydroxide+Simethicone"},
-        {"name": "Gelusil", "brand": "Pfizer", "generic": "Aluminium Hydroxide+Magnesium Hydroxide"},
-        {"name": "Pan-D", "brand": "Alkem", "generic": "Pantoprazole+Domperidone"},
-        {"name": "Aciloc", "brand": "Cadila", "generic": "Ranitidine"}
-    ],
-    "diarrhea": [
-        {"name": "Lopamide", "brand": "Cipla", "generic": "Loperamide"},
-        {"name": "Eldoper", "brand": "Micro Labs", "generic": "Loperamide"},
-        {"name": "Norflox-TZ", "brand": "Cipla", "generic": "Norfloxacin+Tinidazole"},
-        {"name": "Enteroquinol", "brand": "Sanofi", "generic": "Clioquinol"},
-        {"name": "ORS", "brand": "Various", "generic": "Oral Rehydration Solution"}
-    ],
-    "pain_relief": [
-        {"name": "Combiflam", "brand": "Sanofi", "generic": "Ibuprofen+Paracetamol"},
-        {"name": "Brufen", "brand": "Abbott", "generic": "Ibuprofen"},
-        {"name": "Voveran", "brand": "Novartis", "generic": "Diclofenac"},
-        {"name": "Ultracet", "brand": "J&J", "generic": "Tramadol+Paracetamol"},
-        {"name": "Flexon", "brand": "Dr. Reddy's", "generic": "Etoricoxib"}
-    ],
-    "cough": [
-        {"name": "Benadryl", "brand": "J&J", "generic": "Diphenhydramine"},
-        {"name": "Honitus", "brand": "Dabur", "generic": "Herbal Formulation"},
-        {"name": "Ascoril", "brand": "Glenmark", "generic": "Terbutaline+Bromhexine"},
-        {"name": "Koflet", "brand": "Himalaya", "generic": "Herbal Formulation"},
-        {"name": "Chericof", "brand": "Cipla", "generic": "Codeine+Chlorpheniramine"}
-    ],
-    "vitamins": [
-        {"name": "Becosules", "brand": "Pfizer", "generic": "B-Complex+Vitamin C"},
-        {"name": "Supradyn", "brand": "Bayer", "generic": "Multivitamin+Minerals"},
-        {"name": "Shelcal", "brand": "Torrent", "generic": "Calcium+Vitamin D3"},
-        {"name": "Neurobion", "brand": "Merck", "generic": "B1+B6+B12"},
-        {"name": "Zincovit", "brand": "Apex", "generic": "Multivitamin+Zinc"}
-    ]
-}
+# Build the ready-to-send system prompts, onboarding flows and the medicine index once, not on every turn
+load_prompts()
+load_onboarding()
+load_catalog()
 
 # Load environment variables
 load_dotenv()
@@ -99,136 +47,190 @@ if not OPENAI_API_KEY:
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 
-logger.info(f"OPENAI_API_KEY loaded: {'Yes' if OPENAI_API_KEY else 'No'}")
-logger.info(f"TWILIO credentials loaded: {'Yes' if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN else 'No'}")
+logger.info("OPENAI_API_KEY loaded: %s", "Yes" if OPENAI_API_KEY else "No")
+logger.info("TWILIO credentials loaded: %s", "Yes" if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN else "No")
 
-# Print all environment variables for debugging (be careful with sensitive info)
-logger.debug("Environment variables:")
-for key, value in os.environ.items():
-    if 'KEY' in key or 'SECRET' in key or 'SID' in key or 'TOKEN' in key:
-        logger.debug(f"{key}: {'[REDACTED]'}")
-    else:
-        logger.debug(f"{key}: {value}")
-
-OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
-
-# Modify system prompt to include formatting for options
-SYSTEM_PROMPT = """
-You are a friendly, conversational medical assistant. Follow these guidelines:
-
-1. When presenting options to the user, always format them as a numbered list:
-   Example:
-   Please describe your headache:
-   1️⃣ Sharp pain
-   2️⃣ Dull ache
-   3️⃣ Throbbing sensation
-   4️⃣ Other (please describe)
-   
-   Reply with the number of your choice or type your own response.
-
-2. Once you know their name, always address the user by their name.
-3. After getting their name, ask for their age and gender specifically.
-4. Only after collecting name, age, and gender, ask about their health concerns or symptoms.
-5. When asking about health issues, provide examples as numbered options.
-6. Keep track of their name, age, gender and health history throughout the conversation.
-7. Keep responses short and conversational - use 1-3 sentences where possible.
-8. Speak naturally like a real doctor or nurse would in conversation.
-9. Ask focused follow-up questions about symptoms - one question at a time.
-10. Present options when appropriate (like pain types, severity, etc.) using the numbered format.
-11. Use a warm, empathetic tone while maintaining professionalism.
-12. For common ailments, suggest 2-3 specific over-the-counter medicines available in India from our medicine list, including both brand name and generic name. For example: "For your fever, you might consider taking Dolo 650 (Paracetamol) or Crocin (Paracetamol)."
-13. After suggesting medication, recommend consulting a healthcare professional for proper diagnosis and treatment.
-14. DO NOT repeatedly state that you're an AI assistant or that you're not a replacement for professional medical care. Only mention this at the very end of the conversation.
-15. When discussing serious symptoms, recommend seeing a doctor immediately.
-16. Prioritize clarity and brevity over comprehensiveness.
-
-Remember: Be conversational and human-like. Follow the exact sequence: 1) ask name, 2) ask age and gender, 3) ask about medical conditions with examples.
-"""
-
-# Available languages and their system prompts
-LANGUAGES = {
-    "1": {"name": "English", "code": "en"},
-    "2": {"name": "Hindi", "code": "hi"}, 
-    "3": {"name": "Tamil", "code": "ta"},
-    "4": {"name": "Telugu", "code": "te"},
-    "5": {"name": "Kannada", "code": "kn"},
-    "6": {"name": "Malayalam", "code": "ml"}
-}
-
-# Translated language selection message
-LANGUAGE_SELECTION_MESSAGE = {
-    "en": "Welcome to the Medical Assistant! Please select your preferred language:\n1️⃣ English\n2️⃣ Hindi\n3️⃣ Tamil\n4️⃣ Telugu\n5️⃣ Kannada\n6️⃣ Malayalam\n\nReply with the number of your choice.",
-    "hi": "मेडिकल असिस्टेंट में आपका स्वागत है! कृपया अपनी पसंदीदा भाषा चुनें:\n1️⃣ अंग्रे़ी\n2️⃣ हिंदी\n3️⃣ तमिल\n4️⃣ तेलुगु\n5️⃣ कन्नड़\n6️⃣ मलयालम\n\nअपनी पसंद का नंबर लिखकर जवाब दें।",
-    "ta": "மருத்துவ உதவியாளருக்கு வரவேற்கிறோம்! உங்கள் விருப்பமான மொழியைத் தேர்ந்தெடுக்கவும்:\n1️⃣ ஆங்கிலம்\n2️⃣ இந்தி\n3️⃣ தமிழ்\n4️⃣ தெலுங்கு\n5️⃣ கன்னடம்\n6️⃣ மலையாளம்\n\nஉங்கள் தேர்வின் எண்ணுடன் பதிலளிக்கவும்.",
-    "te": "మెడికల్ అసిస్టెంట్‌ని ఉపయోగించినందుకు ధన్యవాదాలు. మీ సంభాషణ ముగిసింది. భవిష్యత్తులో కొత్త సంభాషణను ప్రారంభించాలనుకుంటే 'reset' టైప్ చేయండి.",
-    "kn": "ವೈದ್ಯಕೀಯ ಸಹಾಯಕಕ್ಕೆ ಸುಸ್ವಾಗತ! ದಯವಿಟ್ಟು ನಿಮ್ಮ ಆದ್ಯತೆಯ ಭಾಷೆಯನ್ನು ಆಯ್ಕೆಮಾಡಿ:\n1️⃣ ಇಂಗ್ಲಿಷ್\n2️⃣ ಹಿಂದಿ\n3️⃣ ತಮಿಳು\n4️⃣ ತೆಲುಗು\n5️⃣ ಕನ್ನಡ\n6️⃣ ಮಲಯಾಳಂ\n\nನಿಮ್ಮ ಆಯ್ಕೆಯ ಸಂಖ್ಯೆಯೊಂದಿಗೆ ಉತ್ತರಿಸಿ.",
-    "ml": "മെഡിക്കൽ അസിസ്റ്റന്റ് ആണ്! നിങ്ങളുടെ ഇഷ്ടപ്പെട്ട ഭാഷ തിരഞ്ഞെടുക്കുക:\n1️⃣ ഇംഗ്ലീഷ്\n2️⃣ ഹിന്ദി\n3️⃣ തമിഴ്\n4️⃣ തെലുങ്ക്\n5️⃣ കന്നഡ\n6️⃣ മലയാളം\n\nനിങ്ങളുടെ തിരഞ്ഞെടുക്കലിന്റെ നമ്പർ ഉപയോഗിച്ച് മറുപടി നൽകുക."
-}
-
-# Initialize database on startup
-init_db()
-
-# Store chat history per user
-user_sessions = {}
+# When enabled, the webhook acknowledges Twilio immediately and replies are
+# generated by a background worker pool and sent through the Twilio REST API
+ASYNC_REPLIES = os.getenv("ASYNC_REPLIES", "false").lower() == "true"
+# With asynchronous replies, stream the LLM response and send it as several
+# WhatsApp messages as soon as each part is ready
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "false").lower() == "true"
+
+# Number of recent context messages scanned for symptoms to pick medicine categories
+MEDICINE_CONTEXT_MESSAGES = 6
+
+# Striped locks that keep concurrent messages from one user in order
+USER_LOCKS = [threading.Lock() for _ in range(256)]
+
+# Number of past messages loaded into a new session of a returning user
+HISTORY_LOAD_MESSAGES = int(os.getenv("HISTORY_LOAD_MESSAGES", "20"))
+
+# Build the Supabase, OpenAI and Twilio clients before the first request
+# (see warm_up); otherwise they are created when first needed
+WARM_UP = os.getenv("WARM_UP", "true").lower() == "true"
+
+# Clients that could not be created by warm_up() in this process, None until
+# it ran; /ready only reads this
+_warm_up_failed = None
+_warm_up_lock = threading.Lock()
+
+# Bearer token of the /admin routes, which answer 404 while it is unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def persist_new_messages(user_id, user_data):
+    """Append the messages added to the session since the last call to the user's transcript"""
+    # Only registered users have a database row to attach messages to
+    if not user_data.get("profile"):
+        return
+    history = user_data["history"]
+    persisted = user_data.get("persisted_upto", 0)
+    if persisted > len(history):
+        # The history was replaced (e.g. on language selection)
+        persisted = 0
+    if persisted < len(history):
+        with span("db_write"):
+            append_messages(user_id, history[persisted:])
+    user_data["persisted_upto"] = len(history)
+
+def write_back_session(user_id, user_data):
+    """Persist the messages of a session that is evicted from memory"""
+    persist_new_messages(user_id, user_data)
+
+# Store chat history per user, in process or in a backend shared by all workers
+user_sessions = create_session_store(on_evict=write_back_session)
+
+# Export the counters the components already keep on /metrics
+register_collector("sessions", user_sessions.stats)
+register_collector("replies", get_reply_metrics)
+register_collector("context", get_context_stats)
+register_collector("database", get_database_stats)
+register_collector("logging", get_logging_stats)
+register_collector("response_cache", get_response_cache_stats)
+register_collector("idempotency", get_idempotency_stats)
+register_collector("model_router", get_routing_stats)
+register_collector("circuit_breaker", get_breaker_stats)
+register_collector("rate_limit", get_rate_limit_stats)
 
 def get_chat_history(user_id):
-    """Get or initialize chat history for a user"""
-    if user_id not in user_sessions:
+    """
+    Get or initialize chat history for a user
+    
+    Raises DatabaseUnavailableError, without creating a session, if the user
+    has no session and the database can't tell whether they are registered.
+    """
+    with span("session_lookup"):
+        user_data = user_sessions.get(user_id)
+    if user_data is None:
         # Check if user exists in database
-        user = get_user(user_id)
+        with span("db_read"):
+            user = get_user(user_id)
+            # Continue from the end of the stored transcript
+            recent = get_recent_messages(user_id, HISTORY_LOAD_MESSAGES) if user else []
         if user:
             # Initialize session with user data from database
-            user_sessions[user_id] = {
+            user_data = {
                 "language_selected": True,
                 "language": user['language'],
-                "history": [],
-                "name": user['name'],
-                "age": user['age'],
-                "gender": user['gender'],
-                "medical_history": user['medical_history']
+                "history": [{"role": message["role"], "content": message["content"]} for message in recent],
+                "persisted_upto": len(recent),
+                "profile": {field: user[field] for field in PROFILE_FIELDS}
             }
+            user_data.update(user_data["profile"])
         else:
-            # Initialize new session
-            user_sessions[user_id] = {
+            # Initialize new session, remembering that the user is not registered yet
+            user_data = {
                 "language_selected": False,
                 "language": "en",
-                "history": []
+                "history": [],
+                "profile": None
             }
-        return user_sessions[user_id]
-    return user_sessions[user_id]
+        user_data = user_sessions.save(user_id, user_data)
+    return user_data
+
+def save_chat_history(user_id, user_data):
+    """Store the session after a message, merging updates made concurrently by other workers"""
+    with span("session_save"):
+        return user_sessions.save(user_id, user_data)
 
 def reset_chat_history(user_id):
-    """Reset chat history for a user"""
-    user_sessions[user_id] = {
+    """Reset chat history for a user, keeping their language and the profile already read from the database"""
+    user_data = {
         "language_selected": False,
         "language": "en",
         "history": []
     }
-    return user_sessions[user_id]
-
-def get_system_prompt_for_language(language_code):
-    """Get system prompt translated for the specified language"""
-    # This is a simplified version - in a real app, you would have complete translations
-    # of the system prompt for each language
-    if language_code == "en":
-        return SYSTEM_PROMPT
-    elif language_code == "hi":
-        # Hindi system prompt
-        return SYSTEM_PROMPT.replace("You are a friendly", "आप एक मित्रवत").replace("medical assistant", "चिकित्सा सहायक हैं")
-    elif language_code == "ta":
-        # Tamil system prompt
-        return SYSTEM_PROMPT.replace("You are a friendly", "நீங்கள் ஒரு நட்பான").replace("medical assistant", "மருத்துவ உதவியாளர்")
-    elif language_code == "te":
-        # Telugu system prompt
-        return SYSTEM_PROMPT.replace("You are a friendly", "మీరు స్నేహపూర్వకమైన").replace("medical assistant", "వైద్య సహాయకులు")
-    elif language_code == "kn":
-        # Kannada system prompt
-        return SYSTEM_PROMPT.replace("You are a friendly", "ನೀವು ಸ್ನೇಹಪರ").replace("medical assistant", "ವೈದ್ಯಕೀಯ ಸಹಾಯಕ")
-    elif language_code == "ml":
-        # Malayalam system prompt
-        return SYSTEM_PROMPT.replace("You are a friendly", "നിങ്ങൾ ഒരു സൗഹൃദപരമായ").replace("medical assistant", "മെഡിക്കൽ അസിസ്റ്റന്റ് ആണ്")
-    else:
-        return SYSTEM_PROMPT
+    previous = user_sessions.get(user_id)
+    if previous is not None:
+        user_data["language"] = previous.get("language", "en")
+        if "profile" in previous:
+            user_data["profile"] = previous["profile"]
+    return user_sessions.set(user_id, user_data)
+
+def get_profile(user_id, user_data):
+    """
+    Return the user's stored profile, reading the database only if the session doesn't know it yet
+    
+    A failed read raises DatabaseUnavailableError and leaves the session as it was.
+    """
+    if "profile" not in user_data:
+        with span("db_read"):
+            db_user = get_user(user_id)
+        user_data["profile"] = {field: db_user[field] for field in PROFILE_FIELDS} if db_user else None
+    return user_data["profile"]
+
+def register_user(user_id, user_data):
+    """Create the user's database row once onboarding is complete; the transcript follows in the messages table"""
+    with span("db_write"):
+        success = create_user(
+            user_id,  # Use the cleaned phone number
+            user_data["name"],
+            user_data["age"],
+            user_data["gender"],
+            previous_health_issues=user_data["previous_health_issues"],
+            surgeries=user_data["surgeries"],
+            language=user_data["language"]
+        )
+    if success:
+        user_data["profile"] = {field: user_data[field] for field in PROFILE_FIELDS}
+    return success
+
+def warm_up():
+    """
+    Create the external clients now instead of on the first request
+    
+    Called in every gunicorn worker by the post_fork hook in gunicorn.conf.py
+    and when the ASGI app starts.
+    
+    Returns:
+        list: The names of the clients that could not be created
+    """
+    global _warm_up_failed
+    failed = []
+    if get_supabase_client() is None:
+        failed.append("database")
+    try:
+        get_session()
+        if ASYNC_REPLIES:
+            get_twilio_client()
+    except Exception as e:
+        logger.error("Error creating API clients: %s", e)
+        failed.append("api_clients")
+    _warm_up_failed = failed
+    return failed
+
+def warm_up_failures():
+    """
+    Return the clients this process could not create, for the readiness probe
+    
+    The result of the warm-up at startup is reused, so a probe costs nothing.
+    Without it (WARM_UP=false) the first probe warms up instead.
+    """
+    if _warm_up_failed is None:
+        with _warm_up_lock:
+            if _warm_up_failed is None:
+                warm_up()
+    return _warm_up_failed
 
 def clean_phone_number(whatsapp_number):
     """Clean the WhatsApp phone number by removing 'whatsapp:' prefix and any non-numeric characters"""
@@ -241,9 +243,16 @@ def clean_phone_number(whatsapp_number):
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """Handle incoming WhatsApp messages"""
+    with request_span("webhook"):
+        return handle_webhook()
+
+def handle_webhook():
+    """Answer the Twilio request of an incoming message"""
     # Get the message content and user ID (phone number)
     incoming_msg = request.values.get('Body', '').strip()
     raw_user_id = request.values.get('From', '')
+    # Twilio retries a webhook that doesn't answer in time with the same MessageSid
+    message_sid = request.values.get('MessageSid')
     
     # Clean the phone number
     user_id = clean_phone_number(raw_user_id)
@@ -251,37 +260,206 @@ def webhook():
     # Initialize Twilio response
     resp = MessagingResponse()
     
+    # A retry gets the replies of the first delivery instead of a second LLM call
+    for message in process_once(message_sid, lambda: handle_incoming(raw_user_id, user_id, incoming_msg)):
+        resp.message(message)
+    return str(resp)
+
+def handle_incoming(raw_user_id, user_id, incoming_msg):
+    """Handle a new message: rate limit it, then answer it or queue it for an asynchronous reply"""
+    limited = admit_message(user_id)
+    if limited is not None:
+        return limited
+    
+    if ASYNC_REPLIES:
+        # Acknowledge right away, the reply is delivered through the REST API
+        submit_message(raw_user_id, user_id, process_messages, incoming_msg)
+        return []
+    
+    return process_messages(user_id, [incoming_msg])
+
+def admit_message(user_id):
+    """
+    Take a token from the sender's message bucket before doing any work
+    
+    Returns:
+        list: None if the message may be handled; otherwise the replies to send
+            instead, the slow-down notice for the first refused message and
+            nothing for the next ones
+    """
+    result = get_rate_limiter().check_message(user_id)
+    if result == ALLOWED:
+        return None
+    if result == WARN:
+        user_data = user_sessions.get(user_id) or {}
+        return [get_flow(user_data.get("language", "en")).texts["slow_down"]]
+    return []
+
+def user_lock(user_id):
+    """Return the lock that serializes the handling of a user's messages in this process"""
+    return USER_LOCKS[hash(user_id) % len(USER_LOCKS)]
+
+def is_conversation_turn(user_data, incoming_msg):
+    """Check whether a message goes to the LLM rather than a command or onboarding step"""
+    if incoming_msg.lower() in ('reset', 'bye'):
+        return False
+    return user_data["language_selected"] and pending_field(user_data) is None
+
+def process_messages(user_id, messages, send=None):
+    """
+    Process messages from one user in order, one burst at a time
+    
+    Consecutive conversation messages are merged into a single user turn so
+    that a burst of short messages produces one LLM call. Commands and
+    onboarding answers are still handled one by one.
+    
+    Args:
+        user_id (str): The cleaned phone number of the user
+        messages (list): The incoming messages, in arrival order
+        send (callable): Optional send(body) delivering replies as soon as they
+            are ready; when given, nothing is returned
+        
+    Returns:
+        list: The reply messages to send back, in order
+    """
+    replies = []
+    
+    def handle(incoming_msg):
+        for reply in process_message(user_id, incoming_msg, send):
+            if send:
+                send(reply)
+            else:
+                replies.append(reply)
+    
+    with user_lock(user_id):
+        for incoming_msg in iter_turns(user_id, messages):
+            handle(incoming_msg)
+    return replies
+
+def iter_turns(user_id, messages):
+    """
+    Yield the messages of a burst to handle one by one, merging consecutive
+    conversation messages into one turn
+
+    Each message is classified against the session as left by the previous
+    turn, so the caller must handle a turn before asking for the next one.
+    """
+    if len(messages) == 1:
+        # Nothing to merge
+        yield messages[0]
+        return
+    pending = []
+    for incoming_msg in messages:
+        try:
+            user_data = get_chat_history(user_id)
+        except DatabaseUnavailableError:
+            # Each message gets the reply that the database is unavailable
+            user_data = None
+        if user_data is not None and is_conversation_turn(user_data, incoming_msg):
+            pending.append(incoming_msg)
+            continue
+        if pending:
+            yield "\n".join(pending)
+            pending = []
+        yield incoming_msg
+    if pending:
+        yield "\n".join(pending)
+
+def process_message(user_id, incoming_msg, send=None):
+    """
+    Process an incoming message and generate the replies for it
+    
+    Args:
+        user_id (str): The cleaned phone number of the user
+        incoming_msg (str): The text of the incoming message
+        send (callable): Optional send(body) used to stream the LLM reply
+        
+    Returns:
+        list: The reply messages to send back, in order
+    """
+    replies = handle_command(user_id, incoming_msg)
+    if replies is not None:
+        return replies
+    
+    # Get user data
+    try:
+        user_data = get_chat_history(user_id)
+    except DatabaseUnavailableError:
+        return unavailable_reply({})
+    try:
+        return handle_conversation(user_id, user_data, incoming_msg, send)
+    finally:
+        end_turn(user_id, user_data)
+
+def handle_command(user_id, incoming_msg):
+    """Handle the reset and bye commands; returns their replies, or None for other messages"""
+    replies = []
+    
     # Reset command
     if incoming_msg.lower() == 'reset':
         user_data = reset_chat_history(user_id)
-        resp.message(LANGUAGE_SELECTION_MESSAGE["en"])
-        return str(resp)
+        replies.append(LANGUAGE_SELECTION_MESSAGE["en"])
+        return replies
     
     # Bye command
     if incoming_msg.lower() == 'bye':
         # Reset chat history and add a goodbye message based on user's selected language
         user_data = reset_chat_history(user_id)
-        lang_code = user_data.get("language", "en")
-        
-        goodbye_messages = {
-            "en": "Thank you for using the Medical Assistant. Your conversation has been ended. Type 'bye' if you'd like to end the conversation and start a new one.",
-            "hi": "मेडिकल असिस्टेंट का उपयोग करने के लिए धन्यवाद। आपकी बातचीत समाप्त हो गई है। यदि आप बातचीत समाप्त करना और एक नई बातचीत शुरू करना चाहते हैं तो 'bye' टाइप करें।",
-            "ta": "மருத்துவ உதவியாளரைப் பயன்படுத்தியதற்கு நன்றி. உங்கள் உரையாடல் முடிந்தது. உரையாடலை முடிக்கவும் புதிய உரையாடலைத் தொடங்கவும் 'bye' என்று தட்டச்சு செய்யவும்.",
-            "te": "మెడికల్ అసిస్టెంట్‌ని ఉపయోగించినందుకు ధన్యవాదాలు. మీ సంభాషణ ముగిసింది. సంభాషణను ముగించడానికి మరియు కొత్త సంభాషణను ప్రారంభించడానికి 'bye' టైప్ చేయండి.",
-            "kn": "ವೈದ್ಯಕೀಯ ಸಹಾಯಕವನ್ನು ಬಳಸಿದ್ದಕ್ಕಾಗಿ ಧನ್ಯವಾದಗಳು. ನಿಮ್ಮ ಸಂಭಾಷಣೆಯನ್ನು ಕೊನೆಗೊಳಿಸಲಾಗಿದೆ. ಸಂಭಾಷಣೆಯನ್ನು ಕೊನೆಗೊಳಿಸಲು ಮತ್ತು ಹೊಸ ಸಂಭಾಷಣೆಯನ್ನು ಪ್ರಾರಂಭಿಸಲು ನೀವು 'bye' ಎಂದು ಟೈಪ್ ಮಾಡಬಹುದು.",
-            "ml": "മെഡിക്കൽ അസിസ്റ്റന്റ് ഉപയോഗിച്ചതിന് നന്ദി. നിങ്ങളുടെ സംഭാഷണം അവസാനിച്ചു. സംഭാഷണനു മുഗ്യിക്കാൻ മത്തു സംഭാഷണനു പ്രാരംഭിസ്റ്റുകയും നിങ്ങൾക്ക് ആഗ്രഹിക്കുന്നുവെങ്കിൽ 'bye' എന്ന് ടൈപ്പ് ചെയ്യാം."
-        }
-        
-        goodbye_message = goodbye_messages.get(lang_code, goodbye_messages["en"])
-        resp.message(goodbye_message)
+        goodbye_message = get_flow(user_data.get("language", "en")).texts["goodbye"]
+        replies.append(goodbye_message)
         
         # Prompt user to select language again
-        resp.message(LANGUAGE_SELECTION_MESSAGE["en"])
+        replies.append(LANGUAGE_SELECTION_MESSAGE["en"])
         
-        return str(resp)
+        return replies
     
-    # Get user data
-    user_data = get_chat_history(user_id)
+    return None
+
+def end_turn(user_id, user_data):
+    """Persist the new messages and store the session after a message was handled"""
+    persist_new_messages(user_id, user_data)
+    save_chat_history(user_id, user_data)
+
+def handle_conversation(user_id, user_data, incoming_msg, send=None):
+    """Continue onboarding or the medical conversation, updating the session in place"""
+    replies, payload = begin_conversation_turn(user_id, user_data, incoming_msg)
+    if payload is None:
+        return replies
+    
+    if sampled():
+        logger.info("Sending request to OpenAI API: %s", OPENAI_API_URL)
+    
+    if STREAM_REPLIES and send:
+        return stream_conversation_reply(user_id, user_data, payload, send)
+    
+    try:
+        with span("openai"):
+            response = chat_completion(payload)
+        return finish_conversation_turn(user_data, response.status_code, response.text)
+    except CircuitOpenError:
+        return unavailable_reply(user_data)
+    except Exception as e:
+        return conversation_error(e)
+    finally:
+        # Still count a call that failed after the request went out
+        record_llm_call(user_data, completion="")
+
+def begin_conversation_turn(user_id, user_data, incoming_msg):
+    """
+    Handle a message up to the LLM call
+    
+    Language selection and onboarding answers are handled completely. For a
+    conversation message, the chat completions request is built instead.
+    
+    Args:
+        user_id (str): The cleaned phone number of the user
+        user_data (dict): The user's session, updated in place
+        incoming_msg (str): The text of the incoming message
+        
+    Returns:
+        tuple: The replies so far and the request body for the LLM, or None if the turn is complete
+    """
+    replies = []
     
     # Check if language is already selected
     if not user_data["language_selected"]:
@@ -289,152 +467,225 @@ def webhook():
         if incoming_msg in LANGUAGES:
             # Set the selected language
             selected_lang = LANGUAGES[incoming_msg]["code"]
+            
+            # Returning users are recognized from the profile cached in the session
+            try:
+                profile = get_profile(user_id, user_data)
+            except DatabaseUnavailableError:
+                # Don't take a returning user through onboarding again, they can select the language once it's back
+                replies.append(get_flow(selected_lang).texts["unavailable"])
+                return replies, None
             user_data["language"] = selected_lang
             user_data["language_selected"] = True
-            
-            # Check if user exists in database
-            db_user = get_user(user_id)
-            if db_user:
+            if profile:
                 # User exists, load their data
-                user_data.update({
-                    "name": db_user["name"],
-                    "age": db_user["age"],
-                    "gender": db_user["gender"],
-                    "medical_history": db_user["medical_history"]
-                })
-                # Ask about current health concerns
-                next_question = f"Welcome back {db_user['name']}! How can I help you today?"
-            else:
-                # New user, ask for name
-                next_question = "Could you please tell me your name?"
+                user_data.update(profile)
+            next_question = get_flow(selected_lang).start(profile)
             
             user_data["history"] = [{"role": "assistant", "content": next_question}]
-            resp.message(next_question)
-            return str(resp)
+            user_data["persisted_upto"] = 0
+            # The first symptom question after onboarding may be answered from the response cache
+            user_data["conversation_started"] = False
+            replies.append(next_question)
+            return replies, None
         else:
             # Invalid language selection, send language options again
-            resp.message(LANGUAGE_SELECTION_MESSAGE["en"])
-            return str(resp)
+            replies.append(LANGUAGE_SELECTION_MESSAGE["en"])
+            return replies, None
     
     # Add user message to chat history
     user_data["history"].append({"role": "user", "content": incoming_msg})
     
-    # Check if name is provided
-    if "name" not in user_data:
-        user_data["name"] = incoming_msg
-        next_question = "Thank you! Could you please tell me your age?"
+    # Continue onboarding with the next profile question, no LLM call needed
+    field = pending_field(user_data)
+    if field:
+        flow = get_flow(user_data["language"])
+        next_question = flow.answer(user_data, field, incoming_msg)
         user_data["history"].append({"role": "assistant", "content": next_question})
-        resp.message(next_question)
-        return str(resp)
-    
-    # Check if age is provided
-    if "age" not in user_data:
-        user_data["age"] = incoming_msg
-        next_question = "Please select your gender:\n1️⃣ Male\n2️⃣ Female\n3️⃣ Other (please specify)"
-        user_data["history"].append({"role": "assistant", "content": next_question})
-        resp.message(next_question)
-        return str(resp)
-    
-    # Check if gender is provided
-    if "gender" not in user_data:
-        # Process gender selection
-        if incoming_msg == "1":
-            user_data["gender"] = "Male"
-        elif incoming_msg == "2":
-            user_data["gender"] = "Female"
-        else:
-            user_data["gender"] = incoming_msg  # Store the custom gender input
         
-        # Create new user in database
-        success = create_user(
-            user_id,  # Use the cleaned phone number
-            user_data["name"],
-            user_data["age"],
-            user_data["gender"],
-            language=user_data["language"]
-        )
+        # Save the whole profile in one write once the last question is answered
+        if field == ONBOARDING_FIELDS[-1] and not user_data.get("profile"):
+            if not register_user(user_id, user_data):
+                logger.error("Failed to create user with phone number: %s", user_id)
+                # Ask the last question again on the next message
+                user_data["history"].pop()
+                del user_data[field]
+                replies.append(flow.texts["save_error"])
+                return replies, None
         
-        if not success:
-            logger.error(f"Failed to create user with phone number: {user_id}")
-            resp.message("I'm sorry, there was an error saving your information. Please try again later.")
-            return str(resp)
-            
-        next_question = "Do you have any of the following health issues? (Reply with the number or type 'none' if you don't have any):\n1️⃣ Diabetes\n2️⃣ Blood Pressure\n3️⃣ Chronic Problems\n4️⃣ Kidney or Liver Issues\n5️⃣ Other (please specify)"
-        user_data["history"].append({"role": "assistant", "content": next_question})
-        resp.message(next_question)
-        return str(resp)
+        replies.append(next_question)
+        return replies, None
     
-    # Check if previous health issues are provided
-    if "previous_health_issues" not in user_data:
-        user_data["previous_health_issues"] = incoming_msg
-        next_question = "Have you undergone any surgeries? (Reply with the number or type 'none' if you haven't):\n1️⃣ Appendectomy\n2️⃣ C-section\n3️⃣ Knee/Hip Replacement\n4️⃣ Heart Surgery\n5️⃣ Other (please specify)"
-        user_data["history"].append({"role": "assistant", "content": next_question})
-        resp.message(next_question)
-        return str(resp)
+    # Only the first question of a conversation, asked with the onboarding
+    # answers as the only context, can get a reply written for someone else
+    user_data.pop("_cache_miss", None)
+    if RESPONSE_CACHE_ENABLED and is_first_turn(user_data):
+        cached_reply = get_response_cache().lookup(user_data, incoming_msg)
+        if cached_reply is not None:
+            user_data["conversation_started"] = True
+            user_data["history"].append({"role": "assistant", "content": cached_reply})
+            replies.append(cached_reply)
+            return replies, None
+        user_data["_cache_miss"] = (incoming_msg, time.monotonic())
+    user_data["conversation_started"] = True
     
-    # Check if surgeries are provided
-    if "surgeries" not in user_data:
-        user_data["surgeries"] = incoming_msg
-        next_question = "What health concerns or symptoms would you like to discuss today?"
-        user_data["history"].append({"role": "assistant", "content": next_question})
-        resp.message(next_question)
-        return str(resp)
+    # Don't call the LLM once the user's daily token budget is used up, or while
+    # the whole service is at its rate limit
+    refused = get_rate_limiter().check_llm_call(user_id)
+    if refused:
+        texts = get_flow(user_data["language"]).texts
+        replies.append(texts["daily_limit"] if refused == "budget" else texts["unavailable"])
+        return replies, None
     
     try:
         # Check if API key is available
         if not OPENAI_API_KEY:
             logger.error("OPENAI_API_KEY not found in environment variables")
-            resp.message("I'm sorry, the server is not properly configured. Please contact support.")
-            return str(resp)
-        
-        # Get the appropriate system prompt for the selected language
-        system_prompt = get_system_prompt_for_language(user_data["language"])
-        
-        # Add medicine data to the system prompt
-        medicine_info = f"\n\nAvailable medicines by category: {json.dumps(COMMON_MEDICINES, indent=2)}"
-        enhanced_system_prompt = system_prompt + medicine_info
-        
-        # Prepare the full conversation history for the API
-        messages = [{"role": "system", "content": enhanced_system_prompt}]
-        messages.extend(user_data["history"])
-        
-        # Call OpenAI API
-        headers = {
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": "gpt-4o",
-            "messages": messages,
-            "temperature": 0.7,
-            "max_tokens": 800
-        }
-        
-        logger.info(f"Sending request to OpenAI API: {OPENAI_API_URL}")
+            replies.append("I'm sorry, the server is not properly configured. Please contact support.")
+            return replies, None
         
-        response = requests.post(OPENAI_API_URL, headers=headers, json=payload, timeout=30)
-        
-        if response.status_code != 200:
-            logger.error(f"OpenAI API error: {response.status_code} - {response.text}")
-            resp.message("I'm sorry, I'm having trouble connecting to my knowledge source. Please try again in a moment.")
-        else:
-            response_json = response.json()
-            assistant_message = response_json["choices"][0]["message"]["content"]
-            user_data["history"].append({"role": "assistant", "content": assistant_message})
+        with span("prompt_build"):
+            # Get the prebuilt system prompt for the selected language
+            system_prompt = get_prompt_prefix(user_data["language"])
+            
+            # Prepare the conversation history for the API, older turns folded into a summary
+            context, tokens_saved = build_context(user_data, user_id)
             
-            # Update medical history in database
-            medical_history = json.dumps(user_data["history"])
-            update_user_medical_history(user_id, medical_history)
+            # Add only the medicine categories relevant to the conversation, after
+            # the stable system prompt so that it stays cacheable
+            recent_messages = [message["content"] for message in context[-MEDICINE_CONTEXT_MESSAGES:]]
+            medicine_info = get_catalog().prompt_for([user_data.get("context_summary", "")] + recent_messages)
             
-            resp.message(assistant_message)
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": medicine_info}
+            ]
+            messages.extend(context)
+        logger.debug("Context for %s: %d messages, ~%d prompt tokens saved", user_id, len(context), tokens_saved)
         
     except Exception as e:
-        logger.error(f"Error processing request: {str(e)}")
-        logger.error(traceback.format_exc())
-        resp.message(f"I'm sorry, I encountered an error: {str(e)}")
+        return conversation_error(e), None
     
-    return str(resp)
+    # Acknowledgements and answers to the bot's own questions go to a cheaper model
+    route = classify_turn(user_data, incoming_msg)
+    payload = {"messages": messages}
+    payload.update(route_settings(route))
+    user_data["_llm_call"] = (route, time.monotonic(), user_id, count_message_tokens(messages))
+    return replies, payload
+
+def finish_conversation_turn(user_data, status_code, body):
+    """
+    Handle the LLM response of a conversation turn
+    
+    Args:
+        user_data (dict): The user's session, updated in place
+        status_code (int): The HTTP status of the chat completions response
+        body (str): The response body
+        
+    Returns:
+        list: The reply messages to send back
+    """
+    if status_code != 200:
+        # The body of an error is short, but don't log a whole reply if something else went wrong
+        logger.error("OpenAI API error: %s - %.500s", status_code, body)
+        record_llm_call(user_data)
+        return ["I'm sorry, I'm having trouble connecting to my knowledge source. Please try again in a moment."]
+    
+    response_json = json.loads(body)
+    record_usage(response_json.get("usage"))
+    record_llm_call(user_data, response_json.get("usage"))
+    choice = response_json["choices"][0]
+    assistant_message = choice["message"]["content"]
+    user_data["history"].append({"role": "assistant", "content": assistant_message})
+    # Truncated replies are not worth serving again
+    if choice.get("finish_reason") in (None, "stop"):
+        cache_first_reply(user_data, assistant_message)
+    return [assistant_message]
+
+def record_llm_call(user_data, usage=None, completion=None):
+    """
+    Count the LLM call of a turn for its model route and against the user's daily token budget
+    
+    Args:
+        user_data (dict): The user's session; does nothing if its call was already counted
+        usage (dict): The `usage` object of the response
+        completion (str): The reply received so far when the call failed or
+            was cut off without `usage`; its tokens and the prompt's are then
+            estimated. None for an error response, which is not billed
+    """
+    call = user_data.pop("_llm_call", None)
+    if call is None:
+        return
+    route, started, user_id, prompt_tokens = call
+    if not usage and completion is not None:
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": estimate_tokens(completion) if completion else 0}
+    record_route(route, time.monotonic() - started, usage)
+    get_rate_limiter().record_usage(user_id, usage)
+
+def cache_first_reply(user_data, assistant_message):
+    """Store the reply to a first symptom question that missed the response cache"""
+    miss = user_data.pop("_cache_miss", None)
+    if miss is not None:
+        incoming_msg, started = miss
+        get_response_cache().store(user_data, incoming_msg, assistant_message, time.monotonic() - started)
+
+def unavailable_reply(user_data):
+    """The reply sent without calling OpenAI while its circuit breaker is open, in the user's language"""
+    user_data.pop("_llm_call", None)
+    return [get_flow(user_data.get("language", "en")).texts["unavailable"]]
+
+def conversation_error(e):
+    """Log an unexpected error of a conversation turn and return the reply telling the user"""
+    logger.error("Error processing request: %s", e, exc_info=e)
+    return [f"I'm sorry, I encountered an error: {str(e)}"]
+
+def stream_conversation_reply(user_id, user_data, payload, send):
+    """
+    Stream the LLM reply and send it in chunks as they become ready
+    
+    The complete reply is still stored as a single assistant message.
+    
+    Args:
+        user_id (str): The cleaned phone number of the user
+        user_data (dict): The user's session
+        payload (dict): The chat completions request body
+        send (callable): send(body) delivering a WhatsApp message
+        
+    Returns:
+        list: Replies still to be sent after the streamed chunks
+    """
+    pieces = []
+    chunks = []
+    usage = {}
+    
+    def generate():
+        for piece in stream_chat_completion(payload, usage=usage):
+            pieces.append(piece)
+            yield piece
+    
+    try:
+        for chunk in chunk_stream(generate()):
+            send(chunk)
+            chunks.append(chunk)
+    except CircuitOpenError:
+        # Raised before the request, so nothing was sent yet
+        return unavailable_reply(user_data)
+    except Exception as e:
+        logger.error("OpenAI streaming error after %d chunks: %s", len(chunks), e)
+        if not chunks:
+            return ["I'm sorry, I'm having trouble connecting to my knowledge source. Please try again in a moment."]
+        # Keep what the user already received so the conversation stays consistent
+        user_data["history"].append({"role": "assistant", "content": "\n\n".join(chunks)})
+        return ["I'm sorry, my answer was cut off. Please send your message again."]
+    finally:
+        # A stream that failed or ended without usage is counted with estimated tokens
+        record_usage(usage)
+        record_llm_call(user_data, usage, "".join(pieces))
+    
+    assistant_message = "".join(pieces).strip()
+    user_data["history"].append({"role": "assistant", "content": assistant_message})
+    cache_first_reply(user_data, assistant_message)
+    return []
 
 @app.route('/', methods=['GET'])
 def index():
@@ -501,6 +752,63 @@ def check():
     """Simple endpoint to verify the server is running"""
     return "WhatsApp Medical Assistant is running!"
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: unlike /check, only succeeds once the clients the webhook needs exist"""
+    failed = warm_up_failures()
+    if failed:
+        return Response(f"Not ready: {', '.join(failed)}\n", status=503, mimetype="text/plain")
+    return "Ready"
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose timing histograms, token usage and component counters to Prometheus"""
+    if not METRICS_ENABLED:
+        return Response("Metrics are disabled\n", status=404, mimetype="text/plain")
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/admin/rate-limit', methods=['POST'])
+def admin_rate_limit():
+    """Exempt a phone number from the rate limits, revoke the exemption, or reset its limits"""
+    status, body = rate_limit_override(request.headers.get("Authorization", ""), request.values)
+    return Response(body, status=status, mimetype="application/json")
+
+def rate_limit_override(authorization, values):
+    """
+    Apply an admin override of the rate limits
+    
+    Args:
+        authorization (str): The Authorization header, "Bearer <ADMIN_TOKEN>"
+        values (dict): phone_number, action ("exempt", "revoke" or "reset")
+            and, to exempt, hours (default 24)
+        
+    Returns:
+        tuple: The HTTP status and the JSON body, with the number's usage today
+    """
+    if not ADMIN_TOKEN:
+        return 404, json.dumps({"error": "Admin routes are disabled"})
+    if not hmac.compare_digest(authorization.encode("utf-8"), f"Bearer {ADMIN_TOKEN}".encode("utf-8")):
+        return 401, json.dumps({"error": "Unauthorized"})
+    
+    user_id = clean_phone_number(values.get("phone_number", ""))
+    action = values.get("action", "")
+    if not user_id or action not in ("exempt", "revoke", "reset"):
+        return 400, json.dumps({"error": "phone_number and action (exempt, revoke or reset) are required"})
+    
+    limiter = get_rate_limiter()
+    if action == "exempt":
+        try:
+            hours = float(values.get("hours", "24"))
+        except ValueError:
+            return 400, json.dumps({"error": "hours must be a number"})
+        limiter.set_exempt(user_id, limiter.clock() + hours * 3600)
+    elif action == "revoke":
+        limiter.set_exempt(user_id, 0)
+    else:
+        limiter.reset(user_id)
+    logger.info("Rate limit override for %s: %s", user_id, action)
+    return 200, json.dumps(dict(limiter.usage(user_id), phone_number=user_id))
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=True, host='0.0.0.0', port=port) 
\ No newline at end of file
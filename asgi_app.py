@@ -0,0 +1,200 @@
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, PlainTextResponse, Response
+from starlette.routing import Route
+from twilio.twiml.messaging_response import MessagingResponse
+from app import (
+    ASYNC_REPLIES, WARM_UP, admit_message, begin_conversation_turn, check, clean_phone_number, conversation_error,
+    end_turn, finish_conversation_turn, get_chat_history, handle_command, index, iter_turns, process_messages,
+    rate_limit_override, record_llm_call, unavailable_reply, warm_up, warm_up_failures
+)
+from circuit_breaker import CircuitOpenError
+from database import DatabaseUnavailableError
+from idempotency import process_once_async
+from log_config import sampled
+from llm_client import OPENAI_API_URL, async_chat_completion, close_async_session, get_async_session
+from metrics import METRICS_ENABLED, render_metrics, request_span, span
+from reply_dispatcher import submit_message
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Threads running database and session store calls for the event loop. Keep
+# it below the 20 keep-alive connections of the Supabase client: with more
+# threads its pool closes connections still in use under bursts
+ASGI_BLOCKING_THREADS = int(os.getenv("ASGI_BLOCKING_THREADS", "16"))
+
+# Striped locks that keep concurrent messages from one user in order,
+# created on the event loop that uses them
+_user_locks = None
+
+def user_lock(user_id):
+    """Return the asyncio lock that serializes the handling of a user's messages"""
+    global _user_locks
+    if _user_locks is None:
+        _user_locks = [asyncio.Lock() for _ in range(256)]
+    return _user_locks[hash(user_id) % len(_user_locks)]
+
+async def process_messages_async(user_id, messages):
+    """
+    Process messages from one user in order, like app.process_messages
+
+    Args:
+        user_id (str): The cleaned phone number of the user
+        messages (list): The incoming messages, in arrival order
+
+    Returns:
+        list: The reply messages to send back, in order
+    """
+    replies = []
+    async with user_lock(user_id):
+        turns = iter_turns(user_id, messages)
+        while True:
+            incoming_msg = await asyncio.to_thread(next, turns, None)
+            if incoming_msg is None:
+                break
+            replies.extend(await process_message_async(user_id, incoming_msg))
+    return replies
+
+def begin_message(user_id, incoming_msg):
+    """
+    Handle a message up to the LLM call, in one trip to a worker thread
+
+    Returns:
+        tuple: The session (None for commands), the replies so far and the LLM
+            request body, or None if the message is completely handled
+    """
+    replies = handle_command(user_id, incoming_msg)
+    if replies is not None:
+        return None, replies, None
+
+    try:
+        user_data = get_chat_history(user_id)
+    except DatabaseUnavailableError:
+        return None, unavailable_reply({}), None
+    payload = None
+    try:
+        replies, payload = begin_conversation_turn(user_id, user_data, incoming_msg)
+    finally:
+        if payload is None:
+            end_turn(user_id, user_data)
+    return user_data, replies, payload
+
+async def process_message_async(user_id, incoming_msg):
+    """Process one message like app.process_message, awaiting the LLM reply"""
+    user_data, replies, payload = await asyncio.to_thread(begin_message, user_id, incoming_msg)
+    if payload is None:
+        return replies
+
+    if sampled():
+        logger.info("Sending request to OpenAI API: %s", OPENAI_API_URL)
+    try:
+        with span("openai"):
+            response = await async_chat_completion(payload)
+        return replies + finish_conversation_turn(user_data, response.status, await response.text())
+    except CircuitOpenError:
+        return replies + unavailable_reply(user_data)
+    except Exception as e:
+        return conversation_error(e)
+    finally:
+        # Still count a call that failed after the request went out
+        record_llm_call(user_data, completion="")
+        await asyncio.to_thread(end_turn, user_id, user_data)
+
+async def webhook(request):
+    """Handle incoming WhatsApp messages"""
+    with request_span("webhook"):
+        return await handle_webhook(request)
+
+async def handle_webhook(request):
+    """Answer the Twilio request of an incoming message"""
+    # Twilio posts a form; like Flask's request.values, the query string is read too
+    values = dict(request.query_params)
+    values.update(parse_qsl((await request.body()).decode("utf-8"), keep_blank_values=True))
+    incoming_msg = values.get('Body', '').strip()
+    raw_user_id = values.get('From', '')
+    # Twilio retries a webhook that doesn't answer in time with the same MessageSid
+    message_sid = values.get('MessageSid')
+
+    # Clean the phone number
+    user_id = clean_phone_number(raw_user_id)
+
+    # Initialize Twilio response
+    resp = MessagingResponse()
+
+    async def handle():
+        limited = await asyncio.to_thread(admit_message, user_id)
+        if limited is not None:
+            return limited
+        if ASYNC_REPLIES:
+            # Acknowledge right away, the reply is delivered through the REST API
+            submit_message(raw_user_id, user_id, process_messages, incoming_msg)
+            return []
+        return await process_messages_async(user_id, [incoming_msg])
+
+    # A retry gets the replies of the first delivery instead of a second LLM call
+    for message in await process_once_async(message_sid, handle):
+        resp.message(message)
+    return HTMLResponse(str(resp))
+
+async def home(request):
+    """Home page with instructions"""
+    return HTMLResponse(index())
+
+async def health(request):
+    """Simple endpoint to verify the server is running"""
+    return HTMLResponse(check())
+
+async def readiness(request):
+    """Readiness probe: unlike /check, only succeeds once the clients the webhook needs exist"""
+    failed = await asyncio.to_thread(warm_up_failures)
+    if failed:
+        return PlainTextResponse(f"Not ready: {', '.join(failed)}\n", status_code=503)
+    return PlainTextResponse("Ready")
+
+async def metrics(request):
+    """Expose timing histograms, token usage and component counters to Prometheus"""
+    if not METRICS_ENABLED:
+        return PlainTextResponse("Metrics are disabled\n", status_code=404)
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+async def admin_rate_limit(request):
+    """Exempt a phone number from the rate limits, revoke the exemption, or reset its limits"""
+    values = dict(request.query_params)
+    values.update(parse_qsl((await request.body()).decode("utf-8"), keep_blank_values=True))
+    status, body = await asyncio.to_thread(rate_limit_override, request.headers.get("authorization", ""), values)
+    return Response(body, status_code=status, media_type="application/json")
+
+@asynccontextmanager
+async def lifespan(application):
+    """Bound the blocking thread pool and build the clients on startup, close the OpenAI session on shutdown"""
+    executor = ThreadPoolExecutor(max_workers=ASGI_BLOCKING_THREADS, thread_name_prefix="asgi-blocking")
+    asyncio.get_running_loop().set_default_executor(executor)
+    if WARM_UP:
+        await asyncio.to_thread(warm_up)
+        get_async_session()
+    try:
+        yield
+    finally:
+        await close_async_session()
+
+app = Starlette(
+    routes=[
+        Route('/webhook', webhook, methods=['POST']),
+        Route('/', home, methods=['GET']),
+        Route('/check', health, methods=['GET']),
+        Route('/ready', readiness, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+        Route('/admin/rate-limit', admin_rate_limit, methods=['POST'])
+    ],
+    lifespan=lifespan
+)
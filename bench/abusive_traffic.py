@@ -0,0 +1,270 @@
+"""
+Check the rate limits against abusive traffic.
+
+Runs offline against the local OpenAI and Supabase stubs:
+
+- one phone number floods the webhook while other patients chat normally;
+  the flood gets a single slow-down reply and costs at most a burst of
+  OpenAI calls, the other patients get every reply
+- a patient over the daily token budget is told to come back tomorrow
+  without an OpenAI call
+- the global limit stops LLM calls of every patient at once
+- /admin/rate-limit needs the admin token, and exempts or resets a number
+- the ASGI app limits a flood like the Flask app
+- a SQLite limiter is shared between two instances
+
+    python -m bench.abusive_traffic --flood 200 --users 20
+"""
+import os
+import re
+import sys
+import html
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+
+from bench.stubs import FakeOpenAI, FakeSupabase, DEFAULT_REPLY
+from bench.traffic import twilio_form
+
+MESSAGE = re.compile(r"<Message>(.*?)</Message>", re.S)
+ADMIN_TOKEN = "bench-admin-token"
+
+_users = iter(range(1, 10 ** 6))
+
+def _onboarded_session():
+    return {
+        "language_selected": True,
+        "language": "en",
+        "history": [],
+        "name": "Asha",
+        "age": "34",
+        "gender": "Female",
+        "previous_health_issues": "none",
+        "surgeries": "none"
+    }
+
+def new_user(app):
+    """Phone number of a fresh, onboarded patient"""
+    user = f"9166{next(_users):08d}"
+    app.user_sessions[user] = _onboarded_session()
+    return user
+
+def replies(body):
+    return [html.unescape(text) for text in MESSAGE.findall(body)]
+
+def send(client, user, body):
+    """Post a message; returns its replies"""
+    return replies(client.post("/webhook", data=twilio_form(user, body)).get_data(as_text=True))
+
+def flood_scenario(app, rate_limit, openai_stub, args, failures):
+    texts = app.get_flow("en").texts
+    flooder = new_user(app)
+    patients = [new_user(app) for _ in range(args.users)]
+    flood_replies = []
+    patient_replies = []
+    lock = threading.Lock()
+    calls_before = len(openai_stub.requests)
+
+    def flood():
+        client = app.app.test_client()
+        for index in range(args.flood):
+            result = send(client, flooder, f"spam {index}")
+            with lock:
+                flood_replies.extend(result)
+
+    def chat(user):
+        client = app.app.test_client()
+        for body in ("I have a fever", "It started yesterday", "I also have a headache"):
+            result = send(client, user, body)
+            with lock:
+                patient_replies.append(result)
+
+    # The stub answers in milliseconds, so the patients alone would hit the global limit
+    global_rate = rate_limit.GLOBAL_LLM_CALLS_PER_SECOND
+    rate_limit.GLOBAL_LLM_CALLS_PER_SECOND = 0
+    start = time.perf_counter()
+    threads = [threading.Thread(target=flood)] + [threading.Thread(target=chat, args=(user,)) for user in patients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    rate_limit.GLOBAL_LLM_CALLS_PER_SECOND = global_rate
+    calls = len(openai_stub.requests) - calls_before
+    flood_calls = calls - len(patient_replies)
+    warnings = flood_replies.count(texts["slow_down"])
+
+    print(f"flood of {args.flood} messages with {args.users} patients chatting: {elapsed:.2f}s, "
+          f"{flood_calls} OpenAI calls for the flood, {warnings} slow-down replies")
+    burst = rate_limit.USER_MESSAGE_BURST
+    if flood_calls > burst + 1:
+        failures.append(f"the flood made {flood_calls} OpenAI calls, the burst is {burst:.0f}")
+    if warnings != 1:
+        failures.append(f"the flood got {warnings} slow-down replies, expected 1")
+    if any(result != [DEFAULT_REPLY] for result in patient_replies):
+        failures.append("a patient chatting normally did not get a reply from the model")
+    return flooder
+
+def budget_scenario(app, rate_limit, openai_stub, failures):
+    client = app.app.test_client()
+    texts = app.get_flow("en").texts
+    user = new_user(app)
+    budget = rate_limit.USER_DAILY_TOKEN_BUDGET
+    rate_limit.USER_DAILY_TOKEN_BUDGET = 1
+    try:
+        first = send(client, user, "I have a sore throat")
+        calls = len(openai_stub.requests)
+        second = send(client, user, "It hurts when I swallow")
+        refused_calls = len(openai_stub.requests) - calls
+    finally:
+        rate_limit.USER_DAILY_TOKEN_BUDGET = budget
+    used = app.get_rate_limiter().usage(user)["tokens_today"]
+    print(f"daily budget: {used} tokens used by the first reply, second message answered with {second}")
+    if first != [DEFAULT_REPLY] or not used:
+        failures.append("the first message within the budget was not answered by the model")
+    if second != [texts["daily_limit"]] or refused_calls:
+        failures.append("a patient over the daily budget was not refused without an OpenAI call")
+    return user
+
+def global_scenario(app, rate_limit, failures):
+    client = app.app.test_client()
+    unavailable = app.get_flow("en").texts["unavailable"]
+    settings = rate_limit.GLOBAL_LLM_CALLS_PER_SECOND, rate_limit.GLOBAL_LLM_CALL_BURST
+    rate_limit.GLOBAL_LLM_CALLS_PER_SECOND, rate_limit.GLOBAL_LLM_CALL_BURST = 0.001, 5
+    app.get_rate_limiter().reset(rate_limit.GLOBAL_KEY)
+    try:
+        results = [send(client, new_user(app), "I have a cough") for _ in range(10)]
+    finally:
+        rate_limit.GLOBAL_LLM_CALLS_PER_SECOND, rate_limit.GLOBAL_LLM_CALL_BURST = settings
+        app.get_rate_limiter().reset(rate_limit.GLOBAL_KEY)
+    answered = sum(1 for result in results if result == [DEFAULT_REPLY])
+    refused = sum(1 for result in results if result == [unavailable])
+    print(f"global limit of 5 calls: {answered} answered, {refused} refused")
+    if answered != 5 or refused != 5:
+        failures.append(f"the global limit let {answered} of 10 calls through, expected 5")
+
+def admin_scenario(app, flooder, budget_user, failures):
+    client = app.app.test_client()
+
+    def post(values, token=ADMIN_TOKEN):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = client.post("/admin/rate-limit", data=values, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+    app.ADMIN_TOKEN = None
+    disabled, _ = post({"phone_number": flooder, "action": "exempt"})
+    app.ADMIN_TOKEN = ADMIN_TOKEN
+    checks = [
+        (disabled, 404, "without ADMIN_TOKEN"),
+        (post({"phone_number": flooder, "action": "exempt"}, token=None)[0], 401, "without a token"),
+        (post({"phone_number": flooder, "action": "exempt"}, token="wrong")[0], 401, "with a wrong token"),
+        (post({"phone_number": flooder, "action": "mute"})[0], 400, "with an unknown action"),
+        (post({"phone_number": flooder, "action": "exempt", "hours": "soon"})[0], 400, "with bad hours")
+    ]
+    for status, expected, name in checks:
+        if status != expected:
+            failures.append(f"admin route {name} answered {status}, expected {expected}")
+
+    status, body = post({"phone_number": f"whatsapp:+{flooder}", "action": "exempt", "hours": "1"})
+    exempt_reply = send(client, flooder, "I need help")
+    post({"phone_number": flooder, "action": "revoke"})
+    revoked_reply = send(client, flooder, "I need help")
+    print(f"admin: exempt answered {status} {body}, revoked flooder got {revoked_reply}")
+    if status != 200 or not body or not body["exempt"]:
+        failures.append("exempting a number did not report it as exempt")
+    if exempt_reply != [DEFAULT_REPLY]:
+        failures.append("an exempt number was still limited")
+    if revoked_reply != []:
+        failures.append("a number whose exemption was revoked was not limited again")
+
+    status, body = post({"phone_number": budget_user, "action": "reset"})
+    if status != 200 or body["tokens_today"] != 0:
+        failures.append(f"resetting a number answered {status} {body}")
+
+def asgi_scenario(app, rate_limit, openai_stub, args, failures):
+    import httpx
+    import asgi_app
+    slow_down = app.get_flow("en").texts["slow_down"]
+
+    async def run():
+        transport = httpx.ASGITransport(app=asgi_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            user = new_user(app)
+            calls = len(openai_stub.requests)
+            results = []
+            for index in range(args.flood // 4):
+                response = await client.post("/webhook", data=twilio_form(user, f"spam {index}"))
+                results.extend(replies(response.text))
+            return len(openai_stub.requests) - calls, results.count(slow_down)
+
+    calls, warnings = asyncio.run(run())
+    print(f"asgi flood of {args.flood // 4} messages: {calls} OpenAI calls, {warnings} slow-down replies")
+    if warnings != 1:
+        failures.append(f"asgi: the flood got {warnings} slow-down replies, expected 1")
+    if calls > rate_limit.USER_MESSAGE_BURST + 1:
+        failures.append(f"asgi: the flood made {calls} OpenAI calls")
+
+def sqlite_scenario(rate_limit, failures):
+    now = [1000.0]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "limits.db")
+        first = rate_limit.SQLiteRateLimiter(path=path, clock=lambda: now[0])
+        second = rate_limit.SQLiteRateLimiter(path=path, clock=lambda: now[0])
+        burst = int(rate_limit.USER_MESSAGE_BURST)
+        results = [(first if index % 2 else second).check_message("919100000001") for index in range(burst + 2)]
+        expected = [rate_limit.ALLOWED] * burst + [rate_limit.WARN, rate_limit.LIMITED]
+        if results != expected:
+            failures.append(f"sqlite limiter: {results}, expected {expected}")
+        now[0] += 60 / rate_limit.USER_MESSAGES_PER_MINUTE
+        if second.check_message("919100000001") != rate_limit.ALLOWED:
+            failures.append("sqlite limiter: the bucket did not refill")
+
+        first.record_usage("919100000001", {"prompt_tokens": 700, "completion_tokens": 50})
+        if second.usage("919100000001")["tokens_today"] != 750:
+            failures.append("sqlite limiter: token usage is not shared")
+        first.set_exempt("919100000001", now[0] + 3600)
+        if not second.is_exempt("919100000001"):
+            failures.append("sqlite limiter: the exemption is not shared")
+        second.reset("919100000001")
+        if first.usage("919100000001")["tokens_today"]:
+            failures.append("sqlite limiter: reset did not clear the token usage")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--flood", type=int, default=200, help="messages the abusive number sends")
+    parser.add_argument("--users", type=int, default=20, help="patients chatting normally during the flood")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    failures = []
+    with FakeOpenAI(latency=args.llm_latency) as openai_stub, FakeSupabase() as supabase_stub:
+        os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+        os.environ["OPENAI_API_URL"] = openai_stub.completions_url
+        os.environ["SUPABASE_URL"] = supabase_stub.url
+        os.environ["SUPABASE_KEY"] = supabase_stub.api_key
+        os.environ["RATE_LIMIT_ENABLED"] = "true"
+        os.environ["RATE_LIMIT_BACKEND"] = "memory"
+        import app
+        import rate_limit
+        app.ASYNC_REPLIES = False
+        app.RESPONSE_CACHE_ENABLED = False
+
+        flooder = flood_scenario(app, rate_limit, openai_stub, args, failures)
+        budget_user = budget_scenario(app, rate_limit, openai_stub, failures)
+        global_scenario(app, rate_limit, failures)
+        admin_scenario(app, flooder, budget_user, failures)
+        asgi_scenario(app, rate_limit, openai_stub, args, failures)
+        metrics = app.app.test_client().get("/metrics").get_data(as_text=True)
+    sqlite_scenario(rate_limit, failures)
+
+    if "whatsapp_rate_limit_warnings" not in metrics:
+        failures.append("/metrics has no rate limit counters")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
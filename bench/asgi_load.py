@@ -0,0 +1,195 @@
+"""
+Load test the ASGI entry point against the Flask app on sync gunicorn workers.
+
+Both servers run as subprocesses against the local OpenAI and Supabase stubs.
+Registered users answer the remaining onboarding questions and then hold
+--conversations concurrent conversations of --turns messages each; every
+reply must contain the model's answer. Latencies are those of the LLM turns,
+throughput counts every request. Reports
+throughput, latency percentiles and the servers' peak RSS:
+
+    python -m bench.asgi_load --conversations 200 --turns 2 --llm-latency 0.2
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+
+import aiohttp
+
+from bench.stubs import FakeOpenAI, FakeSupabase
+
+# Part of the stub's reply that every answer must contain
+REPLY_MARKER = "How long have you had these symptoms"
+
+# Returning users are asked these onboarding questions again before chatting
+ONBOARDING_ANSWERS = ("none", "none")
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _rss_kib(pid):
+    """RSS of a process and its descendants, from /proc"""
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1])
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = f.read().split()
+    except OSError:
+        return total
+    return total + sum(_rss_kib(int(child)) for child in children)
+
+class _PeakRSS(threading.Thread):
+    def __init__(self, pid):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.peak = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, _rss_kib(self.pid))
+            time.sleep(0.05)
+
+def _populate(stub, conversations):
+    with stub.lock:
+        stub.connection.executemany(
+            "INSERT INTO users (phone_number, name, age, gender, language) VALUES (?, ?, ?, ?, ?)",
+            [(f"92{index:08d}", f"Patient {index}", 40, "Male", "en") for index in range(conversations)]
+        )
+        stub.connection.commit()
+
+def _wait_ready(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"{url}/check", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+async def _load(url, conversations, turns):
+    latencies = []
+    failures = []
+    # httpx's async pool slows down badly with hundreds of concurrent requests, aiohttp does not
+    connector = aiohttp.TCPConnector(limit=conversations)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=300)) as client:
+        async def post(body, sender):
+            async with client.post(f"{url}/webhook", data={"Body": body, "From": sender}) as response:
+                return response.status, await response.text()
+
+        async def converse(index):
+            sender = f"whatsapp:+92{index:08d}"
+            try:
+                for answer in ONBOARDING_ANSWERS:
+                    await post(answer, sender)
+                for turn in range(turns):
+                    start = time.perf_counter()
+                    status, text = await post(f"turn {turn}: I have a fever", sender)
+                    latencies.append(time.perf_counter() - start)
+                    if status != 200 or REPLY_MARKER not in text:
+                        failures.append(f"{sender} turn {turn}: {status} {text[:120]}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                failures.append(f"{sender}: {e!r}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(converse(index) for index in range(conversations)))
+        elapsed = time.perf_counter() - start
+    return latencies, failures, conversations * (len(ONBOARDING_ANSWERS) + turns) / elapsed
+
+def run_server(command, env, conversations, turns):
+    port = _free_port()
+    process = subprocess.Popen(command(port), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        url = f"http://127.0.0.1:{port}"
+        _wait_ready(url, process)
+        idle_kib = _rss_kib(process.pid)
+        monitor = _PeakRSS(process.pid)
+        monitor.start()
+        latencies, failures, throughput = asyncio.run(_load(url, conversations, turns))
+        monitor.running = False
+        monitor.join()
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return {
+        "throughput": throughput,
+        "p50": _percentile(latencies, 0.50),
+        "p95": _percentile(latencies, 0.95),
+        "p99": _percentile(latencies, 0.99),
+        "idle_mib": idle_kib / 1024,
+        "peak_mib": max(monitor.peak, idle_kib) / 1024,
+        "failures": failures
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=200, help="concurrent conversations")
+    parser.add_argument("--turns", type=int, default=2, help="messages per conversation")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds the fake OpenAI server waits")
+    parser.add_argument("--gunicorn-workers", type=int, default=4)
+    parser.add_argument("--servers", default="gunicorn,uvicorn", help="comma-separated servers to run")
+    args = parser.parse_args(argv)
+
+    results = {}
+    with FakeOpenAI(latency=args.llm_latency) as openai_stub, FakeSupabase() as supabase_stub, \
+            tempfile.TemporaryDirectory() as directory:
+        env = dict(
+            os.environ,
+            OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "bench-key"),
+            OPENAI_API_URL=openai_stub.completions_url,
+            SUPABASE_URL=supabase_stub.url,
+            SUPABASE_KEY=supabase_stub.api_key,
+            ASYNC_REPLIES="false",
+            # Scripted users send far faster than people do; measure the servers, not the rate limits
+            RATE_LIMIT_ENABLED=os.environ.get("RATE_LIMIT_ENABLED", "false")
+        )
+        # Several gunicorn workers must share sessions, the single uvicorn process keeps them in memory
+        servers = {
+            "gunicorn": (lambda port: [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{port}",
+                                       "--workers", str(args.gunicorn_workers), "--timeout", "300"],
+                         {"SESSION_BACKEND": "sqlite", "SESSION_SQLITE_PATH": os.path.join(directory, "sessions.db")}),
+            "uvicorn": (lambda port: [sys.executable, "-m", "uvicorn", "asgi_app:app", "--host", "127.0.0.1",
+                                      "--port", str(port), "--log-level", "warning"],
+                        {"SESSION_BACKEND": "memory"})
+        }
+        for name in args.servers.split(","):
+            command, server_env = servers[name]
+            with supabase_stub.lock:
+                supabase_stub.connection.execute("DELETE FROM messages")
+                supabase_stub.connection.execute("DELETE FROM users")
+            _populate(supabase_stub, args.conversations)
+            results[name] = run_server(command, dict(env, **server_env), args.conversations, args.turns)
+
+    print(f"{args.conversations} conversations x {args.turns} turns, {args.llm_latency * 1000:.0f} ms per OpenAI call")
+    print(f"{'server':<10}{'req/s':>9}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'idle MiB':>10}{'peak MiB':>10}")
+    failures = []
+    for name, result in results.items():
+        print(f"{name:<10}{result['throughput']:>9.1f}{result['p50'] * 1000:>10.0f}{result['p95'] * 1000:>10.0f}"
+              f"{result['p99'] * 1000:>10.0f}{result['idle_mib']:>10.1f}{result['peak_mib']:>10.1f}")
+        failures.extend(f"{name}: {failure}" for failure in result["failures"])
+    for failure in failures[:10]:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Compare webhook acknowledgement latency in sync and async reply modes.
+
+Runs entirely offline against the local OpenAI and Twilio stubs:
+
+    python -m bench.async_webhook --users 50 --llm-latency 0.5
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+from bench.stubs import FakeOpenAI, FakeTwilio
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def _onboarded_session():
+    return {
+        "language_selected": True,
+        "language": "en",
+        "history": [],
+        "name": "Asha",
+        "age": "34",
+        "gender": "Female",
+        "previous_health_issues": "none",
+        "surgeries": "none"
+    }
+
+def run(users, llm_latency):
+    with FakeOpenAI(latency=llm_latency) as openai_stub, FakeTwilio() as twilio_stub:
+        os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+        os.environ["OPENAI_API_URL"] = openai_stub.completions_url
+        os.environ["TWILIO_API_BASE_URL"] = twilio_stub.url
+        # Measure delivery itself, without waiting for follow-up messages
+        os.environ.setdefault("COALESCE_WINDOW", "0")
+        os.environ.setdefault("TWILIO_ACCOUNT_SID", "ACbench")
+        os.environ.setdefault("TWILIO_AUTH_TOKEN", "bench-token")
+        os.environ.setdefault("TWILIO_WHATSAPP_NUMBER", "whatsapp:+10000000000")
+        # Scripted users send far faster than people do; measure the app, not the rate limits
+        os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+        import app
+        import reply_dispatcher
+
+        results = {}
+        for mode in ("sync", "async"):
+            app.ASYNC_REPLIES = mode == "async"
+            acks = []
+            acks_lock = threading.Lock()
+            sent_before = len(twilio_stub.messages)
+
+            def send(index):
+                user = f"91{int(app.ASYNC_REPLIES)}{index:08d}"
+                app.user_sessions[user] = _onboarded_session()
+                client = app.app.test_client()
+                start = time.perf_counter()
+                client.post("/webhook", data={"Body": "I have a fever", "From": f"whatsapp:+{user}"})
+                with acks_lock:
+                    acks.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            threads = [threading.Thread(target=send, args=(i,)) for i in range(users)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if app.ASYNC_REPLIES:
+                twilio_stub.wait_for_messages(sent_before + users)
+            elapsed = time.perf_counter() - start
+
+            results[mode] = {
+                "ack_p50_ms": _percentile(acks, 0.50) * 1000,
+                "ack_p99_ms": _percentile(acks, 0.99) * 1000,
+                "total_s": elapsed
+            }
+
+        reply_dispatcher.shutdown()
+        metrics = reply_dispatcher.get_reply_metrics()
+
+    print(f"{'mode':<8}{'ack p50 (ms)':>14}{'ack p99 (ms)':>14}{'total (s)':>12}")
+    for mode, result in results.items():
+        print(f"{mode:<8}{result['ack_p50_ms']:>14.1f}{result['ack_p99_ms']:>14.1f}{result['total_s']:>12.2f}")
+    print(f"async reply latency p50={metrics['latency_p50']:.3f}s p99={metrics['latency_p99']:.3f}s, "
+          f"sent={metrics['messages_sent']}, queue depth={metrics['queue_depth']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="concurrent users sending one message each")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds the fake OpenAI server waits")
+    args = parser.parse_args(argv)
+    run(args.users, args.llm_latency)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Throughput and correctness of the batch summarizer against the local
+OpenAI and Supabase stubs.
+
+Summarizes a synthetic roster sequentially and with a thread pool, checks
+that a second run skips every unchanged patient, that only patients with new
+messages are summarized again, and that a run stopped by its token budget
+resumes without summarizing anyone twice:
+
+    python -m bench.batch_summarize --users 100 --llm-latency 0.1
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from collections import Counter
+
+from bench.stubs import FakeOpenAI, FakeSupabase
+from summary_cache import SummaryCache
+
+def _populate(stub, users, messages_per_user):
+    with stub.lock:
+        for index in range(users):
+            phone = f"96{index:08d}"
+            stub.connection.execute(
+                "INSERT INTO users (phone_number, name, age, gender, language) VALUES (?, ?, ?, ?, ?)",
+                (phone, f"Patient {index}", 30 + index % 50, "Female", "en")
+            )
+            stub.connection.executemany(
+                "INSERT INTO messages (phone_number, role, content) VALUES (?, ?, ?)",
+                [(phone, "user" if turn % 2 == 0 else "assistant", f"Message {turn} from {phone} about a recurring migraine")
+                 for turn in range(messages_per_user)]
+            )
+        stub.connection.commit()
+
+def _summarizer(summarize_history, directory, name, **kwargs):
+    # Runs with the same name share their output, state and summary cache
+    cache = SummaryCache(os.path.join(directory, f"{name}.cache.db"))
+    return summarize_history.BatchSummarizer(
+        os.path.join(directory, f"{name}.jsonl"), os.path.join(directory, f"{name}.state.json"), rate=0,
+        cache=cache, **kwargs
+    )
+
+def _summarized_phones(path):
+    with open(path) as f:
+        return [json.loads(line)["phone_number"] for line in f]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=40, help="messages per user")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--llm-latency", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    failures = []
+    with FakeOpenAI(latency=args.llm_latency, reply="Summary: recurring migraine.") as openai_stub, \
+            FakeSupabase() as supabase_stub, tempfile.TemporaryDirectory() as directory:
+        os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+        os.environ["OPENAI_API_URL"] = openai_stub.completions_url
+        os.environ["OPENAI_MAX_CONCURRENCY"] = str(args.workers)
+        os.environ["SUPABASE_URL"] = supabase_stub.url
+        os.environ["SUPABASE_KEY"] = supabase_stub.api_key
+        import summarize_history
+        _populate(supabase_stub, args.users, args.messages)
+
+        timings = {}
+        for name, workers in (("sequential", 1), ("parallel", args.workers)):
+            summarizer = _summarizer(summarize_history, directory, name, workers=workers, page_size=50)
+            start = time.perf_counter()
+            summarizer.run()
+            timings[name] = time.perf_counter() - start
+            if summarizer.stats["summarized"] != args.users:
+                failures.append(f"{name}: summarized {summarizer.stats['summarized']} of {args.users}")
+        cost = summarizer.cost()
+
+        calls_before = len(openai_stub.requests)
+        rerun = _summarizer(summarize_history, directory, "parallel", workers=args.workers, page_size=50)
+        rerun.run()
+        if rerun.stats["skipped"] != args.users or len(openai_stub.requests) != calls_before:
+            failures.append(f"unchanged rerun: skipped {rerun.stats['skipped']}, "
+                            f"{len(openai_stub.requests) - calls_before} OpenAI calls")
+
+        changed = [f"96{index:08d}" for index in range(0, args.users, 10)]
+        with supabase_stub.lock:
+            supabase_stub.connection.executemany(
+                "INSERT INTO messages (phone_number, role, content) VALUES (?, 'user', 'It is worse today')",
+                [(phone,) for phone in changed]
+            )
+            supabase_stub.connection.commit()
+        incremental = _summarizer(summarize_history, directory, "parallel", workers=args.workers, page_size=50)
+        incremental.run()
+        if incremental.stats["summarized"] != len(changed):
+            failures.append(f"after {len(changed)} users changed, summarized {incremental.stats['summarized']}")
+
+        per_user = (args.messages * 40) // 4 + summarize_history.SUMMARY_MAX_TOKENS
+        limited = _summarizer(summarize_history, directory, "budget", workers=4, page_size=20,
+                              token_budget=per_user * (args.users // 3))
+        first_complete = limited.run()
+        resumed = _summarizer(summarize_history, directory, "budget", workers=4, page_size=20)
+        second_complete = resumed.run()
+        counts = Counter(_summarized_phones(os.path.join(directory, "budget.jsonl")))
+        if first_complete or not second_complete:
+            failures.append("the budget-limited run should stop early and the resumed run finish")
+        if len(counts) != args.users or max(counts.values()) != 1:
+            failures.append(f"budget + resume: {len(counts)} users summarized, max {max(counts.values())} times each")
+
+    print(f"{args.users} users, {args.messages} messages each, {args.llm_latency * 1000:.0f} ms per OpenAI call")
+    for name, seconds in timings.items():
+        print(f"{name:<11} {seconds:6.2f}s  {args.users / seconds:7.1f} summaries/s")
+    print(f"estimated cost of one full run: ${cost:.4f}")
+    print(f"budget-limited run: {limited.stats['summarized']} summarized, {limited.stats['deferred']} deferred; "
+          f"resumed run: {resumed.stats['summarized']} summarized, {resumed.stats['skipped']} skipped")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Fire bursts of messages per user and check ordering and LLM call counts.
+
+Every user sends a quick burst, pauses for longer than the coalescing
+window, then sends another burst. Each burst must become exactly one user
+turn, in order, and one OpenAI call:
+
+    python -m bench.burst --users 20 --burst 4
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+from bench.stubs import FakeOpenAI, FakeTwilio
+
+COALESCE_WINDOW = 0.3
+
+def _onboarded_session():
+    return {
+        "language_selected": True,
+        "language": "en",
+        "history": [],
+        "name": "Ravi",
+        "age": "41",
+        "gender": "Male",
+        "previous_health_issues": "none",
+        "surgeries": "none"
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--burst", type=int, default=4, help="messages per burst")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    with FakeOpenAI(latency=args.llm_latency) as openai_stub, FakeTwilio() as twilio_stub:
+        os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+        os.environ["OPENAI_API_URL"] = openai_stub.completions_url
+        os.environ["TWILIO_API_BASE_URL"] = twilio_stub.url
+        os.environ["COALESCE_WINDOW"] = str(COALESCE_WINDOW)
+        os.environ.setdefault("TWILIO_ACCOUNT_SID", "ACbench")
+        os.environ.setdefault("TWILIO_AUTH_TOKEN", "bench-token")
+        # Scripted users send far faster than people do; measure the app, not the rate limits
+        os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+        import app
+        import reply_dispatcher
+        app.ASYNC_REPLIES = True
+
+        def user_traffic(index):
+            user = f"9199{index:08d}"
+            app.user_sessions[user] = _onboarded_session()
+            client = app.app.test_client()
+            for burst in range(2):
+                for position in range(args.burst):
+                    client.post("/webhook", data={"Body": f"b{burst}m{position}", "From": f"whatsapp:+{user}"})
+                time.sleep(COALESCE_WINDOW * 3)
+
+        threads = [threading.Thread(target=user_traffic, args=(i,)) for i in range(args.users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        reply_dispatcher.shutdown()
+
+        failures = 0
+        for index in range(args.users):
+            turns = [m["content"] for m in app.user_sessions[f"9199{index:08d}"]["history"] if m["role"] == "user"]
+            expected = ["\n".join(f"b{burst}m{position}" for position in range(args.burst)) for burst in range(2)]
+            if turns != expected:
+                failures += 1
+                print(f"user {index}: expected {expected!r}, got {turns!r}")
+
+        calls = len(openai_stub.requests)
+        metrics = reply_dispatcher.get_reply_metrics()
+
+    print(f"users={args.users} burst={args.burst} llm_calls={calls} (expected {args.users * 2}) "
+          f"coalesced={metrics['coalesced']} sent={metrics['messages_sent']}")
+    if failures or calls != args.users * 2:
+        print("FAIL")
+        return 1
+    print("OK")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Prompt size and lookup latency of the indexed medicine catalog on a large
+synthetic catalog, compared with dumping the whole catalog every turn, then
+a few texts that must (or must not) match a category of the real catalog.
+
+    python -m bench.catalog_select --items 10000
+"""
+import sys
+import json
+import time
+import random
+import argparse
+
+from context_window import estimate_tokens
+from medicine_catalog import MedicineCatalog, CATEGORY_KEYWORDS, COMMON_MEDICINES
+
+# Text and the category it must match, or None when nothing may match:
+# inflected symptoms match, words that merely start with a brand don't
+MATCH_CASES = [
+    ("headaches since morning", "headache"),
+    ("two fevers this month", "fever"),
+    ("coughing all night", "cough"),
+    ("body aches", "pain_relief"),
+    ("தலைவலியால் அவதி", "headache"),
+    ("i took crocin", "fever"),
+    ("Dart", "headache"),
+    ("I have had enough", None),
+    ("I gasp when I climb stairs", None),
+    ("we played darts", None),
+]
+
+def synthetic_catalog(items, per_category, seed):
+    """Grow the real catalog with generated categories up to `items` medicines"""
+    rng = random.Random(seed)
+    catalog = {category: list(medicines) for category, medicines in COMMON_MEDICINES.items()}
+    keywords = {category: list(words) for category, words in CATEGORY_KEYWORDS.items()}
+    count = sum(len(medicines) for medicines in catalog.values())
+    index = 0
+    while count < items:
+        category = f"condition_{index}"
+        catalog[category] = [
+            {"name": f"Brand{index}x{n}", "brand": f"Maker{rng.randrange(200)}", "generic": f"Compound{rng.randrange(5000)}"}
+            for n in range(per_category)
+        ]
+        keywords[category] = [f"symptom{index}", f"sign{index} severe", f"लक्षण{index}"]
+        count += per_category
+        index += 1
+    return catalog, keywords, index
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--per-category", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    catalog, keywords, generated = synthetic_catalog(args.items, args.per_category, args.seed)
+
+    start = time.perf_counter()
+    index = MedicineCatalog(catalog, keywords)
+    build_seconds = time.perf_counter() - start
+
+    rng = random.Random(args.seed)
+    queries = []
+    for _ in range(args.queries):
+        queries.append([
+            "Hello doctor, thank you for the help so far",
+            rng.choice(["I have a fever since morning", "मुझे सिर दर्द है", "I have symptom%d and feel weak" % rng.randrange(generated)]),
+        ])
+
+    prompt_tokens = []
+    start = time.perf_counter()
+    for texts in queries:
+        prompt_tokens.append(estimate_tokens(index.prompt_for(texts)))
+    lookup_seconds = (time.perf_counter() - start) / len(queries)
+
+    full_tokens = estimate_tokens(f"Available medicines by category: {json.dumps(catalog, indent=2)}")
+    items = sum(len(medicines) for medicines in catalog.values())
+    print(f"catalog: {items} items in {len(catalog)} categories, index built in {build_seconds * 1000:.0f} ms")
+    print(f"full dump:        ~{full_tokens} prompt tokens per turn")
+    print(f"relevant subset:  ~{sum(prompt_tokens) / len(prompt_tokens):.0f} prompt tokens per turn (max {max(prompt_tokens)})")
+    print(f"lookup + render:  {lookup_seconds * 1e6:.1f} us per turn")
+
+    real = MedicineCatalog(COMMON_MEDICINES)
+    failures = 0
+    for text, expected in MATCH_CASES:
+        matched = real.match_categories([text])
+        if (expected in matched) if expected else not matched:
+            continue
+        failures += 1
+        print(f"{text!r}: expected {expected or 'no match'}, got {matched}")
+    if failures:
+        print("FAIL")
+        return 1
+    print("OK")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
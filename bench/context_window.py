@@ -0,0 +1,73 @@
+"""
+Check and measure build_context over long conversations against the local
+OpenAI stub.
+
+A session grows one message at a time and build_context runs after each.
+The time per turn must not grow with the length of the history, and the
+tokens reported as saved must equal the tokens of the full history less the
+tokens sent. A session saved without the folded-token count (an older
+session) must report the same savings:
+
+    python -m bench.context_window --turns 2000
+"""
+import os
+import sys
+import time
+import argparse
+
+from bench.stubs import FakeOpenAI
+
+def _message(turn):
+    # Every 50th message alone is over the token budget
+    words = 4000 if turn % 50 == 49 else 20
+    return {"role": "user" if turn % 2 == 0 else "assistant", "content": f"turn {turn}: " + "headache " * words}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    # Scripted users send far faster than people do; measure the app, not the rate limits
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    failures = []
+    with FakeOpenAI(latency=0, reply="Notes: recurring headache.") as openai_stub:
+        os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+        os.environ["OPENAI_API_URL"] = openai_stub.completions_url
+        import context_window
+
+        user_data = {"history": []}
+        timings = []
+        for turn in range(args.turns):
+            user_data["history"].append(_message(turn))
+            start = time.perf_counter()
+            messages, tokens_saved = context_window.build_context(user_data, "9600000000")
+            timings.append(time.perf_counter() - start)
+            expected = max(0, context_window.count_message_tokens(user_data["history"])
+                           - context_window.count_message_tokens(messages))
+            if tokens_saved != expected:
+                failures.append(f"turn {turn}: {tokens_saved} tokens saved reported, {expected} expected")
+
+        older = {key: value for key, value in user_data.items() if key != "summarized_tokens"}
+        older["history"] = list(user_data["history"])
+        messages, tokens_saved = context_window.build_context(older)
+        expected = max(0, context_window.count_message_tokens(older["history"])
+                       - context_window.count_message_tokens(messages))
+        if tokens_saved != expected:
+            failures.append(f"older session: {tokens_saved} tokens saved reported, {expected} expected")
+
+    # Medians, leaving out the turns that waited for a summary call
+    window = max(1, args.turns // 10)
+    early = sorted(timings[window:2 * window])[window // 2]
+    late = sorted(timings[-window:])[window // 2]
+    print(f"{args.turns} turns, {len(openai_stub.requests)} summary calls")
+    print(f"build_context: {early * 1e6:.0f} us/turn early on, {late * 1e6:.0f} us/turn at the end")
+    print(f"stats: {context_window.get_context_stats()}")
+    if late > 3 * early:
+        failures.append("build_context gets slower as the history grows")
+    for failure in failures[:10]:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
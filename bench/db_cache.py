@@ -0,0 +1,90 @@
+"""
+Check and measure the profile cache and the buffered history writes in
+database.py against a local PostgREST stand-in backed by SQLite.
+
+Verifies that repeated reads hit the cache, that bursts of history updates
+are coalesced into one write per user with the last value winning, and that
+updates still buffered when a process exits are written by the exit hook:
+
+    python -m bench.db_cache --users 200 --updates 10 --db-latency 0.005
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+from bench.stubs import FakeSupabase
+
+EXIT_SCRIPT = """
+import database
+database.update_user_medical_history("910000000000", "written at exit")
+"""
+
+def _history(turn):
+    return json.dumps([{"role": "user", "content": f"message {turn}"}])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--reads", type=int, default=5, help="profile reads per user")
+    parser.add_argument("--updates", type=int, default=10, help="history updates per user")
+    parser.add_argument("--db-latency", type=float, default=0.005)
+    args = parser.parse_args(argv)
+
+    failures = []
+    with FakeSupabase(latency=args.db_latency) as stub:
+        os.environ["SUPABASE_URL"] = stub.url
+        os.environ["SUPABASE_KEY"] = stub.api_key
+        import database
+
+        phones = [f"94{index:08d}" for index in range(args.users)]
+        for phone in phones:
+            database.create_user(phone, "Test", 30, "Female", medical_history="[]")
+
+        start = time.perf_counter()
+        for _ in range(args.reads):
+            for phone in phones:
+                database.get_user(phone)
+        read_seconds = (time.perf_counter() - start) / (args.reads * args.users)
+        if stub.calls.get("select") != args.users:
+            failures.append(f"expected {args.users} selects, got {stub.calls.get('select')}")
+
+        start = time.perf_counter()
+        for turn in range(args.updates):
+            for phone in phones:
+                database.update_user_medical_history(phone, _history(turn))
+        buffered_seconds = (time.perf_counter() - start) / (args.updates * args.users)
+        database.flush_pending_writes()
+        writes = stub.calls.get("update", 0)
+        stored = {row["phone_number"]: row["medical_history"] for row in stub.rows("users")}
+        stale = [phone for phone in phones if stored[phone] != _history(args.updates - 1)]
+        if stale:
+            failures.append(f"{len(stale)} users have a stale history after the flush")
+
+        # The same updates written one by one, as before buffering
+        database.HISTORY_FLUSH_INTERVAL = 0
+        start = time.perf_counter()
+        for phone in phones[:50]:
+            database.update_user_medical_history(phone, _history(args.updates))
+        direct_seconds = (time.perf_counter() - start) / min(50, args.users)
+
+        stub_env = dict(os.environ, HISTORY_FLUSH_INTERVAL="60")
+        database.create_user("910000000000", "Exit", 40, "Male", medical_history="[]")
+        subprocess.run([sys.executable, "-c", EXIT_SCRIPT], env=stub_env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        stored = {row["phone_number"]: row["medical_history"] for row in stub.rows("users")}
+        if stored["910000000000"] != "written at exit":
+            failures.append("history buffered at exit was lost")
+
+    print(f"get_user:                    {read_seconds * 1000:.2f} ms/call ({args.users} selects for {args.reads * args.users} reads)")
+    print(f"update_user_medical_history: {buffered_seconds * 1000:.3f} ms/call buffered, {direct_seconds * 1000:.2f} ms/call direct")
+    print(f"history writes: {writes} for {args.updates * args.users} updates")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
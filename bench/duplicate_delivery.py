@@ -0,0 +1,226 @@
+"""
+Check that Twilio's retries of a webhook are answered without handling the message again.
+
+Runs offline against the local OpenAI, Supabase and Twilio stubs. Every
+scenario posts the same form (same MessageSid) more than once and checks the
+OpenAI calls, Supabase writes, chat history and TwiML answers:
+
+- a retry after the first delivery was answered gets the same replies
+- a retry while the first delivery waits on OpenAI waits for its replies
+- a new MessageSid with the same text is handled again
+- a delivery without MessageSid is always handled
+- with ASYNC_REPLIES a retry is not queued, and one reply is sent
+- the ASGI app behaves like the Flask app
+- a SQLite registry is shared between two instances, and a claim whose
+  worker died is taken over after the lease
+
+    python -m bench.duplicate_delivery --llm-latency 0.3
+"""
+import os
+import sys
+import asyncio
+import argparse
+import tempfile
+import threading
+
+from bench.stubs import FakeOpenAI, FakeSupabase, FakeTwilio
+from bench.traffic import twilio_form
+
+_users = iter(range(1, 10 ** 6))
+
+def _onboarded_session():
+    return {
+        "language_selected": True,
+        "language": "en",
+        "history": [],
+        "name": "Asha",
+        "age": "34",
+        "gender": "Female",
+        "previous_health_issues": "none",
+        "surgeries": "none"
+    }
+
+def new_user(app):
+    """Phone number of a fresh, onboarded patient"""
+    user = f"9177{next(_users):08d}"
+    app.user_sessions[user] = _onboarded_session()
+    return user
+
+def _writes(supabase_stub):
+    with supabase_stub.lock:
+        return sum(count for method, count in supabase_stub.calls.items() if method in ("insert", "update", "delete"))
+
+class Check:
+    """Counts what a scenario costs and collects its failures"""
+
+    def __init__(self, name, openai_stub, supabase_stub, failures):
+        self.name = name
+        self.openai_stub = openai_stub
+        self.supabase_stub = supabase_stub
+        self.failures = failures
+
+    def __enter__(self):
+        self.calls = len(self.openai_stub.requests)
+        self.writes = _writes(self.supabase_stub)
+        return self
+
+    def __exit__(self, *exc):
+        self.calls = len(self.openai_stub.requests) - self.calls
+        self.writes = _writes(self.supabase_stub) - self.writes
+
+    def expect(self, condition, message):
+        if not condition:
+            self.failures.append(f"{self.name}: {message}")
+
+def post_concurrently(client, form, count):
+    """Post the same form `count` times at once; returns the response bodies"""
+    bodies = [None] * count
+
+    def send(index):
+        bodies[index] = client.post("/webhook", data=form).get_data(as_text=True)
+
+    threads = [threading.Thread(target=send, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return bodies
+
+def flask_scenarios(app, openai_stub, supabase_stub, failures):
+    client = app.app.test_client()
+
+    with Check("retry after reply", openai_stub, supabase_stub, failures) as check:
+        user = new_user(app)
+        form = twilio_form(user, "I have a fever since yesterday")
+        first = client.post("/webhook", data=form).get_data(as_text=True)
+        writes = _writes(supabase_stub)
+        history = len(app.user_sessions[user]["history"])
+        retries = [client.post("/webhook", data=form).get_data(as_text=True) for _ in range(3)]
+    check.expect(check.calls == 1, f"{check.calls} OpenAI calls, expected 1")
+    check.expect("<Message>" in first, "first delivery got no reply")
+    check.expect(all(retry == first for retry in retries), "a retry got different TwiML")
+    check.expect(_writes(supabase_stub) == writes, "a retry wrote to Supabase")
+    check.expect(len(app.user_sessions[user]["history"]) == history, "a retry changed the chat history")
+
+    with Check("retry in flight", openai_stub, supabase_stub, failures) as check:
+        user = new_user(app)
+        bodies = post_concurrently(client, twilio_form(user, "My head hurts"), 3)
+    check.expect(check.calls == 1, f"{check.calls} OpenAI calls, expected 1")
+    check.expect(len(set(bodies)) == 1 and "<Message>" in bodies[0], "retries did not get the first reply")
+    check.expect(len(app.user_sessions[user]["history"]) == 2, "the chat history is not one exchange")
+
+    with Check("new MessageSid", openai_stub, supabase_stub, failures) as check:
+        user = new_user(app)
+        client.post("/webhook", data=twilio_form(user, "I feel dizzy"))
+        client.post("/webhook", data=twilio_form(user, "I feel dizzy"))
+    check.expect(check.calls == 2, f"{check.calls} OpenAI calls, expected 2")
+
+    with Check("no MessageSid", openai_stub, supabase_stub, failures) as check:
+        user = new_user(app)
+        form = {"Body": "I have a cough", "From": f"whatsapp:+{user}"}
+        client.post("/webhook", data=form)
+        client.post("/webhook", data=form)
+    check.expect(check.calls == 2, f"{check.calls} OpenAI calls, expected 2")
+
+def async_reply_scenario(app, openai_stub, supabase_stub, twilio_stub, failures):
+    client = app.app.test_client()
+    app.ASYNC_REPLIES = True
+    try:
+        with Check("async replies", openai_stub, supabase_stub, failures) as check:
+            user = new_user(app)
+            sent_before = len(twilio_stub.messages)
+            post_concurrently(client, twilio_form(user, "My stomach hurts"), 3)
+            twilio_stub.wait_for_messages(sent_before + 1)
+            # Give a second reply, if one was queued, the time to arrive
+            twilio_stub.wait_for_messages(sent_before + 2, timeout=openai_stub.latency * 3 + 1)
+            sent = len(twilio_stub.messages) - sent_before
+    finally:
+        app.ASYNC_REPLIES = False
+    check.expect(check.calls == 1, f"{check.calls} OpenAI calls, expected 1")
+    check.expect(sent == 1, f"{sent} replies sent, expected 1")
+
+def asgi_scenarios(app, openai_stub, supabase_stub, failures):
+    import httpx
+    import asgi_app
+
+    async def run():
+        transport = httpx.ASGITransport(app=asgi_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            async def post(form):
+                return (await client.post("/webhook", data=form)).text
+
+            with Check("asgi retry in flight", openai_stub, supabase_stub, failures) as check:
+                user = new_user(app)
+                form = twilio_form(user, "I have a rash on my arm")
+                bodies = await asyncio.gather(*(post(form) for _ in range(3)))
+                bodies.append(await post(form))
+            check.expect(check.calls == 1, f"{check.calls} OpenAI calls, expected 1")
+            check.expect(len(set(bodies)) == 1 and "<Message>" in bodies[0], "retries did not get the first reply")
+
+    asyncio.run(run())
+
+def sqlite_scenarios(failures):
+    from idempotency import SQLiteMessageRegistry, NEW, IN_FLIGHT, DONE
+
+    now = [1000.0]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sids.db")
+        first = SQLiteMessageRegistry(path=path, lease=60, clock=lambda: now[0])
+        second = SQLiteMessageRegistry(path=path, lease=60, clock=lambda: now[0])
+
+        checks = [
+            (first.claim("SM1"), (NEW, None), "first claim"),
+            (second.claim("SM1"), (IN_FLIGHT, None), "claim of a message in flight elsewhere")
+        ]
+        first.complete("SM1", ["reply"])
+        checks.append((second.claim("SM1"), (DONE, ["reply"]), "claim of a message handled elsewhere"))
+
+        first.claim("SM2")
+        now[0] += 61
+        checks.append((second.claim("SM2"), (NEW, None), "claim after the lease lapsed"))
+        second.release("SM2")
+        checks.append((first.claim("SM2"), (NEW, None), "claim after a release"))
+
+        now[0] += first.ttl + 1
+        checks.append((second.claim("SM1"), (NEW, None), "claim after the TTL"))
+        for result, expected, name in checks:
+            if result != expected:
+                failures.append(f"sqlite registry: {name} returned {result}, expected {expected}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    args = parser.parse_args(argv)
+
+    failures = []
+    with FakeOpenAI(latency=args.llm_latency) as openai_stub, FakeSupabase() as supabase_stub, \
+            FakeTwilio() as twilio_stub:
+        os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+        os.environ["OPENAI_API_URL"] = openai_stub.completions_url
+        os.environ["SUPABASE_URL"] = supabase_stub.url
+        os.environ["SUPABASE_KEY"] = supabase_stub.api_key
+        os.environ["TWILIO_API_BASE_URL"] = twilio_stub.url
+        os.environ.setdefault("COALESCE_WINDOW", "0")
+        os.environ.setdefault("TWILIO_ACCOUNT_SID", "ACbench")
+        os.environ.setdefault("TWILIO_AUTH_TOKEN", "bench-token")
+        os.environ.setdefault("TWILIO_WHATSAPP_NUMBER", "whatsapp:+10000000000")
+        import app
+        import reply_dispatcher
+        app.ASYNC_REPLIES = False
+
+        flask_scenarios(app, openai_stub, supabase_stub, failures)
+        async_reply_scenario(app, openai_stub, supabase_stub, twilio_stub, failures)
+        asgi_scenarios(app, openai_stub, supabase_stub, failures)
+        reply_dispatcher.shutdown()
+        stats = app.get_idempotency_stats()
+    sqlite_scenarios(failures)
+
+    print(f"claims {stats['claims']}, duplicates {stats['duplicates']}, waits {stats['waits']}, "
+          f"wait timeouts {stats['wait_timeouts']}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
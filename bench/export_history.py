@@ -0,0 +1,252 @@
+"""
+Throughput and correctness of the history export against the local Supabase stub.
+
+Generates synthetic patients in every language: some were registered by an
+earlier version before the last onboarding questions, some never describe a
+concern, the others have one or more conversations whose messages mention
+medicines of the catalog. Messages of neighbouring patients are interleaved,
+like messages arriving at the same time.
+
+1. A small roster is exported with one worker and with --workers while the
+   stub answers in --db-latency seconds, to show the effect of fetching
+   pages in parallel.
+2. The same roster is exported in small parts, with the users query failing
+   midway; the export is resumed, and every patient must be in the parts
+   exactly once.
+3. The full roster (--users, 1M by default, in a SQLite file) is exported
+   as fast as possible, reporting users and messages per second, the size
+   of the parts and the memory growth.
+
+Every export's aggregates must match the ones counted while generating:
+
+    python -m bench.export_history --users 1000000 --workers 4
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+from bench.stubs import FakeSupabase
+from medicine_catalog import COMMON_MEDICINES
+from onboarding import ONBOARDING_TEXTS
+
+LANGUAGE_WEIGHTS = {"en": 40, "hi": 30, "ta": 10, "te": 8, "kn": 6, "ml": 6}
+MEDICINES = sorted({medicine["name"] for medicines in COMMON_MEDICINES.values() for medicine in medicines})
+SYMPTOMS = ("I have had a fever since yesterday", "My head hurts a lot", "I have a dry cough at night",
+            "My stomach hurts after meals", "I feel tired all the time")
+ADVICE = "Please rest, drink plenty of water and see a doctor if it gets worse."
+
+def _rss_mib():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def synthetic_patient(rng, phone):
+    """
+    A patient's users row, transcript and the metrics the export must find
+
+    Returns:
+        tuple: (users row, messages as (role, content), expected record)
+    """
+    language = rng.choices(list(LANGUAGE_WEIGHTS), weights=list(LANGUAGE_WEIGHTS.values()))[0]
+    texts = ONBOARDING_TEXTS[language]
+    outcome = rng.random()
+    messages = [
+        ("assistant", texts["ask_name"]), ("user", "Asha"),
+        ("assistant", texts["ask_age"]), ("user", "34"),
+        ("assistant", texts["ask_gender"]), ("user", "2"),
+        ("assistant", texts["ask_health_issues"])
+    ]
+    turns = []
+    medicines = []
+    if outcome < 0.05:
+        # Registered after the gender question by an earlier version of the bot
+        step = "previous_health_issues"
+    elif outcome < 0.08:
+        messages += [("user", "none"), ("assistant", texts["ask_surgeries"])]
+        step = "surgeries"
+    else:
+        messages += [("user", "none"), ("assistant", texts["ask_surgeries"]), ("user", "none"),
+                     ("assistant", texts["ask_concern"])]
+        conversations = 0 if outcome < 0.2 else 1 + (rng.random() < 0.3) + (rng.random() < 0.1)
+        step = "complete" if conversations else "concern"
+        if not conversations:
+            turns.append(0)
+        for index in range(conversations):
+            if index:
+                messages.append(("assistant", texts["welcome_back"].format(name="Asha")))
+            count = rng.randint(1, 4) if index == 0 else rng.randint(0, 3)
+            turns.append(count)
+            for _ in range(count):
+                if rng.random() < 0.1:
+                    medicine = rng.choice(MEDICINES)
+                    messages.append(("user", f"I already took {medicine}"))
+                    medicines.append(medicine)
+                else:
+                    messages.append(("user", rng.choice(SYMPTOMS)))
+                if rng.random() < 0.4:
+                    medicine = rng.choice(MEDICINES)
+                    messages.append(("assistant", f"You can take {medicine} after food. {ADVICE}"))
+                    medicines.append(medicine)
+                else:
+                    messages.append(("assistant", ADVICE))
+    user = (phone, "Asha", str(20 + rng.randrange(60)), "Female", language, "2025-01-01T00:00:00")
+    expected = {
+        "language": language,
+        "message_count": len(messages),
+        "onboarding_step": step,
+        "turns": turns,
+        "medicines": medicines
+    }
+    return user, messages, expected
+
+def populate(stub, users, prefix, seed, block=1000):
+    """Store `users` synthetic patients; returns the aggregates the export must report"""
+    from export_history import ExportAggregates
+
+    rng = random.Random(seed)
+    expected = ExportAggregates()
+    connection = stub.connection
+    with stub.lock:
+        for start in range(0, users, block):
+            user_rows = []
+            transcripts = []
+            for index in range(start, min(users, start + block)):
+                user, messages, record = synthetic_patient(rng, f"{prefix}{index:010d}")
+                user_rows.append(user)
+                transcripts.append([(user[0], role, content) for role, content in reversed(messages)])
+                expected.add(record)
+            # Interleave the transcripts of the block, each one in order
+            rows = []
+            while transcripts:
+                position = rng.randrange(len(transcripts))
+                rows.append(transcripts[position].pop())
+                if not transcripts[position]:
+                    transcripts[position] = transcripts[-1]
+                    transcripts.pop()
+            connection.executemany(
+                "INSERT INTO users (phone_number, name, age, gender, language, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                user_rows
+            )
+            connection.executemany("INSERT INTO messages (phone_number, role, content) VALUES (?, ?, ?)", rows)
+        connection.commit()
+    return expected
+
+def clear(stub):
+    with stub.lock:
+        stub.connection.execute("DELETE FROM messages")
+        stub.connection.execute("DELETE FROM users")
+        stub.connection.commit()
+
+def export(export_history, directory, fmt, **kwargs):
+    """Run an export into a new directory; returns (exporter, completed, seconds)"""
+    exporter = export_history.HistoryExporter(directory, fmt=fmt, **kwargs)
+    start = time.perf_counter()
+    completed = exporter.run()
+    return exporter, completed, time.perf_counter() - start
+
+def parallel_scenario(export_history, stub, expected, directory, args, failures):
+    stub.latency = args.db_latency
+    timings = {}
+    try:
+        for name, workers in (("sequential", 1), ("parallel", args.workers)):
+            exporter, completed, seconds = export(export_history, os.path.join(directory, name), args.format,
+                                                  workers=workers)
+            timings[name] = seconds
+            if not completed or exporter.aggregates.report() != expected.report():
+                failures.append(f"{name} export: the aggregates differ from the generated data")
+    finally:
+        stub.latency = 0.0
+    print(f"{args.small_users} users, {args.db_latency * 1000:.0f} ms per database request:")
+    for name, seconds in timings.items():
+        print(f"  {name:<11}{seconds:7.2f}s {args.small_users / seconds:9.0f} users/s")
+    if timings["parallel"] >= timings["sequential"]:
+        failures.append("fetching pages in parallel was not faster")
+
+def resume_scenario(export_history, expected, directory, args, failures):
+    path = os.path.join(directory, "resumed")
+    get_users_page = export_history.get_users_page
+    calls = [0]
+
+    def failing_users_page(*page_args):
+        calls[0] += 1
+        return None if calls[0] == 23 else get_users_page(*page_args)
+
+    export_history.get_users_page = failing_users_page
+    try:
+        interrupted, first_completed, _ = export(export_history, path, args.format, part_size=2000)
+    finally:
+        export_history.get_users_page = get_users_page
+    leftovers = [name for name in os.listdir(path) if name.endswith(".tmp")]
+    exporter, completed, _ = export(export_history, path, args.format, part_size=2000)
+    phones = [record["phone_number"] for record in export_history.iter_export(path, columns=["phone_number"])]
+    print(f"resume: {interrupted.aggregates.users} users in {interrupted.state['part']} parts before the failure, "
+          f"{len(phones)} rows in {exporter.state['part']} parts after resuming")
+    if first_completed or not completed:
+        failures.append("the interrupted export should stop early and the resumed one finish")
+    if leftovers:
+        failures.append(f"the interrupted export left {leftovers}")
+    if len(phones) != args.small_users or len(set(phones)) != len(phones):
+        failures.append(f"resumed export has {len(phones)} rows for {len(set(phones))} of {args.small_users} users")
+    if export_history.aggregate_export(path).report() != expected.report():
+        failures.append("the aggregates read back from the resumed export differ from the generated data")
+
+def throughput_scenario(export_history, stub, expected, directory, args, failures):
+    rss_before = _rss_mib()
+    exporter, completed, seconds = export(export_history, os.path.join(directory, "full"), args.format,
+                                          workers=args.workers)
+    rss_growth = _rss_mib() - rss_before
+    stats = exporter.stats
+    print(f"full export of {stats['users']} users, {stats['messages']} messages ({args.format}, "
+          f"{args.workers} workers): {seconds:.1f}s, {stats['users'] / seconds:.0f} users/s, "
+          f"{stats['messages'] / seconds:.0f} messages/s")
+    print(f"  {stats['parts']} parts, {stats['bytes'] / 2 ** 20:.1f} MiB, RSS +{rss_growth:.1f} MiB during the export")
+    export_history.print_report(exporter.aggregates.report())
+    if not completed or exporter.aggregates.report() != expected.report():
+        failures.append("full export: the aggregates differ from the generated data")
+    if rss_growth > args.max_rss_growth:
+        failures.append(f"RSS grew {rss_growth:.0f} MiB during the export, more than {args.max_rss_growth} MiB")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000000, help="patients of the throughput run")
+    parser.add_argument("--small-users", type=int, default=20000, help="patients of the parallel and resume runs")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--db-latency", type=float, default=0.005, help="seconds per database request in the parallel run")
+    parser.add_argument("--format", choices=("jsonl", "parquet"))
+    parser.add_argument("--max-rss-growth", type=float, default=256, help="MiB the full export may grow the process")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        with FakeSupabase(path=os.path.join(directory, "supabase.db")) as stub:
+            os.environ["SUPABASE_URL"] = stub.url
+            os.environ["SUPABASE_KEY"] = stub.api_key
+            import export_history
+            args.format = args.format or export_history.default_format()
+            # A bulk load, the file is thrown away afterwards
+            stub.connection.execute("PRAGMA journal_mode=OFF")
+            stub.connection.execute("PRAGMA synchronous=OFF")
+
+            expected = populate(stub, args.small_users, "92", args.seed)
+            parallel_scenario(export_history, stub, expected, directory, args, failures)
+            resume_scenario(export_history, expected, directory, args, failures)
+            clear(stub)
+
+            start = time.perf_counter()
+            expected = populate(stub, args.users, "93", args.seed + 1)
+            print(f"generated {args.users} users, {expected.messages} messages in {time.perf_counter() - start:.1f}s")
+            throughput_scenario(export_history, stub, expected, directory, args, failures)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""
+Fault injection: OpenAI and Supabase outages against the local stubs.
+
+Uses small breaker thresholds so that the run takes seconds:
+
+1. OpenAI answers slower than the read timeout. Messages are sent with the
+   breakers disabled, then enabled; once the OpenAI breaker opens, replies
+   must come back in well under the timeout, in the patient's language.
+2. OpenAI recovers. After the open period, probes go through, the breaker
+   closes and replies come from the model again.
+3. Supabase answers 503. New patients must still finish onboarding; their
+   rows are queued, and inserted once the stub is back. Returning patients
+   get the unavailable reply instead of onboarding, and are recognized once
+   the stub is back. A row the database rejects is not queued, and a queued
+   row it rejects once it is back is dead-lettered without holding back the
+   other queued users.
+
+Fails if any of these does not hold, or /metrics misses the breaker state:
+
+    python -m bench.fault_injection --users 40
+"""
+import os
+import re
+import sys
+import html
+import time
+import argparse
+import tempfile
+import threading
+
+from bench.stubs import FakeOpenAI, FakeSupabase, DEFAULT_REPLY
+from bench.traffic import twilio_form
+
+MESSAGE = re.compile(r"<Message>(.*?)</Message>", re.S)
+
+# Small thresholds, set before the breakers are created
+BREAKER_SETTINGS = {
+    "OPENAI_READ_TIMEOUT": "1",
+    "OPENAI_MAX_RETRIES": "0",
+    "OPENAI_BREAKER_MIN_CALLS": "4",
+    "OPENAI_BREAKER_SLOW_CALL": "0.8",
+    "OPENAI_BREAKER_OPEN_SECONDS": "1",
+    "SUPABASE_BREAKER_MIN_CALLS": "3",
+    "SUPABASE_BREAKER_OPEN_SECONDS": "1",
+    "HISTORY_FLUSH_INTERVAL": "0.2"
+}
+
+def _onboarded_session(language):
+    return {
+        "language_selected": True,
+        "language": language,
+        "history": [],
+        "name": "Asha",
+        "age": "34",
+        "gender": "Female",
+        "previous_health_issues": "none",
+        "surgeries": "none"
+    }
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))] if values else 0.0
+
+def send_all(app, users, body, concurrency, prefix, language="hi"):
+    """Send one conversation message per onboarded user; returns (seconds, replies) per message"""
+    results = []
+    lock = threading.Lock()
+    pending = list(range(users))
+
+    def worker():
+        client = app.app.test_client()
+        while True:
+            with lock:
+                if not pending:
+                    return
+                index = pending.pop()
+            phone = f"{prefix}{index:08d}"
+            app.user_sessions[phone] = _onboarded_session(language)
+            start = time.perf_counter()
+            response = client.post("/webhook", data=twilio_form(phone, body))
+            elapsed = time.perf_counter() - start
+            replies = [html.unescape(text) for text in MESSAGE.findall(response.get_data(as_text=True))]
+            with lock:
+                results.append((elapsed, replies))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def openai_outage(app, circuit_breaker, openai_stub, args, failures):
+    unavailable = app.get_flow("hi").texts["unavailable"]
+    openai_stub.latency = 2.0
+    rows = {}
+    for enabled in (False, True):
+        circuit_breaker.CIRCUIT_BREAKER_ENABLED = enabled
+        circuit_breaker.openai_breaker.reset()
+        results = send_all(app, args.users, "मुझे बुखार है", args.concurrency, f"9190{int(enabled)}")
+        latencies = [elapsed for elapsed, _ in results]
+        fallbacks = sum(1 for _, replies in results if replies == [unavailable])
+        rows["on" if enabled else "off"] = (_percentile(latencies, 0.5), _percentile(latencies, 0.95), fallbacks)
+    print(f"OpenAI slower than the read timeout, {args.users} messages:")
+    print(f"{'breakers':<10}{'p50 (ms)':>10}{'p95 (ms)':>10}{'fallback replies':>18}")
+    for mode, (p50, p95, fallbacks) in rows.items():
+        print(f"{mode:<10}{p50 * 1000:>10.0f}{p95 * 1000:>10.0f}{fallbacks:>18}")
+    if circuit_breaker.openai_breaker.state != circuit_breaker.OPEN:
+        failures.append("the OpenAI breaker did not open")
+    if rows["on"][2] < args.users // 2:
+        failures.append(f"only {rows['on'][2]} of {args.users} messages got the localized fallback")
+    if rows["on"][0] > 0.1:
+        failures.append(f"p50 {rows['on'][0] * 1000:.0f} ms with the breaker open")
+
+def openai_recovery(app, circuit_breaker, openai_stub, args, failures):
+    openai_stub.latency = 0.05
+    time.sleep(circuit_breaker.openai_breaker.open_seconds + 0.1)
+    results = send_all(app, 10, "I have a headache", 1, "91910", language="en")
+    normal = sum(1 for _, replies in results if replies == [DEFAULT_REPLY])
+    print(f"OpenAI back: {normal} of {len(results)} replies from the model, "
+          f"breaker {circuit_breaker.openai_breaker.state}")
+    if circuit_breaker.openai_breaker.state != circuit_breaker.CLOSED:
+        failures.append("the OpenAI breaker did not close after recovery")
+    if normal < len(results):
+        failures.append(f"{len(results) - normal} replies after recovery were not from the model")
+
+def supabase_outage(app, database, circuit_breaker, supabase_stub, args, failures):
+    client = app.app.test_client()
+    texts = app.get_flow("en").texts
+    count = args.users // 4 or 1
+    new_phones = [f"9192{index:08d}" for index in range(count)]
+    returning = [f"9193{index:08d}" for index in range(count)]
+
+    def post(phone, body):
+        response = client.post("/webhook", data=twilio_form(phone, body))
+        return [html.unescape(text) for text in MESSAGE.findall(response.get_data(as_text=True))]
+
+    # Returning patients without a session, and new patients up to the last onboarding question
+    for phone in returning:
+        database.create_user(phone, "Asha", "34", "Female", language="en")
+    for phone in new_phones:
+        for body in ("hi", "1", "Asha", "34", "2", "none"):
+            post(phone, body)
+
+    supabase_stub.down = True
+    start = time.perf_counter()
+    onboarded = [post(phone, "none") for phone in new_phones]
+    refused = [post(phone, "I have a fever") for phone in returning]
+    elapsed = time.perf_counter() - start
+    queued = database.get_database_stats()["pending_users"]
+    state = circuit_breaker.supabase_breaker.state
+    print(f"Supabase down: {len(new_phones)} onboardings completed and {len(returning)} returning patients "
+          f"answered in {elapsed:.2f}s, {queued} users queued, breaker {state}")
+    if any(replies != [texts["ask_concern"]] for replies in onboarded):
+        failures.append("onboarding did not complete while Supabase was down")
+    if any(replies != [texts["unavailable"]] for replies in refused):
+        failures.append("returning patients did not get the unavailable reply while Supabase was down")
+    if any(app.user_sessions.get(phone) is not None for phone in returning):
+        failures.append("a session was created for a returning patient whose profile could not be read")
+    if state != circuit_breaker.OPEN:
+        failures.append("the Supabase breaker did not open")
+
+    supabase_stub.down = False
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline and database.get_database_stats()["pending_users"]:
+        time.sleep(0.1)
+    stored = {row["phone_number"]: row for row in supabase_stub.rows("users")}
+    missing = [phone for phone in new_phones if phone not in stored]
+    answered = [post(phone, "I have a fever") for phone in returning]
+    print(f"Supabase back: {len(new_phones) - len(missing)} of {len(new_phones)} queued users inserted, "
+          f"breaker {circuit_breaker.supabase_breaker.state}")
+    if missing:
+        failures.append(f"{len(missing)} queued users were not inserted after recovery")
+    if any(stored[phone]["surgeries"] != "none" for phone in new_phones if phone in stored):
+        failures.append("queued users were inserted without their onboarding answers")
+    if any(replies != [DEFAULT_REPLY] for replies in answered):
+        failures.append("returning patients did not get to the conversation once Supabase was back")
+
+    # A row the database rejects is reported, not queued and retried forever
+    queued = database.get_database_stats()["users_queued"]
+    created = database.create_user(returning[0], "Asha", "34", "Female")
+    if created or database.get_database_stats()["users_queued"] != queued:
+        failures.append("a user row rejected by the database was queued instead of reported")
+
+def rejected_user(database, supabase_stub, failures):
+    """One queued row the database rejects must not keep the others queued"""
+    phones = [f"9194{index:08d}" for index in range(3)]
+    supabase_stub.down = True
+    for phone in phones:
+        database.create_user(phone, "Asha", "34", "Female", language="en")
+        database.append_messages(phone, [{"role": "user", "content": "I have a fever"}])
+    # A column the table doesn't have, like a write from a newer schema
+    database._pending_users[phones[0]]["nickname"] = "Ash"
+    supabase_stub.down = False
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline and (database.get_database_stats()["pending_users"]
+                                           or database.get_database_stats()["pending_messages"]):
+        time.sleep(0.1)
+    stats = database.get_database_stats()
+    stored = {row["phone_number"] for row in supabase_stub.rows("users")}
+    print(f"rejected queued user: {len(stored & set(phones[1:]))} of 2 other users inserted, "
+          f"{stats['users_dead_lettered']} dead-lettered, {stats['pending_users']} still queued")
+    if not set(phones[1:]) <= stored or stats["pending_users"]:
+        failures.append("a rejected queued user row held back the other queued users")
+    if stats["users_dead_lettered"] != 1 or phones[0] in stored:
+        failures.append("the rejected queued user row was not dead-lettered")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    failures = []
+    with FakeOpenAI(latency=0.05) as openai_stub, FakeSupabase() as supabase_stub:
+        os.environ.update(BREAKER_SETTINGS)
+        os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+        os.environ["OPENAI_API_URL"] = openai_stub.completions_url
+        os.environ["SUPABASE_URL"] = supabase_stub.url
+        os.environ["SUPABASE_KEY"] = supabase_stub.api_key
+        import app
+        import database
+        import circuit_breaker
+        app.ASYNC_REPLIES = False
+        app.RESPONSE_CACHE_ENABLED = False
+
+        openai_outage(app, circuit_breaker, openai_stub, args, failures)
+        openai_recovery(app, circuit_breaker, openai_stub, args, failures)
+        supabase_outage(app, database, circuit_breaker, supabase_stub, args, failures)
+        with tempfile.TemporaryDirectory() as directory:
+            database.USER_DEAD_LETTER_PATH = os.path.join(directory, "users.jsonl")
+            database.MESSAGE_DEAD_LETTER_PATH = os.path.join(directory, "messages.jsonl")
+            rejected_user(database, supabase_stub, failures)
+        metrics = app.app.test_client().get("/metrics").get_data(as_text=True)
+
+    for name in ("openai", "supabase"):
+        if f"whatsapp_circuit_breaker_{name}_state" not in metrics:
+            failures.append(f"/metrics has no state for the {name} breaker")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
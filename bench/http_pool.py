@@ -0,0 +1,75 @@
+"""
+Per-turn latency of a fresh requests.post() versus the pooled llm_client.
+
+Runs offline against the local OpenAI stub:
+
+    python -m bench.http_pool --turns 300 --concurrency 1
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+import requests
+
+from bench.stubs import FakeOpenAI
+
+PAYLOAD = {
+    "model": "gpt-4o",
+    "messages": [{"role": "user", "content": "I have a headache"}],
+    "temperature": 0.7,
+    "max_tokens": 800
+}
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def _run(call, turns, concurrency):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(count):
+        for _ in range(count):
+            start = time.perf_counter()
+            response = call()
+            response.raise_for_status()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    per_worker = turns // concurrency
+    threads = [threading.Thread(target=worker, args=(per_worker,)) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds the fake OpenAI server waits")
+    args = parser.parse_args(argv)
+
+    with FakeOpenAI(latency=args.llm_latency) as stub:
+        os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+        os.environ["OPENAI_API_URL"] = stub.completions_url
+        import llm_client
+
+        headers = {"Authorization": "Bearer bench-key", "Content-Type": "application/json"}
+        results = {
+            "requests.post": _run(
+                lambda: requests.post(stub.completions_url, headers=headers, json=PAYLOAD, timeout=30),
+                args.turns, args.concurrency
+            ),
+            "llm_client": _run(lambda: llm_client.chat_completion(PAYLOAD), args.turns, args.concurrency)
+        }
+
+    print(f"{'client':<16}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for name, latencies in results.items():
+        print(f"{name:<16}{_percentile(latencies, 0.50) * 1000:>10.2f}{_percentile(latencies, 0.99) * 1000:>10.2f}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Per-request cost of webhook() with each logging mode.
+
+Replays the same traffic as bench.webhook_load on one thread, with instant
+fake OpenAI and Supabase servers so that the app's own work dominates, once
+per mode in a fresh process:
+
+- development: DEBUG text lines written synchronously (the old default)
+- production: LOG_MODE=production, INFO JSON lines from a queue, sampled
+- off: only CRITICAL records
+
+Logs go to /dev/null, so the cost of a slow terminal is not counted. Fails
+if production logging costs more per request than --max-overhead-us over
+logging off:
+
+    python -m bench.logging_cost --users 100 --repeat 3
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+MODES = {
+    "development": {"LOG_MODE": "development"},
+    "production": {"LOG_MODE": "production"},
+    "off": {"LOG_MODE": "production", "LOG_LEVEL": "CRITICAL"}
+}
+
+def measure(mode, users, directory):
+    """Run one replay in a subprocess and return its results"""
+    path = os.path.join(directory, f"{mode}.json")
+    env = dict(os.environ, **MODES[mode])
+    for name in ("LOG_LEVEL", "LOG_FORMAT", "LOG_ASYNC", "LOG_SAMPLE_RATE"):
+        if name not in MODES[mode]:
+            env.pop(name, None)
+    command = [sys.executable, "-m", "bench.webhook_load", "--users", str(users), "--concurrency", "1",
+               "--llm-latency", "0", "--json", path]
+    with open(os.devnull, "w") as devnull:
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=devnull, check=True)
+    with open(path) as f:
+        return json.load(f)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode, the fastest counts")
+    parser.add_argument("--max-overhead-us", type=float, default=100.0)
+    args = parser.parse_args(argv)
+
+    per_request = {}
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        # Alternate the modes so that a slower period of the machine hits them all
+        for _ in range(args.repeat):
+            for mode in MODES:
+                run = measure(mode, args.users, directory)
+                seconds = run["seconds"] / run["messages"]
+                per_request[mode] = min(per_request.get(mode, seconds), seconds)
+                failures.extend(f"{mode}: {failure}" for failure in run["failures"])
+
+    print(f"{'logging':<14}{'us/request':>12}{'overhead (us)':>16}")
+    for mode, seconds in per_request.items():
+        print(f"{mode:<14}{seconds * 1e6:>12.0f}{(seconds - per_request['off']) * 1e6:>16.0f}")
+
+    overhead = (per_request["production"] - per_request["off"]) * 1e6
+    if overhead > args.max_overhead_us:
+        failures.append(f"production logging costs {overhead:.0f} us per request > {args.max_overhead_us} us")
+    for failure in failures[:10]:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Write volume of the append-only messages table versus rewriting the whole
+medical_history blob every turn, plus an end-to-end check through the webhook.
+
+Users are onboarded and then chat for --turns turns against the local OpenAI
+and Supabase stubs. The stored transcript, read back page by page, must match
+the conversation exactly. Then messages of an unregistered number are
+buffered with other users' messages: the others must be inserted, and the
+rejected rows go to the dead-letter file instead of being retried. Last, a
+user's transcript is read while another flush holds the flush lock: the read
+must not wait for it, and must include the user's buffered messages:
+
+    python -m bench.message_log --users 20 --turns 30
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+from bench.stubs import FakeOpenAI, FakeSupabase
+
+ONBOARDING = ("1", "Kiran", "45", "1", "none", "none")
+
+def rejected_rows_scenario(database, supabase_stub, failures):
+    with tempfile.TemporaryDirectory() as directory:
+        database.MESSAGE_DEAD_LETTER_PATH = os.path.join(directory, "dead_letter.jsonl")
+        before = len(supabase_stub.rows("messages"))
+        # Interleaved with registered users, so the bad rows share an INSERT with theirs
+        for index in range(10):
+            database.append_messages(f"95{index:08d}", [{"role": "user", "content": f"late message {index}"}])
+            if index == 5:
+                database.append_messages("9599999999", [{"role": "user", "content": "from nobody"}])
+        left = database.flush_pending_writes()
+        left_after_retry = database.flush_pending_writes()
+        inserted = len(supabase_stub.rows("messages")) - before
+        dead = []
+        if os.path.exists(database.MESSAGE_DEAD_LETTER_PATH):
+            with open(database.MESSAGE_DEAD_LETTER_PATH, encoding="utf-8") as f:
+                dead = [json.loads(line) for line in f]
+    print(f"one rejected user among 10: {inserted} rows inserted, {len(dead)} dead-lettered, "
+          f"{left} left to retry")
+    if inserted != 10:
+        failures.append(f"a rejected row held back other users' messages: {inserted} of 10 inserted")
+    if [row["phone_number"] for row in dead] != ["9599999999"] or left or left_after_retry:
+        failures.append("the rejected rows were not moved to the dead-letter file")
+
+def read_during_flush_scenario(database, failures):
+    phone = "9500000000"
+    database.append_messages(phone, [{"role": "user", "content": "buffered before the read"}])
+    # Stands in for a flush stuck on other users' writes
+    with database._flush_lock:
+        start = time.perf_counter()
+        recent = database.get_recent_messages(phone, 1)
+        elapsed = time.perf_counter() - start
+    if not recent or recent[-1]["content"] != "buffered before the read":
+        failures.append("a read during another flush is missing the user's buffered messages")
+    print(f"read during another flush: {elapsed * 1000:.1f} ms")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--page-size", type=int, default=25)
+    args = parser.parse_args(argv)
+
+    failures = []
+    with FakeOpenAI(latency=0) as openai_stub, FakeSupabase() as supabase_stub:
+        os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+        os.environ["OPENAI_API_URL"] = openai_stub.completions_url
+        os.environ["SUPABASE_URL"] = supabase_stub.url
+        os.environ["SUPABASE_KEY"] = supabase_stub.api_key
+        import app
+        import database
+        app.ASYNC_REPLIES = False
+
+        client = app.app.test_client()
+        blob_bytes = 0
+        for index in range(args.users):
+            sender = f"whatsapp:+95{index:08d}"
+            for body in ONBOARDING:
+                client.post("/webhook", data={"Body": body, "From": sender})
+            for turn in range(args.turns):
+                client.post("/webhook", data={"Body": f"turn {turn}: I still have a headache", "From": sender})
+                # What the old code wrote after every reply
+                blob_bytes += len(json.dumps(app.user_sessions[sender[len("whatsapp:+"):]]["history"]))
+        database.flush_pending_writes()
+
+        message_bytes = sum(len(json.dumps({"role": row["role"], "content": row["content"]}))
+                            for row in supabase_stub.rows("messages"))
+        for index in range(args.users):
+            phone = f"95{index:08d}"
+            stored = [{"role": m["role"], "content": m["content"]} for m in database.iter_messages(phone, args.page_size)]
+            if stored != app.user_sessions[phone]["history"]:
+                failures.append(f"{phone}: stored transcript has {len(stored)} messages, "
+                                f"session has {len(app.user_sessions[phone]['history'])}")
+        inserts = supabase_stub.calls.get("insert", 0)
+        rejected_rows_scenario(database, supabase_stub, failures)
+        read_during_flush_scenario(database, failures)
+
+    print(f"{args.users} users x {args.turns} turns")
+    print(f"rewriting medical_history: {blob_bytes / 1024:.0f} KiB written")
+    print(f"appending messages:        {message_bytes / 1024:.0f} KiB written in {inserts} INSERT requests (incl. {args.users} users)")
+    for failure in failures[:10]:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
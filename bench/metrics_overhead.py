@@ -0,0 +1,113 @@
+"""
+Cost of the timing spans and what /metrics exports after replayed traffic.
+
+Times an empty `with span(...)` block with metrics enabled and disabled,
+single-threaded and from several threads at once, then replays a short
+webhook workload (see bench.webhook_load) and checks that /metrics reports
+every stage of a message in the Prometheus text format. Sessions are kept in
+SQLite so that their serialization is timed too. Fails if a span
+costs more than --max-span-us:
+
+    python -m bench.metrics_overhead --spans 200000 --threads 8
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+import metrics
+from bench import webhook_load
+
+# Stages the replayed traffic must go through
+STAGES = ("session_lookup", "db_read", "prompt_build", "openai", "serialize", "session_save", "db_write")
+
+# name{labels} value, the shape of every sample line
+SAMPLE_LINE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[^}]*\})? -?[0-9.e+-]+$|^[a-zA-Z_:][a-zA-Z0-9_:]* (\+Inf|NaN)$')
+
+def _time_spans(spans, threads):
+    """Seconds per span when `threads` threads time `spans` empty blocks each"""
+    def work():
+        for _ in range(spans):
+            with metrics.span("bench"):
+                pass
+
+    def baseline():
+        for _ in range(spans):
+            pass
+
+    def run(target):
+        workers = [threading.Thread(target=target) for _ in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return time.perf_counter() - start
+
+    empty = min(run(baseline) for _ in range(3))
+    timed = min(run(work) for _ in range(3))
+    # Threads share the GIL, so the per-span cost is wall time over all spans
+    return max(0.0, timed - empty) / (spans * threads)
+
+def check_export(text):
+    """Return the problems found in a /metrics page"""
+    problems = []
+    for line in text.splitlines():
+        if line and not line.startswith("#") and not SAMPLE_LINE.match(line):
+            problems.append(f"malformed line: {line!r}")
+    for stage in STAGES:
+        if f'whatsapp_stage_seconds_count{{stage="{stage}"}}' not in text:
+            problems.append(f"no samples for stage {stage}")
+    for name in ("whatsapp_request_seconds_count{route=\"webhook\"}", "whatsapp_openai_tokens_total{kind=\"prompt\"}",
+                 "whatsapp_sessions_", "whatsapp_database_"):
+        if name not in text:
+            problems.append(f"{name} missing")
+    return problems
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spans", type=int, default=200000, help="spans timed per thread")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--max-span-us", type=float, default=3.0)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for enabled in (True, False):
+        metrics.METRICS_ENABLED = enabled
+        results[enabled] = (_time_spans(args.spans, 1), _time_spans(args.spans // args.threads, args.threads))
+    metrics.METRICS_ENABLED = True
+    metrics.reset_metrics()
+
+    print(f"{'metrics':<10}{'us/span':>10}{f'us/span x{args.threads}':>16}")
+    for enabled, (single, threaded) in results.items():
+        print(f"{'enabled' if enabled else 'disabled':<10}{single * 1e6:>10.3f}{threaded * 1e6:>16.3f}")
+
+    replay_args = argparse.Namespace(users=40, concurrency=4, turns=3, returning=0.3, seed=1, llm_latency=0.0,
+                                     token_rate=0, db_latency=0.0, profile=False)
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["SESSION_BACKEND"] = "sqlite"
+        os.environ["SESSION_SQLITE_PATH"] = os.path.join(directory, "sessions.db")
+        replay = webhook_load.run(replay_args)
+        import app
+        response = app.app.test_client().get("/metrics")
+        text = response.get_data(as_text=True)
+    problems = [f"/metrics returned {response.status_code}"] if response.status_code != 200 else check_export(text)
+    print(f"/metrics after {replay['messages']} messages: {len(text.splitlines())} lines, "
+          f"{text.count('_bucket{')} histogram buckets")
+
+    for enabled, (single, threaded) in results.items():
+        if max(single, threaded) * 1e6 > args.max_span_us:
+            problems.append(f"span costs {max(single, threaded) * 1e6:.2f} us > {args.max_span_us} us "
+                            f"with metrics {'enabled' if enabled else 'disabled'}")
+    if replay["errors"]:
+        problems.append(f"{replay['errors']} webhook errors")
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    print("FAIL" if problems else "OK")
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
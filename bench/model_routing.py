@@ -0,0 +1,174 @@
+"""
+Effect of model routing on OpenAI cost and latency.
+
+Replays the same conversations twice through the Flask test client, once
+with MODEL_ROUTING_ENABLED off and once with it on, against a fake OpenAI
+server that answers the symptom model in --llm-latency seconds and the
+smaller models in --small-latency. Conversations mix symptom questions,
+numbered option answers, yes/no answers and acknowledgements in English and
+Hindi. Reports turns, mean LLM latency and estimated cost per route, and the
+time to classify a message. Fails if a labelled message is routed wrongly or
+routing does not lower the cost:
+
+    python -m bench.model_routing --users 200 --llm-latency 0.5 --small-latency 0.2
+"""
+import os
+import sys
+import time
+import queue
+import random
+import argparse
+import threading
+
+from bench.stubs import FakeOpenAI, FakeSupabase
+from bench.traffic import SYMPTOMS, twilio_form
+
+# (message, expected route) after the stub's reply, which lists numbered options
+LABELLED_MESSAGES = (
+    ("2", "option"),
+    ("3️⃣", "option"),
+    ("yes", "option"),
+    ("नहीं", "option"),
+    ("ok", "trivial"),
+    ("Thank you 🙏", "trivial"),
+    ("धन्यवाद", "trivial"),
+    ("நன்றி!", "trivial"),
+    ("👍", "trivial"),
+    ("ok but the fever is back", "symptom"),
+    ("I have a headache since morning", "symptom"),
+    ("39", "symptom"),
+    ("मुझे बुखार है", "symptom")
+)
+
+# Follow-ups patients send between symptom questions
+FOLLOW_UPS = {
+    "en": ("2", "1️⃣", "yes", "no", "ok", "thanks", "thank you 🙏", "👍"),
+    "hi": ("2", "3", "हाँ", "नहीं", "ठीक है", "धन्यवाद", "🙏")
+}
+
+def _onboarded_session(language):
+    return {
+        "language_selected": True,
+        "language": language,
+        "history": [],
+        "name": "Asha",
+        "age": "34",
+        "gender": "Female",
+        "previous_health_issues": "none",
+        "surgeries": "none"
+    }
+
+def conversations(users, seed, turns):
+    """(phone number, language, messages) for every user, alternating symptoms and follow-ups"""
+    rng = random.Random(seed)
+    result = []
+    for index in range(users):
+        language = rng.choice(("en", "hi"))
+        messages = []
+        for _ in range(turns):
+            messages.append(rng.choice(SYMPTOMS[language]))
+            messages.extend(rng.sample(FOLLOW_UPS[language], 2))
+        result.append((f"9188{index:08d}", language, messages))
+    return result
+
+def replay(app, traffic, concurrency, prefix):
+    """Send every conversation through the webhook, each user on one thread at a time"""
+    users = queue.Queue()
+    for entry in traffic:
+        users.put(entry)
+
+    def worker():
+        client = app.app.test_client()
+        while True:
+            try:
+                phone, language, messages = users.get_nowait()
+            except queue.Empty:
+                return
+            phone = prefix + phone
+            app.user_sessions[phone] = _onboarded_session(language)
+            for body in messages:
+                client.post("/webhook", data=twilio_form(phone, body))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def check_labels(model_router, reply):
+    """Route the labelled messages after a bot reply; returns the failures and µs per message"""
+    user_data = {"history": [{"role": "assistant", "content": reply}]}
+    failures = []
+    for message, expected in LABELLED_MESSAGES:
+        route = model_router.classify_turn(user_data, message)
+        if route != expected:
+            failures.append(f"{message!r} routed to {route}, expected {expected}")
+    repeat = 2000
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for message, _ in LABELLED_MESSAGES:
+            model_router.classify_turn(user_data, message)
+    return failures, (time.perf_counter() - start) / (repeat * len(LABELLED_MESSAGES)) * 1e6
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=2, help="symptom questions per user, each with two follow-ups")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds the symptom model takes")
+    parser.add_argument("--small-latency", type=float, default=0.2, help="seconds the smaller models take")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+    import model_router
+    symptom_model = model_router.ROUTES["symptom"]["model"]
+
+    def latency(request):
+        return args.llm_latency if request.get("model") == symptom_model else args.small_latency
+
+    results = {}
+    with FakeOpenAI(latency=latency) as openai_stub, FakeSupabase() as supabase_stub:
+        os.environ["OPENAI_API_URL"] = openai_stub.completions_url
+        os.environ["SUPABASE_URL"] = supabase_stub.url
+        os.environ["SUPABASE_KEY"] = supabase_stub.api_key
+        import app
+        app.ASYNC_REPLIES = False
+        traffic = conversations(args.users, args.seed, args.turns)
+
+        for enabled in (False, True):
+            model_router.MODEL_ROUTING_ENABLED = enabled
+            before = model_router.get_routing_stats()
+            start = time.perf_counter()
+            replay(app, traffic, args.concurrency, "1" if enabled else "2")
+            elapsed = time.perf_counter() - start
+            after = model_router.get_routing_stats()
+            results["on" if enabled else "off"] = (
+                elapsed,
+                {key: after[key] - before[key] for key in after}
+            )
+        failures, classify_us = check_labels(model_router, openai_stub.reply_for({}))
+
+    print(f"{args.users} users, {sum(len(messages) for _, _, messages in traffic)} messages per run")
+    print(f"{'routing':<9}{'route':<9}{'model':<14}{'turns':>7}{'mean LLM (ms)':>15}{'cost (USD)':>12}")
+    costs = {}
+    for mode, (elapsed, stats) in results.items():
+        costs[mode] = sum(stats[f"{route}_cost_usd"] for route in model_router.ROUTES)
+        for route, settings in model_router.ROUTES.items():
+            turns = stats[f"{route}_turns"]
+            if not turns:
+                continue
+            print(f"{mode:<9}{route:<9}{settings['model']:<14}{turns:>7}"
+                  f"{stats[f'{route}_seconds'] / turns * 1000:>15.0f}{stats[f'{route}_cost_usd']:>12.4f}")
+        print(f"{mode:<9}{'total':<9}{'':<14}{'':>7}{'':>15}{costs[mode]:>12.4f}  ({elapsed:.1f}s wall)")
+    print(f"classify_turn: {classify_us:.1f} µs per message")
+
+    if costs["on"] >= costs["off"]:
+        failures.append("routing did not lower the cost")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
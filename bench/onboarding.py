@@ -0,0 +1,93 @@
+"""
+Requests per second for onboarding-only traffic through the webhook.
+
+Every user greets the bot, picks a language, answers the five profile
+questions, then sends 'reset' and picks a language again. Database calls are
+counted (and optionally delayed by --db-latency) to check that a user costs
+one profile read and one write, however many steps they go through. After
+the 'Welcome back', the next message must start the conversation instead of
+answering a profile question again:
+
+    python -m bench.onboarding --users 500 --db-latency 0.005
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+from onboarding import LANGUAGES
+
+ANSWERS = ("Priya", "32", "2", "none", "none")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--db-latency", type=float, default=0.005, help="seconds per simulated database call")
+    args = parser.parse_args(argv)
+
+    # Onboarding never reaches OpenAI, the key only has to be set
+    os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+    # Scripted users send far faster than people do; measure the app, not the rate limits
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    import app
+    app.ASYNC_REPLIES = False
+
+    calls = {"get_user": 0, "create_user": 0}
+    calls_lock = threading.Lock()
+    users = {}
+
+    def get_user(phone_number):
+        with calls_lock:
+            calls["get_user"] += 1
+        time.sleep(args.db_latency)
+        return users.get(phone_number)
+
+    def create_user(phone_number, name, age, gender, medical_history="", language="en", previous_health_issues="", surgeries=""):
+        with calls_lock:
+            calls["create_user"] += 1
+        time.sleep(args.db_latency)
+        users[phone_number] = {"name": name, "age": age, "gender": gender, "medical_history": medical_history, "language": language,
+                               "previous_health_issues": previous_health_issues, "surgeries": surgeries}
+        return True
+
+    # Count database round trips instead of talking to Supabase
+    app.get_user = get_user
+    app.create_user = create_user
+
+    language_codes = list(LANGUAGES)
+    client = app.app.test_client()
+    requests_sent = [0] * args.threads
+
+    def worker(slot):
+        for index in range(slot, args.users, args.threads):
+            sender = f"whatsapp:+93{index:08d}"
+            language = language_codes[index % len(language_codes)]
+            steps = ("hello", language) + ANSWERS + ("reset", language)
+            for body in steps:
+                client.post("/webhook", data={"Body": body, "From": sender})
+            requests_sent[slot] += len(steps)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(slot,)) for slot in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    total = sum(requests_sent)
+    print(f"{total} onboarding requests from {args.users} users in {elapsed:.2f}s: {total / elapsed:.0f} req/s")
+    print(f"database calls per user: {calls['get_user'] / args.users:.2f} reads, {calls['create_user'] / args.users:.2f} writes")
+
+    onboarding_again = [index for index in range(args.users)
+                        if not app.is_conversation_turn(app.user_sessions.get(f"93{index:08d}"), "I have a fever")]
+    if onboarding_again:
+        print(f"FAIL: {len(onboarding_again)} returning users would be asked a profile question again")
+        return 1
+    print("OK")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
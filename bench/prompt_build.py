@@ -0,0 +1,54 @@
+"""
+Per-turn cost of building the system prompt: on the fly versus the prebuilt
+language prompt plus the medicine categories relevant to the message.
+
+    python -m bench.prompt_build --turns 20000
+"""
+import sys
+import json
+import timeit
+import argparse
+
+import prompts
+import medicine_catalog
+from prompts import SYSTEM_PROMPT, LANGUAGE_REPLACEMENTS
+
+LANGUAGE_CODES = ("en",) + tuple(LANGUAGE_REPLACEMENTS)
+MESSAGES = ["I have had a fever since yesterday", "मुझे सिर दर्द है", "எனக்கு இருமல் இருக்கிறது", "ok thanks"]
+
+def build_on_the_fly(language_code, catalog):
+    """The per-turn work webhook() used to do"""
+    system_prompt = SYSTEM_PROMPT
+    for old, new in LANGUAGE_REPLACEMENTS.get(language_code, ()):
+        system_prompt = system_prompt.replace(old, new)
+    return system_prompt + f"\n\nAvailable medicines by category: {json.dumps(catalog, indent=2)}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    catalog = medicine_catalog.COMMON_MEDICINES
+    prompts.load_prompts()
+    index = medicine_catalog.load_catalog(catalog)
+
+    def old_turns():
+        for index in range(args.turns):
+            build_on_the_fly(LANGUAGE_CODES[index % len(LANGUAGE_CODES)], catalog)
+
+    def new_turns():
+        for turn in range(args.turns):
+            prompts.get_prompt_prefix(LANGUAGE_CODES[turn % len(LANGUAGE_CODES)])
+            index.prompt_for([MESSAGES[turn % len(MESSAGES)]])
+
+    old = min(timeit.repeat(old_turns, number=1, repeat=3)) / args.turns
+    new = min(timeit.repeat(new_turns, number=1, repeat=3)) / args.turns
+    old_chars = len(build_on_the_fly("en", catalog))
+    new_chars = len(prompts.get_prompt_prefix("en")) + len(index.prompt_for([MESSAGES[0]]))
+
+    print(f"{'builder':<12}{'us/turn':>10}{'prompt chars':>14}")
+    print(f"{'on the fly':<12}{old * 1e6:>10.2f}{old_chars:>14}")
+    print(f"{'registry':<12}{new * 1e6:>10.2f}{new_chars:>14}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Effect of the response cache on first symptom questions.
+
+Replays the same simulated traffic (see bench.traffic) twice through the
+Flask test client, once with RESPONSE_CACHE_ENABLED off and once with it on,
+against a fake OpenAI server that addresses every patient by name. Symptom
+messages are varied in case, punctuation and emoji. Reports
+the OpenAI calls, the latency of the first symptom message and of the later
+ones, and the cache's hit rate and latency saved. Fails if a reply carries
+another patient's name:
+
+    python -m bench.response_cache --users 1000 --llm-latency 0.3
+"""
+import os
+import re
+import sys
+import html
+import time
+import queue
+import random
+import argparse
+import threading
+
+from bench.stubs import FakeOpenAI, FakeSupabase, DEFAULT_REPLY
+from bench.traffic import NAMES, generate_traffic, twilio_form
+
+# Ways patients write the same message differently
+VARIATIONS = (
+    lambda body: body,
+    lambda body: body.lower(),
+    lambda body: body + "!!",
+    lambda body: body + " 🤒",
+    lambda body: body.rstrip(".") + ". please help"
+)
+
+MESSAGE = re.compile(r"<Message>(.*?)</Message>", re.S)
+
+# Messages similar enough to share a reply by their trigrams, but not their meaning
+DIFFERENT_MEANING = (
+    ("i took 2 tablets of dolo 650 and still have fever", "i took 10 tablets of dolo 650 and still have fever"),
+    ("fever and cough for 2 days", "fever and cough for 20 days"),
+    ("temperature is 104 F", "temperature is 100 F"),
+    ("headache and fever since yesterday night", "headache and no fever since yesterday night")
+)
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))] if values else 0.0
+
+def personal_reply(request):
+    """The stub's reply, addressed to the patient named in the onboarding answers"""
+    for message in request.get("messages", ()):
+        if message["role"] == "user" and message["content"] in NAMES:
+            return f"{message['content']}, {DEFAULT_REPLY[0].lower()}{DEFAULT_REPLY[1:]}"
+    return DEFAULT_REPLY
+
+def vary(traffic, seed):
+    """Rewrite the symptom messages of the scripts with random variations"""
+    rng = random.Random(seed)
+    return [
+        (phone, language_code, [(kind, rng.choice(VARIATIONS)(body) if kind == "conversation" else body)
+                                for kind, body in script])
+        for phone, language_code, script in traffic
+    ]
+
+def replay(app, traffic, concurrency):
+    """
+    Send every user's script through the webhook
+
+    Returns:
+        tuple: latencies of first and later symptom messages, and the failures
+    """
+    first, later, failures = [], [], []
+    lock = threading.Lock()
+    users = queue.Queue()
+    for entry in traffic:
+        users.put(entry)
+
+    def worker():
+        client = app.app.test_client()
+        while True:
+            try:
+                phone, _, script = users.get_nowait()
+            except queue.Empty:
+                return
+            name = script[2][1] if len(script) > 2 and script[2][1] in NAMES else None
+            first_turn = True
+            for kind, body in script:
+                if kind == "language":
+                    first_turn = True
+                start = time.perf_counter()
+                response = client.post("/webhook", data=twilio_form(phone, body))
+                elapsed = time.perf_counter() - start
+                replies = [html.unescape(text) for text in MESSAGE.findall(response.get_data(as_text=True))]
+                if kind != "conversation":
+                    continue
+                others = [other for other in NAMES if other != name and any(other in reply for reply in replies)]
+                with lock:
+                    (first if first_turn else later).append(elapsed)
+                    if not replies:
+                        failures.append(f"{phone} {body!r}: no reply")
+                    elif others:
+                        failures.append(f"{phone} ({name}) got a reply for {others[0]}: {replies[0][:60]!r}")
+                first_turn = False
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return first, later, failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=3, help="symptom messages per user before a reset")
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    failures = []
+    results = {}
+    with FakeOpenAI(latency=args.llm_latency, reply=personal_reply) as openai_stub, FakeSupabase() as supabase_stub:
+        os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+        os.environ["OPENAI_API_URL"] = openai_stub.completions_url
+        os.environ["SUPABASE_URL"] = supabase_stub.url
+        os.environ["SUPABASE_KEY"] = supabase_stub.api_key
+        # Scripted users send far faster than people do; measure the app, not the rate limits
+        os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+        import app
+        app.ASYNC_REPLIES = False
+
+        for offset, enabled in enumerate((False, True)):
+            app.RESPONSE_CACHE_ENABLED = enabled
+            # Same scripts, different phone numbers
+            traffic = vary(generate_traffic(args.users, seed=args.seed, returning_rate=0, turns=args.turns,
+                                            first_user=offset * args.users), args.seed)
+            calls_before = len(openai_stub.requests)
+            first, later, run_failures = replay(app, traffic, args.concurrency)
+            results["on" if enabled else "off"] = {
+                "openai_calls": len(openai_stub.requests) - calls_before,
+                "first_p50": _percentile(first, 0.50),
+                "first_p95": _percentile(first, 0.95),
+                "later_p50": _percentile(later, 0.50),
+                "first_turns": len(first)
+            }
+            failures.extend(run_failures)
+        stats = app.get_response_cache().stats()
+
+    print(f"{args.users} users, {results['off']['first_turns']} first symptom messages, "
+          f"{args.llm_latency * 1000:.0f} ms per OpenAI call")
+    print(f"{'cache':<7}{'OpenAI calls':>14}{'first p50 (ms)':>16}{'first p95 (ms)':>16}{'later p50 (ms)':>16}")
+    for mode, result in results.items():
+        print(f"{mode:<7}{result['openai_calls']:>14}{result['first_p50'] * 1000:>16.0f}"
+              f"{result['first_p95'] * 1000:>16.0f}{result['later_p50'] * 1000:>16.0f}")
+    print(f"hit rate {stats['hit_rate']:.1%} of {stats['lookups']} lookups ({stats['similar_hits']} similar), "
+          f"{stats['entries']} entries, {stats['latency_saved_seconds']:.1f}s of OpenAI calls saved")
+
+    if results["on"]["openai_calls"] >= results["off"]["openai_calls"]:
+        failures.append("the cache did not save any OpenAI call")
+
+    from response_cache import ResponseCache
+    patient = {"name": "Asha", "language": "en", "age": "34", "gender": "Female",
+               "previous_health_issues": "none", "surgeries": "none"}
+    for stored, asked in DIFFERENT_MEANING:
+        cache = ResponseCache()
+        cache.store(patient, stored, f"Asha, this is the reply to {stored}", 1.0)
+        if cache.lookup(patient, asked) is not None:
+            failures.append(f"{asked!r} got the cached reply to {stored!r}")
+    cache.store(patient, "I have had a fever since yesterday", "Asha, please rest", 1.0)
+    if cache.lookup(patient, "i have had fever since yesterday") is None:
+        failures.append("a similar message with the same numbers and negations missed the cache")
+    for failure in failures[:10]:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+RSS growth of the unbounded session dict versus the bounded SessionStore.
+
+Simulates many distinct phone numbers, each holding a short conversation,
+and samples the resident set size as users arrive:
+
+    python -m bench.session_memory --users 100000
+"""
+import sys
+import argparse
+import resource
+import subprocess
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() / (1024 * 1024)
+    except OSError:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS; only a fallback
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _conversation(index):
+    return {
+        "language_selected": True,
+        "language": "en",
+        "name": f"User {index}",
+        "age": "30",
+        "gender": "Female",
+        "history": [
+            {"role": "user", "content": f"I have had a headache since morning ({index})"},
+            {"role": "assistant", "content": "I'm sorry to hear that. " * 20},
+            {"role": "user", "content": "It is a dull ache"},
+            {"role": "assistant", "content": "You might consider Crocin (Paracetamol). " * 10}
+        ]
+    }
+
+def run_store(kind, users, samples):
+    if kind == "dict":
+        sessions = {}
+    else:
+        from session_store import SessionStore
+        sessions = SessionStore(max_sessions=5000, max_bytes=16 * 1024 * 1024)
+
+    step = max(1, users // samples)
+    for index in range(users):
+        user_id = f"91{index:010d}"
+        sessions[user_id] = _conversation(index)
+        if (index + 1) % step == 0:
+            print(f"{kind:<8}{index + 1:>10}{_rss_mb():>12.1f}", flush=True)
+    if kind != "dict":
+        print(f"{kind:<8} stats: {sessions.stats()}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--store", choices=("dict", "bounded"), help="run a single store in this process")
+    args = parser.parse_args(argv)
+
+    if args.store:
+        run_store(args.store, args.users, args.samples)
+        return
+
+    print(f"{'store':<8}{'users':>10}{'RSS (MB)':>12}")
+    # Each store runs in a fresh interpreter so their RSS does not overlap
+    for kind in ("dict", "bounded"):
+        subprocess.run([sys.executable, "-m", "bench.session_memory", "--store", kind,
+                        "--users", str(args.users), "--samples", str(args.samples)], check=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
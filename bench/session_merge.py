@@ -0,0 +1,134 @@
+"""
+Concurrent writers of one shared session: no message lost or stored twice.
+
+Several workers handle turns of the same phone number against one
+SQLiteSessionStore. Each turn reads the session, appends a user message and
+a reply, persists the new messages with app.persist_new_messages and saves
+the session, so saves race and get merged. At the end every message must be
+in the session history once, and must have been appended to the messages
+table exactly once, in each worker's order.
+
+A scripted race also checks that the rolling summary of the merged session
+still covers the messages it was built from:
+
+    python -m bench.session_merge --writers 2 --turns 200
+"""
+import os
+import sys
+import argparse
+import tempfile
+import threading
+from collections import Counter
+
+def _onboarded_session():
+    return {
+        "language_selected": True,
+        "language": "en",
+        "history": [{"role": "assistant", "content": "Welcome back Asha! How can I help you today?"}],
+        "persisted_upto": 1,
+        "name": "Asha",
+        "age": "34",
+        "gender": "Female",
+        "previous_health_issues": "none",
+        "surgeries": "none",
+        "profile": {"name": "Asha", "age": "34", "gender": "Female", "previous_health_issues": "none", "surgeries": "none"}
+    }
+
+def turn(app, store, user_id, writer, index):
+    data = store.get(user_id)
+    data["history"].append({"role": "user", "content": f"{writer}-{index}-user"})
+    data["history"].append({"role": "assistant", "content": f"{writer}-{index}-reply"})
+    app.persist_new_messages(user_id, data)
+    store.save(user_id, data)
+
+def race_scenario(app, store, stored, args, failures):
+    user_id = "919500000001"
+    store.set(user_id, _onboarded_session())
+    barrier = threading.Barrier(args.writers)
+
+    def writer(name):
+        barrier.wait()
+        for index in range(args.turns):
+            turn(app, store, user_id, name, index)
+
+    threads = [threading.Thread(target=writer, args=(f"w{number}",)) for number in range(args.writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    final = store.get(user_id)
+    app.persist_new_messages(user_id, final)
+
+    expected = {f"w{number}-{index}-{kind}" for number in range(args.writers)
+                for index in range(args.turns) for kind in ("user", "reply")}
+    in_history = Counter(message["content"] for message in final["history"][1:])
+    in_table = Counter(row["content"] for row in stored if row["phone_number"] == user_id)
+    conflicts = store.stats()["conflicts"]
+    print(f"{args.writers} writers x {args.turns} turns: {conflicts} merged saves, "
+          f"{len(in_history)} messages in the session, {sum(in_table.values())} rows appended")
+    for name, counts in (("session history", in_history), ("messages table", in_table)):
+        missing = expected - set(counts)
+        duplicated = [content for content, count in counts.items() if count > 1]
+        if missing or duplicated:
+            failures.append(f"{name}: {len(missing)} messages missing, {len(duplicated)} stored more than once")
+    for number in range(args.writers):
+        order = [row["content"] for row in stored if row["content"].startswith(f"w{number}-")]
+        if order != sorted(order, key=lambda content: (int(content.split("-")[1]), content.endswith("reply"))):
+            failures.append(f"the messages of writer w{number} were appended out of order")
+    if not conflicts:
+        failures.append("no save was merged, the writers did not race")
+
+def summary_scenario(app, store, failures):
+    user_id = "919500000002"
+    store.set(user_id, _onboarded_session())
+    second = store.get(user_id)
+    turn(app, store, user_id, "first", 0)
+
+    # The second worker summarizes its copy, including a message the first one never saw
+    second["history"].append({"role": "user", "content": "second-0-user"})
+    second["summarized_upto"] = 2
+    second["context_summary"] = "covers the welcome and second-0-user"
+    app.persist_new_messages(user_id, second)
+    merged = store.save(user_id, second)
+
+    contents = [message["content"] for message in merged["history"]]
+    summarized = merged.get("summarized_upto", 0)
+    print(f"summary after a merge: {merged.get('context_summary')!r} up to {summarized} of {len(contents)} messages, "
+          f"{merged['persisted_upto']} persisted")
+    if "context_summary" in merged and "second-0-user" not in contents[:summarized]:
+        failures.append("the merged summary offset no longer covers the messages it was built from")
+    if merged["persisted_upto"] != len(contents):
+        failures.append(f"the merged session counts {merged['persisted_upto']} of {len(contents)} messages as persisted")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--turns", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+    import app
+    from session_store import SQLiteSessionStore
+
+    stored = []
+    lock = threading.Lock()
+
+    def append_messages(phone_number, messages):
+        with lock:
+            stored.extend(dict(message, phone_number=phone_number) for message in messages)
+        return True
+
+    app.append_messages = append_messages
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteSessionStore(path=os.path.join(directory, "sessions.db"))
+        race_scenario(app, store, stored, args, failures)
+        summary_scenario(app, store, failures)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""
+Cold start of the app: import time, where it goes, and time until ready.
+
+Imports app.py in fresh interpreters and reports the median import time and
+the slowest imports from `python -X importtime`. Then starts gunicorn (with
+the post_fork warm-up of gunicorn.conf.py) and uvicorn against the local
+Supabase stub and measures the time until /ready answers 200. Fails if
+importing the app loads supabase or aiohttp, or takes longer than
+--max-import-ms:
+
+    python -m bench.startup --repeat 5 --top 15
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+import statistics
+import urllib.error
+import urllib.request
+
+from bench.stubs import FakeOpenAI, FakeSupabase
+from bench.asgi_load import _free_port
+
+# Modules that must only be imported when first used
+DEFERRED_MODULES = ("supabase", "aiohttp", "twilio.rest")
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import app
+print(time.perf_counter() - start)
+print(",".join(name for name in {deferred!r} if name in sys.modules))
+"""
+
+def time_import(env):
+    """Seconds to import app.py in a fresh interpreter, and the deferred modules it loaded"""
+    script = IMPORT_SCRIPT.format(deferred=DEFERRED_MODULES)
+    result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True)
+    seconds, loaded = result.stdout.split("\n")[:2]
+    return float(seconds), [name for name in loaded.split(",") if name]
+
+def slowest_imports(env, top):
+    """The modules with the largest cumulative import time, from -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], env=env,
+                            capture_output=True, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative), name.rstrip()))
+    return sorted(imports, reverse=True)[:top]
+
+def time_until_ready(command, env, timeout=60):
+    """Seconds from starting a server until its /ready route answers 200"""
+    port = _free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(command(port), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"server exited with {process.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (urllib.error.HTTPError, OSError):
+                pass
+            time.sleep(0.01)
+        raise RuntimeError("server did not become ready")
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to show")
+    parser.add_argument("--max-import-ms", type=float, default=500)
+    args = parser.parse_args(argv)
+
+    failures = []
+    with FakeOpenAI() as openai_stub, FakeSupabase() as supabase_stub:
+        env = dict(
+            os.environ,
+            OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "bench-key"),
+            OPENAI_API_URL=openai_stub.completions_url,
+            SUPABASE_URL=supabase_stub.url,
+            SUPABASE_KEY=supabase_stub.api_key,
+            LOG_MODE="production"
+        )
+        imports = [time_import(env) for _ in range(args.repeat)]
+        import_seconds = statistics.median(seconds for seconds, _ in imports)
+        loaded = sorted({name for _, names in imports for name in names})
+
+        print(f"import app: {import_seconds * 1000:.0f} ms (median of {args.repeat})")
+        print(f"{'cumulative (ms)':>16}  module")
+        for cumulative, name in slowest_imports(env, args.top):
+            print(f"{cumulative / 1000:>16.1f}  {name}")
+
+        servers = {
+            "gunicorn": lambda port: [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{port}",
+                                      "--workers", "1"],
+            "uvicorn": lambda port: [sys.executable, "-m", "uvicorn", "asgi_app:app", "--host", "127.0.0.1",
+                                     "--port", str(port), "--log-level", "warning"]
+        }
+        for name, command in servers.items():
+            try:
+                ready = statistics.median(time_until_ready(command, env) for _ in range(args.repeat))
+                print(f"{name}: ready after {ready * 1000:.0f} ms (median of {args.repeat})")
+            except RuntimeError as e:
+                failures.append(f"{name}: {e}")
+
+    if loaded:
+        failures.append(f"importing the app loads {', '.join(loaded)}")
+    if import_seconds * 1000 > args.max_import_ms:
+        failures.append(f"import takes {import_seconds * 1000:.0f} ms > {args.max_import_ms} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
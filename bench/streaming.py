@@ -0,0 +1,109 @@
+"""
+Time to first WhatsApp message with and without streamed LLM replies.
+
+Both modes use asynchronous replies against the local stubs. The fake OpenAI
+server waits --llm-latency seconds and then emits one word every
+--token-delay seconds, like a real model generating a long answer:
+
+    python -m bench.streaming --users 8 --token-delay 0.02
+
+Keep --users at or below REPLY_WORKERS to measure generation rather than queueing.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+from bench.stubs import FakeOpenAI, FakeTwilio
+
+LONG_REPLY = (
+    "I'm sorry to hear that you have had a fever. A fever is usually the body's response to an infection "
+    "and most fevers settle within a few days with rest and plenty of fluids.\n\n"
+    "You can take Paracetamol (Crocin 500 mg) every six hours if the temperature is high or you feel unwell. "
+    "Do not take more than four tablets in a day, and avoid combining it with other cold medicines that contain "
+    "paracetamol.\n\n"
+    "Please see a doctor soon if the fever goes above 103°F, lasts more than three days, or comes with a rash, "
+    "stiff neck, breathing difficulty or confusion.\n\n"
+    "How long have you had the fever?\n1️⃣ Less than a day\n2️⃣ 1-3 days\n3️⃣ More than 3 days"
+)
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def _onboarded_session():
+    return {
+        "language_selected": True,
+        "language": "en",
+        "history": [],
+        "name": "Meena",
+        "age": "29",
+        "gender": "Female",
+        "previous_health_issues": "none",
+        "surgeries": "none"
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds between streamed words")
+    args = parser.parse_args(argv)
+
+    with FakeOpenAI(latency=args.llm_latency, reply=LONG_REPLY, token_delay=args.token_delay) as openai_stub, \
+            FakeTwilio() as twilio_stub:
+        os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+        os.environ["OPENAI_API_URL"] = openai_stub.completions_url
+        os.environ["TWILIO_API_BASE_URL"] = twilio_stub.url
+        os.environ.setdefault("COALESCE_WINDOW", "0")
+        os.environ.setdefault("TWILIO_ACCOUNT_SID", "ACbench")
+        os.environ.setdefault("TWILIO_AUTH_TOKEN", "bench-token")
+        os.environ.setdefault("TWILIO_WHATSAPP_NUMBER", "whatsapp:+10000000000")
+
+        import app
+        import reply_dispatcher
+        app.ASYNC_REPLIES = True
+
+        results = {}
+        for streaming in (False, True):
+            app.STREAM_REPLIES = streaming
+            posted_at = {}
+            sent_before = len(twilio_stub.messages)
+
+            def send(index):
+                user = f"92{int(streaming)}{index:08d}"
+                app.user_sessions[user] = _onboarded_session()
+                client = app.app.test_client()
+                posted_at[f"whatsapp:+{user}"] = time.monotonic()
+                client.post("/webhook", data={"Body": "I have a fever", "From": f"whatsapp:+{user}"})
+
+            threads = [threading.Thread(target=send, args=(i,)) for i in range(args.users)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            reply_dispatcher.shutdown()
+
+            first, last, counts = {}, {}, {}
+            for message in twilio_stub.messages[sent_before:]:
+                to = message["to"]
+                first.setdefault(to, message["received_at"])
+                last[to] = message["received_at"]
+                counts[to] = counts.get(to, 0) + 1
+            ttfm = [first[to] - posted_at[to] for to in first]
+            total = [last[to] - posted_at[to] for to in last]
+            results["streamed" if streaming else "buffered"] = {
+                "ttfm_p50": _percentile(ttfm, 0.50),
+                "ttfm_p95": _percentile(ttfm, 0.95),
+                "last_p50": _percentile(total, 0.50),
+                "messages": sum(counts.values()) / len(counts)
+            }
+
+    print(f"{'mode':<10}{'first msg p50':>15}{'first msg p95':>15}{'last msg p50':>14}{'msgs/reply':>12}")
+    for mode, result in results.items():
+        print(f"{mode:<10}{result['ttfm_p50']:>14.2f}s{result['ttfm_p95']:>14.2f}s"
+              f"{result['last_p50']:>13.2f}s{result['messages']:>12.1f}")
+
+if __name__ == "__main__":
+    sys.exit(main())
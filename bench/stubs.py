@@ -0,0 +1,389 @@
+import re
+import json
+import time
+import sqlite3
+import threading
+from urllib.parse import urlsplit, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "I'm sorry to hear that. How long have you had these symptoms?\n1️⃣ Less than a day\n2️⃣ 1-3 days\n3️⃣ More than 3 days"
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops SYNs under bursty benchmark traffic
+    request_queue_size = 1024
+
+class StubServer:
+    """Run a local HTTP stub in a background thread"""
+
+    handler_class = None
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.server = _Server((host, port), self.handler_class)
+        self.server.stub = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, avoid delayed-ACK stalls on keep-alive
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class _OpenAIHandler(_QuietHandler):
+    def do_POST(self):
+        stub = self.server.stub
+        request = json.loads(self._read_body() or b"{}")
+        with stub.lock:
+            stub.requests.append(request)
+            rate_limited = len(stub.requests) <= stub.failures
+        if rate_limited:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        time.sleep(stub.latency_for(request))
+        if request.get("stream"):
+            self._stream_reply(stub, request)
+            return
+        # Without streaming the whole reply is generated before anything is sent
+        reply = stub.reply_for(request)
+        completion_tokens = len(re.findall(r"\S+", reply))
+        time.sleep(stub.token_delay * completion_tokens)
+        prompt_tokens = sum(len(message.get("content") or "") for message in request.get("messages", ())) // 4
+        self._send_json(200, {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "model": request.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        })
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _write_event(self, event):
+        self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+
+    def _stream_reply(self, stub, request):
+        """Send the reply as server-sent events, one word per token_delay"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = re.findall(r"\S+\s*", stub.reply_for(request))
+        for word in words:
+            self._write_event({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "model": request.get("model"),
+                "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]
+            })
+            time.sleep(stub.token_delay)
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._write_event({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "choices": [],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)}
+            })
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+class FakeOpenAI(StubServer):
+    """
+    Local stand-in for the chat completions endpoint with a fixed latency
+
+    The first `failures` requests are answered with 429 and Retry-After: 0.
+    Replies take `token_delay` seconds per word to generate; streaming requests
+    get them word by word as they are generated. `reply` is a string or a
+    function of the request body returning one, and so is `latency` (seconds).
+    """
+
+    handler_class = _OpenAIHandler
+
+    def __init__(self, latency=0.5, reply=DEFAULT_REPLY, failures=0, token_delay=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.reply = reply
+        self.failures = failures
+        self.token_delay = token_delay
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def reply_for(self, request):
+        return self.reply(request) if callable(self.reply) else self.reply
+
+    def latency_for(self, request):
+        return self.latency(request) if callable(self.latency) else self.latency
+
+    @property
+    def completions_url(self):
+        return f"{self.url}/v1/chat/completions"
+
+class _TwilioHandler(_QuietHandler):
+    def do_POST(self):
+        from urllib.parse import parse_qs
+        stub = self.server.stub
+        form = {key: values[0] for key, values in parse_qs(self._read_body().decode("utf-8")).items()}
+        with stub.lock:
+            stub.messages.append({"to": form.get("To"), "body": form.get("Body"), "received_at": time.monotonic()})
+            sid = f"SM{len(stub.messages):032d}"
+        self._send_json(201, {"sid": sid, "to": form.get("To"), "from": form.get("From"), "body": form.get("Body"), "status": "queued"})
+
+class FakeTwilio(StubServer):
+    """Local stand-in for the Twilio Messages API that records outbound messages"""
+
+    handler_class = _TwilioHandler
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def wait_for_messages(self, count, timeout=30):
+        """Block until at least `count` messages have been received"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.messages) >= count:
+                    return True
+            time.sleep(0.01)
+        return False
+
+# table -> SQLite column definitions mirroring the Supabase migrations
+SUPABASE_SCHEMA = {
+    "users": "phone_number PRIMARY KEY, name, age, gender, previous_health_issues, surgeries, medical_history, language, "
+             "created_at, updated_at",
+    "messages": "seq INTEGER PRIMARY KEY, phone_number NOT NULL REFERENCES users (phone_number) ON DELETE CASCADE, "
+                "role, content, created_at DEFAULT CURRENT_TIMESTAMP",
+    "summaries": "phone_number PRIMARY KEY, summary, last_seq, model, prompt_tokens, completion_tokens, created_at"
+}
+
+# Indexes of the Supabase migrations, created for the tables of the schema
+SUPABASE_INDEXES = {
+    "messages": "CREATE INDEX messages_phone_number_seq_idx ON messages (phone_number, seq)"
+}
+
+# Postgres SQLSTATE of the constraint an insert violated, by SQLite's message
+CONSTRAINT_SQLSTATES = {"UNIQUE": "23505", "FOREIGN KEY": "23503", "NOT NULL": "23502"}
+
+# PostgREST filter operators supported by the stub
+FILTER_OPERATORS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+class _SupabaseHandler(_QuietHandler):
+    """Just enough of the PostgREST API for the queries database.py makes"""
+
+    def _parse(self):
+        parts = urlsplit(self.path)
+        table = parts.path.rstrip("/").rsplit("/", 1)[-1]
+        if table not in self.server.stub.schema:
+            self._send_json(404, {"message": f"relation {table} does not exist", "code": "42P01", "hint": None, "details": None})
+            return None, None, None
+        where, values, options = [], [], {}
+        for key, value in parse_qsl(parts.query):
+            if key in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                options[key] = value
+                continue
+            operator, _, operand = value.partition(".")
+            if operator == "in":
+                items = operand.strip("()").split(",") if operand.strip("()") else []
+                where.append(f'"{key}" IN ({", ".join("?" for _ in items)})')
+                values.extend(items)
+            elif operator == "is":
+                where.append(f'"{key}" IS NULL' if operand == "null" else f'"{key}" IS NOT NULL')
+            else:
+                where.append(f'"{key}" {FILTER_OPERATORS[operator]} ?')
+                values.append(operand)
+        clause = f" WHERE {' AND '.join(where)}" if where else ""
+        return table, (clause, values), options
+
+    def _rows(self, cursor):
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def _respond(self, status, rows):
+        if "return=representation" in self.headers.get("Prefer", ""):
+            self._send_json(status, rows)
+        else:
+            self.send_response(204 if status == 200 else status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def _count(self, method):
+        """Count a request and wait like a round trip to a remote database"""
+        stub = self.server.stub
+        with stub.lock:
+            stub.calls[method] = stub.calls.get(method, 0) + 1
+        time.sleep(stub.latency)
+
+    def _unavailable(self):
+        """Answer 503 while the stub is marked down, like a database outage"""
+        stub = self.server.stub
+        if not stub.down:
+            return False
+        self._read_body()
+        self._count("unavailable")
+        self._send_json(503, {"message": "service unavailable", "code": "503", "hint": None, "details": None})
+        return True
+
+    def _execute(self, sql, values):
+        stub = self.server.stub
+        with stub.lock:
+            cursor = stub.connection.execute(sql, values)
+            rows = self._rows(cursor) if cursor.description else []
+            stub.connection.commit()
+        return rows
+
+    def do_GET(self):
+        if self._unavailable():
+            return
+        table, (clause, values), options = self._parse()
+        if table is None:
+            return
+        select = options.get("select", "*")
+        columns = "*" if select == "*" else ", ".join(f'"{column.strip()}"' for column in select.split(","))
+        sql = f"SELECT {columns} FROM {table}{clause}"
+        if "order" in options:
+            column, _, direction = options["order"].partition(".")
+            sql += f' ORDER BY "{column}" {"DESC" if direction.startswith("desc") else "ASC"}'
+        if "limit" in options:
+            sql += f" LIMIT {int(options['limit'])} OFFSET {int(options.get('offset', 0))}"
+        self._count("select")
+        self._send_json(200, self._execute(sql, values))
+
+    def do_POST(self):
+        if self._unavailable():
+            return
+        table, _, options = self._parse()
+        if table is None:
+            return
+        body = json.loads(self._read_body() or b"[]")
+        rows = body if isinstance(body, list) else [body]
+        prefer = self.headers.get("Prefer", "")
+        upsert = "OR REPLACE " if "resolution=merge-duplicates" in prefer else ""
+        if "resolution=ignore-duplicates" in prefer:
+            upsert = "OR IGNORE "
+        self._count("insert")
+        inserted = []
+        stub = self.server.stub
+        # A bulk insert is one statement in Postgres: all rows or none
+        with stub.lock:
+            try:
+                for row in rows:
+                    columns = list(row)
+                    names = ", ".join(f'"{column}"' for column in columns)
+                    placeholders = ", ".join("?" for _ in columns)
+                    sql = f"INSERT {upsert}INTO {table} ({names}) VALUES ({placeholders}) RETURNING *"
+                    cursor = stub.connection.execute(sql, [_to_sql(row[column]) for column in columns])
+                    inserted.extend(self._rows(cursor))
+                stub.connection.commit()
+            except sqlite3.IntegrityError as e:
+                stub.connection.rollback()
+                code = next((sqlstate for name, sqlstate in CONSTRAINT_SQLSTATES.items() if name in str(e)), "23000")
+                self._send_json(409, {"message": str(e), "code": code, "hint": None, "details": None})
+                return
+            except sqlite3.OperationalError as e:
+                # PostgREST's answer to a column missing from the schema
+                stub.connection.rollback()
+                self._send_json(400, {"message": str(e), "code": "PGRST204", "hint": None, "details": None})
+                return
+        self._respond(201, inserted)
+
+    def do_PATCH(self):
+        if self._unavailable():
+            return
+        table, (clause, values), _ = self._parse()
+        if table is None:
+            return
+        changes = json.loads(self._read_body() or b"{}")
+        assignments = ", ".join(f'"{column}" = ?' for column in changes)
+        sql = f"UPDATE {table} SET {assignments}{clause} RETURNING *"
+        self._count("update")
+        self._respond(200, self._execute(sql, [_to_sql(value) for value in changes.values()] + values))
+
+    def do_DELETE(self):
+        if self._unavailable():
+            return
+        table, (clause, values), _ = self._parse()
+        if table is None:
+            return
+        self._count("delete")
+        self._respond(200, self._execute(f"DELETE FROM {table}{clause} RETURNING *", values))
+
+def _to_sql(value):
+    """Store JSON objects and arrays as text, SQLite has no JSON column type"""
+    return json.dumps(value) if isinstance(value, (dict, list)) else value
+
+class FakeSupabase(StubServer):
+    """
+    Local stand-in for Supabase's PostgREST API backed by SQLite, in memory
+    unless a `path` is given for datasets that don't fit
+
+    Supports select with eq/neq/gt/gte/lt/lte/in/is filters, order and limit,
+    insert (and upsert), update and delete. `calls` counts the requests per
+    kind and `latency` delays each one to mimic a remote database. While
+    `down` is set every request is answered with 503.
+    """
+
+    handler_class = _SupabaseHandler
+
+    # supabase-py only accepts keys that look like a JWT
+    api_key = "bench.supabase.key"
+
+    def __init__(self, latency=0.0, schema=None, path=":memory:", **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.down = False
+        self.schema = schema or SUPABASE_SCHEMA
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        for table, columns in self.schema.items():
+            self.connection.execute(f"CREATE TABLE {table} ({columns})")
+            if table in SUPABASE_INDEXES:
+                self.connection.execute(SUPABASE_INDEXES[table])
+
+    def rows(self, table):
+        """Return every row of a table"""
+        with self.lock:
+            cursor = self.connection.execute(f"SELECT * FROM {table}")
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
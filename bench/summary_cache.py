@@ -0,0 +1,132 @@
+"""
+Check and measure the summary cache against the local OpenAI and Supabase
+stubs.
+
+Summarizes a synthetic roster once, then verifies that repeated lookups make
+no OpenAI call, that new messages are summarized on top of the cached summary
+with a fraction of the prompt tokens, that the full transcript is summarized
+again after SUMMARY_MAX_INCREMENTS updates, that identical transcripts share
+a summary, that eviction keeps the cache within its size bound and that a
+transcript that can't be read is a failure, not an empty history:
+
+    python -m bench.summary_cache --users 50 --messages 200
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+from bench.stubs import FakeOpenAI, FakeSupabase
+from summary_cache import SummaryCache
+
+def _add_messages(stub, phone, count, start=0):
+    with stub.lock:
+        stub.connection.executemany(
+            "INSERT INTO messages (phone_number, role, content) VALUES (?, ?, ?)",
+            [(phone, "user" if turn % 2 == 0 else "assistant", f"Message {turn} from {phone}: the headache is back")
+             for turn in range(start, start + count)]
+        )
+        stub.connection.commit()
+
+def _prompt_tokens(results):
+    return sum(result["usage"].get("prompt_tokens", 0) for result in results)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=200, help="messages per user before the update")
+    parser.add_argument("--new-messages", type=int, default=4, help="messages added per user before the update")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    failures = []
+    with FakeOpenAI(latency=args.llm_latency, reply="Summary: recurring headache.") as openai_stub, \
+            FakeSupabase() as supabase_stub, tempfile.TemporaryDirectory() as directory:
+        os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+        os.environ["OPENAI_API_URL"] = openai_stub.completions_url
+        os.environ["SUPABASE_URL"] = supabase_stub.url
+        os.environ["SUPABASE_KEY"] = supabase_stub.api_key
+        import summarize_history
+        from database import create_user
+
+        phones = [f"93{index:08d}" for index in range(args.users)]
+        for phone in phones:
+            create_user(phone, "Test", 30, "Female")
+            _add_messages(supabase_stub, phone, args.messages)
+        cache = SummaryCache(os.path.join(directory, "cache.db"))
+
+        start = time.perf_counter()
+        first = [summarize_history.summarize_patient(phone, cache=cache) for phone in phones]
+        first_seconds = (time.perf_counter() - start) / args.users
+        if not all(result["success"] and not result["cached"] for result in first):
+            failures.append("the first summaries should all be computed")
+
+        calls = len(openai_stub.requests)
+        start = time.perf_counter()
+        repeated = [summarize_history.summarize_patient(phone, cache=cache) for phone in phones]
+        repeat_seconds = (time.perf_counter() - start) / args.users
+        if len(openai_stub.requests) != calls or not all(result["cached"] for result in repeated):
+            failures.append(f"repeated lookups made {len(openai_stub.requests) - calls} OpenAI calls")
+
+        for phone in phones:
+            _add_messages(supabase_stub, phone, args.new_messages, start=args.messages)
+        updated = [summarize_history.summarize_patient(phone, cache=cache) for phone in phones]
+        if not all(result["incremental"] for result in updated):
+            failures.append("summaries after new messages should be incremental")
+        fresh_cache = SummaryCache(os.path.join(directory, "fresh.db"))
+        full = [summarize_history.summarize_patient(phone, cache=fresh_cache) for phone in phones]
+
+        phone = phones[0]
+        # One update was made above
+        for turn in range(summarize_history.SUMMARY_MAX_INCREMENTS - 1):
+            _add_messages(supabase_stub, phone, 1, start=args.messages + args.new_messages + turn)
+            summarize_history.summarize_patient(phone, cache=cache)
+        _add_messages(supabase_stub, phone, 1, start=args.messages + args.new_messages + 100)
+        if summarize_history.summarize_patient(phone, cache=cache)["incremental"]:
+            failures.append(f"no full summary after {summarize_history.SUMMARY_MAX_INCREMENTS} updates")
+
+        create_user("930000009999", "Twin", 30, "Female")
+        with supabase_stub.lock:
+            supabase_stub.connection.execute(
+                "INSERT INTO messages (phone_number, role, content) "
+                "SELECT '930000009999', role, content FROM messages WHERE phone_number = ? ORDER BY seq",
+                (phones[1],)
+            )
+            supabase_stub.connection.commit()
+        calls = len(openai_stub.requests)
+        twin = summarize_history.summarize_patient("930000009999", cache=cache)
+        if len(openai_stub.requests) != calls or twin["summary"] != updated[1]["summary"]:
+            failures.append("an identical transcript should reuse the cached summary")
+
+        bounded = SummaryCache(os.path.join(directory, "bounded.db"), max_entries=10)
+        for phone in phones:
+            summarize_history.summarize_patient(phone, cache=bounded)
+        bounded.evict()
+        entries = bounded.stats()["entries"]
+        if entries > 10:
+            failures.append(f"bounded cache holds {entries} entries, expected at most 10")
+        stats = cache.stats()
+
+        supabase_stub.down = True
+        unread = summarize_history.summarize_patient(phones[2], cache=SummaryCache(os.path.join(directory, "down.db")))
+        supabase_stub.down = False
+        if unread["success"] or unread["summary"] is not None:
+            failures.append("a transcript read failure should fail the summary")
+
+    incremental_tokens, full_tokens = _prompt_tokens(updated), _prompt_tokens(full)
+    print(f"{args.users} users, {args.messages} messages each, {args.llm_latency * 1000:.0f} ms per OpenAI call")
+    print(f"first summary:    {first_seconds * 1000:7.2f} ms/user")
+    print(f"repeated lookup:  {repeat_seconds * 1000:7.2f} ms/user")
+    print(f"after {args.new_messages} new messages: {incremental_tokens} prompt tokens incremental, "
+          f"{full_tokens} summarizing everything again ({incremental_tokens / max(full_tokens, 1):.1%})")
+    print(f"cache: {stats}")
+    if incremental_tokens >= full_tokens:
+        failures.append("incremental summaries should use fewer prompt tokens than full ones")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("FAIL" if failures else "OK")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
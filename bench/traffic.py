@@ -0,0 +1,155 @@
+"""
+Synthetic WhatsApp traffic in the shape Twilio posts to /webhook.
+
+Each simulated user follows a script: a greeting, a language choice and
+onboarding (users already in the database go straight to the conversation),
+a few symptom messages in their language, and now and then a 'reset' followed
+by a new language choice, or a 'bye'. Scripts are generated from a seed so a run
+can be replayed exactly.
+"""
+import random
+import itertools
+
+from onboarding import LANGUAGES
+
+GREETINGS = ("hi", "hello", "Hi doctor", "namaste", "vanakkam")
+
+NAMES = ("Priya", "Arjun", "Lakshmi", "Rahul", "Ananya", "Suresh", "Kavya", "Mohammed", "Divya", "Ravi")
+
+HEALTH_ISSUES = ("none", "1", "2", "none", "thyroid")
+SURGERIES = ("none", "none", "2", "1", "none")
+
+# Symptom messages per language code
+SYMPTOMS = {
+    "en": (
+        "I have had a fever since yesterday",
+        "My head hurts a lot in the morning",
+        "I have a dry cough and sore throat",
+        "My stomach is upset after eating",
+        "I feel dizzy when I stand up",
+        "2"
+    ),
+    "hi": (
+        "मुझे कल से बुखार है",
+        "सुबह सिर में बहुत दर्द होता है",
+        "मुझे सूखी खांसी और गले में खराश है",
+        "खाने के बाद पेट खराब हो जाता है",
+        "1"
+    ),
+    "ta": (
+        "எனக்கு நேற்றிலிருந்து காய்ச்சல் இருக்கிறது",
+        "காலையில் தலைவலி அதிகமாக இருக்கிறது",
+        "எனக்கு இருமல் மற்றும் தொண்டை வலி உள்ளது",
+        "3"
+    ),
+    "te": (
+        "నాకు నిన్నటి నుండి జ్వరం ఉంది",
+        "ఉదయం తలనొప్పి ఎక్కువగా ఉంది",
+        "నాకు దగ్గు మరియు గొంతు నొప్పి ఉంది",
+        "2"
+    ),
+    "kn": (
+        "ನನಗೆ ನಿನ್ನೆಯಿಂದ ಜ್ವರ ಇದೆ",
+        "ಬೆಳಿಗ್ಗೆ ತಲೆನೋವು ಹೆಚ್ಚಾಗಿದೆ",
+        "ನನಗೆ ಕೆಮ್ಮು ಮತ್ತು ಗಂಟಲು ನೋವು ಇದೆ",
+        "1"
+    ),
+    "ml": (
+        "എനിക്ക് ഇന്നലെ മുതൽ പനി ഉണ്ട്",
+        "രാവിലെ തലവേദന കൂടുതലാണ്",
+        "എനിക്ക് ചുമയും തൊണ്ടവേദനയും ഉണ്ട്",
+        "3"
+    )
+}
+
+# Language choices, weighted roughly like the user base
+LANGUAGE_WEIGHTS = {"1": 5, "2": 4, "3": 2, "4": 2, "5": 1, "6": 1}
+
+def user_phone(index):
+    """Phone number of a simulated user"""
+    return f"9190{index:08d}"
+
+def _language_choice(rng):
+    choices = list(LANGUAGE_WEIGHTS)
+    return rng.choices(choices, weights=[LANGUAGE_WEIGHTS[choice] for choice in choices])[0]
+
+def _chat(rng, language_code, turns):
+    return [("conversation", rng.choice(SYMPTOMS[language_code])) for _ in range(turns)]
+
+def conversation_script(rng, language_code=None, turns=4, reset_rate=0.2, bye_rate=0.2):
+    """
+    Build the messages one user sends, in order
+
+    Args:
+        rng (random.Random): Source of randomness
+        language_code (str): The stored language of a user already in the database, None for a new user
+        turns (int): Symptom messages before an eventual reset
+
+    Returns:
+        list: (kind, body) pairs; kind is greeting, language, onboarding, conversation or command
+    """
+    if language_code:
+        # The session of a user in the database resumes the conversation in
+        # their stored language, so the greeting already goes to the LLM
+        script = [("conversation", rng.choice(GREETINGS))]
+    else:
+        choice = _language_choice(rng)
+        language_code = LANGUAGES[choice]["code"]
+        script = [
+            ("greeting", rng.choice(GREETINGS)),
+            ("language", choice),
+            ("onboarding", rng.choice(NAMES)),
+            ("onboarding", str(rng.randint(18, 80))),
+            ("onboarding", rng.choice(("1", "2"))),
+            ("onboarding", rng.choice(HEALTH_ISSUES)),
+            ("onboarding", rng.choice(SURGERIES))
+        ]
+    script += _chat(rng, language_code, turns)
+
+    if rng.random() < reset_rate:
+        # The profile is kept, the conversation starts again after the welcome back
+        choice = _language_choice(rng)
+        language_code = LANGUAGES[choice]["code"]
+        script += [
+            ("command", "reset"),
+            ("language", choice)
+        ]
+        script += _chat(rng, language_code, max(1, turns // 2))
+    if rng.random() < bye_rate:
+        script.append(("command", "bye"))
+    return script
+
+def generate_traffic(users, seed=0, returning_rate=0.3, turns=4, first_user=0):
+    """
+    Generate the scripts of all simulated users, numbered from `first_user`
+
+    Returns:
+        list: (phone number, stored language code or None for new users, script) per user
+    """
+    rng = random.Random(seed)
+    traffic = []
+    for index in range(users):
+        language_code = LANGUAGES[_language_choice(rng)]["code"] if rng.random() < returning_rate else None
+        traffic.append((user_phone(first_user + index), language_code, conversation_script(rng, language_code, turns)))
+    return traffic
+
+_message_sids = itertools.count(1)
+
+def twilio_form(phone_number, body, to="whatsapp:+14155238886"):
+    """The form fields Twilio posts for an incoming WhatsApp text message"""
+    message_sid = f"SM{next(_message_sids):032x}"
+    return {
+        "SmsMessageSid": message_sid,
+        "MessageSid": message_sid,
+        "AccountSid": "ACbench00000000000000000000000000",
+        "MessagingServiceSid": "",
+        "From": f"whatsapp:+{phone_number}",
+        "To": to,
+        "Body": body,
+        "NumMedia": "0",
+        "NumSegments": "1",
+        "ProfileName": "Bench User",
+        "WaId": phone_number,
+        "SmsStatus": "received",
+        "ApiVersion": "2010-04-01"
+    }
@@ -0,0 +1,232 @@
+"""
+Throughput, latency and memory of webhook() under replayed WhatsApp traffic.
+
+Simulated users (see bench.traffic) onboard in six languages, describe their
+symptoms, and send 'reset' and 'bye', all through the Flask test client. The
+OpenAI and Supabase stubs run locally, so the suite works offline. Every
+request must get a TwiML reply. Latency percentiles are reported per kind of
+message:
+
+    python -m bench.webhook_load --users 200 --concurrency 16 --llm-latency 0.05 --token-rate 200
+
+--profile replays the traffic on one thread under cProfile to show where the
+time goes. --ci runs the fixed workload in bench/ci_thresholds.json and exits
+with 1 if throughput, a latency percentile, the OpenAI or Supabase calls per
+message, memory growth or the error count is worse than its threshold:
+
+    python -m bench.webhook_load --ci
+"""
+import os
+import sys
+import json
+import time
+import queue
+import pstats
+import cProfile
+import argparse
+import resource
+import threading
+from collections import defaultdict
+
+from bench.stubs import FakeOpenAI, FakeSupabase
+from bench.traffic import generate_traffic, twilio_form
+
+THRESHOLDS_PATH = os.path.join(os.path.dirname(__file__), "ci_thresholds.json")
+
+KINDS = ("greeting", "language", "onboarding", "conversation", "command")
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def _rss_mib():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def _populate(stub, traffic):
+    """Store the users that are already registered"""
+    with stub.lock:
+        stub.connection.executemany(
+            "INSERT INTO users (phone_number, name, age, gender, language) VALUES (?, ?, ?, ?, ?)",
+            [(phone, "Returning User", 50, "Female", language_code)
+             for phone, language_code, _ in traffic if language_code]
+        )
+        stub.connection.commit()
+
+def replay(app, traffic, concurrency):
+    """
+    Send every user's script through the webhook, users in parallel
+
+    Returns:
+        tuple: {kind: [latency]}, the failures and the elapsed seconds
+    """
+    latencies = defaultdict(list)
+    failures = []
+    lock = threading.Lock()
+    users = queue.Queue()
+    for entry in traffic:
+        users.put(entry)
+
+    def worker():
+        client = app.app.test_client()
+        while True:
+            try:
+                phone, _, script = users.get_nowait()
+            except queue.Empty:
+                return
+            for kind, body in script:
+                start = time.perf_counter()
+                response = client.post("/webhook", data=twilio_form(phone, body))
+                elapsed = time.perf_counter() - start
+                text = response.get_data(as_text=True)
+                with lock:
+                    latencies[kind].append(elapsed)
+                    if response.status_code != 200 or "<Message>" not in text:
+                        failures.append(f"{phone} {kind} {body!r}: {response.status_code} {text[:100]}")
+
+    start = time.perf_counter()
+    if concurrency <= 1:
+        worker()
+    else:
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return latencies, failures, time.perf_counter() - start
+
+def run(args):
+    """Run the workload described by the arguments and return its results"""
+    with FakeOpenAI(latency=args.llm_latency, token_delay=1 / args.token_rate if args.token_rate else 0) as openai_stub, \
+            FakeSupabase(latency=args.db_latency) as supabase_stub:
+        os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+        os.environ["OPENAI_API_URL"] = openai_stub.completions_url
+        os.environ["SUPABASE_URL"] = supabase_stub.url
+        os.environ["SUPABASE_KEY"] = supabase_stub.api_key
+        # Scripted users send far faster than people do; measure the app, not the rate limits
+        os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+        import app
+        import database
+        app.ASYNC_REPLIES = False
+
+        traffic = generate_traffic(args.users, seed=args.seed, returning_rate=args.returning, turns=args.turns)
+        _populate(supabase_stub, traffic)
+
+        rss_before = _rss_mib()
+        if args.profile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            latencies, failures, elapsed = replay(app, traffic, 1)
+            profiler.disable()
+        else:
+            latencies, failures, elapsed = replay(app, traffic, args.concurrency)
+        database.flush_pending_writes()
+        rss_after = _rss_mib()
+
+        messages = sum(len(values) for values in latencies.values())
+        results = {
+            "users": args.users,
+            "messages": messages,
+            "seconds": elapsed,
+            "throughput": messages / elapsed,
+            "latency_ms": {
+                kind: {
+                    "count": len(values),
+                    "p50": _percentile(values, 0.50) * 1000,
+                    "p95": _percentile(values, 0.95) * 1000,
+                    "p99": _percentile(values, 0.99) * 1000
+                }
+                for kind, values in ([("all", sum(latencies.values(), []))] + [(kind, latencies[kind]) for kind in KINDS])
+                if values
+            },
+            "openai_calls": len(openai_stub.requests),
+            "supabase_requests": sum(supabase_stub.calls.values()),
+            "rss_growth_mib": rss_after - rss_before,
+            "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "errors": len(failures),
+            "failures": failures[:10]
+        }
+    if args.profile:
+        stats = pstats.Stats(profiler)
+        stats.sort_stats("cumulative").print_stats(25)
+    return results
+
+def check_thresholds(results, thresholds):
+    """Return the thresholds the results do not meet"""
+    violations = []
+    if results["throughput"] < thresholds["min_throughput"]:
+        violations.append(f"throughput {results['throughput']:.1f} msg/s < {thresholds['min_throughput']}")
+    for kind, limits in thresholds["max_latency_ms"].items():
+        for percentile, limit in limits.items():
+            value = results["latency_ms"][kind][percentile]
+            if value > limit:
+                violations.append(f"{kind} {percentile} {value:.1f} ms > {limit} ms")
+    conversation = results["latency_ms"]["conversation"]["count"]
+    if results["openai_calls"] > thresholds["max_openai_calls_per_conversation_message"] * conversation:
+        violations.append(f"{results['openai_calls']} OpenAI calls for {conversation} conversation messages")
+    supabase_per_message = results["supabase_requests"] / results["messages"]
+    if supabase_per_message > thresholds["max_supabase_requests_per_message"]:
+        violations.append(f"{supabase_per_message:.2f} Supabase requests per message > "
+                          f"{thresholds['max_supabase_requests_per_message']}")
+    if results["rss_growth_mib"] > thresholds["max_rss_growth_mib"]:
+        violations.append(f"RSS grew {results['rss_growth_mib']:.1f} MiB > {thresholds['max_rss_growth_mib']} MiB")
+    if results["errors"] > thresholds["max_errors"]:
+        violations.append(f"{results['errors']} errors > {thresholds['max_errors']}")
+    return violations
+
+def report(results):
+    print(f"{results['users']} users, {results['messages']} messages in {results['seconds']:.2f}s: "
+          f"{results['throughput']:.1f} msg/s")
+    print(f"{'kind':<14}{'count':>7}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}")
+    for kind, stats in results["latency_ms"].items():
+        print(f"{kind:<14}{stats['count']:>7}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}")
+    conversation = results["latency_ms"].get("conversation", {}).get("count", 0)
+    print(f"OpenAI calls: {results['openai_calls']} for {conversation} conversation messages; "
+          f"Supabase requests: {results['supabase_requests'] / results['messages']:.2f} per message")
+    print(f"RSS: +{results['rss_growth_mib']:.1f} MiB during the run, peak {results['peak_rss_mib']:.1f} MiB")
+    for failure in results["failures"]:
+        print(f"FAIL: {failure}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16, help="users replayed in parallel")
+    parser.add_argument("--turns", type=int, default=4, help="symptom messages per user before a reset")
+    parser.add_argument("--returning", type=float, default=0.3, help="share of users already in the database")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds before the fake OpenAI server answers")
+    parser.add_argument("--token-rate", type=float, default=0, help="tokens per second generated by the fake OpenAI server (0 for instant)")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="seconds per fake Supabase request")
+    parser.add_argument("--profile", action="store_true", help="replay on one thread under cProfile")
+    parser.add_argument("--ci", action="store_true", help="run the workload in ci_thresholds.json and check it")
+    parser.add_argument("--thresholds", default=THRESHOLDS_PATH)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    thresholds = None
+    if args.ci:
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+        for name, value in thresholds["workload"].items():
+            setattr(args, name, value)
+
+    results = run(args)
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = results["errors"] > 0
+    if thresholds:
+        violations = check_thresholds(results, thresholds)
+        for violation in violations:
+            print(f"REGRESSION: {violation}")
+        failed = failed or bool(violations)
+    print("FAIL" if failed else "OK")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
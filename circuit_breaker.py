@@ -0,0 +1,190 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Off switch: with breakers disabled every call goes through
+CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Exported as a number on /metrics
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open"""
+
+    def __init__(self, name):
+        super().__init__(f"{name} circuit is open")
+        self.name = name
+
+class CircuitBreaker:
+    """
+    Stop calling a dependency that keeps failing or is too slow
+
+    Calls of the last `window` seconds are tracked; a call fails if it raised,
+    returned an error, or took `slow_call` seconds or more. Once at least
+    `min_calls` were made and `failure_rate` of them failed, the breaker opens
+    and calls are refused for `open_seconds`. Then up to `half_open_calls`
+    probes go through: if they all succeed the breaker closes, and if one
+    fails it opens again.
+    """
+
+    def __init__(self, name, failure_rate=0.5, min_calls=10, window=30.0, slow_call=10.0, open_seconds=30.0,
+                 half_open_calls=2, clock=time.monotonic):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+        self._state = CLOSED
+        self._opened_at = 0.0
+        # (finished at, failed) of the calls in the window, oldest first
+        self._calls = deque()
+        self._failures = 0
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "failures": 0, "slow_calls": 0, "rejected": 0, "opened": 0}
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow(self):
+        """Whether a call may go through now; every allowed call must be passed to record()"""
+        if not CIRCUIT_BREAKER_ENABLED:
+            return True
+        with self._lock:
+            if self._state == OPEN:
+                if self.clock() < self._opened_at + self.open_seconds:
+                    self._stats["rejected"] += 1
+                    return False
+                self._state = HALF_OPEN
+                self._probes = 0
+                self._probe_successes = 0
+                logger.info("%s circuit half-open, probing", self.name)
+            if self._state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self._stats["rejected"] += 1
+                    return False
+                self._probes += 1
+            return True
+
+    def record(self, failed, seconds):
+        """Record the outcome of an allowed call"""
+        if not CIRCUIT_BREAKER_ENABLED:
+            return
+        slow = seconds >= self.slow_call
+        failed = failed or slow
+        now = self.clock()
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["failures"] += failed
+            self._stats["slow_calls"] += slow
+            if self._state == HALF_OPEN:
+                if failed:
+                    self._open(now)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_calls:
+                        self._state = CLOSED
+                        self._calls.clear()
+                        self._failures = 0
+                        logger.info("%s circuit closed", self.name)
+                return
+            if self._state == OPEN:
+                # A call that started before the breaker opened
+                return
+            self._calls.append((now, failed))
+            self._failures += failed
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._failures -= self._calls.popleft()[1]
+            if len(self._calls) >= self.min_calls and self._failures >= self.failure_rate * len(self._calls):
+                self._open(now)
+
+    def _open(self, now):
+        """Refuse calls for open_seconds (lock held)"""
+        self._state = OPEN
+        self._opened_at = now
+        self._stats["opened"] += 1
+        logger.warning("%s circuit open for %.0fs after %s of %s calls failed",
+                       self.name, self.open_seconds, self._failures, len(self._calls))
+
+    @contextmanager
+    def guard(self):
+        """
+        Run a block as a call through the breaker
+
+        Usage:
+            with supabase_breaker.guard():
+                response = query.execute()
+
+        Raises CircuitOpenError without running the block when the breaker
+        refuses the call. The call fails if the block raises.
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.name)
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException:
+            self.record(True, time.monotonic() - start)
+            raise
+        self.record(False, time.monotonic() - start)
+
+    def reset(self):
+        """Close the breaker and forget the calls made so far"""
+        with self._lock:
+            self._state = CLOSED
+            self._calls.clear()
+            self._failures = 0
+
+    def stats(self):
+        """Return the state (0 closed, 1 half-open, 2 open), the failure rate in the window and counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["state"] = STATE_CODES[self._state]
+            stats["failure_rate"] = self._failures / len(self._calls) if self._calls else 0.0
+        return stats
+
+def _breaker_from_env(name, slow_call, open_seconds):
+    """A breaker whose settings can be overridden with <NAME>_BREAKER_<SETTING>"""
+    prefix = f"{name.upper()}_BREAKER_"
+    return CircuitBreaker(
+        name,
+        failure_rate=float(os.getenv(prefix + "FAILURE_RATE", "0.5")),
+        min_calls=int(os.getenv(prefix + "MIN_CALLS", "10")),
+        window=float(os.getenv(prefix + "WINDOW", "30")),
+        slow_call=float(os.getenv(prefix + "SLOW_CALL", slow_call)),
+        open_seconds=float(os.getenv(prefix + "OPEN_SECONDS", open_seconds)),
+        half_open_calls=int(os.getenv(prefix + "HALF_OPEN_CALLS", "2"))
+    )
+
+# A reply normally takes a few seconds; waiting 15 pins a worker and Twilio gives up soon after
+openai_breaker = _breaker_from_env("openai", "15", "30")
+# Queries take tens of milliseconds
+supabase_breaker = _breaker_from_env("supabase", "2", "15")
+
+def get_breaker_stats():
+    """Return the state and counters of every breaker, flattened as <name>_<counter>"""
+    return {
+        f"{breaker.name}_{key}": value
+        for breaker in (openai_breaker, supabase_breaker)
+        for key, value in breaker.stats().items()
+    }
@@ -0,0 +1,215 @@
+import os
+import logging
+import threading
+from dotenv import load_dotenv
+from circuit_breaker import CircuitOpenError
+from llm_client import chat_completion
+from metrics import record_usage
+from rate_limit import get_rate_limiter
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Number of most recent history messages always sent verbatim
+CONTEXT_RECENT_MESSAGES = int(os.getenv("CONTEXT_RECENT_MESSAGES", "12"))
+# Token budget for the history part of the prompt (summary + verbatim messages)
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+# Fold older messages into the summary only once this many have piled up,
+# so the summary is refreshed every few turns rather than on every turn
+CONTEXT_SUMMARY_BATCH = int(os.getenv("CONTEXT_SUMMARY_BATCH", "8"))
+CONTEXT_SUMMARY_MODEL = os.getenv("CONTEXT_SUMMARY_MODEL", "gpt-4o")
+# Tokenizer used to count tokens exactly when tiktoken is installed
+TIKTOKEN_ENCODING = os.getenv("TIKTOKEN_ENCODING", "o200k_base")
+
+SUMMARY_PROMPT = """
+You are a medical assistant keeping running notes of a conversation with a patient.
+You will be given the notes so far (if any) and the next part of the conversation.
+Update the notes so they stay concise and include:
+
+1. Patient's basic information (name, age, gender)
+2. Symptoms described, with duration and severity
+3. Chronic conditions, past procedures or surgeries
+4. Medicines suggested or already being taken
+5. Allergies and any advice already given
+
+Only return the updated notes.
+"""
+
+# Per-message overhead of the chat format, in tokens
+MESSAGE_OVERHEAD_TOKENS = 4
+# Characters per token without tiktoken: about four in English, but only
+# about two in the Indian scripts, whose words are split into more tokens
+ASCII_CHARS_PER_TOKEN = 4
+OTHER_CHARS_PER_TOKEN = 2
+
+_stats = {"turns": 0, "tokens_sent": 0, "tokens_saved": 0, "summaries": 0, "summary_errors": 0,
+          "summaries_limited": 0}
+_stats_lock = threading.Lock()
+
+# The tiktoken encoding, False once it turned out to be unavailable
+_encoding = None
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+        except Exception as e:
+            # Not installed, or its vocabulary could not be downloaded
+            logger.info("Estimating tokens per script, tiktoken is unavailable: %s", e)
+            _encoding = False
+    return _encoding
+
+def estimate_tokens(text):
+    """Token count of a text: exact with tiktoken, otherwise estimated from its characters per script"""
+    text = text or ""
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return ascii_chars // ASCII_CHARS_PER_TOKEN + (len(text) - ascii_chars) // OTHER_CHARS_PER_TOKEN + 1
+
+def message_tokens(message):
+    """Rough token count of one chat message"""
+    return estimate_tokens(message.get("content")) + MESSAGE_OVERHEAD_TOKENS
+
+def count_message_tokens(messages):
+    """Rough token count of a list of chat messages"""
+    return sum(message_tokens(message) for message in messages)
+
+def _count_summary_error():
+    with _stats_lock:
+        _stats["summary_errors"] += 1
+
+def update_summary(previous_summary, messages, user_id=None):
+    """
+    Fold a slice of the conversation into the running summary
+
+    The call is an LLM call of its own: with a `user_id` it takes a token from
+    the global rate limit and its usage counts against the user's daily budget.
+
+    Args:
+        previous_summary (str): The summary so far, or None
+        messages (list): The history messages to add to it
+        user_id (str): The phone number the call is made for
+
+    Returns:
+        str: The updated summary, or None if the API call failed or was rate limited
+    """
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    content = f"Notes so far:\n{previous_summary or '(none)'}\n\nNext part of the conversation:\n{transcript}"
+    payload = {
+        "model": CONTEXT_SUMMARY_MODEL,
+        "messages": [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": content}
+        ],
+        "temperature": 0.3,
+        "max_tokens": 400
+    }
+    if user_id is not None and get_rate_limiter().check_llm_call(user_id):
+        with _stats_lock:
+            _stats["summaries_limited"] += 1
+        return None
+    try:
+        response = chat_completion(payload)
+        if response.status_code != 200:
+            logger.error("OpenAI API error while summarizing context: %s", response.status_code)
+            _count_summary_error()
+            return None
+        response_json = response.json()
+        usage = response_json.get("usage")
+        record_usage(usage, purpose="context_summary")
+        if user_id is not None:
+            get_rate_limiter().record_usage(user_id, usage)
+        return response_json["choices"][0]["message"]["content"]
+    except CircuitOpenError:
+        # Nothing was sent
+        _count_summary_error()
+        return None
+    except Exception as e:
+        logger.error("Error summarizing conversation context: %s", e)
+        _count_summary_error()
+        if user_id is not None:
+            # The request may have been processed, count its prompt
+            get_rate_limiter().record_usage(user_id, {"prompt_tokens": count_message_tokens(payload["messages"])})
+        return None
+
+def build_context(user_data, user_id=None):
+    """
+    Build the history part of the prompt within the token budget
+
+    The last CONTEXT_RECENT_MESSAGES messages are kept verbatim. Older ones are
+    folded into `user_data["context_summary"]` in batches, and the summary is
+    extended incrementally from `user_data["summarized_upto"]` instead of being
+    recomputed. The full history stays in the session untouched.
+
+    Only the messages after the summary are counted, once per turn; the
+    tokens of the folded ones are kept in `user_data["summarized_tokens"]`.
+
+    Args:
+        user_data (dict): The user's session
+        user_id (str): The phone number whose rate limits a summary call counts against
+
+    Returns:
+        tuple: (messages to send, estimated prompt tokens saved)
+    """
+    history = user_data["history"]
+    summarized = user_data.get("summarized_upto", 0)
+    if summarized > len(history):
+        # The history was replaced (e.g. on language selection), start over
+        summarized = 0
+        user_data.pop("context_summary", None)
+    if "summarized_tokens" not in user_data or not summarized:
+        # Sessions from before the count was kept, or without a summary
+        user_data["summarized_tokens"] = count_message_tokens(history[:summarized])
+    counts = [message_tokens(message) for message in history[summarized:]]
+    pending_tokens = sum(counts)
+
+    # Keep the recent messages, and fewer of them if they alone exceed the budget
+    keep_from = max(summarized, len(history) - CONTEXT_RECENT_MESSAGES)
+    kept_tokens = sum(counts[keep_from - summarized:])
+    while keep_from < len(history) - 1 and kept_tokens > CONTEXT_MAX_TOKENS:
+        kept_tokens -= counts[keep_from - summarized]
+        keep_from += 1
+
+    over_budget = pending_tokens > CONTEXT_MAX_TOKENS
+    if keep_from > summarized and (keep_from - summarized >= CONTEXT_SUMMARY_BATCH or over_budget):
+        summary = update_summary(user_data.get("context_summary"), history[summarized:keep_from], user_id)
+        if summary:
+            with _stats_lock:
+                _stats["summaries"] += 1
+            user_data["context_summary"] = summary
+            user_data["summarized_tokens"] += pending_tokens - kept_tokens
+            user_data["summarized_upto"] = summarized = keep_from
+            pending_tokens = kept_tokens
+
+    # If folding failed, still stay within budget by dropping the oldest messages
+    start = summarized if pending_tokens <= CONTEXT_MAX_TOKENS else keep_from
+    messages = []
+    if user_data.get("context_summary"):
+        messages.append({
+            "role": "system",
+            "content": f"Summary of the earlier conversation with this patient:\n{user_data['context_summary']}"
+        })
+    summary_tokens = count_message_tokens(messages)
+    messages.extend(history[start:])
+
+    # The folded messages and any dropped ones, less the summary that replaces them
+    dropped_tokens = pending_tokens - kept_tokens if start > summarized else 0
+    tokens_sent = summary_tokens + pending_tokens - dropped_tokens
+    tokens_saved = max(0, user_data["summarized_tokens"] + dropped_tokens - summary_tokens)
+    with _stats_lock:
+        _stats["turns"] += 1
+        _stats["tokens_sent"] += tokens_sent
+        _stats["tokens_saved"] += tokens_saved
+    return messages, tokens_saved
+
+def get_context_stats():
+    """Return counters of context turns, summaries and estimated tokens sent/saved"""
+    with _stats_lock:
+        return dict(_stats)
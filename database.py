@@ -1,8 +1,13 @@
 import os
+import json
+import time
+import atexit
 from dotenv import load_dotenv
 import logging
-from supabase import create_client, Client
+import threading
+from collections import OrderedDict
 from datetime import datetime
+from circuit_breaker import CircuitOpenError, supabase_breaker
 
 # Load environment variables
 load_dotenv()
@@ -14,21 +19,107 @@ logger = logging.getLogger(__name__)
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 
-# Initialize Supabase client
-supabase: Client = None
+# Read-through cache of user rows, per process
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+
+# Medical history updates are buffered and written at most once per interval
+# per user; 0 writes every update immediately
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "2"))
+# Flush early once this many users have unwritten history
+HISTORY_MAX_PENDING = int(os.getenv("HISTORY_MAX_PENDING", "1000"))
+# Rows per INSERT when flushing buffered messages
+MESSAGE_INSERT_BATCH = int(os.getenv("MESSAGE_INSERT_BATCH", "500"))
+# Buffered messages the database rejects are appended to this JSONL file
+# instead of being retried forever
+MESSAGE_DEAD_LETTER_PATH = os.getenv("MESSAGE_DEAD_LETTER_PATH", "messages_dead_letter.jsonl")
+# Queued user rows the database rejects, likewise
+USER_DEAD_LETTER_PATH = os.getenv("USER_DEAD_LETTER_PATH", "users_dead_letter.jsonl")
+
+# Columns read for a user; the legacy medical_history blob is left out
+USER_COLUMNS = "phone_number, name, age, gender, previous_health_issues, surgeries, language, created_at, updated_at"
+
+# Supabase client, created on first use (see get_supabase_client)
+supabase = None
+_client_lock = threading.Lock()
+
+# phone_number -> (expires at, user row)
+_profile_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# phone_number -> latest medical history not yet written
+_pending_history = {}
+# phone_number -> user row whose insert failed, replayed by the flush thread
+_pending_users = {}
+# phone_number -> message rows not yet inserted, in order
+_pending_messages = {}
+_pending_lock = threading.Lock()
+# Users whose buffered messages are being inserted; their newer rows wait,
+# so a transcript is inserted in order without holding the flush lock
+_flushing_messages = set()
+_messages_flushed = threading.Condition(_pending_lock)
+# Serializes flushes so an older write can never land after a newer one
+_flush_lock = threading.Lock()
+_flush_requested = threading.Event()
+_flusher = None
+
+# Postgres error classes of a database that can't serve queries for now:
+# connection exceptions, insufficient resources, shutdown or statement
+# timeout, system errors
+UNAVAILABLE_SQLSTATE_CLASSES = ("08", "53", "57", "58")
+
+class DatabaseUnavailableError(Exception):
+    """Raised by reads whose answer is unknown because the database could not be queried"""
+
+_stats = {
+    "cache_hits": 0,
+    "cache_misses": 0,
+    "history_updates": 0,
+    "history_writes": 0,
+    "history_write_errors": 0,
+    "messages_appended": 0,
+    "message_inserts": 0,
+    "message_insert_errors": 0,
+    "messages_dead_lettered": 0,
+    "users_queued": 0,
+    "user_inserts": 0,
+    "user_insert_errors": 0,
+    "users_dead_lettered": 0
+}
 
 def get_supabase_client():
     """Create and return a Supabase client"""
     global supabase
     if supabase is None:
-        try:
-            supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-            logger.info("Supabase client initialized successfully")
-        except Exception as e:
-            logger.error(f"Error connecting to Supabase: {e}")
-            return None
+        with _client_lock:
+            if supabase is None:
+                try:
+                    # Importing supabase takes a few hundred milliseconds, only pay for it when needed
+                    from supabase import create_client
+                    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+                    logger.info("Supabase client initialized successfully")
+                except Exception as e:
+                    logger.error("Error connecting to Supabase: %s", e)
+                    return None
     return supabase
 
+def _execute(query):
+    """Execute a query through the Supabase circuit breaker, which raises CircuitOpenError while open"""
+    with supabase_breaker.guard():
+        return query.execute()
+
+def is_unavailable(error):
+    """Whether a query failed because the database could not be reached, rather than because of the query itself"""
+    import httpx
+    if isinstance(error, (CircuitOpenError, DatabaseUnavailableError, httpx.TransportError)):
+        return True
+    # PostgREST errors carry the Postgres SQLSTATE, its own PGRST code, or the
+    # HTTP status when a gateway answered instead
+    code = str(getattr(error, "code", None) or "")
+    if code.isdigit() and len(code) == 3:
+        return code.startswith("5")
+    return code.startswith("PGRST00") or (len(code) == 5 and code[:2] in UNAVAILABLE_SQLSTATE_CLASSES)
+
 def init_db():
     """Initialize the database and create tables if they don't exist"""
     try:
@@ -42,70 +133,560 @@ def init_db():
             logger.error("Failed to initialize database")
             return False
     except Exception as e:
-        logger.error(f"Error initializing database: {e}")
+        logger.error("Error initializing database: %s", e)
         return False
 
+def _cache_get(phone_number):
+    """Return a copy of the cached user row, or None if it is missing or expired"""
+    with _cache_lock:
+        entry = _profile_cache.get(phone_number)
+        if entry is None or entry[0] < time.monotonic():
+            _stats["cache_misses"] += 1
+            return None
+        _stats["cache_hits"] += 1
+        _profile_cache.move_to_end(phone_number)
+        return dict(entry[1])
+
+def _cache_put(phone_number, user):
+    """Cache a user row for PROFILE_CACHE_TTL seconds"""
+    with _cache_lock:
+        _profile_cache[phone_number] = (time.monotonic() + PROFILE_CACHE_TTL, dict(user))
+        _profile_cache.move_to_end(phone_number)
+        while len(_profile_cache) > PROFILE_CACHE_SIZE:
+            _profile_cache.popitem(last=False)
+
+def invalidate_user(phone_number):
+    """Drop a user from the profile cache so the next read goes to the database"""
+    with _cache_lock:
+        _profile_cache.pop(phone_number, None)
+
 def get_user(phone_number):
-    """Get user details from the database"""
+    """
+    Get user details from the cache or the database
+
+    Returns:
+        dict: The user row, or None if the user is not registered
+
+    Raises:
+        DatabaseUnavailableError: If the database could not be queried, so
+            whether the user is registered is unknown
+    """
+    user = _cache_get(phone_number)
+    if user is None:
+        with _pending_lock:
+            user = _pending_users.get(phone_number)
+        if user is not None:
+            return dict(user)
+        client = get_supabase_client()
+        if not client:
+            raise DatabaseUnavailableError("No Supabase client")
+        try:
+            response = _execute(client.table('users').select(USER_COLUMNS).eq('phone_number', phone_number))
+        except Exception as e:
+            logger.error("Error getting user: %s", e)
+            raise DatabaseUnavailableError(str(e)) from e
+        if response.data and len(response.data) > 0:
+            user = response.data[0]
+            _cache_put(phone_number, user)
+    return user
+
+def create_user(phone_number, name, age, gender, medical_history="", language="en", previous_health_issues="", surgeries=""):
+    """
+    Create a new user in the database
+
+    If the database can't be reached, e.g. while Supabase is down, the row
+    is queued and inserted by the flush thread once the database is back;
+    get_user() returns it meanwhile. Without buffering
+    (HISTORY_FLUSH_INTERVAL=0), or if the database rejects the row, the
+    failure is returned instead.
+    """
+    now = datetime.now().isoformat()
+    user_data = {
+        'phone_number': phone_number,
+        'name': name,
+        'age': age,
+        'gender': gender,
+        'previous_health_issues': previous_health_issues,
+        'surgeries': surgeries,
+        'medical_history': medical_history,
+        'language': language,
+        'created_at': now,
+        'updated_at': now
+    }
     try:
         client = get_supabase_client()
         if client:
-            response = client.table('users').select('*').eq('phone_number', phone_number).execute()
-            if response.data and len(response.data) > 0:
-                return response.data[0]
-            return None
+            response = _execute(client.table('users').insert(user_data))
+            invalidate_user(phone_number)
+            return True
     except Exception as e:
-        logger.error(f"Error getting user: {e}")
-        return None
+        logger.error("Error creating user: %s", e)
+        if not is_unavailable(e):
+            return False
+    if HISTORY_FLUSH_INTERVAL <= 0:
+        return False
 
-def create_user(phone_number, name, age, gender, medical_history="", language="en"):
-    """Create a new user in the database"""
+    with _pending_lock:
+        _stats["users_queued"] += 1
+        _pending_users[phone_number] = user_data
+    _ensure_flusher()
+    logger.warning("Queued user %s to be created once the database is available", phone_number)
+    return True
+
+def write_user_medical_history(phone_number, medical_history):
+    """Update user's medical history in the database right away"""
     try:
         client = get_supabase_client()
         if client:
             now = datetime.now().isoformat()
-            user_data = {
-                'phone_number': phone_number,
-                'name': name,
-                'age': age,
-                'gender': gender,
+            response = _execute(client.table('users').update({
                 'medical_history': medical_history,
-                'language': language,
-                'created_at': now,
                 'updated_at': now
-            }
-            response = client.table('users').insert(user_data).execute()
+            }).eq('phone_number', phone_number))
             return True
     except Exception as e:
-        logger.error(f"Error creating user: {e}")
+        logger.error("Error updating user medical history: %s", e)
         return False
 
 def update_user_medical_history(phone_number, medical_history):
-    """Update user's medical history"""
+    """
+    Update user's legacy medical history column (superseded by append_messages)
+
+    The update is buffered and written by a background thread within
+    HISTORY_FLUSH_INTERVAL seconds; later updates for the same user replace
+    earlier ones that are still waiting. Pending updates are flushed at exit.
+
+    Returns:
+        bool: True once the update is queued (or written, without buffering)
+    """
+    if HISTORY_FLUSH_INTERVAL <= 0:
+        return write_user_medical_history(phone_number, medical_history)
+
+    with _pending_lock:
+        _stats["history_updates"] += 1
+        _pending_history[phone_number] = medical_history
+        pending = len(_pending_history) + len(_pending_messages)
+    _ensure_flusher()
+    if pending >= HISTORY_MAX_PENDING:
+        _flush_requested.set()
+    return True
+
+def _insert_message_rows(rows):
+    """Insert message rows in one request; return None on success, or the error"""
+    try:
+        client = get_supabase_client()
+        if not client:
+            return DatabaseUnavailableError("No Supabase client")
+        _execute(client.table('messages').insert(rows))
+        return None
+    except Exception as e:
+        logger.error("Error inserting messages: %s", e)
+        return e
+
+def insert_messages(rows):
+    """Insert message rows into the messages table right away, in one request"""
+    return _insert_message_rows(rows) is None
+
+def append_messages(phone_number, messages):
+    """
+    Append messages to a user's transcript in the messages table
+
+    Like history updates, messages are buffered and inserted by the flush
+    thread, many users per INSERT. They are never rewritten afterwards.
+
+    A transcript is ordered by `seq`, which is assigned when the rows are
+    inserted. Each process inserts a user's messages in the order they were
+    appended, but if two processes buffer messages of one user at once (a
+    shared SESSION_BACKEND with concurrent messages), their flushes may
+    interleave them.
+
+    Args:
+        phone_number (str): The user's phone number
+        messages (list): Chat messages ({"role", "content"}) in order
+
+    Returns:
+        bool: True once the messages are queued (or inserted, without buffering)
+    """
+    rows = [
+        {"phone_number": phone_number, "role": message["role"], "content": message["content"]}
+        for message in messages
+    ]
+    if not rows:
+        return True
+    if HISTORY_FLUSH_INTERVAL <= 0:
+        return insert_messages(rows)
+
+    with _pending_lock:
+        _stats["messages_appended"] += len(rows)
+        _pending_messages.setdefault(phone_number, []).extend(rows)
+        pending = len(_pending_history) + len(_pending_messages)
+    _ensure_flusher()
+    if pending >= HISTORY_MAX_PENDING:
+        _flush_requested.set()
+    return True
+
+def _message_chunks(batch):
+    """Pack the buffered rows of whole users into INSERTs of about MESSAGE_INSERT_BATCH rows"""
+    chunk = []
+    for _, user_rows in batch:
+        if chunk and len(chunk) + len(user_rows) > MESSAGE_INSERT_BATCH:
+            yield chunk
+            chunk = []
+        # A user with more rows than a batch gets an INSERT of their own
+        chunk.extend(user_rows)
+    if chunk:
+        yield chunk
+
+def _dead_letter(path, rows, error):
+    """Append rows the database rejected to a dead-letter file"""
+    failed_at = datetime.now().isoformat()
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(dict(row, error=str(error), failed_at=failed_at), ensure_ascii=False) + "\n")
+    except OSError as e:
+        logger.error("Error writing dead-letter rows to %s: %s", path, e)
+
+def _dead_letter_messages(rows, error):
+    """Append message rows the database rejected to the dead-letter file"""
+    logger.error("Dropping %d messages of %s rejected by the database: %s", len(rows), rows[0]['phone_number'], error)
+    _dead_letter(MESSAGE_DEAD_LETTER_PATH, rows, error)
+    with _pending_lock:
+        _stats["messages_dead_lettered"] += len(rows)
+
+def _flush_messages(phone_numbers=None):
+    """
+    Insert buffered messages of the given users (all by default); return the number of rows left
+
+    Rows of users whose own row is still queued, or whose earlier rows are
+    being inserted by another flush, wait for it. If an INSERT fails while
+    the database is reachable, each of its users' rows are inserted on their
+    own, so one bad row doesn't hold back other users' messages; rows that
+    are rejected again go to the dead-letter file.
+    """
+    with _pending_lock:
+        if phone_numbers is None:
+            phone_numbers = list(_pending_messages)
+        # Messages reference the user row, which is inserted first
+        batch = [(phone_number, _pending_messages.pop(phone_number)) for phone_number in phone_numbers
+                 if phone_number in _pending_messages and phone_number not in _pending_users
+                 and phone_number not in _flushing_messages]
+        waiting = sum(len(_pending_messages.get(phone_number, ())) for phone_number in phone_numbers)
+        _flushing_messages.update(phone_number for phone_number, _ in batch)
+    failed = []
+    inserted = 0
+    try:
+        for chunk in _message_chunks(batch):
+            error = _insert_message_rows(chunk)
+            if error is None:
+                inserted += len(chunk)
+                continue
+            if is_unavailable(error):
+                failed.extend(chunk)
+                continue
+            by_user = {}
+            for row in chunk:
+                by_user.setdefault(row["phone_number"], []).append(row)
+            for user_rows in by_user.values():
+                error = _insert_message_rows(user_rows)
+                if error is None:
+                    inserted += len(user_rows)
+                elif is_unavailable(error):
+                    failed.extend(user_rows)
+                else:
+                    _dead_letter_messages(user_rows, error)
+        # Put failed rows back ahead of anything appended meanwhile, keeping each transcript in order
+        retry = {}
+        for row in failed:
+            retry.setdefault(row["phone_number"], []).append(row)
+        with _pending_lock:
+            for phone_number, user_rows in retry.items():
+                _pending_messages[phone_number] = user_rows + _pending_messages.get(phone_number, [])
+            _stats["message_inserts"] += inserted
+            _stats["message_insert_errors"] += len(failed)
+    finally:
+        with _messages_flushed:
+            _flushing_messages.difference_update(phone_number for phone_number, _ in batch)
+            _messages_flushed.notify_all()
+    return len(failed) + waiting
+
+def _upsert_user_rows(rows):
+    """Insert queued user rows in one request; return None on success, or the error"""
+    try:
+        client = get_supabase_client()
+        if not client:
+            return DatabaseUnavailableError("No Supabase client")
+        # A row that was written before its insert timed out is kept as it is
+        _execute(client.table('users').upsert(rows, on_conflict='phone_number', ignore_duplicates=True))
+        return None
+    except Exception as e:
+        logger.error("Error inserting queued users: %s", e)
+        return e
+
+def _flush_users():
+    """
+    Insert the queued user rows; return the number left queued
+
+    Rows stay queued while the database can't be reached. If the upsert
+    fails otherwise, the rows are inserted one at a time, and rows the
+    database rejects again go to the dead-letter file instead of holding
+    back every other queued user (and their messages).
+    """
+    with _pending_lock:
+        batch = list(_pending_users.values())
+    if not batch:
+        return 0
+    error = _upsert_user_rows(batch)
+    if error is None:
+        inserted, rejected = batch, []
+    elif is_unavailable(error):
+        inserted, rejected = [], []
+    else:
+        inserted, rejected = [], []
+        for row in batch:
+            error = _upsert_user_rows([row])
+            if error is None:
+                inserted.append(row)
+            elif not is_unavailable(error):
+                logger.error("Dropping queued user %s rejected by the database: %s", row['phone_number'], error)
+                _dead_letter(USER_DEAD_LETTER_PATH, [row], error)
+                rejected.append(row)
+    with _pending_lock:
+        for row in inserted + rejected:
+            # Unless the user was queued again meanwhile
+            if _pending_users.get(row['phone_number']) is row:
+                del _pending_users[row['phone_number']]
+        _stats["user_inserts"] += len(inserted)
+        _stats["user_insert_errors"] += len(batch) - len(inserted)
+        _stats["users_dead_lettered"] += len(rejected)
+    for row in inserted + rejected:
+        invalidate_user(row['phone_number'])
+    return len(batch) - len(inserted) - len(rejected)
+
+def _flush_history():
+    """Write buffered medical history updates; return the number that failed"""
+    with _pending_lock:
+        batch = _pending_history.copy()
+        _pending_history.clear()
+    failed = 0
+    for phone_number, medical_history in batch.items():
+        if write_user_medical_history(phone_number, medical_history):
+            continue
+        failed += 1
+        with _pending_lock:
+            _pending_history.setdefault(phone_number, medical_history)
+    with _pending_lock:
+        _stats["history_writes"] += len(batch) - failed
+        _stats["history_write_errors"] += failed
+    return failed
+
+def flush_pending_writes():
+    """
+    Write every buffered message and history update to the database
+
+    Writes that fail are put back in the buffer (history updates only if no
+    newer one arrived meanwhile), so they are retried on the next flush.
+
+    Returns:
+        int: The number of rows and updates that could not be written
+    """
+    with _flush_lock:
+        # Users first, their messages reference them
+        failed = _flush_users() + _flush_messages() + _flush_history()
+    if failed:
+        logger.warning("%s buffered writes failed and will be retried", failed)
+    return failed
+
+def _flush_user_messages(phone_number):
+    """Insert a user's buffered messages before reading their transcript, without waiting for other users' writes"""
+    with _messages_flushed:
+        # Rows taken by a running flush are inserted before the ones still buffered
+        _messages_flushed.wait_for(lambda: phone_number not in _flushing_messages)
+    _flush_messages([phone_number])
+
+def get_messages(phone_number, after_seq=0, limit=100):
+    """
+    Read a page of a user's transcript, oldest first
+
+    Pages are keyed on `seq`, so pass the `seq` of the last message of a page
+    to get the next one. Messages still buffered for the user are written
+    first so the transcript is complete.
+
+    Args:
+        phone_number (str): The user's phone number
+        after_seq (int): Only return messages after this sequence number
+        limit (int): The maximum number of messages to return
+
+    Returns:
+        list: Rows with seq, role, content and created_at
+
+    Raises:
+        DatabaseUnavailableError: If the database could not be queried, so
+            the transcript is unknown (not empty)
+    """
+    _flush_user_messages(phone_number)
+    client = get_supabase_client()
+    if not client:
+        raise DatabaseUnavailableError("No Supabase client")
+    try:
+        response = _execute(client.table('messages')
+                            .select('seq, role, content, created_at')
+                            .eq('phone_number', phone_number)
+                            .gt('seq', after_seq)
+                            .order('seq')
+                            .limit(limit))
+    except Exception as e:
+        logger.error("Error getting messages: %s", e)
+        raise DatabaseUnavailableError(str(e)) from e
+    return response.data
+
+def get_recent_messages(phone_number, limit=20):
+    """
+    Return the last `limit` messages of a user's transcript, oldest first
+
+    Raises DatabaseUnavailableError if the database could not be queried.
+    """
+    _flush_user_messages(phone_number)
+    client = get_supabase_client()
+    if not client:
+        raise DatabaseUnavailableError("No Supabase client")
+    try:
+        response = _execute(client.table('messages')
+                            .select('seq, role, content, created_at')
+                            .eq('phone_number', phone_number)
+                            .order('seq', desc=True)
+                            .limit(limit))
+    except Exception as e:
+        logger.error("Error getting recent messages: %s", e)
+        raise DatabaseUnavailableError(str(e)) from e
+    return list(reversed(response.data))
+
+def iter_messages(phone_number, page_size=500, after_seq=0):
+    """
+    Yield a user's transcript after `after_seq` (all of it by default), oldest first, one page at a time
+
+    Raises DatabaseUnavailableError if a page could not be read.
+    """
+    while True:
+        page = get_messages(phone_number, after_seq, page_size)
+        if not page:
+            return
+        yield from page
+        if len(page) < page_size:
+            return
+        after_seq = page[-1]["seq"]
+
+def _run_flusher():
+    """Flush buffered history updates every HISTORY_FLUSH_INTERVAL seconds"""
+    while True:
+        _flush_requested.wait(HISTORY_FLUSH_INTERVAL)
+        _flush_requested.clear()
+        try:
+            flush_pending_writes()
+        except Exception as e:
+            logger.error("Error flushing history updates: %s", e)
+
+def _ensure_flusher():
+    """Start the flush thread of this process if it is not running"""
+    global _flusher
+    if _flusher is not None and _flusher.is_alive():
+        return
+    with _pending_lock:
+        # Checked again under the lock, and after a fork the parent's thread is gone
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_run_flusher, name="history-flusher", daemon=True)
+            _flusher.start()
+
+def get_users_page(after_phone_number=None, limit=500):
+    """
+    Read a page of users ordered by phone number, for batch jobs
+
+    Args:
+        after_phone_number (str): Only return users after this phone number
+        limit (int): The maximum number of users to return
+
+    Returns:
+        list: User rows, or None on error
+    """
     try:
         client = get_supabase_client()
         if client:
-            now = datetime.now().isoformat()
-            response = client.table('users').update({
-                'medical_history': medical_history,
-                'updated_at': now
-            }).eq('phone_number', phone_number).execute()
+            query = client.table('users').select(USER_COLUMNS)
+            if after_phone_number is not None:
+                query = query.gt('phone_number', after_phone_number)
+            response = _execute(query.order('phone_number').limit(limit))
+            return response.data
+    except Exception as e:
+        logger.error("Error getting users: %s", e)
+        return None
+
+def get_users_messages(phone_numbers, after_seq=0, limit=1000):
+    """
+    Read a page of the transcripts of several users at once, for batch jobs
+
+    Rows are ordered by `seq`, so each user's messages come in order; pass
+    the `seq` of the last row of a page to get the next one. Messages still
+    buffered by the app are not included.
+
+    Args:
+        phone_numbers (list): The users' phone numbers
+        after_seq (int): Only return messages after this sequence number
+        limit (int): The maximum number of messages to return, at most the
+            API's maximum rows per response (1000 by default on Supabase)
+
+    Returns:
+        list: Rows with phone_number, seq, role, content and created_at, or None on error
+    """
+    try:
+        client = get_supabase_client()
+        if client:
+            response = _execute(client.table('messages')
+                                .select('phone_number, seq, role, content, created_at')
+                                .in_('phone_number', phone_numbers)
+                                .gt('seq', after_seq)
+                                .order('seq')
+                                .limit(limit))
+            return response.data
+    except Exception as e:
+        logger.error("Error getting messages of users: %s", e)
+        return None
+
+def save_summary(summary):
+    """Insert or replace a row of the summaries table"""
+    try:
+        client = get_supabase_client()
+        if client:
+            _execute(client.table('summaries').upsert(summary, on_conflict='phone_number'))
             return True
     except Exception as e:
-        logger.error(f"Error updating user medical history: {e}")
+        logger.error("Error saving summary: %s", e)
         return False
 
+def get_database_stats():
+    """Return profile cache and write-behind counters"""
+    with _cache_lock, _pending_lock:
+        stats = dict(_stats)
+        stats["pending_writes"] = len(_pending_history)
+        stats["pending_messages"] = sum(len(rows) for rows in _pending_messages.values())
+        stats["pending_users"] = len(_pending_users)
+        stats["cached_profiles"] = len(_profile_cache)
+    return stats
+
+# Don't lose buffered messages when the process exits normally (including gunicorn's graceful shutdown)
+atexit.register(flush_pending_writes)
+
 def update_user_language(phone_number, language):
     """Update user's preferred language"""
     try:
         client = get_supabase_client()
         if client:
             now = datetime.now().isoformat()
-            response = client.table('users').update({
+            response = _execute(client.table('users').update({
                 'language': language,
                 'updated_at': now
-            }).eq('phone_number', phone_number).execute()
+            }).eq('phone_number', phone_number))
+            invalidate_user(phone_number)
             return True
     except Exception as e:
-        logger.error(f"Error updating user language: {e}")
+        logger.error("Error updating user language: %s", e)
         return False 
\ No newline at end of file
@@ -0,0 +1,560 @@
+import os
+import sys
+import gzip
+import re
+import json
+import time
+import logging
+import argparse
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from database import get_users_page, get_users_messages
+from medicine_catalog import COMMON_MEDICINES
+from onboarding import NEXT_MESSAGE, ONBOARDING_FIELDS, ONBOARDING_TEXTS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Where the first conversation of a user ended: an onboarding field whose
+# question went unanswered, CONCERN if the user was asked to describe their
+# symptoms but never did, COMPLETE once they did, UNKNOWN without any
+# onboarding question in the transcript
+CONCERN = "concern"
+COMPLETE = "complete"
+UNKNOWN = "unknown"
+STEPS = ONBOARDING_FIELDS + (CONCERN, COMPLETE, UNKNOWN)
+# Outcomes summed up in the aggregates. Transcripts are only stored once a
+# user is registered at the end of onboarding, so users who stopped earlier
+# are not in the export; a transcript ending at an onboarding question was
+# registered by an earlier version of the bot and is counted as UNKNOWN
+FIRST_CONVERSATION_OUTCOMES = (CONCERN, COMPLETE, UNKNOWN)
+
+# Users per row group of a Parquet part
+PARQUET_ROW_GROUP_USERS = 10000
+# gzip level of JSONL parts; higher levels are much slower for little gain on chat text
+JSONL_COMPRESSLEVEL = 5
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+# Columns read back to aggregate an export, the transcripts are not needed
+AGGREGATE_COLUMNS = ("language", "message_count", "onboarding_step", "turns", "medicines")
+
+def _prompt_steps():
+    """Map the onboarding questions of every language to the step they ask for"""
+    asks = {"ask_name": ONBOARDING_FIELDS[0]}
+    for index, field in enumerate(ONBOARDING_FIELDS):
+        asks[NEXT_MESSAGE[field]] = ONBOARDING_FIELDS[index + 1] if index + 1 < len(ONBOARDING_FIELDS) else CONCERN
+    return {texts[key]: step for texts in ONBOARDING_TEXTS.values() for key, step in asks.items()}
+
+# onboarding question -> the step it asks for
+PROMPT_STEPS = _prompt_steps()
+
+# (prefix, suffix) of the greeting that starts the conversations of a returning user
+WELCOME_BACK = tuple({tuple(texts["welcome_back"].split("{name}", 1)) for texts in ONBOARDING_TEXTS.values()})
+
+def _welcomes_back(content):
+    return any(content.startswith(prefix) and content.endswith(suffix) for prefix, suffix in WELCOME_BACK)
+
+def _medicine_names(catalog):
+    """Map the lowercased name of every medicine of the catalog to its name"""
+    return {medicine["name"].lower(): medicine["name"] for medicines in catalog.values() for medicine in medicines}
+
+MEDICINE_NAMES = _medicine_names(COMMON_MEDICINES)
+# Whole names only, longest first so that "Pan-D" is not counted as "Pan"
+MEDICINE_PATTERN = re.compile(
+    r"(?<!\w)(?:" + "|".join(re.escape(name) for name in sorted(MEDICINE_NAMES, key=len, reverse=True)) + r")(?!\w)",
+    re.IGNORECASE
+)
+
+def _outcome(step, conversation_turns):
+    """Where a conversation ended, from the step it was at and the turns after onboarding"""
+    if conversation_turns:
+        return COMPLETE
+    return step
+
+def analyze_transcript(messages):
+    """
+    Follow a user's transcript through onboarding and their conversations
+
+    A conversation starts with the name question, or with the greeting of a
+    returning user; user messages after the prompt to describe symptoms are
+    its turns.
+
+    Args:
+        messages (list): The transcript rows (role, content), oldest first
+
+    Returns:
+        tuple: The step the first conversation ended at (see STEPS), the user
+            turns of every conversation that got past onboarding, and the
+            medicines mentioned, once per message mentioning them
+    """
+    step = None
+    # None until the conversation gets past onboarding
+    conversation_turns = None
+    first_step = None
+    turns = []
+    medicines = []
+    for message in messages:
+        content = message["content"] or ""
+        if message["role"] == "assistant":
+            asked = PROMPT_STEPS.get(content)
+            welcome = asked is None and _welcomes_back(content)
+            if asked == ONBOARDING_FIELDS[0] or welcome:
+                if step is not None:
+                    if conversation_turns is not None:
+                        turns.append(conversation_turns)
+                    if first_step is None:
+                        first_step = _outcome(step, conversation_turns)
+                step, conversation_turns = (CONCERN, 0) if welcome else (asked, None)
+                continue
+            if asked is not None:
+                step = asked
+                if asked == CONCERN and conversation_turns is None:
+                    conversation_turns = 0
+                continue
+        elif step == CONCERN:
+            conversation_turns += 1
+        for match in MEDICINE_PATTERN.findall(content):
+            medicines.append(MEDICINE_NAMES[match.lower()])
+    if step is not None:
+        if conversation_turns is not None:
+            turns.append(conversation_turns)
+        if first_step is None:
+            first_step = _outcome(step, conversation_turns)
+    return first_step or UNKNOWN, turns, medicines
+
+def export_record(user, messages, include_messages=True):
+    """
+    Build the exported row of a user
+
+    Args:
+        user (dict): The users row
+        messages (list): The user's transcript (seq, role, content, created_at), oldest first
+        include_messages (bool): Whether to include the transcript itself
+
+    Returns:
+        dict: The profile (without the name), the conversation metrics and the transcript
+    """
+    step, turns, medicines = analyze_transcript(messages)
+    record = {
+        "phone_number": user["phone_number"],
+        "language": user.get("language"),
+        "age": None if user.get("age") is None else str(user["age"]),
+        "gender": user.get("gender"),
+        "created_at": user.get("created_at"),
+        "message_count": len(messages),
+        "onboarding_step": step,
+        "conversations": len(turns),
+        "turns": turns,
+        "medicines": medicines
+    }
+    if include_messages:
+        record["messages"] = messages
+    return record
+
+def fetch_transcripts(phone_numbers, page_size=1000):
+    """
+    Read the transcripts of a page of users, a page of messages at a time
+
+    Returns:
+        dict: phone_number -> messages (seq, role, content, created_at) oldest first, or None on error
+    """
+    transcripts = {phone_number: [] for phone_number in phone_numbers}
+    after_seq = 0
+    while True:
+        page = get_users_messages(phone_numbers, after_seq, page_size)
+        if page is None:
+            return None
+        for row in page:
+            transcripts[row.pop("phone_number")].append(row)
+        if len(page) < page_size:
+            return transcripts
+        after_seq = page[-1]["seq"]
+
+def _percentile(histogram, fraction):
+    """The value below which `fraction` of a histogram's counts fall"""
+    total = sum(histogram.values())
+    seen = 0
+    for value in sorted(histogram):
+        seen += histogram[value]
+        if seen >= fraction * total:
+            return value
+    return 0
+
+class ExportAggregates:
+    """Language mix, first conversations, turns per conversation and medicine mentions over exported users"""
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.users = data.get("users", 0)
+        self.messages = data.get("messages", 0)
+        self.languages = Counter(data.get("languages", {}))
+        self.steps = Counter(data.get("steps", {}))
+        # turns -> conversations
+        self.turns = Counter({int(turns): count for turns, count in data.get("turns", {}).items()})
+        self.medicine_mentions = Counter(data.get("medicine_mentions", {}))
+        self.medicine_users = Counter(data.get("medicine_users", {}))
+
+    def add(self, record):
+        """Count an exported row"""
+        self.users += 1
+        self.messages += record["message_count"]
+        self.languages[record["language"] or UNKNOWN] += 1
+        self.steps[record["onboarding_step"]] += 1
+        self.turns.update(record["turns"])
+        if record["medicines"]:
+            self.medicine_mentions.update(record["medicines"])
+            self.medicine_users.update(set(record["medicines"]))
+
+    def to_dict(self):
+        """The counters, as saved in the state file"""
+        return {
+            "users": self.users,
+            "messages": self.messages,
+            "languages": dict(self.languages),
+            "steps": dict(self.steps),
+            "turns": {str(turns): count for turns, count in self.turns.items()},
+            "medicine_mentions": dict(self.medicine_mentions),
+            "medicine_users": dict(self.medicine_users)
+        }
+
+    def report(self, top=10):
+        """
+        Summarize the counters
+
+        Returns:
+            dict: Users and share per language, users whose first
+                conversation after registering described a concern or not,
+                the distribution of turns per conversation, and the `top`
+                most mentioned medicines
+        """
+        users = self.users or 1
+        conversations = sum(self.turns.values())
+        outcomes = {CONCERN: self.steps[CONCERN], COMPLETE: self.steps[COMPLETE]}
+        outcomes[UNKNOWN] = self.users - outcomes[CONCERN] - outcomes[COMPLETE]
+        return {
+            "users": self.users,
+            "messages": self.messages,
+            "languages": {
+                language: {"users": count, "share": round(count / users, 4)}
+                for language, count in self.languages.most_common()
+            },
+            "first_conversation": {
+                outcome: {"users": outcomes[outcome], "share": round(outcomes[outcome] / users, 4)}
+                for outcome in FIRST_CONVERSATION_OUTCOMES if outcomes[outcome]
+            },
+            "turns_per_conversation": {
+                "conversations": conversations,
+                "mean": round(sum(turns * count for turns, count in self.turns.items()) / (conversations or 1), 2),
+                "median": _percentile(self.turns, 0.5),
+                "p90": _percentile(self.turns, 0.9),
+                "histogram": {str(turns): self.turns[turns] for turns in sorted(self.turns)}
+            },
+            "medicines": [
+                {"name": name, "mentions": mentions, "users": self.medicine_users[name]}
+                for name, mentions in self.medicine_mentions.most_common(top)
+            ]
+        }
+
+class JsonlPartWriter:
+    """Writes a part as gzipped JSON lines, one user per line"""
+
+    extension = ".jsonl.gz"
+
+    def __init__(self, path, include_messages=True):
+        self.file = gzip.open(path, "wt", encoding="utf-8", compresslevel=JSONL_COMPRESSLEVEL)
+
+    def write(self, records):
+        self.file.write("".join(_json_encoder.encode(record) + "\n" for record in records))
+
+    def close(self):
+        self.file.close()
+
+def parquet_schema(pyarrow, include_messages=True):
+    """The Arrow schema of exported rows"""
+    fields = [
+        ("phone_number", pyarrow.string()),
+        ("language", pyarrow.string()),
+        ("age", pyarrow.string()),
+        ("gender", pyarrow.string()),
+        ("created_at", pyarrow.string()),
+        ("message_count", pyarrow.int32()),
+        ("onboarding_step", pyarrow.string()),
+        ("conversations", pyarrow.int32()),
+        ("turns", pyarrow.list_(pyarrow.int32())),
+        ("medicines", pyarrow.list_(pyarrow.string()))
+    ]
+    if include_messages:
+        fields.append(("messages", pyarrow.list_(pyarrow.struct([
+            ("seq", pyarrow.int64()),
+            ("role", pyarrow.string()),
+            ("content", pyarrow.string()),
+            ("created_at", pyarrow.string())
+        ]))))
+    return pyarrow.schema(fields)
+
+class ParquetPartWriter:
+    """Writes a part as a zstd-compressed Parquet file, PARQUET_ROW_GROUP_USERS users per row group"""
+
+    extension = ".parquet"
+
+    def __init__(self, path, include_messages=True):
+        # Optional dependency, only needed for Parquet exports
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.schema = parquet_schema(pyarrow, include_messages)
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression="zstd")
+        self.buffer = []
+
+    def write(self, records):
+        self.buffer.extend(records)
+        if len(self.buffer) >= PARQUET_ROW_GROUP_USERS:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            self.writer.write_table(self.pyarrow.Table.from_pylist(self.buffer, schema=self.schema))
+            self.buffer = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+WRITERS = {"jsonl": JsonlPartWriter, "parquet": ParquetPartWriter}
+
+def default_format():
+    """Parquet if pyarrow is installed, gzipped JSONL otherwise"""
+    try:
+        import pyarrow.parquet
+        return "parquet"
+    except ImportError:
+        return "jsonl"
+
+def iter_export(output_dir, columns=None):
+    """Yield the rows of an export, part by part; with Parquet parts only the given columns are read"""
+    for name in sorted(os.listdir(output_dir)):
+        path = os.path.join(output_dir, name)
+        if not name.startswith("part-"):
+            continue
+        if name.endswith(JsonlPartWriter.extension):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    yield json.loads(line)
+        elif name.endswith(ParquetPartWriter.extension):
+            import pyarrow.parquet
+            for batch in pyarrow.parquet.ParquetFile(path).iter_batches(columns=columns):
+                yield from batch.to_pylist()
+
+def aggregate_export(output_dir):
+    """Compute the aggregates of an existing export from its part files"""
+    aggregates = ExportAggregates()
+    for record in iter_export(output_dir, columns=list(AGGREGATE_COLUMNS)):
+        aggregates.add(record)
+    return aggregates
+
+class HistoryExporter:
+    """
+    Export every user's transcript and conversation metrics, resumably
+
+    Users are read in pages ordered by phone number, each page starting after
+    the last phone number of the previous one, and the transcripts of up to
+    `workers` pages are fetched concurrently while earlier pages are written.
+    Pages are written in order to part files of about `part_size` users. A
+    part is written to a temporary file and renamed once complete; the state
+    file then records the last user exported, the next part number and the
+    aggregates so far. An interrupted run resumes after the last complete
+    part, so every user is exported once, and memory stays bounded by the
+    pages in flight.
+    """
+
+    def __init__(self, output_dir, fmt="jsonl", state_path=None, workers=4, page_size=200, message_page_size=1000,
+                 part_size=100000, include_messages=True):
+        self.output_dir = output_dir
+        self.writer_class = WRITERS[fmt]
+        self.state_path = state_path or os.path.join(output_dir, "export_state.json")
+        self.workers = workers
+        self.page_size = page_size
+        self.message_page_size = message_page_size
+        self.part_size = part_size
+        self.include_messages = include_messages
+        os.makedirs(output_dir, exist_ok=True)
+        self.state = self._load_state()
+        self.aggregates = ExportAggregates(self.state["aggregates"])
+        self.stats = {"users": 0, "messages": 0, "parts": 0, "bytes": 0}
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+        return {"cursor": None, "part": 0, "completed": False, "aggregates": {}}
+
+    def _save_state(self):
+        """Write the state file atomically so a crash never leaves it half written"""
+        temp_path = f"{self.state_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.state_path)
+
+    def _part_path(self, index):
+        return os.path.join(self.output_dir, f"part-{index:05d}{self.writer_class.extension}")
+
+    def _close_part(self, writer, last_phone_number):
+        """Publish the part being written and checkpoint after it"""
+        writer.close()
+        path = self._part_path(self.state["part"])
+        os.replace(f"{path}.tmp", path)
+        self.stats["parts"] += 1
+        self.stats["bytes"] += os.path.getsize(path)
+        self.state["cursor"] = last_phone_number
+        self.state["part"] += 1
+        self.state["aggregates"] = self.aggregates.to_dict()
+        self._save_state()
+        logger.info("Wrote %s: %s users exported", path, self.aggregates.users)
+
+    def _fetch_page(self, users):
+        """Read the transcripts of a page of users and build their rows; None on error"""
+        transcripts = fetch_transcripts([user["phone_number"] for user in users], self.message_page_size)
+        if transcripts is None:
+            return None
+        return [export_record(user, transcripts[user["phone_number"]], self.include_messages) for user in users]
+
+    def run(self):
+        """
+        Export all users from the saved cursor on
+
+        Returns:
+            bool: True if every user was exported, False if the run stopped early
+        """
+        if self.state["completed"]:
+            logger.info("The export in %s is complete, start a new one in another directory", self.output_dir)
+            return True
+        cursor = self.state["cursor"]
+        reading = True
+        failed = False
+        in_flight = deque()
+        writer = None
+        part_users = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                # Keep up to `workers` pages fetching ahead of the one being written
+                while reading and len(in_flight) < self.workers:
+                    users = get_users_page(cursor, self.page_size)
+                    if users is None:
+                        logger.error("Could not read users, stopping; the export can be resumed")
+                        reading = False
+                        failed = True
+                        break
+                    if users:
+                        cursor = users[-1]["phone_number"]
+                        in_flight.append((users, executor.submit(self._fetch_page, users)))
+                    if len(users) < self.page_size:
+                        reading = False
+                if failed or not in_flight:
+                    break
+
+                users, future = in_flight.popleft()
+                records = future.result()
+                if records is None:
+                    logger.error("Could not read messages, stopping; the export can be resumed")
+                    failed = True
+                    break
+                if writer is None:
+                    writer = self.writer_class(f"{self._part_path(self.state['part'])}.tmp", self.include_messages)
+                writer.write(records)
+                for record in records:
+                    self.aggregates.add(record)
+                    self.stats["messages"] += record["message_count"]
+                self.stats["users"] += len(records)
+                part_users += len(records)
+                if part_users >= self.part_size:
+                    self._close_part(writer, users[-1]["phone_number"])
+                    writer = None
+                    part_users = 0
+                last_phone_number = users[-1]["phone_number"]
+            for _, future in in_flight:
+                future.cancel()
+
+        if failed:
+            if writer is not None:
+                # The users of the unfinished part are exported again on resume
+                writer.close()
+                os.remove(f"{self._part_path(self.state['part'])}.tmp")
+            self.aggregates = ExportAggregates(self.state["aggregates"])
+            return False
+        if writer is not None:
+            self._close_part(writer, last_phone_number)
+        self.state["completed"] = True
+        self._save_state()
+        with open(os.path.join(self.output_dir, "aggregates.json"), "w") as f:
+            json.dump(self.aggregates.report(), f, indent=2, ensure_ascii=False)
+        return True
+
+def print_report(report):
+    """Print the aggregates of an export"""
+    print(f"Users: {report['users']}, messages: {report['messages']}")
+    print("Languages: " + ", ".join(f"{language} {entry['share']:.1%}" for language, entry in report["languages"].items()))
+    print("First conversation after registering: " + ", ".join(
+        f"{outcome} {entry['users']} ({entry['share']:.1%})" for outcome, entry in report["first_conversation"].items()
+    ))
+    turns = report["turns_per_conversation"]
+    print(f"Turns per conversation: {turns['conversations']} conversations, mean {turns['mean']}, "
+          f"median {turns['median']}, p90 {turns['p90']}")
+    print("Most mentioned medicines: " + ", ".join(
+        f"{entry['name']} {entry['mentions']} ({entry['users']} users)" for entry in report["medicines"]
+    ))
+
+def run_export(args):
+    """Run an export from the command line arguments and print a report"""
+    exporter = HistoryExporter(
+        args.output,
+        fmt=args.format or default_format(),
+        state_path=args.state,
+        workers=args.workers,
+        page_size=args.page_size,
+        part_size=args.part_size,
+        include_messages=not args.no_messages
+    )
+    start = time.monotonic()
+    completed = exporter.run()
+    elapsed = time.monotonic() - start
+
+    stats = exporter.stats
+    print(f"Exported {stats['users']} users and {stats['messages']} messages in {elapsed:.1f}s "
+          f"({stats['users'] / elapsed if elapsed else 0:.0f} users/s), {stats['parts']} parts, "
+          f"{stats['bytes'] / 2 ** 20:.1f} MiB")
+    if not completed:
+        print("Export incomplete, rerun with the same --output to resume")
+        return 1
+    print_report(exporter.aggregates.report())
+    return 0
+
+def main(argv=None):
+    """Main function to run the export tool"""
+    parser = argparse.ArgumentParser(
+        description="Export conversation histories and aggregate them",
+        epilog="Only registered users are exported: a transcript is stored once onboarding is complete, "
+               "so users who stop during onboarding are not counted and there is no onboarding drop-off metric."
+    )
+    parser.add_argument("--output", default="export", help="directory of the part files, aggregates and state")
+    parser.add_argument("--format", choices=sorted(WRITERS), help="parquet (needs pyarrow, the default when installed) or jsonl")
+    parser.add_argument("--state", help="checkpoint file used to resume (default: export_state.json in --output)")
+    parser.add_argument("--workers", type=int, default=4, help="pages of users whose messages are fetched concurrently")
+    parser.add_argument("--page-size", type=int, default=200, help="users read from the database per page")
+    parser.add_argument("--part-size", type=int, default=100000, help="users per part file")
+    parser.add_argument("--no-messages", action="store_true", help="export the metrics without the transcripts")
+    parser.add_argument("--aggregate", metavar="DIR", help="only aggregate an existing export, without the database")
+    args = parser.parse_args(argv)
+
+    if args.aggregate:
+        print_report(aggregate_export(args.aggregate).report())
+        return 0
+    return run_export(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
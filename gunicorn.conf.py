@@ -0,0 +1,17 @@
+# Gunicorn settings, read automatically by `gunicorn app:app` from this directory
+import os
+
+# Import the app once in the master and fork the workers from it, so that a
+# new worker starts in milliseconds. The external clients are never created at
+# import time, each worker builds its own in post_fork
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true"
+
+def post_fork(server, worker):
+    """Build the Supabase and API clients in the new worker before it takes requests"""
+    if os.getenv("WARM_UP", "true").lower() != "true":
+        return
+    # Without preload_app this is the worker's first import of the app
+    from app import warm_up
+    failed = warm_up()
+    if failed:
+        server.log.warning("Worker %s started without: %s", worker.pid, ', '.join(failed))
@@ -0,0 +1,388 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Where handled MessageSids are remembered: "memory" (per process), "sqlite" or
+# "redis". Defaults to the session backend, which is shared the same way
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", os.getenv("SESSION_BACKEND", "memory")).lower()
+IDEMPOTENCY_SQLITE_PATH = os.getenv("IDEMPOTENCY_SQLITE_PATH", os.getenv("SESSION_SQLITE_PATH", "sessions.db"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Seconds a handled message is remembered; Twilio retries within minutes
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "3600"))
+# Most MessageSids remembered per process (memory backend) or file (sqlite backend)
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "100000"))
+# Seconds a retry waits for the original delivery to finish; Twilio gives up after 15
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "13"))
+# Seconds after which a message still in flight in a shared backend is
+# considered abandoned (its worker died) and handled again
+IDEMPOTENCY_LEASE = float(os.getenv("IDEMPOTENCY_LEASE", "120"))
+# Seconds between checks while waiting on a shared backend
+IDEMPOTENCY_POLL_INTERVAL = 0.05
+
+NEW = "new"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+
+class MessageRegistry:
+    """
+    Remembers which incoming messages were handled, and their replies
+
+    A delivery claims its MessageSid before doing any work. The first claim
+    wins (NEW); later deliveries of the same message see it IN_FLIGHT or
+    DONE together with the replies, and must not do the work again.
+    """
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self._stats = {"claims": 0, "duplicates": 0, "waits": 0, "wait_timeouts": 0}
+
+    def claim(self, message_sid):
+        """Claim a message; returns (NEW, None), (IN_FLIGHT, None) or (DONE, replies)"""
+        raise NotImplementedError
+
+    def peek(self, message_sid):
+        """Return the state of a claimed message like claim(), without claiming it"""
+        raise NotImplementedError
+
+    def complete(self, message_sid, replies):
+        """Record the replies of a claimed message"""
+        raise NotImplementedError
+
+    def release(self, message_sid):
+        """Forget a claim whose handling failed, so that a retry handles it again"""
+        raise NotImplementedError
+
+    def wait(self, message_sid, timeout=IDEMPOTENCY_WAIT_TIMEOUT):
+        """Wait for a message in flight; returns its replies, or None on timeout"""
+        self._count("waits")
+        deadline = time.monotonic() + timeout
+        while True:
+            state, replies = self.peek(message_sid)
+            if state == DONE:
+                return replies
+            if state == NEW:
+                # Released by a failed delivery
+                return None
+            if time.monotonic() >= deadline:
+                self._count("wait_timeouts")
+                return None
+            time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+    def stats(self):
+        """Return claim/duplicate/wait counters"""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+class MemoryMessageRegistry(MessageRegistry):
+    """
+    Per-process registry: a bounded, time-windowed map of MessageSids
+
+    Entries are dropped after `ttl` seconds or, oldest first, beyond
+    `max_entries`. Retries wait on an event instead of polling.
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_entries=IDEMPOTENCY_MAX_ENTRIES, clock=time.monotonic):
+        super().__init__()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        # message_sid -> [claimed at, replies or None while in flight, event], oldest first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._entries:
+            message_sid, entry = next(iter(self._entries.items()))
+            if entry[0] + self.ttl > now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[message_sid]
+
+    def claim(self, message_sid):
+        now = self.clock()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(message_sid)
+            if entry is None:
+                self._entries[message_sid] = [now, None, threading.Event()]
+                self._count("claims")
+                return NEW, None
+        self._count("duplicates")
+        return (IN_FLIGHT, None) if entry[1] is None else (DONE, entry[1])
+
+    def peek(self, message_sid):
+        with self._lock:
+            entry = self._entries.get(message_sid)
+        if entry is None:
+            return NEW, None
+        return (IN_FLIGHT, None) if entry[1] is None else (DONE, entry[1])
+
+    def complete(self, message_sid, replies):
+        with self._lock:
+            entry = self._entries.get(message_sid)
+            if entry is not None:
+                entry[1] = list(replies)
+        if entry is not None:
+            entry[2].set()
+
+    def release(self, message_sid):
+        with self._lock:
+            entry = self._entries.pop(message_sid, None)
+        if entry is not None:
+            entry[2].set()
+
+    def wait(self, message_sid, timeout=IDEMPOTENCY_WAIT_TIMEOUT):
+        with self._lock:
+            entry = self._entries.get(message_sid)
+        if entry is None:
+            return None
+        self._count("waits")
+        if not entry[2].wait(timeout):
+            self._count("wait_timeouts")
+        return entry[1]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+class SQLiteMessageRegistry(MessageRegistry):
+    """Registry in a local SQLite file, shared by all workers on one node"""
+
+    # Drop expired and excess rows every this many claims
+    SWEEP_INTERVAL = 500
+
+    def __init__(self, path=IDEMPOTENCY_SQLITE_PATH, ttl=IDEMPOTENCY_TTL, max_entries=IDEMPOTENCY_MAX_ENTRIES,
+                 lease=IDEMPOTENCY_LEASE, clock=time.time):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lease = lease
+        self.clock = clock
+        self._local = threading.local()
+        self._claims = 0
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS message_sids ("
+            "message_sid TEXT PRIMARY KEY, replies TEXT, claimed_at REAL NOT NULL)"
+        )
+        self._connect().execute("CREATE INDEX IF NOT EXISTS message_sids_claimed_at ON message_sids (claimed_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _state(self, row, now):
+        if row is None or row[1] + self.ttl < now:
+            return NEW, None
+        if row[0] is None:
+            return IN_FLIGHT, None
+        return DONE, json.loads(row[0])
+
+    def claim(self, message_sid):
+        now = self.clock()
+        conn = self._connect()
+        # Take over rows that expired or whose worker gave up on them
+        cursor = conn.execute(
+            "INSERT INTO message_sids (message_sid, replies, claimed_at) VALUES (?, NULL, ?) "
+            "ON CONFLICT (message_sid) DO UPDATE SET replies = NULL, claimed_at = excluded.claimed_at "
+            "WHERE claimed_at < ? OR (replies IS NULL AND claimed_at < ?)",
+            (message_sid, now, now - self.ttl, now - self.lease)
+        )
+        if cursor.rowcount == 1:
+            self._count("claims")
+            with self._stats_lock:
+                self._claims += 1
+                sweep = self._claims % self.SWEEP_INTERVAL == 0
+            if sweep:
+                self.sweep()
+            return NEW, None
+        self._count("duplicates")
+        return self.peek(message_sid)
+
+    def peek(self, message_sid):
+        row = self._connect().execute(
+            "SELECT replies, claimed_at FROM message_sids WHERE message_sid = ?", (message_sid,)
+        ).fetchone()
+        return self._state(row, self.clock())
+
+    def complete(self, message_sid, replies):
+        self._connect().execute(
+            "UPDATE message_sids SET replies = ? WHERE message_sid = ?", (json.dumps(list(replies)), message_sid)
+        )
+
+    def release(self, message_sid):
+        self._connect().execute("DELETE FROM message_sids WHERE message_sid = ? AND replies IS NULL", (message_sid,))
+
+    def sweep(self):
+        """Delete expired rows and the oldest ones beyond max_entries"""
+        conn = self._connect()
+        conn.execute("DELETE FROM message_sids WHERE claimed_at < ?", (self.clock() - self.ttl,))
+        conn.execute(
+            "DELETE FROM message_sids WHERE claimed_at <= ("
+            "SELECT claimed_at FROM message_sids ORDER BY claimed_at DESC LIMIT 1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+class RedisMessageRegistry(MessageRegistry):
+    """
+    Registry in Redis, shared by every worker on every node
+
+    A claim is a SET NX with the lease as expiry, so the claim of a worker
+    that died lapses on its own; completing it stores the replies for the TTL.
+    """
+
+    def __init__(self, url=REDIS_URL, ttl=IDEMPOTENCY_TTL, lease=IDEMPOTENCY_LEASE, prefix="message_sid:"):
+        super().__init__()
+        # Optional dependency, only needed with the redis backend
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = int(ttl)
+        self.lease = int(lease)
+        self.prefix = prefix
+
+    def _key(self, message_sid):
+        return f"{self.prefix}{message_sid}"
+
+    def _state(self, raw):
+        if raw is None:
+            return NEW, None
+        if raw == b"":
+            return IN_FLIGHT, None
+        return DONE, json.loads(raw)
+
+    def claim(self, message_sid):
+        if self.client.set(self._key(message_sid), b"", nx=True, ex=self.lease):
+            self._count("claims")
+            return NEW, None
+        self._count("duplicates")
+        return self.peek(message_sid)
+
+    def peek(self, message_sid):
+        return self._state(self.client.get(self._key(message_sid)))
+
+    def complete(self, message_sid, replies):
+        self.client.set(self._key(message_sid), json.dumps(list(replies)), ex=self.ttl)
+
+    def release(self, message_sid):
+        self.client.delete(self._key(message_sid))
+
+def create_message_registry():
+    """Create the registry selected by IDEMPOTENCY_BACKEND"""
+    if IDEMPOTENCY_BACKEND == "redis":
+        return RedisMessageRegistry()
+    if IDEMPOTENCY_BACKEND == "sqlite":
+        return SQLiteMessageRegistry()
+    if IDEMPOTENCY_BACKEND != "memory":
+        logger.warning("Unknown IDEMPOTENCY_BACKEND '%s', remembering messages in memory", IDEMPOTENCY_BACKEND)
+    return MemoryMessageRegistry()
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_message_registry():
+    """Create and return the process-wide message registry"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = create_message_registry()
+    return _registry
+
+def get_idempotency_stats():
+    """Return the counters of the message registry"""
+    return get_message_registry().stats()
+
+def process_once(message_sid, handle):
+    """
+    Handle a message once, however often Twilio delivers it
+
+    The first delivery runs handle() and records its replies. A retry of a
+    message that was handled gets the same replies; a retry of one still
+    being handled waits for it, up to IDEMPOTENCY_WAIT_TIMEOUT, and gets no
+    replies if it is not done by then. Retries never run handle().
+
+    Args:
+        message_sid (str): Twilio's MessageSid, or None to always handle the message
+        handle (callable): handle() returning the list of replies
+
+    Returns:
+        list: The replies to answer the delivery with
+    """
+    if not message_sid:
+        return handle()
+    registry = get_message_registry()
+    state, replies = registry.claim(message_sid)
+    if state == DONE:
+        logger.info("Duplicate delivery of %s, reusing its replies", message_sid)
+        return replies
+    if state == IN_FLIGHT:
+        logger.info("Duplicate delivery of %s while it is handled, waiting", message_sid)
+        return registry.wait(message_sid) or []
+    try:
+        replies = handle()
+    except Exception:
+        registry.release(message_sid)
+        raise
+    registry.complete(message_sid, replies)
+    return replies
+
+async def process_once_async(message_sid, handle):
+    """
+    Like process_once(), from the event loop
+
+    Args:
+        message_sid (str): Twilio's MessageSid, or None to always handle the message
+        handle (callable): Coroutine function returning the list of replies
+
+    Returns:
+        list: The replies to answer the delivery with
+    """
+    if not message_sid:
+        return await handle()
+    registry = get_message_registry()
+    state, replies = await asyncio.to_thread(registry.claim, message_sid)
+    if state == DONE:
+        logger.info("Duplicate delivery of %s, reusing its replies", message_sid)
+        return replies
+    if state == IN_FLIGHT:
+        logger.info("Duplicate delivery of %s while it is handled, waiting", message_sid)
+        # Poll instead of holding one of the few blocking threads for seconds
+        registry._count("waits")
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+            state, replies = await asyncio.to_thread(registry.peek, message_sid)
+            if state == DONE:
+                return replies
+            if state == NEW:
+                return []
+        registry._count("wait_timeouts")
+        return []
+    try:
+        replies = await handle()
+    except BaseException:
+        await asyncio.to_thread(registry.release, message_sid)
+        raise
+    await asyncio.to_thread(registry.complete, message_sid, replies)
+    return replies
@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from contextlib import nullcontext
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from circuit_breaker import CircuitOpenError, openai_breaker
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_API_URL = os.getenv("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
+
+# Connection pool and concurrency limits (per process)
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "20"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "20"))
+# Calls in flight cost a socket rather than a thread on the event loop (asgi_app.py)
+OPENAI_ASYNC_MAX_CONCURRENCY = int(os.getenv("OPENAI_ASYNC_MAX_CONCURRENCY", "1000"))
+
+# Timeouts in seconds
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "30"))
+
+# Retries on rate limiting, server errors and connection failures
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "8"))
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+_semaphore = threading.BoundedSemaphore(OPENAI_MAX_CONCURRENCY)
+_async_session = None
+_async_semaphore = None
+
+def get_session():
+    """Create and return the shared keep-alive session for the OpenAI API"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OPENAI_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({
+                    "Authorization": f"Bearer {OPENAI_API_KEY}",
+                    "Content-Type": "application/json"
+                })
+                _session = session
+    return _session
+
+def _retry_after_seconds(response):
+    """Parse the Retry-After header (seconds or HTTP date), if present"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _backoff_seconds(attempt):
+    """Full-jitter exponential backoff for the given retry attempt"""
+    return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * (2 ** attempt)))
+
+def _post(payload, stream=False):
+    """Post to the chat completions endpoint, retrying 429/5xx and connection errors"""
+    session = get_session()
+    attempt = 0
+    while True:
+        # Every attempt goes through the breaker, so an outage stops the retries too
+        if not openai_breaker.allow():
+            raise CircuitOpenError(openai_breaker.name)
+        start = time.monotonic()
+        try:
+            # Streams hold the semaphore for their whole duration (see stream_chat_completion)
+            with nullcontext() if stream else _semaphore:
+                response = session.post(
+                    OPENAI_API_URL,
+                    json=payload,
+                    timeout=(OPENAI_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT),
+                    stream=stream
+                )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            openai_breaker.record(True, time.monotonic() - start)
+            if attempt >= OPENAI_MAX_RETRIES:
+                raise
+            delay = _backoff_seconds(attempt)
+            logger.warning("OpenAI request failed (%s), retrying in %.2fs", e, delay)
+        except BaseException:
+            openai_breaker.record(True, time.monotonic() - start)
+            raise
+        else:
+            openai_breaker.record(response.status_code in RETRY_STATUS_CODES, time.monotonic() - start)
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= OPENAI_MAX_RETRIES:
+                return response
+            retry_after = _retry_after_seconds(response)
+            if retry_after is not None and retry_after > OPENAI_BACKOFF_MAX:
+                # Waiting that long would pin the worker, let the caller handle it
+                return response
+            delay = retry_after if retry_after is not None else _backoff_seconds(attempt)
+            logger.warning("OpenAI API returned %s, retrying in %.2fs", response.status_code, delay)
+            response.close()
+        time.sleep(delay)
+        attempt += 1
+
+def chat_completion(payload):
+    """
+    Send a chat completion request through the pooled session
+
+    Requests that fail with 429/5xx or a connection error are retried with
+    jittered backoff, honouring Retry-After when the server sends one.
+    Raises CircuitOpenError right away while the OpenAI breaker is open.
+
+    Args:
+        payload (dict): The chat completions request body
+
+    Returns:
+        requests.Response: The final response from the API
+    """
+    return _post(payload)
+
+def stream_chat_completion(payload, usage=None):
+    """
+    Stream a chat completion, yielding the content as it is generated
+
+    The request is retried like chat_completion() until the stream starts;
+    errors after that are raised to the caller.
+
+    Args:
+        payload (dict): The chat completions request body, without `stream`
+        usage (dict): Optional dict updated with the token usage of the call
+
+    Yields:
+        str: Pieces of the assistant message, in order
+    """
+    payload = dict(payload, stream=True, stream_options={"include_usage": True})
+    with _semaphore:
+        response = _post(payload, stream=True)
+        with response:
+            response.raise_for_status()
+            # SSE responses carry no charset, requests would assume latin-1
+            response.encoding = "utf-8"
+            # chunk_size=None yields each chunk as it arrives instead of waiting for 512 bytes
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                if usage is not None and event.get("usage"):
+                    usage.update(event["usage"])
+                for choice in event.get("choices") or ():
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        yield content
+
+def get_async_session():
+    """Create and return the shared async session for the OpenAI API; call from the event loop"""
+    global _async_session, _async_semaphore
+    if _async_session is None:
+        # Only the ASGI entry point needs aiohttp, don't import it in the Flask workers
+        import aiohttp
+        _async_session = aiohttp.ClientSession(
+            headers={
+                "Authorization": f"Bearer {OPENAI_API_KEY}",
+                "Content-Type": "application/json"
+            },
+            timeout=aiohttp.ClientTimeout(sock_connect=OPENAI_CONNECT_TIMEOUT, sock_read=OPENAI_READ_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=OPENAI_ASYNC_MAX_CONCURRENCY)
+        )
+        _async_semaphore = asyncio.Semaphore(OPENAI_ASYNC_MAX_CONCURRENCY)
+    return _async_session
+
+async def close_async_session():
+    """Close the async session, e.g. when the event loop shuts down"""
+    global _async_session
+    if _async_session is not None:
+        session, _async_session = _async_session, None
+        await session.close()
+
+async def async_chat_completion(payload):
+    """
+    Send a chat completion request from the event loop
+
+    Retries like chat_completion(), sleeping without blocking the loop.
+
+    Args:
+        payload (dict): The chat completions request body
+
+    Returns:
+        aiohttp.ClientResponse: The final response from the API, with its body already read
+    """
+    import aiohttp
+    session = get_async_session()
+    attempt = 0
+    while True:
+        if not openai_breaker.allow():
+            raise CircuitOpenError(openai_breaker.name)
+        start = time.monotonic()
+        try:
+            async with _async_semaphore:
+                async with session.post(OPENAI_API_URL, json=payload) as response:
+                    await response.read()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            openai_breaker.record(True, time.monotonic() - start)
+            if attempt >= OPENAI_MAX_RETRIES:
+                raise
+            delay = _backoff_seconds(attempt)
+            logger.warning("OpenAI request failed (%r), retrying in %.2fs", e, delay)
+        except BaseException:
+            # Including cancellation, so that a half-open probe is never lost
+            openai_breaker.record(True, time.monotonic() - start)
+            raise
+        else:
+            openai_breaker.record(response.status in RETRY_STATUS_CODES, time.monotonic() - start)
+            if response.status not in RETRY_STATUS_CODES or attempt >= OPENAI_MAX_RETRIES:
+                return response
+            retry_after = _retry_after_seconds(response)
+            if retry_after is not None and retry_after > OPENAI_BACKOFF_MAX:
+                return response
+            delay = retry_after if retry_after is not None else _backoff_seconds(attempt)
+            logger.warning("OpenAI API returned %s, retrying in %.2fs", response.status, delay)
+        await asyncio.sleep(delay)
+        attempt += 1
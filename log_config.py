@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# "development" logs everything as text, synchronously. "production" logs INFO
+# and above as JSON lines from a background thread and samples the
+# high-volume lines. Each setting below can still be overridden on its own.
+LOG_MODE = os.getenv("LOG_MODE", "development").lower()
+_PRODUCTION = LOG_MODE == "production"
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO" if _PRODUCTION else "DEBUG").upper()
+# "text" or "json"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json" if _PRODUCTION else "text").lower()
+# Format and write records on a background thread instead of the request's
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true" if _PRODUCTION else "false").lower() == "true"
+# Records waiting for the background thread; more are dropped rather than queued
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Share of the high-volume lines (see sampled()) that are logged
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1" if _PRODUCTION else "1"))
+
+# HTTP client libraries that log every request at INFO, kept to warnings in production
+NOISY_LOGGERS = ("httpx", "httpcore", "urllib3", "hpack")
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+_handler = None
+_dropped = 0
+_configure_lock = threading.Lock()
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Queue records without formatting them
+
+    The standard QueueHandler merges the message and its arguments on the
+    logging thread. Here that is left to the listener thread, so the caller
+    only pays for creating the record. Log immutable values (strings,
+    numbers), not objects that are changed right after the call.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Rather lose log lines than block requests behind a slow stream
+            _dropped += 1
+
+def sampled():
+    """
+    Whether to log the next high-volume line, e.g.
+
+        if sampled():
+            logger.info("Sending request to OpenAI API: %s", OPENAI_API_URL)
+
+    Deciding before the call skips the record creation as well.
+    """
+    return LOG_SAMPLE_RATE >= 1 or random.random() < LOG_SAMPLE_RATE
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def _restart_listener():
+    """The listener thread does not survive fork, start one in the child"""
+    global _listener
+    if _handler is not None and _listener is not None:
+        # The parent's listener may have held the queue's lock when forking
+        _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+        _listener = QueueListener(_handler.queue, *_listener.handlers, respect_handler_level=True)
+        _listener.start()
+
+def configure_logging(level=None, log_format=None, use_queue=None, stream=None):
+    """
+    Configure the root logger from the LOG_* settings, replacing its handlers
+
+    Args:
+        level (str): Overrides LOG_LEVEL
+        log_format (str): Overrides LOG_FORMAT ("text" or "json")
+        use_queue (bool): Overrides LOG_ASYNC
+        stream: Where to write, stderr by default
+    """
+    global _listener, _handler
+    level = level or LOG_LEVEL
+    log_format = log_format or LOG_FORMAT
+    use_queue = LOG_ASYNC if use_queue is None else use_queue
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+    with _configure_lock:
+        _stop_listener()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        if use_queue:
+            _handler = LazyQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+            _listener = QueueListener(_handler.queue, output, respect_handler_level=True)
+            _listener.start()
+            root.addHandler(_handler)
+        else:
+            _handler = None
+            root.addHandler(output)
+        root.setLevel(level)
+        if _PRODUCTION:
+            for name in NOISY_LOGGERS:
+                logging.getLogger(name).setLevel(logging.WARNING)
+
+def get_logging_stats():
+    """Return the number of records dropped because the queue was full"""
+    return {"dropped": _dropped}
+
+# Write out the queued records on a normal exit
+atexit.register(_stop_listener)
+os.register_at_fork(after_in_child=_restart_listener)
@@ -0,0 +1,283 @@
+import re
+import json
+import logging
+import threading
+from collections import defaultdict
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Common Indian medicines by category
+COMMON_MEDICINES = {
+    "fever": [
+        {"name": "Crocin", "brand": "GSK", "generic": "Paracetamol"},
+        {"name": "Dolo 650", "brand": "Micro Labs", "generic": "Paracetamol"},
+        {"name": "Calpol", "brand": "GSK", "generic": "Paracetamol"},
+        {"name": "Sumo", "brand": "CFL Pharma", "generic": "Paracetamol"},
+        {"name": "Febrinil", "brand": "Aristo", "generic": "Paracetamol"}
+    ],
+    "headache": [
+        {"name": "Saridon", "brand": "Bayer", "generic": "Propyphenazone+Paracetamol"},
+        {"name": "Dart", "brand": "Cipla", "generic": "Paracetamol+Caffeine"},
+        {"name": "Disprin", "brand": "Reckitt", "generic": "Aspirin"},
+        {"name": "Combiflam", "brand": "Sanofi", "generic": "Ibuprofen+Paracetamol"}
+    ],
+    "cold": [
+        {"name": "Vicks Action 500", "brand": "P&G", "generic": "Paracetamol+Phenylephrine"},
+        {"name": "D'Cold Total", "brand": "Reckitt", "generic": "Paracetamol+Phenylephrine"},
+        {"name": "Coldarin", "brand": "Alkem", "generic": "Phenylephrine+Chlorpheniramine"},
+        {"name": "Sinarest", "brand": "Centaur", "generic": "Paracetamol+Phenylephrine+Caffeine"},
+        {"name": "Nasivion", "brand": "Merck", "generic": "Oxymetazoline"}
+    ],
+    "allergies": [
+        {"name": "Allegra", "brand": "Sanofi", "generic": "Fexofenadine"},
+        {"name": "Cetrizine", "brand": "Various", "generic": "Cetirizine"},
+        {"name": "Montek LC", "brand": "Sun Pharma", "generic": "Montelukast+Levocetirizine"},
+        {"name": "Avil", "brand": "Sanofi", "generic": "Pheniramine Maleate"},
+        {"name": "Teczine", "brand": "GSK", "generic": "Levocetirizine"}
+    ],
+    "stomach_pain": [
+        {"name": "Buscopan", "brand": "Sanofi", "generic": "Hyoscine Butylbromide"},
+        {"name": "Cyclopam", "brand": "Indoco", "generic": "Dicyclomine"},
+        {"name": "Meftal Spas", "brand": "Blue Cross", "generic": "Mefenamic Acid+Dicyclomine"},
+        {"name": "Spasmo Proxyvon", "brand": "Wockhardt", "generic": "Dicyclomine+Paracetamol"}
+    ],
+    "acidity": [
+        {"name": "Eno", "brand": "GSK", "generic": "Sodium Bicarbonate+Citric Acid"},
+        {"name": "Digene", "brand": "Abbott", "generic": "Magnesium Hydroxide+Simethicone"},
+        {"name": "Gelusil", "brand": "Pfizer", "generic": "Aluminium Hydroxide+Magnesium Hydroxide"},
+        {"name": "Pan-D", "brand": "Alkem", "generic": "Pantoprazole+Domperidone"},
+        {"name": "Aciloc", "brand": "Cadila", "generic": "Ranitidine"}
+    ],
+    "diarrhea": [
+        {"name": "Lopamide", "brand": "Cipla", "generic": "Loperamide"},
+        {"name": "Eldoper", "brand": "Micro Labs", "generic": "Loperamide"},
+        {"name": "Norflox-TZ", "brand": "Cipla", "generic": "Norfloxacin+Tinidazole"},
+        {"name": "Enteroquinol", "brand": "Sanofi", "generic": "Clioquinol"},
+        {"name": "ORS", "brand": "Various", "generic": "Oral Rehydration Solution"}
+    ],
+    "pain_relief": [
+        {"name": "Combiflam", "brand": "Sanofi", "generic": "Ibuprofen+Paracetamol"},
+        {"name": "Brufen", "brand": "Abbott", "generic": "Ibuprofen"},
+        {"name": "Voveran", "brand": "Novartis", "generic": "Diclofenac"},
+        {"name": "Ultracet", "brand": "J&J", "generic": "Tramadol+Paracetamol"},
+        {"name": "Flexon", "brand": "Dr. Reddy's", "generic": "Etoricoxib"}
+    ],
+    "cough": [
+        {"name": "Benadryl", "brand": "J&J", "generic": "Diphenhydramine"},
+        {"name": "Honitus", "brand": "Dabur", "generic": "Herbal Formulation"},
+        {"name": "Ascoril", "brand": "Glenmark", "generic": "Terbutaline+Bromhexine"},
+        {"name": "Koflet", "brand": "Himalaya", "generic": "Herbal Formulation"},
+        {"name": "Chericof", "brand": "Cipla", "generic": "Codeine+Chlorpheniramine"}
+    ],
+    "vitamins": [
+        {"name": "Becosules", "brand": "Pfizer", "generic": "B-Complex+Vitamin C"},
+        {"name": "Supradyn", "brand": "Bayer", "generic": "Multivitamin+Minerals"},
+        {"name": "Shelcal", "brand": "Torrent", "generic": "Calcium+Vitamin D3"},
+        {"name": "Neurobion", "brand": "Merck", "generic": "B1+B6+B12"},
+        {"name": "Zincovit", "brand": "Apex", "generic": "Multivitamin+Zinc"}
+    ]
+}
+
+# Symptom keywords and synonyms per category, in every supported language
+# (English, Hindi incl. romanized, Tamil, Telugu, Kannada, Malayalam)
+CATEGORY_KEYWORDS = {
+    "fever": [
+        "fever", "feverish", "temperature", "chills",
+        "बुखार", "ज्वर", "bukhar", "bukhaar",
+        "காய்ச்சல்", "జ్వరం", "ಜ್ವರ", "പനി"
+    ],
+    "headache": [
+        "headache", "head ache", "head pain", "migraine",
+        "सिरदर्द", "सिर दर्द", "sir dard", "sardard",
+        "தலைவலி", "తలనొప్పి", "ತಲೆನೋವು", "ತಲೆ ನೋವು", "തലവേദന"
+    ],
+    "cold": [
+        "cold", "runny nose", "blocked nose", "stuffy nose", "congestion",
+        "सर्दी", "जुकाम", "zukam", "jukam", "sardi",
+        "சளி", "ஜலதோஷம்", "జలుబు", "ನೆಗಡಿ", "ಶೀತ", "ജലദോഷം"
+    ],
+    "allergies": [
+        "allergy", "allergic", "itching", "itchy", "rash", "hives", "sneezing",
+        "एलर्जी", "खुजली", "छींक",
+        "ஒவ்வாமை", "அரிப்பு", "అలెర్జీ", "దురద", "ಅಲರ್ಜಿ", "ತುರಿಕೆ", "അലർജി", "ചൊറിച്ചിൽ"
+    ],
+    "stomach_pain": [
+        "stomach pain", "stomach ache", "stomachache", "abdominal pain", "tummy", "cramps",
+        "पेट दर्द", "पेट में दर्द", "pet dard",
+        "வயிற்று வலி", "வயிற்றுவலி", "కడుపు నొప్పి", "ಹೊಟ್ಟೆ ನೋವು", "വയറുവേദന", "വയറു വേദന"
+    ],
+    "acidity": [
+        "acidity", "heartburn", "acid reflux", "indigestion", "gas", "bloating",
+        "एसिडिटी", "जलन", "गैस", "अपच",
+        "அசிடிட்டி", "நெஞ்செரிச்சல்", "ఎసిడిటీ", "గ్యాస్", "ಆಮ್ಲೀಯತೆ", "ಗ್ಯಾಸ್", "അസിഡിറ്റി", "ഗ്യാസ്"
+    ],
+    "diarrhea": [
+        "diarrhea", "diarrhoea", "loose motion", "loose stools", "dehydration",
+        "दस्त", "लूज मोशन", "dast",
+        "வயிற்றுப்போக்கு", "విరేచనాలు", "ಅತಿಸಾರ", "ಭೇದಿ", "വയറിളക്കം"
+    ],
+    "pain_relief": [
+        "pain", "ache", "body ache", "back pain", "joint pain", "toothache", "sprain", "muscle",
+        "दर्द", "बदन दर्द", "dard",
+        "வலி", "உடல் வலி", "నొప్పి", "ఒళ్ళు నొప్పులు", "ನೋವು", "ಮೈ ನೋವು", "വേദന", "ശരീരവേദന"
+    ],
+    "cough": [
+        "cough", "coughing", "sore throat", "phlegm",
+        "खांसी", "खाँसी", "khansi", "गले में खराश",
+        "இருமல்", "దగ్గు", "ಕೆಮ್ಮು", "ചുമ"
+    ],
+    "vitamins": [
+        "vitamin", "vitamins", "weakness", "tired", "tiredness", "fatigue", "deficiency", "supplement",
+        "कमजोरी", "थकान", "विटामिन", "kamzori",
+        "சோர்வு", "வைட்டமின்", "నీరసం", "విటమిన్", "ಆಯಾಸ", "ವಿಟಮಿನ್", "ക്ഷീണം", "വിറ്റാമിൻ"
+    ]
+}
+
+# Word characters plus the Indic blocks (Devanagari to Malayalam, whose vowel
+# signs are not alphanumeric for \w) and the zero-width (non-)joiners
+TOKEN_PATTERN = re.compile(r"[\w\u0900-\u0D7F\u200c\u200d']+")
+
+# Longest keyword phrase looked up, in words
+MAX_PHRASE_WORDS = 3
+# Trailing characters that may be stripped from a symptom keyword to match
+# inflected forms (case suffixes in the Indian languages); words in Latin
+# script only match with an English inflection, so "gasp" isn't "gas"
+MAX_SUFFIX_CHARS = 4
+ENGLISH_SUFFIXES = ("s", "es", "ed", "ing")
+MIN_KEYWORD_CHARS = 3
+# Categories named in the prompt when nothing in the conversation matched
+MAX_LISTED_CATEGORIES = 30
+
+def tokenize(text):
+    """Split text into lowercase words, keeping Indic words intact"""
+    return TOKEN_PATTERN.findall((text or "").lower())
+
+def normalize(text):
+    """Normalize a keyword or name to the form used as an index key"""
+    return " ".join(tokenize(text))
+
+class MedicineCatalog:
+    """
+    Indexed medicine catalog for picking the categories relevant to a conversation
+
+    The keyword index maps normalized phrases (symptom synonyms in every
+    language, medicine names and generic ingredients) to categories, and the
+    JSON of every category is rendered once so a turn only joins strings.
+    Inflected forms are only matched for symptoms: a brand like "Eno" must
+    not match "enough".
+    """
+
+    def __init__(self, catalog, keywords=CATEGORY_KEYWORDS):
+        self.catalog = catalog
+        self._index = defaultdict(set)
+        # Symptom keywords, also matched with an inflection suffix
+        self._stems = defaultdict(set)
+        self._generics = defaultdict(list)
+        self._names = {}
+        self._fragments = {}
+
+        for category, items in catalog.items():
+            self._add_keyword(category.replace("_", " "), category, inflected=True)
+            for keyword in keywords.get(category, ()):
+                self._add_keyword(keyword, category, inflected=True)
+            for item in items:
+                self._add_keyword(item["name"], category)
+                self._names.setdefault(normalize(item["name"]), (category, item))
+                for generic in item.get("generic", "").split("+"):
+                    key = normalize(generic)
+                    if key:
+                        self._generics[key].append((category, item))
+                        self._add_keyword(key, category)
+            self._fragments[category] = (
+                f"{json.dumps(category)}:{json.dumps(items, separators=(',', ':'), ensure_ascii=False)}"
+            )
+        # Large catalogs are not listed, the list alone would cost more than it helps
+        self.category_list = ", ".join(catalog) if len(catalog) <= MAX_LISTED_CATEGORIES else None
+
+    def _add_keyword(self, keyword, category, inflected=False):
+        key = normalize(keyword)
+        if len(key) >= MIN_KEYWORD_CHARS:
+            self._index[key].add(category)
+            if inflected:
+                self._stems[key].add(category)
+
+    def _match(self, phrase):
+        """Look up a phrase, allowing a symptom keyword to be followed by an inflection"""
+        categories = self._index.get(phrase)
+        if categories:
+            return categories
+        latin = phrase.isascii()
+        for strip in range(1, MAX_SUFFIX_CHARS + 1):
+            stem = phrase[:-strip]
+            if len(stem) < MIN_KEYWORD_CHARS:
+                break
+            if latin and phrase[-strip:] not in ENGLISH_SUFFIXES:
+                continue
+            categories = self._stems.get(stem)
+            if categories:
+                return categories
+        return ()
+
+    def lookup_generic(self, generic):
+        """Return (category, medicine) pairs containing a generic ingredient"""
+        return list(self._generics.get(normalize(generic), ()))
+
+    def lookup_name(self, name):
+        """Return the (category, medicine) pair for a brand name, or None"""
+        return self._names.get(normalize(name))
+
+    def match_categories(self, texts, limit=3):
+        """
+        Rank the categories mentioned in a conversation
+
+        Args:
+            texts (list): Conversation snippets, oldest first; later ones weigh more
+            limit (int): Maximum number of categories to return
+
+        Returns:
+            list: The most relevant category names
+        """
+        scores = defaultdict(int)
+        for weight, text in enumerate(texts, start=1):
+            words = tokenize(text)
+            for start in range(len(words)):
+                for size in range(1, MAX_PHRASE_WORDS + 1):
+                    if start + size > len(words):
+                        break
+                    for category in self._match(" ".join(words[start:start + size])):
+                        scores[category] += weight
+        ranked = sorted(scores, key=lambda category: -scores[category])
+        return ranked[:limit]
+
+    def format_categories(self, categories):
+        """Render the given categories as a system message"""
+        if not categories:
+            listed = f"Medicine categories available: {self.category_list}. " if self.category_list else ""
+            return f"{listed}Ask about symptoms before suggesting medicines."
+        fragments = ",".join(self._fragments[category] for category in categories)
+        return f"Available medicines by category: {{{fragments}}}"
+
+    def prompt_for(self, texts, limit=3):
+        """Return the medicine system message for a conversation"""
+        return self.format_categories(self.match_categories(texts, limit))
+
+_catalog = None
+_catalog_lock = threading.RLock()
+
+def load_catalog(catalog=None):
+    """Build (or rebuild after a change) the indexed catalog"""
+    global _catalog
+    new_catalog = MedicineCatalog(COMMON_MEDICINES if catalog is None else catalog)
+    with _catalog_lock:
+        _catalog = new_catalog
+    logger.info("Medicine catalog indexed: %s categories, %s keywords", len(new_catalog.catalog), len(new_catalog._index))
+    return new_catalog
+
+def get_catalog():
+    """Return the indexed catalog, building it on first use"""
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                return load_catalog()
+    return _catalog
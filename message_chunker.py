@@ -0,0 +1,74 @@
+import os
+import re
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Do not send a streamed chunk before it has this many characters, so that a
+# reply is not split into a flurry of one-line messages
+STREAM_MIN_CHARS = int(os.getenv("STREAM_MIN_CHARS", "80"))
+# WhatsApp rejects bodies over 1600 characters, split well before that
+STREAM_MAX_CHARS = int(os.getenv("STREAM_MAX_CHARS", "1500"))
+
+# Paragraph breaks and sentence ends (including the Devanagari danda)
+BOUNDARY_PATTERN = re.compile(r"\n[ \t]*\n\s*|(?<=[.!।])\s+")
+# Numbered options ("1.", "2)", "3️⃣") and bullets that belong to the preceding question
+OPTION_PATTERN = re.compile(r"\s*(\d+[.)]|\d️?⃣|[-*•]\s)")
+
+def _split_at(buffer):
+    """Return the end of the first chunk that can be sent from the buffer, or None"""
+    for match in BOUNDARY_PATTERN.finditer(buffer):
+        if match.start() < STREAM_MIN_CHARS:
+            continue
+        rest = buffer[match.end():]
+        if not rest:
+            # The next token may still continue this paragraph or start an option list
+            return None
+        if OPTION_PATTERN.match(rest):
+            continue
+        head = buffer[:match.start()].rstrip()
+        last_line = head.rsplit("\n", 1)[-1]
+        if head.endswith(("?", ":")) or OPTION_PATTERN.match(last_line):
+            # Keep questions together with their answer options
+            continue
+        return match
+    return None
+
+def _split_long(buffer):
+    """Cut a buffer that grew past STREAM_MAX_CHARS at the last whitespace"""
+    cut = max(buffer.rfind(" ", 0, STREAM_MAX_CHARS), buffer.rfind("\n", 0, STREAM_MAX_CHARS))
+    if cut <= 0:
+        cut = STREAM_MAX_CHARS
+    return buffer[:cut], buffer[cut:]
+
+def chunk_stream(pieces):
+    """
+    Group streamed pieces of a reply into WhatsApp-sized messages
+
+    Chunks end at paragraph or sentence boundaries once they are at least
+    STREAM_MIN_CHARS long. A question or a line ending in ":" is never split
+    from the options listed after it, so numbered choices arrive together.
+
+    Args:
+        pieces (iterable): Text deltas in the order they were generated
+
+    Yields:
+        str: Messages ready to be sent, in order
+    """
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        while True:
+            match = _split_at(buffer)
+            if match is None:
+                break
+            chunk, buffer = buffer[:match.start()].strip(), buffer[match.end():]
+            if chunk:
+                yield chunk
+        while len(buffer) > STREAM_MAX_CHARS:
+            chunk, buffer = _split_long(buffer)
+            if chunk.strip():
+                yield chunk.strip()
+    if buffer.strip():
+        yield buffer.strip()
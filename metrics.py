@@ -0,0 +1,237 @@
+import os
+import logging
+import threading
+from bisect import bisect_left
+from time import perf_counter_ns
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Off switch for the timing spans and counters; /metrics answers 404 when disabled
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Prefix of every exported metric name
+METRICS_NAMESPACE = "whatsapp"
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(label_name, label, extra=None):
+    labels = []
+    if label_name:
+        labels.append(f'{label_name}="{label}"')
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """A monotonic counter, optionally split by one label"""
+
+    def __init__(self, name, help_text, label_name=None):
+        self.name = f"{METRICS_NAMESPACE}_{name}"
+        self.help_text = help_text
+        self.label_name = label_name
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, label=""):
+        with self._lock:
+            self._values[label] = self._values.get(label, 0) + amount
+
+    def value(self, label=""):
+        with self._lock:
+            return self._values.get(label, 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label, value in values:
+            lines.append(f"{self.name}{_format_labels(self.label_name, label)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    """A histogram with fixed buckets, optionally split by one label"""
+
+    def __init__(self, name, help_text, label_name=None, buckets=LATENCY_BUCKETS):
+        self.name = f"{METRICS_NAMESPACE}_{name}"
+        self.help_text = help_text
+        self.label_name = label_name
+        self.buckets = tuple(buckets)
+        # label -> [count per bucket (the last one is +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, label=""):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, label=""):
+        with self._lock:
+            series = self._series.get(label)
+            return series[2] if series else 0
+
+    def render(self):
+        with self._lock:
+            series = sorted((label, (list(counts), total, count)) for label, (counts, total, count) in self._series.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.label_name, label, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_name, label)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_name, label)} {count}")
+        return lines
+
+STAGE_SECONDS = Histogram(
+    "stage_seconds",
+    "Time spent in each stage of handling a message",
+    label_name="stage"
+)
+REQUEST_SECONDS = Histogram(
+    "request_seconds",
+    "Time to answer a request, by route",
+    label_name="route"
+)
+OPENAI_TOKENS = Counter(
+    "openai_tokens_total",
+    "Tokens reported by the OpenAI API, by kind",
+    label_name="kind"
+)
+OPENAI_CALLS = Counter(
+    "openai_calls_total",
+    "OpenAI calls whose token usage was recorded, by purpose",
+    label_name="purpose"
+)
+ROUTE_TURNS = Counter(
+    "model_route_turns_total",
+    "Conversation turns sent to the LLM, by model route",
+    label_name="route"
+)
+ROUTE_SECONDS = Histogram(
+    "model_route_seconds",
+    "Time the LLM took to answer a turn, by model route",
+    label_name="route"
+)
+ROUTE_COST = Counter(
+    "model_route_cost_usd_total",
+    "Estimated OpenAI cost of the turns, in USD, by model route",
+    label_name="route"
+)
+
+_metrics = [STAGE_SECONDS, REQUEST_SECONDS, OPENAI_TOKENS, OPENAI_CALLS, ROUTE_TURNS, ROUTE_SECONDS, ROUTE_COST]
+
+# Callables returning a dict of numbers, exported as gauges (see register_collector)
+_collectors = {}
+
+class _Span:
+    __slots__ = ("histogram", "label", "start")
+
+    def __init__(self, histogram, label):
+        self.histogram = histogram
+        self.label = label
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe((perf_counter_ns() - self.start) / 1e9, self.label)
+        return False
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def span(stage):
+    """
+    Time a block of code as a stage of message handling
+
+    Usage:
+        with span("db_read"):
+            user = get_user(user_id)
+
+    Returns a shared no-op context manager when metrics are disabled.
+    """
+    if not METRICS_ENABLED:
+        return _NO_SPAN
+    return _Span(STAGE_SECONDS, stage)
+
+def request_span(route):
+    """Time a whole request to the given route"""
+    if not METRICS_ENABLED:
+        return _NO_SPAN
+    return _Span(REQUEST_SECONDS, route)
+
+def record_usage(usage, purpose="reply"):
+    """Add the token usage of an OpenAI response (its `usage` object) to the counters"""
+    if not METRICS_ENABLED or not usage:
+        return
+    OPENAI_CALLS.inc(1, purpose)
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            OPENAI_TOKENS.inc(usage[kind], kind[:-len("_tokens")])
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    if cached:
+        OPENAI_TOKENS.inc(cached, "cached")
+
+def register_collector(name, collect):
+    """
+    Export the numeric values of collect() as gauges named <namespace>_<name>_<key>
+
+    Existing stats functions (reply metrics, session store, database caches)
+    are registered this way so /metrics shows them without duplicating their
+    bookkeeping.
+    """
+    _collectors[name] = collect
+
+def render_metrics():
+    """Return all metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for name, collect in sorted(_collectors.items()):
+        try:
+            values = collect()
+        except Exception as e:
+            logger.error("Error collecting %s metrics: %s", name, e)
+            continue
+        for key, value in sorted(values.items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            metric_name = f"{METRICS_NAMESPACE}_{name}_{key}"
+            lines.append(f"# TYPE {metric_name} gauge")
+            lines.append(f"{metric_name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+def reset_metrics():
+    """Clear all recorded values, e.g. between benchmark runs"""
+    for metric in _metrics:
+        with metric._lock:
+            if isinstance(metric, Histogram):
+                metric._series.clear()
+            else:
+                metric._values.clear()
@@ -0,0 +1,160 @@
+import os
+import re
+import json
+import logging
+import threading
+import unicodedata
+from dotenv import load_dotenv
+from metrics import METRICS_ENABLED, ROUTE_SECONDS, ROUTE_TURNS, ROUTE_COST
+from response_cache import is_first_turn, normalize_message
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Send acknowledgements and answers to the bot's own questions to a smaller
+# model; off by default, every turn then goes to the symptom route
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING_ENABLED", "false").lower() == "true"
+
+def _route_settings(route, model, temperature, max_tokens):
+    """Chat completions settings of a route, each overridable with MODEL_ROUTE_<ROUTE>_<SETTING>"""
+    prefix = f"MODEL_ROUTE_{route.upper()}_"
+    return {
+        "model": os.getenv(prefix + "MODEL", model),
+        "temperature": float(os.getenv(prefix + "TEMPERATURE", temperature)),
+        "max_tokens": int(os.getenv(prefix + "MAX_TOKENS", max_tokens))
+    }
+
+ROUTES = {
+    # "thanks", "ok", greetings and emoji: a short, polite reply
+    "trivial": _route_settings("trivial", "gpt-4o-mini", "0.5", "200"),
+    # "2", "yes", "no" answering a question or menu the bot just sent
+    "option": _route_settings("option", "gpt-4o-mini", "0.7", "600"),
+    # Everything else, including every first question of a conversation
+    "symptom": _route_settings("symptom", "gpt-4o", "0.7", "800")
+}
+
+# USD per million tokens: (prompt, cached prompt, completion). Extend or
+# override with MODEL_PRICES, e.g. {"gpt-4.1-mini": [0.4, 0.1, 1.6]}
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60)
+}
+MODEL_PRICES.update({model: tuple(prices) for model, prices in json.loads(os.getenv("MODEL_PRICES", "{}")).items()})
+
+# Whole messages (normalized, see response_cache.normalize_message) that only
+# acknowledge, thank or greet, in the supported languages and their romanizations
+TRIVIAL_MESSAGES = {
+    "ok", "okay", "okk", "k", "kk", "thanks", "thank you", "thanks a lot", "thank you so much", "thank you doctor",
+    "thx", "ty", "hi", "hello", "hey", "good morning", "good night", "fine", "alright", "sure", "got it", "noted",
+    "great", "cool", "welcome",
+    "dhanyavad", "dhanyavaad", "shukriya", "theek hai", "thik hai", "accha", "acha", "namaste",
+    "धन्यवाद", "शुक्रिया", "ठीक है", "अच्छा", "नमस्ते",
+    "nandri", "sari", "seri", "vanakkam", "நன்றி", "சரி", "வணக்கம்",
+    "dhanyavadalu", "sare", "namaskaram", "ధన్యవాదాలు", "సరే", "నమస్కారం",
+    "dhanyavadagalu", "namaskara", "ಧನ್ಯವಾದಗಳು", "ಸರಿ", "ನಮಸ್ಕಾರ",
+    "nanni", "shari", "sheri", "നന്ദി", "ശരി", "നമസ്കാരം"
+}
+
+# Short answers to a yes/no question of the bot
+YES_NO_MESSAGES = {
+    "yes", "yeah", "yep", "no", "nope", "not really",
+    "haan", "ha", "nahi", "nahin", "हाँ", "हां", "नहीं",
+    "aamam", "illai", "ஆமாம்", "இல்லை",
+    "avunu", "ledu", "అవును", "లేదు",
+    "houdu", "illa", "ಹೌದು", "ಇಲ್ಲ",
+    "athe", "അതെ", "ഇല്ല"
+}
+
+# A numbered option in a bot message: "1️⃣ ...", "1. ..." or "1) ..." at the start of a line
+OPTION_LINE = re.compile(r"(?:^|\n)\s*\d(?:\ufe0f?\u20e3|[.)])")
+
+def _last_assistant_message(user_data):
+    for message in reversed(user_data.get("history", ())):
+        if message["role"] == "assistant":
+            return message["content"]
+    return ""
+
+def classify_turn(user_data, incoming_msg):
+    """
+    Decide which route answers a conversation message
+
+    Only whole messages are matched, so "ok but the fever is back" is a
+    symptom turn. A number is an option only if the bot's last message listed
+    numbered options.
+
+    Args:
+        user_data (dict): The user's session, with the message already in its history
+        incoming_msg (str): The text of the incoming message
+
+    Returns:
+        str: "trivial", "option" or "symptom"
+    """
+    if not MODEL_ROUTING_ENABLED or is_first_turn(user_data):
+        return "symptom"
+    normalized = normalize_message(incoming_msg)
+    if not normalized:
+        # Emoji or punctuation only ("👍", "🙏"); a media message without text is not trivial
+        return "trivial" if incoming_msg.strip() else "symptom"
+    if normalized in TRIVIAL_MESSAGES:
+        return "trivial"
+    if normalized in YES_NO_MESSAGES:
+        return "option"
+    # Keycap emoji ("2️⃣") keep their combining marks after normalization
+    digits = "".join(character for character in normalized if unicodedata.category(character)[0] != "M")
+    if digits.isdigit() and len(digits) == 1 and OPTION_LINE.search(_last_assistant_message(user_data)):
+        return "option"
+    return "symptom"
+
+def route_settings(route):
+    """Return the model, temperature and max_tokens of a route"""
+    return ROUTES[route]
+
+def usage_cost(model, usage):
+    """
+    Price of an OpenAI response in USD, from its `usage` object
+
+    Returns 0.0 for models missing from MODEL_PRICES.
+    """
+    prices = MODEL_PRICES.get(model)
+    if prices is None or not usage:
+        return 0.0
+    prompt = usage.get("prompt_tokens") or 0
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    completion = usage.get("completion_tokens") or 0
+    return ((prompt - cached) * prices[0] + cached * prices[1] + completion * prices[2]) / 1e6
+
+_stats = {route: {"turns": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}
+          for route in ROUTES}
+_stats_lock = threading.Lock()
+
+def record_route(route, seconds, usage=None):
+    """
+    Count a routed turn with its LLM latency and the cost of its usage
+
+    Args:
+        route (str): The route the turn was sent to
+        seconds (float): How long the LLM took to answer
+        usage (dict): The `usage` object of the response, None if the call failed
+    """
+    cost = usage_cost(ROUTES[route]["model"], usage)
+    with _stats_lock:
+        stats = _stats[route]
+        stats["turns"] += 1
+        stats["seconds"] += seconds
+        if usage:
+            stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            stats["completion_tokens"] += usage.get("completion_tokens") or 0
+        stats["cost_usd"] += cost
+    if METRICS_ENABLED:
+        ROUTE_TURNS.inc(1, route)
+        ROUTE_SECONDS.observe(seconds, route)
+        if cost:
+            ROUTE_COST.inc(cost, route)
+
+def get_routing_stats():
+    """Return turns, LLM seconds, tokens and cost per route, flattened as <route>_<counter>"""
+    with _stats_lock:
+        return {f"{route}_{key}": value for route, stats in _stats.items() for key, value in stats.items()}
@@ -0,0 +1,197 @@
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Available languages, by the number the user replies with
+LANGUAGES = {
+    "1": {"name": "English", "code": "en"},
+    "2": {"name": "Hindi", "code": "hi"},
+    "3": {"name": "Tamil", "code": "ta"},
+    "4": {"name": "Telugu", "code": "te"},
+    "5": {"name": "Kannada", "code": "kn"},
+    "6": {"name": "Malayalam", "code": "ml"}
+}
+
+# Translated language selection message
+LANGUAGE_SELECTION_MESSAGE = {
+    "en": "Welcome to the Medical Assistant! Please select your preferred language:\n1️⃣ English\n2️⃣ Hindi\n3️⃣ Tamil\n4️⃣ Telugu\n5️⃣ Kannada\n6️⃣ Malayalam\n\nReply with the number of your choice.",
+    "hi": "मेडिकल असिस्टेंट में आपका स्वागत है! कृपया अपनी पसंदीदा भाषा चुनें:\n1️⃣ अंग्रे़ी\n2️⃣ हिंदी\n3️⃣ तमिल\n4️⃣ तेलुगु\n5️⃣ कन्नड़\n6️⃣ मलयालम\n\nअपनी पसंद का नंबर लिखकर जवाब दें।",
+    "ta": "மருத்துவ உதவியாளருக்கு வரவேற்கிறோம்! உங்கள் விருப்பமான மொழியைத் தேர்ந்தெடுக்கவும்:\n1️⃣ ஆங்கிலம்\n2️⃣ இந்தி\n3️⃣ தமிழ்\n4️⃣ தெலுங்கு\n5️⃣ கன்னடம்\n6️⃣ மலையாளம்\n\nஉங்கள் தேர்வின் எண்ணுடன் பதிலளிக்கவும்.",
+    "te": "మెడికల్ అసిస్టెంట్‌కు స్వాగతం! దయచేసి మీకు ఇష్టమైన భాషను ఎంచుకోండి:\n1️⃣ ఇంగ్లీష్\n2️⃣ హిందీ\n3️⃣ తమిళం\n4️⃣ తెలుగు\n5️⃣ కన్నడ\n6️⃣ మలయాళం\n\nమీ ఎంపిక సంఖ్యతో సమాధానం ఇవ్వండి.",
+    "kn": "ವೈದ್ಯಕೀಯ ಸಹಾಯಕಕ್ಕೆ ಸುಸ್ವಾಗತ! ದಯವಿಟ್ಟು ನಿಮ್ಮ ಆದ್ಯತೆಯ ಭಾಷೆಯನ್ನು ಆಯ್ಕೆಮಾಡಿ:\n1️⃣ ಇಂಗ್ಲಿಷ್\n2️⃣ ಹಿಂದಿ\n3️⃣ ತಮಿಳು\n4️⃣ ತೆಲುಗು\n5️⃣ ಕನ್ನಡ\n6️⃣ ಮಲಯಾಳಂ\n\nನಿಮ್ಮ ಆಯ್ಕೆಯ ಸಂಖ್ಯೆಯೊಂದಿಗೆ ಉತ್ತರಿಸಿ.",
+    "ml": "മെഡിക്കൽ അസിസ്റ്റന്റ് ആണ്! നിങ്ങളുടെ ഇഷ്ടപ്പെട്ട ഭാഷ തിരഞ്ഞെടുക്കുക:\n1️⃣ ഇംഗ്ലീഷ്\n2️⃣ ഹിന്ദി\n3️⃣ തമിഴ്\n4️⃣ തെലുങ്ക്\n5️⃣ കന്നഡ\n6️⃣ മലയാളം\n\nനിങ്ങളുടെ തിരഞ്ഞെടുക്കലിന്റെ നമ്പർ ഉപയോഗിച്ച് മറുപടി നൽകുക."
+}
+
+# Profile fields collected during onboarding, in order
+ONBOARDING_FIELDS = ("name", "age", "gender", "previous_health_issues", "surgeries")
+
+# Profile fields stored in the users table and restored for returning users
+PROFILE_FIELDS = ONBOARDING_FIELDS
+
+# The message sent once each field has been answered
+NEXT_MESSAGE = {
+    "name": "ask_age",
+    "age": "ask_gender",
+    "gender": "ask_health_issues",
+    "previous_health_issues": "ask_surgeries",
+    "surgeries": "ask_concern"
+}
+
+# Numbered answers stored as a value; any other reply is stored as typed
+FIELD_OPTIONS = {
+    "gender": {"1": "Male", "2": "Female"}
+}
+
+ONBOARDING_TEXTS = {
+    "en": {
+        "ask_name": "Could you please tell me your name?",
+        "ask_age": "Thank you! Could you please tell me your age?",
+        "ask_gender": "Please select your gender:\n1️⃣ Male\n2️⃣ Female\n3️⃣ Other (please specify)",
+        "ask_health_issues": "Do you have any of the following health issues? (Reply with the number or type 'none' if you don't have any):\n1️⃣ Diabetes\n2️⃣ Blood Pressure\n3️⃣ Chronic Problems\n4️⃣ Kidney or Liver Issues\n5️⃣ Other (please specify)",
+        "ask_surgeries": "Have you undergone any surgeries? (Reply with the number or type 'none' if you haven't):\n1️⃣ Appendectomy\n2️⃣ C-section\n3️⃣ Knee/Hip Replacement\n4️⃣ Heart Surgery\n5️⃣ Other (please specify)",
+        "ask_concern": "What health concerns or symptoms would you like to discuss today?",
+        "welcome_back": "Welcome back {name}! How can I help you today?",
+        "save_error": "I'm sorry, there was an error saving your information. Please try again later.",
+        "unavailable": "I'm sorry, I can't answer right now because of a temporary problem. Please send your message again in a few minutes. If your symptoms are severe, please see a doctor or go to the nearest hospital right away.",
+        "slow_down": "You're sending messages too quickly. Please wait a minute, then send your message again.",
+        "daily_limit": "You've reached today's limit for this service. Please come back tomorrow. If your symptoms are severe, please see a doctor or go to the nearest hospital right away.",
+        "goodbye": "Thank you for using the Medical Assistant. Your conversation has been ended. Type 'bye' if you'd like to end the conversation and start a new one."
+    },
+    "hi": {
+        "ask_name": "कृपया अपना नाम बताएं?",
+        "ask_age": "धन्यवाद! कृपया अपनी उम्र बताएं?",
+        "ask_gender": "कृपया अपना लिंग चुनें:\n1️⃣ पुरुष\n2️⃣ महिला\n3️⃣ अन्य (कृपया बताएं)",
+        "ask_health_issues": "क्या आपको इनमें से कोई स्वास्थ्य समस्या है? (नंबर लिखकर जवाब दें या कोई समस्या न हो तो 'none' लिखें):\n1️⃣ मधुमेह (डायबिटीज़)\n2️⃣ ब्लड प्रेशर\n3️⃣ पुरानी बीमारियाँ\n4️⃣ किडनी या लिवर की समस्या\n5️⃣ अन्य (कृपया बताएं)",
+        "ask_surgeries": "क्या आपकी कोई सर्जरी हुई है? (नंबर लिखकर जवाब दें या न हुई हो तो 'none' लिखें):\n1️⃣ अपेंडिक्स का ऑपरेशन\n2️⃣ सी-सेक्शन\n3️⃣ घुटने/कूल्हे का प्रत्यारोपण\n4️⃣ हृदय की सर्जरी\n5️⃣ अन्य (कृपया बताएं)",
+        "ask_concern": "आज आप किन स्वास्थ्य समस्याओं या लक्षणों के बारे में बात करना चाहेंगे?",
+        "welcome_back": "फिर से स्वागत है {name}! आज मैं आपकी कैसे मदद कर सकता हूँ?",
+        "save_error": "क्षमा करें, आपकी जानकारी सहेजने में त्रुटि हुई। कृपया बाद में पुनः प्रयास करें।",
+        "unavailable": "क्षमा करें, एक अस्थायी समस्या के कारण मैं अभी उत्तर नहीं दे सकता। कृपया कुछ मिनट बाद अपना संदेश फिर से भेजें। यदि आपके लक्षण गंभीर हैं, तो कृपया तुरंत डॉक्टर से मिलें या नज़दीकी अस्पताल जाएँ।",
+        "slow_down": "आप बहुत जल्दी-जल्दी संदेश भेज रहे हैं। कृपया एक मिनट रुकें, फिर अपना संदेश दोबारा भेजें।",
+        "daily_limit": "आपने आज के लिए इस सेवा की सीमा पूरी कर ली है। कृपया कल फिर आएँ। यदि आपके लक्षण गंभीर हैं, तो कृपया तुरंत डॉक्टर से मिलें या नज़दीकी अस्पताल जाएँ।",
+        "goodbye": "मेडिकल असिस्टेंट का उपयोग करने के लिए धन्यवाद। आपकी बातचीत समाप्त हो गई है। यदि आप बातचीत समाप्त करना और एक नई बातचीत शुरू करना चाहते हैं तो 'bye' टाइप करें।"
+    },
+    "ta": {
+        "ask_name": "உங்கள் பெயரைச் சொல்ல முடியுமா?",
+        "ask_age": "நன்றி! உங்கள் வயதைச் சொல்ல முடியுமா?",
+        "ask_gender": "உங்கள் பாலினத்தைத் தேர்ந்தெடுக்கவும்:\n1️⃣ ஆண்\n2️⃣ பெண்\n3️⃣ மற்றவை (குறிப்பிடவும்)",
+        "ask_health_issues": "உங்களுக்குப் பின்வரும் உடல்நலப் பிரச்சினைகள் ஏதேனும் உள்ளதா? (எண்ணுடன் பதிலளிக்கவும் அல்லது இல்லையென்றால் 'none' என தட்டச்சு செய்யவும்):\n1️⃣ நீரிழிவு\n2️⃣ இரத்த அழுத்தம்\n3️⃣ நாள்பட்ட பிரச்சினைகள்\n4️⃣ சிறுநீரக அல்லது கல்லீரல் பிரச்சினைகள்\n5️⃣ மற்றவை (குறிப்பிடவும்)",
+        "ask_surgeries": "உங்களுக்கு ஏதேனும் அறுவை சிகிச்சை செய்யப்பட்டுள்ளதா? (எண்ணுடன் பதிலளிக்கவும் அல்லது இல்லையென்றால் 'none' என தட்டச்சு செய்யவும்):\n1️⃣ குடல்வால் அறுவை சிகிச்சை\n2️⃣ சிசேரியன்\n3️⃣ முழங்கால்/இடுப்பு மாற்று\n4️⃣ இதய அறுவை சிகிச்சை\n5️⃣ மற்றவை (குறிப்பிடவும்)",
+        "ask_concern": "இன்று எந்த உடல்நலப் பிரச்சினைகள் அல்லது அறிகுறிகளைப் பற்றிப் பேச விரும்புகிறீர்கள்?",
+        "welcome_back": "மீண்டும் வருக {name}! இன்று நான் உங்களுக்கு எப்படி உதவ முடியும்?",
+        "save_error": "மன்னிக்கவும், உங்கள் தகவலைச் சேமிப்பதில் பிழை ஏற்பட்டது. பின்னர் மீண்டும் முயற்சிக்கவும்.",
+        "unavailable": "மன்னிக்கவும், தற்காலிக சிக்கல் காரணமாக இப்போது என்னால் பதிலளிக்க முடியவில்லை. சில நிமிடங்கள் கழித்து உங்கள் செய்தியை மீண்டும் அனுப்பவும். உங்கள் அறிகுறிகள் தீவிரமாக இருந்தால், உடனடியாக மருத்துவரை அணுகவும் அல்லது அருகிலுள்ள மருத்துவமனைக்குச் செல்லவும்.",
+        "slow_down": "நீங்கள் மிக வேகமாக செய்திகளை அனுப்புகிறீர்கள். ஒரு நிமிடம் காத்திருந்து, பின்னர் உங்கள் செய்தியை மீண்டும் அனுப்பவும்.",
+        "daily_limit": "இன்றைய இந்த சேவையின் வரம்பை நீங்கள் அடைந்துவிட்டீர்கள். நாளை மீண்டும் வாருங்கள். உங்கள் அறிகுறிகள் தீவிரமாக இருந்தால், உடனடியாக மருத்துவரை அணுகவும் அல்லது அருகிலுள்ள மருத்துவமனைக்குச் செல்லவும்.",
+        "goodbye": "மருத்துவ உதவியாளரைப் பயன்படுத்தியதற்கு நன்றி. உங்கள் உரையாடல் முடிந்தது. உரையாடலை முடிக்கவும் புதிய உரையாடலைத் தொடங்கவும் 'bye' என்று தட்டச்சு செய்யவும்."
+    },
+    "te": {
+        "ask_name": "దయచేసి మీ పేరు చెప్పగలరా?",
+        "ask_age": "ధన్యవాదాలు! దయచేసి మీ వయస్సు చెప్పగలరా?",
+        "ask_gender": "దయచేసి మీ లింగాన్ని ఎంచుకోండి:\n1️⃣ పురుషుడు\n2️⃣ స్త్రీ\n3️⃣ ఇతర (దయచేసి పేర్కొనండి)",
+        "ask_health_issues": "మీకు ఈ క్రింది ఆరోగ్య సమస్యలలో ఏవైనా ఉన్నాయా? (సంఖ్యతో సమాధానం ఇవ్వండి లేదా ఏవీ లేకపోతే 'none' అని టైప్ చేయండి):\n1️⃣ మధుమేహం\n2️⃣ రక్తపోటు\n3️⃣ దీర్ఘకాలిక సమస్యలు\n4️⃣ కిడ్నీ లేదా కాలేయ సమస్యలు\n5️⃣ ఇతర (దయచేసి పేర్కొనండి)",
+        "ask_surgeries": "మీకు ఏవైనా శస్త్రచికిత్సలు జరిగాయా? (సంఖ్యతో సమాధానం ఇవ్వండి లేదా జరగకపోతే 'none' అని టైప్ చేయండి):\n1️⃣ అపెండిక్స్ ఆపరేషన్\n2️⃣ సి-సెక్షన్\n3️⃣ మోకాలు/తుంటి మార్పిడి\n4️⃣ గుండె శస్త్రచికిత్స\n5️⃣ ఇతర (దయచేసి పేర్కొనండి)",
+        "ask_concern": "ఈ రోజు మీరు ఏ ఆరోగ్య సమస్యలు లేదా లక్షణాల గురించి మాట్లాడాలనుకుంటున్నారు?",
+        "welcome_back": "తిరిగి స్వాగతం {name}! ఈ రోజు నేను మీకు ఎలా సహాయం చేయగలను?",
+        "save_error": "క్షమించండి, మీ సమాచారాన్ని సేవ్ చేయడంలో లోపం జరిగింది. దయచేసి తర్వాత మళ్లీ ప్రయత్నించండి.",
+        "unavailable": "క్షమించండి, తాత్కాలిక సమస్య కారణంగా నేను ఇప్పుడు సమాధానం ఇవ్వలేను. దయచేసి కొన్ని నిమిషాల తర్వాత మీ సందేశాన్ని మళ్లీ పంపండి. మీ లక్షణాలు తీవ్రంగా ఉంటే, వెంటనే వైద్యుడిని సంప్రదించండి లేదా దగ్గరలోని ఆసుపత్రికి వెళ్లండి.",
+        "slow_down": "మీరు చాలా వేగంగా సందేశాలు పంపుతున్నారు. దయచేసి ఒక నిమిషం ఆగి, ఆపై మీ సందేశాన్ని మళ్లీ పంపండి.",
+        "daily_limit": "ఈ రోజుకు ఈ సేవ పరిమితిని మీరు చేరుకున్నారు. దయచేసి రేపు మళ్లీ రండి. మీ లక్షణాలు తీవ్రంగా ఉంటే, వెంటనే వైద్యుడిని సంప్రదించండి లేదా దగ్గరలోని ఆసుపత్రికి వెళ్లండి.",
+        "goodbye": "మెడికల్ అసిస్టెంట్‌ని ఉపయోగించినందుకు ధన్యవాదాలు. మీ సంభాషణ ముగిసింది. సంభాషణను ముగించడానికి మరియు కొత్త సంభాషణను ప్రారంభించడానికి 'bye' టైప్ చేయండి."
+    },
+    "kn": {
+        "ask_name": "ದಯವಿಟ್ಟು ನಿಮ್ಮ ಹೆಸರನ್ನು ತಿಳಿಸುವಿರಾ?",
+        "ask_age": "ಧನ್ಯವಾದಗಳು! ದಯವಿಟ್ಟು ನಿಮ್ಮ ವಯಸ್ಸನ್ನು ತಿಳಿಸುವಿರಾ?",
+        "ask_gender": "ದಯವಿಟ್ಟು ನಿಮ್ಮ ಲಿಂಗವನ್ನು ಆಯ್ಕೆಮಾಡಿ:\n1️⃣ ಪುರುಷ\n2️⃣ ಮಹಿಳೆ\n3️⃣ ಇತರೆ (ದಯವಿಟ್ಟು ನಮೂದಿಸಿ)",
+        "ask_health_issues": "ನಿಮಗೆ ಈ ಕೆಳಗಿನ ಯಾವುದಾದರೂ ಆರೋಗ್ಯ ಸಮಸ್ಯೆಗಳಿವೆಯೇ? (ಸಂಖ್ಯೆಯೊಂದಿಗೆ ಉತ್ತರಿಸಿ ಅಥವಾ ಇಲ್ಲದಿದ್ದರೆ 'none' ಎಂದು ಟೈಪ್ ಮಾಡಿ):\n1️⃣ ಮಧುಮೇಹ\n2️⃣ ರಕ್ತದೊತ್ತಡ\n3️⃣ ದೀರ್ಘಕಾಲದ ಸಮಸ್ಯೆಗಳು\n4️⃣ ಮೂತ್ರಪಿಂಡ ಅಥವಾ ಯಕೃತ್ತಿನ ಸಮಸ್ಯೆಗಳು\n5️⃣ ಇತರೆ (ದಯವಿಟ್ಟು ನಮೂದಿಸಿ)",
+        "ask_surgeries": "ನಿಮಗೆ ಯಾವುದಾದರೂ ಶಸ್ತ್ರಚಿಕಿತ್ಸೆ ಆಗಿದೆಯೇ? (ಸಂಖ್ಯೆಯೊಂದಿಗೆ ಉತ್ತರಿಸಿ ಅಥವಾ ಆಗಿಲ್ಲದಿದ್ದರೆ 'none' ಎಂದು ಟೈಪ್ ಮಾಡಿ):\n1️⃣ ಅಪೆಂಡಿಕ್ಸ್ ಶಸ್ತ್ರಚಿಕಿತ್ಸೆ\n2️⃣ ಸಿ-ಸೆಕ್ಷನ್\n3️⃣ ಮೊಣಕಾಲು/ಸೊಂಟ ಬದಲಾವಣೆ\n4️⃣ ಹೃದಯ ಶಸ್ತ್ರಚಿಕಿತ್ಸೆ\n5️⃣ ಇತರೆ (ದಯವಿಟ್ಟು ನಮೂದಿಸಿ)",
+        "ask_concern": "ಇಂದು ನೀವು ಯಾವ ಆರೋಗ್ಯ ಸಮಸ್ಯೆಗಳು ಅಥವಾ ಲಕ್ಷಣಗಳ ಬಗ್ಗೆ ಮಾತನಾಡಲು ಬಯಸುತ್ತೀರಿ?",
+        "welcome_back": "ಮರಳಿ ಸ್ವಾಗತ {name}! ಇಂದು ನಾನು ನಿಮಗೆ ಹೇಗೆ ಸಹಾಯ ಮಾಡಬಹುದು?",
+        "save_error": "ಕ್ಷಮಿಸಿ, ನಿಮ್ಮ ಮಾಹಿತಿಯನ್ನು ಉಳಿಸುವಲ್ಲಿ ದೋಷ ಉಂಟಾಗಿದೆ. ದಯವಿಟ್ಟು ನಂತರ ಮತ್ತೆ ಪ್ರಯತ್ನಿಸಿ.",
+        "unavailable": "ಕ್ಷಮಿಸಿ, ತಾತ್ಕಾಲಿಕ ಸಮಸ್ಯೆಯಿಂದಾಗಿ ನಾನು ಈಗ ಉತ್ತರಿಸಲು ಸಾಧ್ಯವಿಲ್ಲ. ದಯವಿಟ್ಟು ಕೆಲವು ನಿಮಿಷಗಳ ನಂತರ ನಿಮ್ಮ ಸಂದೇಶವನ್ನು ಮತ್ತೆ ಕಳುಹಿಸಿ. ನಿಮ್ಮ ರೋಗಲಕ್ಷಣಗಳು ತೀವ್ರವಾಗಿದ್ದರೆ, ತಕ್ಷಣ ವೈದ್ಯರನ್ನು ಭೇಟಿ ಮಾಡಿ ಅಥವಾ ಹತ್ತಿರದ ಆಸ್ಪತ್ರೆಗೆ ಹೋಗಿ.",
+        "slow_down": "ನೀವು ತುಂಬಾ ವೇಗವಾಗಿ ಸಂದೇಶಗಳನ್ನು ಕಳುಹಿಸುತ್ತಿದ್ದೀರಿ. ದಯವಿಟ್ಟು ಒಂದು ನಿಮಿಷ ಕಾಯಿರಿ, ನಂತರ ನಿಮ್ಮ ಸಂದೇಶವನ್ನು ಮತ್ತೆ ಕಳುಹಿಸಿ.",
+        "daily_limit": "ಇಂದಿನ ಈ ಸೇವೆಯ ಮಿತಿಯನ್ನು ನೀವು ತಲುಪಿದ್ದೀರಿ. ದಯವಿಟ್ಟು ನಾಳೆ ಮತ್ತೆ ಬನ್ನಿ. ನಿಮ್ಮ ರೋಗಲಕ್ಷಣಗಳು ತೀವ್ರವಾಗಿದ್ದರೆ, ತಕ್ಷಣ ವೈದ್ಯರನ್ನು ಭೇಟಿ ಮಾಡಿ ಅಥವಾ ಹತ್ತಿರದ ಆಸ್ಪತ್ರೆಗೆ ಹೋಗಿ.",
+        "goodbye": "ವೈದ್ಯಕೀಯ ಸಹಾಯಕವನ್ನು ಬಳಸಿದ್ದಕ್ಕಾಗಿ ಧನ್ಯವಾದಗಳು. ನಿಮ್ಮ ಸಂಭಾಷಣೆಯನ್ನು ಕೊನೆಗೊಳಿಸಲಾಗಿದೆ. ಸಂಭಾಷಣೆಯನ್ನು ಕೊನೆಗೊಳಿಸಲು ಮತ್ತು ಹೊಸ ಸಂಭಾಷಣೆಯನ್ನು ಪ್ರಾರಂಭಿಸಲು ನೀವು 'bye' ಎಂದು ಟೈಪ್ ಮಾಡಬಹುದು."
+    },
+    "ml": {
+        "ask_name": "ദയവായി നിങ്ങളുടെ പേര് പറയാമോ?",
+        "ask_age": "നന്ദി! ദയവായി നിങ്ങളുടെ പ്രായം പറയാമോ?",
+        "ask_gender": "ദയവായി നിങ്ങളുടെ ലിംഗം തിരഞ്ഞെടുക്കുക:\n1️⃣ പുരുഷൻ\n2️⃣ സ്ത്രീ\n3️⃣ മറ്റുള്ളവ (ദയവായി വ്യക്തമാക്കുക)",
+        "ask_health_issues": "നിങ്ങൾക്ക് താഴെപ്പറയുന്ന ഏതെങ്കിലും ആരോഗ്യ പ്രശ്നങ്ങളുണ്ടോ? (നമ്പർ ഉപയോഗിച്ച് മറുപടി നൽകുക അല്ലെങ്കിൽ ഒന്നുമില്ലെങ്കിൽ 'none' എന്ന് ടൈപ്പ് ചെയ്യുക):\n1️⃣ പ്രമേഹം\n2️⃣ രക്തസമ്മർദ്ദം\n3️⃣ ദീർഘകാല പ്രശ്നങ്ങൾ\n4️⃣ വൃക്ക അല്ലെങ്കിൽ കരൾ പ്രശ്നങ്ങൾ\n5️⃣ മറ്റുള്ളവ (ദയവായി വ്യക്തമാക്കുക)",
+        "ask_surgeries": "നിങ്ങൾക്ക് എന്തെങ്കിലും ശസ്ത്രക്രിയ നടത്തിയിട്ടുണ്ടോ? (നമ്പർ ഉപയോഗിച്ച് മറുപടി നൽകുക അല്ലെങ്കിൽ ഇല്ലെങ്കിൽ 'none' എന്ന് ടൈപ്പ് ചെയ്യുക):\n1️⃣ അപ്പെൻഡിക്സ് ശസ്ത്രക്രിയ\n2️⃣ സിസേറിയൻ\n3️⃣ കാൽമുട്ട്/ഇടുപ്പ് മാറ്റിവയ്ക്കൽ\n4️⃣ ഹൃദയ ശസ്ത്രക്രിയ\n5️⃣ മറ്റുള്ളവ (ദയവായി വ്യക്തമാക്കുക)",
+        "ask_concern": "ഇന്ന് ഏതൊക്കെ ആരോഗ്യ പ്രശ്നങ്ങളെക്കുറിച്ചോ ലക്ഷണങ്ങളെക്കുറിച്ചോ സംസാരിക്കാൻ ആഗ്രഹിക്കുന്നു?",
+        "welcome_back": "വീണ്ടും സ്വാഗതം {name}! ഇന്ന് ഞാൻ നിങ്ങളെ എങ്ങനെ സഹായിക്കും?",
+        "save_error": "ക്ഷമിക്കണം, നിങ്ങളുടെ വിവരങ്ങൾ സംരക്ഷിക്കുന്നതിൽ പിശക് സംഭവിച്ചു. ദയവായി പിന്നീട് വീണ്ടും ശ്രമിക്കുക.",
+        "unavailable": "ക്ഷമിക്കണം, ഒരു താൽക്കാലിക പ്രശ്നം കാരണം എനിക്ക് ഇപ്പോൾ മറുപടി നൽകാൻ കഴിയില്ല. കുറച്ച് മിനിറ്റുകൾക്ക് ശേഷം നിങ്ങളുടെ സന്ദേശം വീണ്ടും അയയ്ക്കുക. നിങ്ങളുടെ ലക്ഷണങ്ങൾ ഗുരുതരമാണെങ്കിൽ, ഉടൻ തന്നെ ഒരു ഡോക്ടറെ കാണുക അല്ലെങ്കിൽ അടുത്തുള്ള ആശുപത്രിയിൽ പോകുക.",
+        "slow_down": "നിങ്ങൾ വളരെ വേഗത്തിൽ സന്ദേശങ്ങൾ അയയ്ക്കുന്നു. ദയവായി ഒരു മിനിറ്റ് കാത്തിരുന്ന ശേഷം നിങ്ങളുടെ സന്ദേശം വീണ്ടും അയയ്ക്കുക.",
+        "daily_limit": "ഇന്നത്തേക്കുള്ള ഈ സേവനത്തിന്റെ പരിധി നിങ്ങൾ എത്തി. ദയവായി നാളെ വീണ്ടും വരിക. നിങ്ങളുടെ ലക്ഷണങ്ങൾ ഗുരുതരമാണെങ്കിൽ, ഉടൻ തന്നെ ഒരു ഡോക്ടറെ കാണുക അല്ലെങ്കിൽ അടുത്തുള്ള ആശുപത്രിയിൽ പോകുക.",
+        "goodbye": "മെഡിക്കൽ അസിസ്റ്റന്റ് ഉപയോഗിച്ചതിന് നന്ദി. നിങ്ങളുടെ സംഭാഷണം അവസാനിച്ചു. സംഭാഷണനു മുഗ്യിക്കാൻ മത്തു സംഭാഷണനു പ്രാരംഭിസ്റ്റുകയും നിങ്ങൾക്ക് ആഗ്രഹിക്കുന്നുവെങ്കിൽ 'bye' എന്ന് ടൈപ്പ് ചെയ്യാം."
+    }
+}
+
+class OnboardingFlow:
+    """
+    The onboarding state machine compiled for one language
+
+    The state is the first profile field missing from the session, so a step
+    is a couple of dict lookups and never touches the database or the LLM.
+    """
+
+    def __init__(self, language_code, texts):
+        self.language_code = language_code
+        self.texts = texts
+        # field -> (numbered options, message sent after the answer)
+        self.transitions = {
+            field: (FIELD_OPTIONS.get(field, {}), texts[NEXT_MESSAGE[field]])
+            for field in ONBOARDING_FIELDS
+        }
+
+    def start(self, profile=None):
+        """Return the first message after language selection"""
+        if profile:
+            return self.texts["welcome_back"].format(name=profile["name"])
+        return self.texts["ask_name"]
+
+    def answer(self, user_data, field, incoming_msg):
+        """
+        Store the answer to a field and return the next message to send
+
+        Args:
+            user_data (dict): The user's session, updated in place
+            field (str): The field being answered, from pending_field()
+            incoming_msg (str): The user's reply
+
+        Returns:
+            str: The next question, or the prompt to describe symptoms once done
+        """
+        options, next_message = self.transitions[field]
+        user_data[field] = options.get(incoming_msg, incoming_msg)
+        return next_message
+
+# language code -> compiled onboarding flow
+_registry = {}
+
+def pending_field(user_data):
+    """Return the profile field the user is being asked for, or None once onboarded"""
+    # Users registered before every field was stored have nothing left to answer either
+    if user_data.get("profile"):
+        return None
+    for field in ONBOARDING_FIELDS:
+        if field not in user_data:
+            return field
+    return None
+
+def build_onboarding_flows():
+    """Compile the onboarding flow of every supported language"""
+    return {language_code: OnboardingFlow(language_code, texts) for language_code, texts in ONBOARDING_TEXTS.items()}
+
+def load_onboarding():
+    """Build the onboarding flows at startup"""
+    global _registry
+    _registry = build_onboarding_flows()
+    logger.info("Onboarding flows built for %s languages", len(_registry))
+
+def get_flow(language_code):
+    """Return the onboarding flow for a language, falling back to English"""
+    return _registry.get(language_code, _registry["en"])
@@ -0,0 +1,82 @@
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Base system prompt, with formatting instructions for options
+SYSTEM_PROMPT = """
+You are a friendly, conversational medical assistant. Follow these guidelines:
+
+1. When presenting options to the user, always format them as a numbered list:
+   Example:
+   Please describe your headache:
+   1️⃣ Sharp pain
+   2️⃣ Dull ache
+   3️⃣ Throbbing sensation
+   4️⃣ Other (please describe)
+   
+   Reply with the number of your choice or type your own response.
+
+2. Once you know their name, always address the user by their name.
+3. After getting their name, ask for their age and gender specifically.
+4. Only after collecting name, age, and gender, ask about their health concerns or symptoms.
+5. When asking about health issues, provide examples as numbered options.
+6. Keep track of their name, age, gender and health history throughout the conversation.
+7. Keep responses short and conversational - use 1-3 sentences where possible.
+8. Speak naturally like a real doctor or nurse would in conversation.
+9. Ask focused follow-up questions about symptoms - one question at a time.
+10. Present options when appropriate (like pain types, severity, etc.) using the numbered format.
+11. Use a warm, empathetic tone while maintaining professionalism.
+12. For common ailments, suggest 2-3 specific over-the-counter medicines available in India from our medicine list, including both brand name and generic name. For example: "For your fever, you might consider taking Dolo 650 (Paracetamol) or Crocin (Paracetamol)."
+13. After suggesting medication, recommend consulting a healthcare professional for proper diagnosis and treatment.
+14. DO NOT repeatedly state that you're an AI assistant or that you're not a replacement for professional medical care. Only mention this at the very end of the conversation.
+15. When discussing serious symptoms, recommend seeing a doctor immediately.
+16. Prioritize clarity and brevity over comprehensiveness.
+
+Remember: Be conversational and human-like. Follow the exact sequence: 1) ask name, 2) ask age and gender, 3) ask about medical conditions with examples.
+"""
+
+# Per-language replacements for the opening of the system prompt. This is a
+# simplified version - in a real app, you would have complete translations
+# of the system prompt for each language
+LANGUAGE_REPLACEMENTS = {
+    "hi": (("You are a friendly", "आप एक मित्रवत"), ("medical assistant", "चिकित्सा सहायक हैं")),
+    "ta": (("You are a friendly", "நீங்கள் ஒரு நட்பான"), ("medical assistant", "மருத்துவ உதவியாளர்")),
+    "te": (("You are a friendly", "మీరు స్నేహపూర్వకమైన"), ("medical assistant", "వైద్య సహాయకులు")),
+    "kn": (("You are a friendly", "ನೀವು ಸ್ನೇಹಪರ"), ("medical assistant", "ವೈದ್ಯಕೀಯ ಸಹಾಯಕ")),
+    "ml": (("You are a friendly", "നിങ്ങൾ ഒരു സൗഹൃദപരമായ"), ("medical assistant", "മെഡിക്കൽ അസിസ്റ്റന്റ് ആണ്"))
+}
+
+# language code -> ready-to-send system prompt
+_registry = {}
+
+def get_system_prompt_for_language(language_code):
+    """Get system prompt translated for the specified language"""
+    prompt = SYSTEM_PROMPT
+    for old, new in LANGUAGE_REPLACEMENTS.get(language_code, ()):
+        prompt = prompt.replace(old, new)
+    return prompt
+
+def build_prompt_registry():
+    """Build the ready-to-send system prompts for every supported language"""
+    return {
+        language_code: get_system_prompt_for_language(language_code)
+        for language_code in ("en",) + tuple(LANGUAGE_REPLACEMENTS)
+    }
+
+def load_prompts():
+    """Build the prompt registry at startup"""
+    global _registry
+    # Swap in a fully built registry so readers never see a partial one
+    _registry = build_prompt_registry()
+    logger.info("Prompt registry built for %s languages", len(_registry))
+
+def get_prompt_prefix(language_code):
+    """
+    Return the system prompt for a language
+
+    The prompt is byte-identical on every turn and is sent before anything
+    that varies per turn (medicines, conversation summary), so provider-side
+    prompt caching can reuse it.
+    """
+    return _registry.get(language_code, _registry["en"])
@@ -0,0 +1,417 @@
+import os
+import time
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Off switch for every limit below
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+
+# Where buckets and token counts live: "memory" (per process), "sqlite"
+# (shared by the workers of one node) or "redis" (shared by every node).
+# Defaults to the session backend, which is shared the same way
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", os.getenv("SESSION_BACKEND", "memory")).lower()
+RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", os.getenv("SESSION_SQLITE_PATH", "sessions.db"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Messages per minute a phone number may send on average, and how many it may send at once
+USER_MESSAGES_PER_MINUTE = float(os.getenv("USER_MESSAGES_PER_MINUTE", "10"))
+USER_MESSAGE_BURST = float(os.getenv("USER_MESSAGE_BURST", "8"))
+# LLM calls per second for the whole service, and the burst; 0 disables the global limit
+GLOBAL_LLM_CALLS_PER_SECOND = float(os.getenv("GLOBAL_LLM_CALLS_PER_SECOND", "20"))
+GLOBAL_LLM_CALL_BURST = float(os.getenv("GLOBAL_LLM_CALL_BURST", "40"))
+# OpenAI tokens (prompt + completion) a phone number may use per UTC day; 0 disables the budget
+USER_DAILY_TOKEN_BUDGET = int(os.getenv("USER_DAILY_TOKEN_BUDGET", "200000"))
+
+# Phone numbers never limited, comma-separated (e.g. staff testing the bot)
+RATE_LIMIT_EXEMPT_NUMBERS = {number.strip() for number in os.getenv("RATE_LIMIT_EXEMPT_NUMBERS", "").split(",")
+                             if number.strip()}
+# Phone numbers whose buckets are tracked in memory, least recently active dropped first
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", "100000"))
+
+# Results of a bucket
+ALLOWED = "allowed"
+# Refused, and the sender has not been told yet
+WARN = "warn"
+# Refused again; answered with silence so that a flood gets one reply
+LIMITED = "limited"
+
+GLOBAL_KEY = "*"
+
+def _today(now):
+    return time.strftime("%Y-%m-%d", time.gmtime(now))
+
+def refill(tokens, updated_at, now, rate, burst):
+    """Tokens in a bucket that held `tokens` at `updated_at`, refilled at `rate` per second"""
+    return min(burst, tokens + max(0.0, now - updated_at) * rate)
+
+class RateLimiter:
+    """
+    Token buckets per phone number and for the whole service, and daily
+    token budgets per phone number
+
+    Every incoming message takes a token from its sender's bucket. Every LLM
+    call takes one from the global bucket and is refused once the sender
+    used their daily budget of OpenAI tokens, counted from `usage`. Exempt
+    numbers are never limited.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._stats_lock = threading.Lock()
+        self._stats = {"messages_allowed": 0, "messages_limited": 0, "warnings": 0, "llm_calls_limited": 0,
+                       "budget_exhausted": 0}
+
+    def _take(self, key, rate, burst, now):
+        """Take a token from a bucket; returns ALLOWED, WARN or LIMITED"""
+        raise NotImplementedError
+
+    def _add_tokens(self, user_id, day, tokens):
+        """Add to a user's token count of a day"""
+        raise NotImplementedError
+
+    def _tokens_used(self, user_id, day):
+        raise NotImplementedError
+
+    def _exempt_until(self, user_id):
+        """Time until which a user is exempt, 0 if not"""
+        raise NotImplementedError
+
+    def set_exempt(self, user_id, until):
+        """Exempt a user from every limit until the given time, or revoke the exemption with 0"""
+        raise NotImplementedError
+
+    def reset(self, user_id):
+        """Refill a user's bucket and forget the tokens they used today"""
+        raise NotImplementedError
+
+    def is_exempt(self, user_id):
+        return user_id in RATE_LIMIT_EXEMPT_NUMBERS or self._exempt_until(user_id) > self.clock()
+
+    def check_message(self, user_id):
+        """
+        Take a token for an incoming message from its sender's bucket
+
+        Returns:
+            str: ALLOWED, WARN for the first refused message, LIMITED for the next ones
+        """
+        if not RATE_LIMIT_ENABLED or self.is_exempt(user_id):
+            return ALLOWED
+        result = self._take(user_id, USER_MESSAGES_PER_MINUTE / 60, USER_MESSAGE_BURST, self.clock())
+        self._count("messages_allowed" if result == ALLOWED else "messages_limited")
+        if result == WARN:
+            self._count("warnings")
+            logger.warning("Rate limiting %s", user_id)
+        return result
+
+    def check_llm_call(self, user_id):
+        """
+        Check the daily budget of a user and take a token from the global bucket
+
+        Returns:
+            str: None if the call may be made, "budget" or "global" otherwise
+        """
+        if not RATE_LIMIT_ENABLED or self.is_exempt(user_id):
+            return None
+        now = self.clock()
+        if USER_DAILY_TOKEN_BUDGET > 0 and self._tokens_used(user_id, _today(now)) >= USER_DAILY_TOKEN_BUDGET:
+            self._count("budget_exhausted")
+            return "budget"
+        if GLOBAL_LLM_CALLS_PER_SECOND > 0:
+            if self._take(GLOBAL_KEY, GLOBAL_LLM_CALLS_PER_SECOND, GLOBAL_LLM_CALL_BURST, now) != ALLOWED:
+                self._count("llm_calls_limited")
+                return "global"
+        return None
+
+    def record_usage(self, user_id, usage):
+        """Count the tokens of an OpenAI response (its `usage` object) against the user's daily budget"""
+        if not RATE_LIMIT_ENABLED or not usage or USER_DAILY_TOKEN_BUDGET <= 0:
+            return
+        tokens = (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+        if tokens:
+            self._add_tokens(user_id, _today(self.clock()), tokens)
+
+    def usage(self, user_id):
+        """Return a user's tokens used today, remaining budget and exemption"""
+        used = self._tokens_used(user_id, _today(self.clock()))
+        return {
+            "tokens_today": used,
+            "budget_left": max(0, USER_DAILY_TOKEN_BUDGET - used) if USER_DAILY_TOKEN_BUDGET > 0 else None,
+            "exempt": self.is_exempt(user_id)
+        }
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+class MemoryRateLimiter(RateLimiter):
+    """Limits kept in this process; with several workers each one enforces them on its own"""
+
+    def __init__(self, max_users=RATE_LIMIT_MAX_USERS, clock=time.time):
+        super().__init__(clock)
+        self.max_users = max_users
+        # key -> [tokens, updated at, warned], least recently used first
+        self._buckets = OrderedDict()
+        # user_id -> [day, tokens used]
+        self._used = OrderedDict()
+        self._exempt = {}
+        self._lock = threading.Lock()
+
+    def _take(self, key, rate, burst, now):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now, False]
+            else:
+                bucket[0] = refill(bucket[0], bucket[1], now, rate, burst)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_users:
+                # A bucket dropped early only makes its user's limit more lenient
+                self._buckets.popitem(last=False)
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                bucket[2] = False
+                return ALLOWED
+            if bucket[2]:
+                return LIMITED
+            bucket[2] = True
+            return WARN
+
+    def _add_tokens(self, user_id, day, tokens):
+        with self._lock:
+            used = self._used.get(user_id)
+            if used is None or used[0] != day:
+                used = self._used[user_id] = [day, 0]
+            used[1] += tokens
+            self._used.move_to_end(user_id)
+            while len(self._used) > self.max_users:
+                self._used.popitem(last=False)
+
+    def _tokens_used(self, user_id, day):
+        with self._lock:
+            used = self._used.get(user_id)
+        return used[1] if used is not None and used[0] == day else 0
+
+    def _exempt_until(self, user_id):
+        return self._exempt.get(user_id, 0)
+
+    def set_exempt(self, user_id, until):
+        with self._lock:
+            if until:
+                self._exempt[user_id] = until
+            else:
+                self._exempt.pop(user_id, None)
+
+    def reset(self, user_id):
+        with self._lock:
+            self._buckets.pop(user_id, None)
+            self._used.pop(user_id, None)
+
+class SQLiteRateLimiter(RateLimiter):
+    """Limits in a local SQLite file, shared by all workers on one node"""
+
+    # Drop idle buckets and old token counts every this many messages
+    SWEEP_INTERVAL = 1000
+
+    def __init__(self, path=RATE_LIMIT_SQLITE_PATH, clock=time.time):
+        super().__init__(clock)
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, warned INTEGER NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_usage ("
+            "user_id TEXT NOT NULL, day TEXT NOT NULL, tokens INTEGER NOT NULL, PRIMARY KEY (user_id, day))"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS rate_exemptions (user_id TEXT PRIMARY KEY, until REAL NOT NULL)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _take(self, key, rate, burst, now):
+        conn = self._connect()
+        # Take the write lock before reading, so two workers can't spend the same token
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at, warned FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, warned = (burst, 0) if row is None else (refill(row[0], row[1], now, rate, burst), row[2])
+            if tokens >= 1:
+                tokens, warned, result = tokens - 1, 0, ALLOWED
+            else:
+                result = LIMITED if warned else WARN
+                warned = 1
+            conn.execute(
+                "INSERT INTO rate_buckets (key, tokens, updated_at, warned) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at, "
+                "warned = excluded.warned",
+                (key, tokens, now, warned)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        with self._stats_lock:
+            self._takes += 1
+            sweep = self._takes % self.SWEEP_INTERVAL == 0
+        if sweep:
+            self.sweep(now)
+        return result
+
+    def sweep(self, now):
+        """Delete buckets idle long enough to be full again, and token counts of past days"""
+        conn = self._connect()
+        # No bucket takes more than an hour to refill with the default limits
+        conn.execute("DELETE FROM rate_buckets WHERE updated_at < ?", (now - 3600,))
+        conn.execute("DELETE FROM token_usage WHERE day < ?", (_today(now),))
+        conn.execute("DELETE FROM rate_exemptions WHERE until < ?", (now,))
+
+    def _add_tokens(self, user_id, day, tokens):
+        self._connect().execute(
+            "INSERT INTO token_usage (user_id, day, tokens) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id, day) DO UPDATE SET tokens = tokens + excluded.tokens",
+            (user_id, day, tokens)
+        )
+
+    def _tokens_used(self, user_id, day):
+        row = self._connect().execute(
+            "SELECT tokens FROM token_usage WHERE user_id = ? AND day = ?", (user_id, day)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _exempt_until(self, user_id):
+        row = self._connect().execute("SELECT until FROM rate_exemptions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def set_exempt(self, user_id, until):
+        conn = self._connect()
+        if until:
+            conn.execute(
+                "INSERT INTO rate_exemptions (user_id, until) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET until = excluded.until",
+                (user_id, until)
+            )
+        else:
+            conn.execute("DELETE FROM rate_exemptions WHERE user_id = ?", (user_id,))
+
+    def reset(self, user_id):
+        conn = self._connect()
+        conn.execute("DELETE FROM rate_buckets WHERE key = ?", (user_id,))
+        conn.execute("DELETE FROM token_usage WHERE user_id = ?", (user_id,))
+
+class RedisRateLimiter(RateLimiter):
+    """
+    Limits in Redis, shared by every worker on every node
+
+    A bucket is a hash updated by a Lua script, so taking a token is one
+    round trip. Buckets expire once they would be full again, and token
+    counts the day after.
+    """
+
+    TAKE_SCRIPT = """
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at', 'warned')
+    local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local tokens, warned = burst, 0
+    if bucket[1] then
+        tokens = math.min(burst, tonumber(bucket[1]) + math.max(0, now - tonumber(bucket[2])) * rate)
+        warned = tonumber(bucket[3])
+    end
+    local result
+    if tokens >= 1 then
+        tokens, warned, result = tokens - 1, 0, 0
+    else
+        if warned == 1 then result = 2 else result = 1 end
+        warned = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', ARGV[3], 'warned', warned)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return result
+    """
+
+    RESULTS = (ALLOWED, WARN, LIMITED)
+
+    def __init__(self, url=REDIS_URL, prefix="rate:", clock=time.time):
+        super().__init__(clock)
+        # Optional dependency, only needed with the redis backend
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._take_script = self.client.register_script(self.TAKE_SCRIPT)
+
+    def _take(self, key, rate, burst, now):
+        result = self._take_script(keys=[f"{self.prefix}bucket:{key}"], args=[rate, burst, repr(now)])
+        return self.RESULTS[int(result)]
+
+    def _usage_key(self, user_id, day):
+        return f"{self.prefix}tokens:{user_id}:{day}"
+
+    def _add_tokens(self, user_id, day, tokens):
+        key = self._usage_key(user_id, day)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.incrby(key, tokens)
+        pipe.expire(key, 2 * 86400)
+        pipe.execute()
+
+    def _tokens_used(self, user_id, day):
+        return int(self.client.get(self._usage_key(user_id, day)) or 0)
+
+    def _exempt_until(self, user_id):
+        return float(self.client.get(f"{self.prefix}exempt:{user_id}") or 0)
+
+    def set_exempt(self, user_id, until):
+        key = f"{self.prefix}exempt:{user_id}"
+        if until:
+            self.client.set(key, repr(until), ex=max(1, int(until - self.clock()) + 1))
+        else:
+            self.client.delete(key)
+
+    def reset(self, user_id):
+        self.client.delete(f"{self.prefix}bucket:{user_id}", self._usage_key(user_id, _today(self.clock())))
+
+def create_rate_limiter():
+    """Create the rate limiter selected by RATE_LIMIT_BACKEND"""
+    if RATE_LIMIT_BACKEND == "redis":
+        return RedisRateLimiter()
+    if RATE_LIMIT_BACKEND == "sqlite":
+        return SQLiteRateLimiter()
+    if RATE_LIMIT_BACKEND != "memory":
+        logger.warning("Unknown RATE_LIMIT_BACKEND '%s', rate limiting in memory", RATE_LIMIT_BACKEND)
+    return MemoryRateLimiter()
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+    """Create and return the process-wide rate limiter"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = create_rate_limiter()
+    return _limiter
+
+def get_rate_limit_stats():
+    """Return the counters of the rate limiter"""
+    return get_rate_limiter().stats()
@@ -0,0 +1,245 @@
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Twilio configuration for outbound messages
+TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
+TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
+TWILIO_WHATSAPP_NUMBER = os.getenv("TWILIO_WHATSAPP_NUMBER")
+# Override the Twilio API host, e.g. to point at a local fake server
+TWILIO_API_BASE_URL = os.getenv("TWILIO_API_BASE_URL")
+
+# Size of the background pool that generates and sends replies
+REPLY_WORKERS = int(os.getenv("REPLY_WORKERS", "8"))
+
+# Seconds to wait for more messages from the same user before replying
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "1.5"))
+
+FALLBACK_MESSAGE = "I'm sorry, I encountered an error. Please try again in a moment."
+
+# Number of recent reply latencies kept for the percentile metrics
+LATENCY_WINDOW = 1000
+
+# Created lazily so that every gunicorn worker builds its own pool after forking
+_executor = None
+_twilio_client = None
+_scheduler = None
+# Reentrant because the scheduler creates the worker pool while holding it
+_lock = threading.RLock()
+_due_changed = threading.Condition(_lock)
+
+# user_id -> pending messages and state of the user's ordered queue
+_mailboxes = {}
+# Heap of (due time, sequence, user_id) for mailboxes waiting for their window
+_due = []
+_sequence = itertools.count()
+
+_stats = {
+    "queue_depth": 0,
+    "submitted": 0,
+    "coalesced": 0,
+    "completed": 0,
+    "failed": 0,
+    "messages_sent": 0,
+    "send_errors": 0
+}
+_latencies = deque(maxlen=LATENCY_WINDOW)
+# Time from the first pending message to the first reply sent for it
+_first_latencies = deque(maxlen=LATENCY_WINDOW)
+
+def get_executor():
+    """Create and return the background reply worker pool"""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=REPLY_WORKERS, thread_name_prefix="reply-worker")
+                logger.info("Reply worker pool started with %d workers", REPLY_WORKERS)
+    return _executor
+
+def get_twilio_client():
+    """Create and return a Twilio REST client"""
+    global _twilio_client
+    if _twilio_client is None:
+        from twilio.rest import Client
+        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+        if TWILIO_API_BASE_URL:
+            client.api.base_url = TWILIO_API_BASE_URL
+        _twilio_client = client
+    return _twilio_client
+
+def send_whatsapp_message(to_number, body):
+    """Send a single WhatsApp message through the Twilio Messages API"""
+    try:
+        get_twilio_client().messages.create(from_=TWILIO_WHATSAPP_NUMBER, to=to_number, body=body)
+        with _lock:
+            _stats["messages_sent"] += 1
+        return True
+    except Exception as e:
+        logger.error("Error sending WhatsApp message to %s: %s", to_number, e)
+        with _lock:
+            _stats["send_errors"] += 1
+        return False
+
+def submit_message(to_number, user_id, handler, message):
+    """
+    Queue an incoming message for ordered, coalesced processing
+
+    Messages from one user are never handled concurrently. Messages that
+    arrive within COALESCE_WINDOW seconds of the first pending one are
+    handed to the handler together, in arrival order.
+
+    Args:
+        to_number (str): The WhatsApp address to reply to (e.g. 'whatsapp:+91...')
+        user_id (str): The key messages are ordered and coalesced by
+        handler (callable): handler(user_id, messages, send) returning the replies
+            to send; it may also deliver replies early by calling send(body)
+        message (str): The text of the incoming message
+    """
+    now = time.monotonic()
+    with _lock:
+        _stats["queue_depth"] += 1
+        _stats["submitted"] += 1
+        mailbox = _mailboxes.get(user_id)
+        if mailbox is None:
+            mailbox = _mailboxes[user_id] = {
+                "to_number": to_number,
+                "handler": handler,
+                "messages": [],
+                "received_at": now,
+                "running": False,
+                "scheduled": False
+            }
+        if not mailbox["messages"]:
+            mailbox["received_at"] = now
+        mailbox["messages"].append(message)
+        mailbox["to_number"] = to_number
+        mailbox["handler"] = handler
+        if not mailbox["running"] and not mailbox["scheduled"]:
+            _schedule(user_id, mailbox)
+
+def _schedule(user_id, mailbox):
+    """Schedule a drain of the mailbox once its coalescing window closes (lock held)"""
+    mailbox["scheduled"] = True
+    _ensure_scheduler()
+    heapq.heappush(_due, (mailbox["received_at"] + COALESCE_WINDOW, next(_sequence), user_id))
+    _due_changed.notify()
+
+def _ensure_scheduler():
+    """Start the thread that hands due mailboxes to the worker pool (lock held)"""
+    global _scheduler
+    if _scheduler is None or not _scheduler.is_alive():
+        _scheduler = threading.Thread(target=_run_scheduler, name="reply-scheduler", daemon=True)
+        _scheduler.start()
+
+def _run_scheduler():
+    """Wait for coalescing windows to close and submit the drains in order"""
+    with _lock:
+        while True:
+            if not _due:
+                _due_changed.wait()
+                continue
+            due, _, user_id = _due[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                _due_changed.wait(delay)
+                continue
+            heapq.heappop(_due)
+            get_executor().submit(_drain, user_id)
+
+def _drain(user_id):
+    """Handle every pending message of a user and send the replies in order"""
+    with _lock:
+        mailbox = _mailboxes[user_id]
+        messages, mailbox["messages"] = mailbox["messages"], []
+        mailbox["scheduled"] = False
+        mailbox["running"] = True
+        _stats["queue_depth"] -= len(messages)
+        _stats["coalesced"] += len(messages) - 1
+        to_number = mailbox["to_number"]
+        handler = mailbox["handler"]
+        received_at = mailbox["received_at"]
+
+    first_sent = []
+
+    def send(body):
+        if not first_sent:
+            first_sent.append(time.monotonic() - received_at)
+        send_whatsapp_message(to_number, body)
+
+    try:
+        replies = handler(user_id, messages, send)
+        failed = False
+    except Exception as e:
+        logger.exception("Error generating reply for %s: %s", to_number, e)
+        replies = [FALLBACK_MESSAGE]
+        failed = True
+
+    for reply in replies:
+        send(reply)
+
+    latency = time.monotonic() - received_at
+    with _lock:
+        _stats["failed" if failed else "completed"] += 1
+        _latencies.append(latency)
+        _first_latencies.extend(first_sent)
+        mailbox["running"] = False
+        if mailbox["messages"]:
+            # More messages arrived while we were busy, they are next in line
+            _schedule(user_id, mailbox)
+        else:
+            del _mailboxes[user_id]
+    logger.debug("Reply to %s delivered in %.1f ms", to_number, latency * 1000)
+
+def _percentile(values, fraction):
+    """Return the given percentile of a sorted list of values"""
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+def get_reply_metrics():
+    """
+    Return queue depth, counters and latency percentiles (seconds)
+
+    `latency_*` measure until the last reply was sent, `ttfm_*` (time to
+    first message) until the first one was, which is what streaming improves.
+    """
+    with _lock:
+        metrics = dict(_stats)
+        latencies = sorted(_latencies)
+        first_latencies = sorted(_first_latencies)
+    metrics["latency_p50"] = _percentile(latencies, 0.50)
+    metrics["latency_p95"] = _percentile(latencies, 0.95)
+    metrics["latency_p99"] = _percentile(latencies, 0.99)
+    metrics["ttfm_p50"] = _percentile(first_latencies, 0.50)
+    metrics["ttfm_p95"] = _percentile(first_latencies, 0.95)
+    metrics["ttfm_p99"] = _percentile(first_latencies, 0.99)
+    return metrics
+
+def shutdown(wait=True):
+    """Stop the worker pool, optionally waiting for queued replies to be sent"""
+    global _executor
+    if wait:
+        # Let pending coalescing windows close so their messages are handled
+        while True:
+            with _lock:
+                if not _mailboxes:
+                    break
+            time.sleep(0.01)
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
@@ -0,0 +1,262 @@
+import os
+import re
+import time
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Opt-in: answer first symptom questions that resemble an earlier one without calling OpenAI
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+# Seconds a reply is served for; medicine advice should not outlive catalog changes by much
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+# Minimum character-trigram Jaccard similarity of two normalized messages to share a reply
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.8"))
+# Shorter normalized messages ("ok", "2") depend too much on context to be cached
+RESPONSE_CACHE_MIN_CHARS = int(os.getenv("RESPONSE_CACHE_MIN_CHARS", "6"))
+
+# Stands for the patient's name in a stored reply
+NAME_PLACEHOLDER = "\x00name\x00"
+
+# Answers to the health issue and surgery questions meaning there are none.
+# Patients who report a condition always get a reply written for them
+NO_CONDITION_ANSWERS = {"none", "no", "nil", "nothing", "na", "n/a", "nahi", "illai", "ledu", "illa"}
+
+# Words that negate a symptom ("headache and no fever"), after normalization.
+# A similar message only shares a reply if these and its numbers match exactly
+NEGATION_WORDS = {
+    "no", "not", "never", "without", "dont", "don", "doesnt", "doesn", "didnt", "didn", "isnt", "isn",
+    "cannot", "cant", "nahi", "nahin", "nhi", "mat", "bina", "illai", "illa", "ledu", "kadu", "alla",
+    "नहीं", "नही", "न", "ना", "मत", "बिना", "இல்லை", "இல்லாமல்", "లేదు", "లేకుండా", "కాదు",
+    "ಇಲ್ಲ", "ಇಲ್ಲದೆ", "ಅಲ್ಲ", "ഇല്ല", "ഇല്ലാതെ", "അല്ല"
+}
+# Negations also written as a verb suffix in the Dravidian languages ("வரவில்லை")
+NEGATION_SUFFIXES = ("இல்லை", "లేదు", "ಇಲ್ಲ", "ഇല്ല")
+
+# Upper bounds of the age bands replies are shared within
+AGE_BANDS = ((12, "child"), (17, "teen"), (39, "adult"), (59, "middle"), (200, "senior"))
+
+def normalize_message(message):
+    """
+    Lowercase a message and reduce it to words separated by single spaces
+
+    Letters, combining marks (vowel signs of Indic scripts) and digits are
+    kept; punctuation, emoji and repeated whitespace are not.
+    """
+    characters = []
+    for character in unicodedata.normalize("NFC", message.lower()):
+        characters.append(character if unicodedata.category(character)[0] in "LMN" else " ")
+    return " ".join("".join(characters).split())
+
+def key_tokens(text):
+    """The numbers and negations of a normalized message, in order; a dose or a "no" changes the reply"""
+    return tuple(
+        token for token in text.split()
+        if token in NEGATION_WORDS or token.endswith(NEGATION_SUFFIXES) or any(character.isdigit() for character in token)
+    )
+
+def trigrams(text):
+    """Character trigrams of a normalized message, padded at the ends"""
+    padded = f"  {text} "
+    return frozenset(padded[index:index + 3] for index in range(len(padded) - 2))
+
+def age_band(age):
+    """Coarse age group of a patient, or None if the age is not a number"""
+    try:
+        age = int(str(age).strip())
+    except (TypeError, ValueError):
+        return None
+    for upper, band in AGE_BANDS:
+        if age <= upper:
+            return band
+    return None
+
+def profile_bucket(user_data):
+    """
+    The part of a patient's profile a cached reply must match, or None if
+    their replies must not be cached
+
+    Patients who reported health issues or surgeries are never bucketed.
+    """
+    for field in ("previous_health_issues", "surgeries"):
+        if str(user_data.get(field) or "").strip().lower() not in NO_CONDITION_ANSWERS:
+            return None
+    band = age_band(user_data.get("age"))
+    if band is None:
+        return None
+    return (user_data.get("language", "en"), band, str(user_data.get("gender", "")).strip().lower())
+
+def is_first_turn(user_data):
+    """Whether the next LLM reply is the first of a conversation started with onboarding"""
+    # Sessions restored from the database continue an older conversation and have no flag
+    return user_data.get("conversation_started") is False and not user_data.get("context_summary")
+
+class ResponseCache:
+    """
+    In-process cache of first replies to symptom questions
+
+    Replies are grouped by profile bucket (language, age band, gender). A
+    message is answered from the bucket when its normalized form was seen
+    before, or when the character trigrams of a stored message are similar
+    enough and both have the same numbers and negation words; a trigram
+    index limits the comparison to messages that share trigrams with it. The patient's name is replaced by a placeholder when a
+    reply is stored and by the new patient's name when it is served. Entries
+    are evicted least recently used first and expire after `ttl` seconds.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL,
+                 similarity=RESPONSE_CACHE_SIMILARITY, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.clock = clock
+        # (bucket, normalized message) -> [expires at, reply template, trigrams, LLM seconds], LRU first
+        self._entries = OrderedDict()
+        # (bucket, trigram) -> keys of the entries containing it
+        self._index = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "lookups": 0,
+            "hits": 0,
+            "similar_hits": 0,
+            "stores": 0,
+            "evictions": 0,
+            "latency_saved_seconds": 0.0
+        }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        bucket = key[0]
+        for gram in entry[2]:
+            keys = self._index.get((bucket, gram))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[(bucket, gram)]
+
+    def _find(self, bucket, normalized):
+        key = (bucket, normalized)
+        if key in self._entries:
+            return key, False
+        grams = trigrams(normalized)
+        # Entries sharing at least one trigram, with the number they share
+        shared = {}
+        for gram in grams:
+            for candidate in self._index.get((bucket, gram), ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        required = key_tokens(normalized)
+        best, best_score = None, self.similarity
+        for candidate, common in shared.items():
+            score = common / (len(grams) + len(self._entries[candidate][2]) - common)
+            # "fever for 2 days" is not "fever for 20 days", however similar
+            if score >= best_score and key_tokens(candidate[1]) == required:
+                best, best_score = candidate, score
+        return best, True
+
+    def lookup(self, user_data, message):
+        """
+        Return the cached reply for a patient's first symptom message, personalized, or None
+
+        Args:
+            user_data (dict): The patient's session, for the profile bucket and name
+            message (str): The incoming message
+        """
+        bucket = profile_bucket(user_data)
+        normalized = normalize_message(message)
+        if bucket is None or len(normalized) < RESPONSE_CACHE_MIN_CHARS:
+            return None
+        now = self.clock()
+        with self._lock:
+            self._stats["lookups"] += 1
+            key, similar = self._find(bucket, normalized)
+            if key is None:
+                return None
+            entry = self._entries[key]
+            if entry[0] < now:
+                self._remove(key)
+                self._stats["evictions"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            if similar:
+                self._stats["similar_hits"] += 1
+            self._stats["latency_saved_seconds"] += entry[3]
+            template = entry[1]
+        return template.replace(NAME_PLACEHOLDER, str(user_data.get("name") or "").strip())
+
+    def store(self, user_data, message, reply, latency):
+        """
+        Remember the reply the model gave to a patient's first symptom message
+
+        Args:
+            user_data (dict): The patient's session
+            message (str): The message that was answered
+            reply (str): The model's reply
+            latency (float): Seconds the model took, credited on every hit
+
+        Returns:
+            bool: Whether the reply was stored
+        """
+        bucket = profile_bucket(user_data)
+        normalized = normalize_message(message)
+        if bucket is None or len(normalized) < RESPONSE_CACHE_MIN_CHARS:
+            return False
+        name = str(user_data.get("name") or "").strip()
+        if len(name) < 2:
+            return False
+        template, count = re.subn(rf"(?<!\w){re.escape(name)}(?!\w)", NAME_PLACEHOLDER, reply)
+        if not count:
+            # The prompt asks the model to address the patient by name; a reply
+            # without it may spell the name in another script, which would be
+            # served to other patients
+            return False
+        key = (bucket, normalized)
+        grams = trigrams(normalized)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = [self.clock() + self.ttl, template, grams, latency]
+            for gram in grams:
+                self._index.setdefault((bucket, gram), set()).add(key)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def stats(self):
+        """Return lookup/hit/eviction counters, the hit rate and the seconds of LLM calls saved"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        return stats
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """Create and return the process-wide response cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+def get_response_cache_stats():
+    """Return the counters of the response cache"""
+    return get_response_cache().stats()
@@ -0,0 +1,492 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from metrics import span
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Where sessions live: "memory" (per process), "sqlite" (shared by the
+# workers of one node) or "redis" (shared by every node)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "sessions.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Attempts to merge a session update that raced with another worker
+SESSION_CAS_RETRIES = 5
+
+# Limits for the in-process session store
+SESSION_MAX_USERS = int(os.getenv("SESSION_MAX_USERS", "10000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Rough fixed overhead of a session dict and its bookkeeping, in bytes
+SESSION_OVERHEAD_BYTES = 1024
+
+def estimate_session_size(data):
+    """Estimate the memory held by a session from the size of its text"""
+    size = SESSION_OVERHEAD_BYTES
+    for message in data.get("history", ()):
+        size += 100 + len(message.get("content") or "")
+    for key in ("name", "medical_history", "previous_health_issues", "surgeries"):
+        value = data.get(key)
+        if isinstance(value, str):
+            size += len(value)
+    return size
+
+def dump_session(data):
+    """Serialize a session, leaving out private bookkeeping keys"""
+    with span("serialize"):
+        return json.dumps({key: value for key, value in data.items() if not key.startswith("_")})
+
+def load_session(raw, version):
+    """Deserialize a session and remember the version and history length it was read at"""
+    data = json.loads(raw)
+    data["_version"] = version
+    data["_history_base"] = len(data.get("history", ()))
+    return data
+
+# Offsets into the history, which can't be copied from our session as they are
+HISTORY_OFFSET_KEYS = ("persisted_upto", "summarized_upto", "summarized_tokens", "context_summary")
+
+def merge_sessions(latest, ours):
+    """
+    Rebase our changes onto a session that another worker updated meanwhile
+
+    Messages we appended since reading the session are added after the latest
+    history, and our profile fields win over the stored ones. Offsets into the
+    history are taken from the latest session and rebased onto the merged one:
+    the messages we persisted count as persisted at their new position, and
+    the rolling summary is the latest one, ours covering messages that now
+    come after the other worker's.
+    """
+    merged = dict(latest)
+    base = ours.get("_history_base", 0)
+    history = ours.get("history", [])
+    new_messages = history[base:] if len(history) >= base else history
+    for key, value in ours.items():
+        if key != "history" and key not in HISTORY_OFFSET_KEYS and not key.startswith("_"):
+            merged[key] = value
+    latest_history = latest.get("history", [])
+    merged["history"] = list(latest_history) + list(new_messages)
+
+    persisted = latest.get("persisted_upto", 0)
+    ours_persisted = ours.get("persisted_upto", 0) - (len(history) - len(new_messages))
+    # Workers persist their messages before saving the session, so the latest
+    # history is only partly persisted for users without a database row yet,
+    # and then none of ours were persisted either
+    if ours_persisted > 0 and persisted >= len(latest_history):
+        persisted = len(latest_history) + min(ours_persisted, len(new_messages))
+    merged["persisted_upto"] = persisted
+    return merged
+
+class SessionStore:
+    """
+    In-process session store with LRU, idle-TTL and memory-cap eviction
+
+    Sessions are handed out by reference, so callers mutate them in place as
+    they did with the plain dict. Sizes are re-estimated whenever a session is
+    accessed, which keeps the memory cap approximate but cheap. Evicted
+    sessions are passed to `on_evict(user_id, data)` outside the store lock so
+    they can be written back to the database.
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX_USERS, idle_ttl=SESSION_IDLE_TTL,
+                 max_bytes=SESSION_MAX_BYTES, on_evict=None, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.clock = clock
+        # user_id -> [data, last_access, size], least recently used first
+        self._sessions = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "conflicts": 0,
+                       "evictions_lru": 0, "evictions_ttl": 0, "evictions_memory": 0}
+
+    def get(self, user_id):
+        """Return the session for a user, or None if it is missing or expired"""
+        evicted = []
+        with self._lock:
+            now = self.clock()
+            entry = self._sessions.get(user_id)
+            if entry is not None and now - entry[1] > self.idle_ttl:
+                self._remove(user_id, "ttl", evicted)
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+            else:
+                self._stats["hits"] += 1
+                entry[1] = now
+                self._resize(entry)
+                self._sessions.move_to_end(user_id)
+            self._expire(now, evicted)
+            self._enforce_limits(evicted)
+        self._write_back(evicted)
+        return entry[0] if entry is not None else None
+
+    def set(self, user_id, data):
+        """Store (or replace) the session for a user"""
+        evicted = []
+        with self._lock:
+            now = self.clock()
+            entry = self._sessions.pop(user_id, None)
+            if entry is not None:
+                self._total_bytes -= entry[2]
+            entry = [data, now, 0]
+            self._sessions[user_id] = entry
+            self._resize(entry)
+            self._expire(now, evicted)
+            self._enforce_limits(evicted)
+        self._write_back(evicted)
+        return data
+
+    def save(self, user_id, data):
+        """Store a session after a message was handled"""
+        with self._lock:
+            entry = self._sessions.get(user_id)
+            if entry is not None and entry[0] is data:
+                # Sessions are shared by reference, the changes are already here
+                self._resize(entry)
+                return data
+            if entry is not None:
+                # Another request created the session while we were working on ours
+                self._stats["conflicts"] += 1
+                data = merge_sessions(entry[0], data)
+        return self.set(user_id, data)
+
+    def delete(self, user_id):
+        """Drop a session without writing it back"""
+        with self._lock:
+            entry = self._sessions.pop(user_id, None)
+            if entry is not None:
+                self._total_bytes -= entry[2]
+
+    def stats(self):
+        """Return hit/miss/eviction counters and the current size of the store"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sessions"] = len(self._sessions)
+            stats["bytes"] = self._total_bytes
+        return stats
+
+    def __contains__(self, user_id):
+        with self._lock:
+            return user_id in self._sessions
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def __getitem__(self, user_id):
+        data = self.get(user_id)
+        if data is None:
+            raise KeyError(user_id)
+        return data
+
+    def __setitem__(self, user_id, data):
+        self.set(user_id, data)
+
+    def _resize(self, entry):
+        size = estimate_session_size(entry[0])
+        self._total_bytes += size - entry[2]
+        entry[2] = size
+
+    def _remove(self, user_id, reason, evicted):
+        data, _, size = self._sessions.pop(user_id)
+        self._total_bytes -= size
+        self._stats[f"evictions_{reason}"] += 1
+        evicted.append((user_id, data))
+
+    def _expire(self, now, evicted):
+        # Entries are ordered by last access, so expired ones sit at the front
+        while self._sessions:
+            user_id, entry = next(iter(self._sessions.items()))
+            if now - entry[1] <= self.idle_ttl:
+                break
+            self._remove(user_id, "ttl", evicted)
+
+    def _enforce_limits(self, evicted):
+        while len(self._sessions) > self.max_sessions:
+            self._remove(next(iter(self._sessions)), "lru", evicted)
+        # Always keep the most recently used session, however large it is
+        while self._total_bytes > self.max_bytes and len(self._sessions) > 1:
+            self._remove(next(iter(self._sessions)), "memory", evicted)
+
+    def _write_back(self, evicted):
+        if self.on_evict is None:
+            return
+        for user_id, data in evicted:
+            try:
+                self.on_evict(user_id, data)
+            except Exception as e:
+                logger.error("Error writing back evicted session for %s: %s", user_id, e)
+
+class SharedSessionStore:
+    """
+    Base for session stores that live outside the process
+
+    Sessions are handed out as copies that carry the version they were read
+    at. save() only writes if the stored version is still the same, otherwise
+    it merges with the latest copy and tries again, so concurrent messages
+    from one phone number don't clobber each other.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "conflicts": 0}
+
+    def get(self, user_id):
+        raise NotImplementedError
+
+    def set(self, user_id, data):
+        raise NotImplementedError
+
+    def compare_and_set(self, user_id, data, expected_version):
+        raise NotImplementedError
+
+    def save(self, user_id, data):
+        """Store a session after a message was handled, merging concurrent updates"""
+        for _ in range(SESSION_CAS_RETRIES):
+            version = data.get("_version", 0)
+            if self.compare_and_set(user_id, data, version):
+                data["_version"] = version + 1
+                data["_history_base"] = len(data.get("history", ()))
+                self._after_write()
+                return data
+            self._count("conflicts")
+            latest = self.get(user_id)
+            if latest is None:
+                data["_version"] = 0
+                continue
+            data = merge_sessions(latest, data)
+        logger.warning("Giving up on merging session updates for %s, overwriting", user_id)
+        return self.set(user_id, data)
+
+    def stats(self):
+        """Return hit/miss/conflict counters"""
+        with self._lock:
+            return dict(self._stats)
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def __getitem__(self, user_id):
+        data = self.get(user_id)
+        if data is None:
+            raise KeyError(user_id)
+        return data
+
+    def __setitem__(self, user_id, data):
+        self.set(user_id, data)
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _after_write(self):
+        pass
+
+class SQLiteSessionStore(SharedSessionStore):
+    """
+    Session store in a local SQLite file, shared by all workers on one node
+
+    Sessions idle for longer than the TTL are swept and written back.
+    """
+
+    # Sweep expired sessions every this many writes
+    SWEEP_INTERVAL = 500
+
+    def __init__(self, path=SESSION_SQLITE_PATH, idle_ttl=SESSION_IDLE_TTL, on_evict=None, clock=time.time):
+        super().__init__()
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.on_evict = on_evict
+        self.clock = clock
+        self._local = threading.local()
+        self._writes = 0
+        self._stats["evictions_ttl"] = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "user_id TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                "version INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id):
+        """Return a copy of the session for a user, or None if missing or expired"""
+        row = self._connect().execute(
+            "SELECT data, version, updated_at FROM sessions WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None or self.clock() - row[2] > self.idle_ttl:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return load_session(row[0], row[1])
+
+    def set(self, user_id, data):
+        """Unconditionally store the session for a user"""
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO sessions (user_id, data, version, updated_at) VALUES (?, ?, 1, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, "
+            "version = sessions.version + 1, updated_at = excluded.updated_at",
+            (user_id, dump_session(data), self.clock())
+        )
+        version = conn.execute("SELECT version FROM sessions WHERE user_id = ?", (user_id,)).fetchone()[0]
+        data["_version"] = version
+        data["_history_base"] = len(data.get("history", ()))
+        self._after_write()
+        return data
+
+    def compare_and_set(self, user_id, data, expected_version):
+        """Write the session only if it is still at `expected_version` (0 = absent)"""
+        conn = self._connect()
+        if expected_version:
+            cursor = conn.execute(
+                "UPDATE sessions SET data = ?, version = version + 1, updated_at = ? "
+                "WHERE user_id = ? AND version = ?",
+                (dump_session(data), self.clock(), user_id, expected_version)
+            )
+        else:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO sessions (user_id, data, version, updated_at) VALUES (?, ?, 1, ?)",
+                (user_id, dump_session(data), self.clock())
+            )
+        return cursor.rowcount == 1
+
+    def delete(self, user_id):
+        """Drop a session without writing it back"""
+        self._connect().execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def stats(self):
+        """Return hit/miss/conflict/eviction counters and the number of stored sessions"""
+        stats = super().stats()
+        stats["sessions"] = self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return stats
+
+    def _after_write(self):
+        with self._lock:
+            self._writes += 1
+            sweep = self._writes % self.SWEEP_INTERVAL == 0
+        if sweep:
+            self.sweep()
+
+    def sweep(self):
+        """Remove sessions idle for longer than the TTL, writing them back first"""
+        conn = self._connect()
+        cutoff = self.clock() - self.idle_ttl
+        rows = conn.execute(
+            "SELECT user_id, data, version FROM sessions WHERE updated_at < ?", (cutoff,)
+        ).fetchall()
+        for user_id, raw, version in rows:
+            # Only drop the row if nobody touched it since we read it
+            cursor = conn.execute(
+                "DELETE FROM sessions WHERE user_id = ? AND version = ?", (user_id, version)
+            )
+            if cursor.rowcount != 1:
+                continue
+            self._count("evictions_ttl")
+            if self.on_evict is not None:
+                try:
+                    self.on_evict(user_id, load_session(raw, version))
+                except Exception as e:
+                    logger.error("Error writing back evicted session for %s: %s", user_id, e)
+
+class RedisSessionStore(SharedSessionStore):
+    """
+    Session store in Redis, shared by every worker on every node
+
+    Sessions are hashes holding the JSON data and a version number, updated
+    through a Lua compare-and-set. Idle sessions expire through Redis TTLs and
+    memory is capped by the server's maxmemory policy, so expired sessions are
+    not written back; registered users' history is already persisted on every
+    LLM turn.
+    """
+
+    CAS_SCRIPT = """
+    local current = redis.call('HGET', KEYS[1], 'version')
+    if (current or '0') ~= ARGV[1] then
+        return 0
+    end
+    redis.call('HSET', KEYS[1], 'data', ARGV[2], 'version', tonumber(ARGV[1]) + 1)
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return 1
+    """
+
+    def __init__(self, url=REDIS_URL, idle_ttl=SESSION_IDLE_TTL, prefix="session:"):
+        super().__init__()
+        # Optional dependency, only needed when SESSION_BACKEND=redis
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.idle_ttl = int(idle_ttl)
+        self.prefix = prefix
+        self._cas = self.client.register_script(self.CAS_SCRIPT)
+
+    def _key(self, user_id):
+        return f"{self.prefix}{user_id}"
+
+    def get(self, user_id):
+        """Return a copy of the session for a user and refresh its idle TTL"""
+        key = self._key(user_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hmget(key, "data", "version")
+        pipe.expire(key, self.idle_ttl)
+        (raw, version), _ = pipe.execute()
+        if raw is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return load_session(raw, int(version))
+
+    def set(self, user_id, data):
+        """Unconditionally store the session for a user"""
+        key = self._key(user_id)
+        pipe = self.client.pipeline()
+        pipe.hset(key, "data", dump_session(data))
+        pipe.hincrby(key, "version", 1)
+        pipe.expire(key, self.idle_ttl)
+        _, version, _ = pipe.execute()
+        data["_version"] = version
+        data["_history_base"] = len(data.get("history", ()))
+        return data
+
+    def compare_and_set(self, user_id, data, expected_version):
+        """Write the session only if it is still at `expected_version` (0 = absent)"""
+        result = self._cas(keys=[self._key(user_id)], args=[str(expected_version), dump_session(data), self.idle_ttl])
+        return result == 1
+
+    def delete(self, user_id):
+        """Drop a session"""
+        self.client.delete(self._key(user_id))
+
+def create_session_store(on_evict=None):
+    """Create the session store selected by SESSION_BACKEND"""
+    if SESSION_BACKEND == "redis":
+        logger.info("Using Redis session store")
+        return RedisSessionStore()
+    if SESSION_BACKEND == "sqlite":
+        logger.info("Using SQLite session store at %s", SESSION_SQLITE_PATH)
+        return SQLiteSessionStore(on_evict=on_evict)
+    if SESSION_BACKEND != "memory":
+        logger.warning("Unknown SESSION_BACKEND '%s', using in-memory sessions", SESSION_BACKEND)
+    return SessionStore(on_evict=on_evict)
@@ -1,9 +1,17 @@
 import os
+import sys
 import json
-import requests
+import time
 import logging
+import argparse
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from database import get_user
+from context_window import estimate_tokens
+from database import DatabaseUnavailableError, get_user, iter_messages, get_recent_messages, get_users_page, save_summary
+from llm_client import chat_completion
+from summary_cache import get_summary_cache, hash_parameters, extend_history_hash, summary_key
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
@@ -19,7 +27,54 @@ if not OPENAI_API_KEY:
     logger.error("OPENAI_API_KEY not found in environment variables")
     raise ValueError("OPENAI_API_KEY environment variable is required")
 
-OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
+SUMMARY_MODEL = "gpt-4o"
+SUMMARY_MAX_TOKENS = 1000
+SUMMARY_TEMPERATURE = 0.3  # Lower temperature for more focused, consistent output
+
+# A summary is extended with new messages at most this many times before it
+# is redone from the full transcript, so errors do not accumulate
+SUMMARY_MAX_INCREMENTS = int(os.getenv("SUMMARY_MAX_INCREMENTS", "10"))
+
+# Prices in USD per million tokens, for the cost report of batch runs
+SUMMARY_PRICE_INPUT = float(os.getenv("SUMMARY_PRICE_INPUT", "2.5"))
+SUMMARY_PRICE_OUTPUT = float(os.getenv("SUMMARY_PRICE_OUTPUT", "10"))
+
+SUMMARY_SYSTEM_PROMPT = """
+        You are a medical assistant tasked with summarizing a patient's medical history.
+        Please provide a concise, well-structured summary of the patient's medical history,
+        highlighting key information such as:
+        
+        1. Patient's basic information (name, age, gender)
+        2. Chronic conditions or ongoing health issues
+        3. Past medical procedures or surgeries
+        4. Current medications
+        5. Allergies or adverse reactions
+        6. Family history of significant conditions
+        
+        Format your response in a clear, professional manner that would be useful for a healthcare provider.
+        """
+
+SUMMARY_REQUEST = "Please summarize the following medical history:\n\n{transcript}"
+
+SUMMARY_UPDATE_REQUEST = """Here is the summary of the patient's medical history so far:
+
+{summary}
+
+Please update it with the following new messages, keeping the same structure:
+
+{transcript}"""
+
+# Everything besides the transcript that a summary depends on; changing any
+# of it invalidates the cached summaries
+SUMMARY_PARAMETERS = hash_parameters({
+    "system_prompt": SUMMARY_SYSTEM_PROMPT,
+    "request": SUMMARY_REQUEST,
+    "update_request": SUMMARY_UPDATE_REQUEST,
+    "model": SUMMARY_MODEL,
+    "temperature": SUMMARY_TEMPERATURE,
+    "max_tokens": SUMMARY_MAX_TOKENS,
+    "max_increments": SUMMARY_MAX_INCREMENTS
+})
 
 def summarize_medical_history(phone_number):
     """
@@ -41,69 +96,65 @@ def summarize_medical_history(phone_number):
         }
     
     # Get user from database
-    user = get_user(phone_number)
+    try:
+        user = get_user(phone_number)
+    except DatabaseUnavailableError:
+        return {
+            "success": False,
+            "error": "Database unavailable",
+            "summary": None
+        }
     
     if not user:
-        logger.error(f"User with phone number {phone_number} not found")
+        logger.error("User with phone number %s not found", phone_number)
         return {
             "success": False,
             "error": "User not found",
             "summary": None
         }
     
-    # Extract medical history
-    medical_history = user.get("medical_history", "")
+    result = summarize_patient(phone_number)
     
-    if not medical_history:
-        logger.info(f"No medical history found for user {phone_number}")
-        return {
-            "success": True,
-            "error": None,
-            "summary": "No medical history available for this patient."
-        }
+    if result["success"] and result["summary"] is None:
+        logger.info("No medical history found for user %s", phone_number)
+        result["summary"] = "No medical history available for this patient."
+    return result
+
+def summarize_transcript(medical_history, previous_summary=None):
+    """
+    Summarize a conversation transcript using OpenAI LLM
     
-    try:
-        # Prepare the prompt for the LLM
-        system_prompt = """
-        You are a medical assistant tasked with summarizing a patient's medical history.
-        Please provide a concise, well-structured summary of the patient's medical history,
-        highlighting key information such as:
-        
-        1. Patient's basic information (name, age, gender)
-        2. Chronic conditions or ongoing health issues
-        3. Past medical procedures or surgeries
-        4. Current medications
-        5. Allergies or adverse reactions
-        6. Family history of significant conditions
+    Args:
+        medical_history (str): The transcript, one "role: content" line per message
+        previous_summary (str): Summary of the messages before the transcript, to be updated
         
-        Format your response in a clear, professional manner that would be useful for a healthcare provider.
-        """
+    Returns:
+        dict: The summary and status, plus the token usage of the call
+    """
+    try:
+        if previous_summary:
+            request = SUMMARY_UPDATE_REQUEST.format(summary=previous_summary, transcript=medical_history)
+        else:
+            request = SUMMARY_REQUEST.format(transcript=medical_history)
         
         # Prepare the messages for the API
         messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Please summarize the following medical history:\n\n{medical_history}"}
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": request}
         ]
         
         # Call OpenAI API
-        headers = {
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
         payload = {
-            "model": "gpt-4o",
+            "model": SUMMARY_MODEL,
             "messages": messages,
-            "temperature": 0.3,  # Lower temperature for more focused, consistent output
-            "max_tokens": 1000
+            "temperature": SUMMARY_TEMPERATURE,
+            "max_tokens": SUMMARY_MAX_TOKENS
         }
         
-        logger.info(f"Sending request to OpenAI API for summarizing medical history of {phone_number}")
-        
-        response = requests.post(OPENAI_API_URL, headers=headers, json=payload, timeout=30)
+        response = chat_completion(payload)
         
         if response.status_code != 200:
-            logger.error(f"OpenAI API error: {response.status_code} - {response.text}")
+            logger.error("OpenAI API error: %s - %s", response.status_code, response.text)
             return {
                 "success": False,
                 "error": f"API error: {response.status_code}",
@@ -117,19 +168,337 @@ def summarize_medical_history(phone_number):
         return {
             "success": True,
             "error": None,
-            "summary": summary
+            "summary": summary,
+            "usage": response_json.get("usage") or {}
         }
         
     except Exception as e:
-        logger.error(f"Error summarizing medical history: {str(e)}")
+        logger.error("Error summarizing medical history: %s", e)
         return {
             "success": False,
             "error": str(e),
             "summary": None
         }
 
-def main():
+def build_transcript(messages):
+    """Format stored messages as the transcript sent for summarization"""
+    return "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+
+def summarize_patient(phone_number, before_call=None, after_call=None, cache=None):
+    """
+    Summarize a patient's transcript, reusing cached summaries
+
+    The patient's latest cached summary is looked up first and only messages
+    stored after it are read. Without new messages it is returned as is. A
+    transcript whose hash is already cached (for any patient) is not sent
+    again. Otherwise the new messages are summarized on top of the cached
+    summary, or the full transcript is once SUMMARY_MAX_INCREMENTS updates
+    have been chained.
+
+    Args:
+        phone_number (str): The patient's phone number
+        before_call (callable): Called with the estimated tokens before an OpenAI call;
+            returning False defers the summary
+        after_call (callable): Called with the estimated tokens and the usage after the call
+        cache (SummaryCache): The cache to use, the process-wide one by default
+
+    Returns:
+        dict: success, error and summary (None without messages), the usage, the last
+            message seq covered and whether the summary was cached, incremental or deferred
+    """
+    cache = cache or get_summary_cache()
+    latest = cache.latest(phone_number, SUMMARY_PARAMETERS)
+    after_seq = latest["last_seq"] if latest else 0
+    result = {
+        "success": True,
+        "error": None,
+        "summary": latest["summary"] if latest else None,
+        "usage": {},
+        "last_seq": after_seq,
+        "cached": latest is not None,
+        "incremental": False,
+        "deferred": False
+    }
+    try:
+        new_messages = list(iter_messages(phone_number, after_seq=after_seq))
+    except DatabaseUnavailableError:
+        result.update(success=False, error="Database unavailable", summary=None, cached=False)
+        return result
+    if not new_messages:
+        if latest:
+            cache.count("hits")
+        return result
+
+    last_seq = new_messages[-1]["seq"]
+    history_hash = extend_history_hash(latest["history_hash"] if latest else None, new_messages)
+    key = summary_key(SUMMARY_PARAMETERS, history_hash)
+    result["last_seq"] = last_seq
+    entry = cache.get(key)
+    if entry:
+        cache.count("hits")
+        cache.put(key, phone_number, SUMMARY_PARAMETERS, last_seq, history_hash, entry["increments"], entry["summary"])
+        result["summary"] = entry["summary"]
+        return result
+    cache.count("misses")
+
+    if latest and latest["increments"] < SUMMARY_MAX_INCREMENTS:
+        previous_summary, increments = latest["summary"], latest["increments"] + 1
+        transcript = build_transcript(new_messages)
+    else:
+        previous_summary, increments = None, 0
+        if latest:
+            try:
+                messages = [message for message in iter_messages(phone_number) if message["seq"] <= last_seq]
+            except DatabaseUnavailableError:
+                result.update(success=False, error="Database unavailable", summary=None, last_seq=after_seq, cached=False)
+                return result
+        else:
+            messages = new_messages
+        transcript = build_transcript(messages)
+
+    estimate = estimate_tokens(transcript) + estimate_tokens(previous_summary or "") + SUMMARY_MAX_TOKENS
+    if before_call and not before_call(estimate):
+        result.update(summary=None, last_seq=after_seq, cached=False, deferred=True)
+        return result
+
+    logger.info("Sending request to OpenAI API for summarizing medical history of %s%s",
+                phone_number, " (update)" if previous_summary else "")
+    response = summarize_transcript(transcript, previous_summary)
+    if after_call:
+        after_call(estimate, response.get("usage") or {})
+    result.update(success=response["success"], error=response["error"], summary=response["summary"],
+                  usage=response.get("usage") or {}, cached=False, incremental=previous_summary is not None)
+    if response["success"]:
+        cache.count("incremental" if previous_summary else "full")
+        cache.put(key, phone_number, SUMMARY_PARAMETERS, last_seq, history_hash, increments, response["summary"])
+    return result
+
+class RateLimiter:
+    """Space out calls so that at most `rate` start per second across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        time.sleep(start - now)
+
+class BatchSummarizer:
+    """
+    Summarize every patient, resumably, within a rate limit and token budget
+
+    Users are read in pages ordered by phone number and summarized by a
+    thread pool. The state file records, per user, the last message `seq`
+    that was summarized (users without new messages are skipped) and the
+    last page that was completed (an interrupted run resumes after it).
+    Summaries go through the summary cache, so a patient with a few new
+    messages costs an update of their previous summary, not a full one.
+    """
+
+    def __init__(self, output, state_path, workers=8, rate=5.0, token_budget=0, page_size=200, cache=None):
+        self.output = output
+        self.cache = cache
+        self.state_path = state_path
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.token_budget = token_budget
+        self.page_size = page_size
+        self.state = self._load_state()
+        self.lock = threading.Lock()
+        self.last_saved = time.monotonic()
+        self.reserved_tokens = 0
+        self.budget_exhausted = False
+        self.stats = {
+            "users": 0,
+            "summarized": 0,
+            "skipped": 0,
+            "failed": 0,
+            "deferred": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0
+        }
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+        return {"cursor": None, "summarized": {}}
+
+    def _save_state(self):
+        """Write the state file atomically so a crash never leaves it half written"""
+        with self.lock:
+            data = json.dumps(self.state)
+            self.last_saved = time.monotonic()
+        temp_path = f"{self.state_path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(data)
+        os.replace(temp_path, self.state_path)
+
+    def _write(self, record):
+        if self.output == "table":
+            return save_summary(record)
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            with open(self.output, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        return True
+
+    def _reserve(self, tokens):
+        """Reserve budget for a call; False once the token budget would be exceeded"""
+        with self.lock:
+            if self.token_budget:
+                spent = self.stats["prompt_tokens"] + self.stats["completion_tokens"]
+                if spent + self.reserved_tokens + tokens > self.token_budget:
+                    self.budget_exhausted = True
+                    return False
+            self.reserved_tokens += tokens
+            return True
+
+    def _before_call(self, tokens):
+        """Reserve budget and wait for the rate limit before an OpenAI call"""
+        if not self._reserve(tokens):
+            return False
+        self.limiter.wait()
+        return True
+
+    def _after_call(self, tokens, usage):
+        """Release a reservation and count the tokens actually used"""
+        with self.lock:
+            self.reserved_tokens -= tokens
+            self.stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            self.stats["completion_tokens"] += usage.get("completion_tokens", 0)
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def summarize_user(self, phone_number):
+        """Summarize one user if they have new messages since their last summary"""
+        try:
+            last = get_recent_messages(phone_number, 1)
+        except DatabaseUnavailableError:
+            self._count("failed")
+            return
+        last_seq = last[-1]["seq"] if last else 0
+        with self.lock:
+            unchanged = self.state["summarized"].get(phone_number) == last_seq
+        if unchanged or not last:
+            self._count("skipped")
+            return
+
+        result = summarize_patient(phone_number, self._before_call, self._after_call, self.cache)
+        if result["deferred"]:
+            self._count("deferred")
+            return
+        if not result["success"]:
+            logger.error("Could not summarize %s: %s", phone_number, result['error'])
+            self._count("failed")
+            return
+
+        usage = result["usage"]
+        last_seq = result["last_seq"]
+        record = {
+            "phone_number": phone_number,
+            "summary": result["summary"],
+            "last_seq": last_seq,
+            "model": SUMMARY_MODEL,
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        if not self._write(record):
+            self._count("failed")
+            return
+        with self.lock:
+            self.state["summarized"][phone_number] = last_seq
+            self.stats["summarized"] += 1
+            save_due = time.monotonic() - self.last_saved > 1.0
+        if save_due:
+            self._save_state()
+
+    def run(self):
+        """
+        Summarize all users from the saved cursor on
+
+        Returns:
+            bool: True if every user was visited, False if the run stopped early
+        """
+        completed = False
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while not self.budget_exhausted:
+                page = get_users_page(self.state["cursor"], self.page_size)
+                if page is None:
+                    logger.error("Could not read users, stopping; the run can be resumed")
+                    break
+                phone_numbers = [user["phone_number"] for user in page]
+                list(executor.map(self.summarize_user, phone_numbers))
+                self.stats["users"] += len(phone_numbers)
+                if self.budget_exhausted:
+                    # Keep the cursor so the deferred users of this page are retried
+                    logger.warning("Token budget exhausted, stopping; the run can be resumed")
+                    break
+                if len(page) < self.page_size:
+                    completed = True
+                    break
+                self.state["cursor"] = phone_numbers[-1]
+                self._save_state()
+        if completed:
+            # The next run starts over, skipping users without new messages
+            self.state["cursor"] = None
+        self._save_state()
+        return completed
+
+    def cost(self):
+        """Estimated cost of the tokens used so far, in USD"""
+        return (self.stats["prompt_tokens"] * SUMMARY_PRICE_INPUT
+                + self.stats["completion_tokens"] * SUMMARY_PRICE_OUTPUT) / 1e6
+
+def run_batch(args):
+    """Run a batch summarization from the command line arguments and print a report"""
+    summarizer = BatchSummarizer(
+        args.output,
+        args.state,
+        workers=args.workers,
+        rate=args.rate,
+        token_budget=args.token_budget,
+        page_size=args.page_size
+    )
+    start = time.monotonic()
+    completed = summarizer.run()
+    elapsed = time.monotonic() - start
+
+    stats = summarizer.stats
+    print(f"Visited {stats['users']} users in {elapsed:.1f}s: {stats['summarized']} summarized, "
+          f"{stats['skipped']} unchanged, {stats['failed']} failed, {stats['deferred']} deferred")
+    print(f"Throughput: {stats['summarized'] / elapsed if elapsed else 0:.2f} summaries/s")
+    print(f"Tokens: {stats['prompt_tokens']} prompt + {stats['completion_tokens']} completion, "
+          f"estimated cost ${summarizer.cost():.4f}")
+    if not completed:
+        print("Run incomplete, rerun with the same --state to resume")
+    return 0 if completed and not stats["failed"] else 1
+
+def main(argv=None):
     """Main function to run the summarization tool"""
+    parser = argparse.ArgumentParser(description="Summarize patients' medical histories")
+    parser.add_argument("--all", action="store_true", help="summarize every patient in the database")
+    parser.add_argument("--output", default="summaries.jsonl", help="JSONL file to append to, or 'table' for the summaries table")
+    parser.add_argument("--state", default="summaries_state.json", help="checkpoint file used to resume and skip unchanged patients")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent OpenAI calls")
+    parser.add_argument("--rate", type=float, default=5.0, help="maximum OpenAI calls per second (0 for no limit)")
+    parser.add_argument("--token-budget", type=int, default=0, help="stop after using about this many tokens (0 for no limit)")
+    parser.add_argument("--page-size", type=int, default=200, help="users read from the database per page")
+    args = parser.parse_args(argv)
+    
+    if args.all:
+        return run_batch(args)
+    
     print("Medical History Summarization Tool")
     print("==================================")
     
@@ -145,4 +514,4 @@ def main():
         print(f"\nError: {result['error']}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
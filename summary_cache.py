@@ -0,0 +1,158 @@
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", "summary_cache.db")
+# Least recently used summaries beyond this many are deleted
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "10000"))
+
+def hash_parameters(parameters):
+    """Hash everything besides the history that determines a summary (prompts, model, sampling)"""
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode("utf-8")).hexdigest()
+
+def extend_history_hash(previous_hash, messages):
+    """
+    Extend a rolling hash of a transcript with more messages
+
+    The hash after a message only depends on the messages up to it, so a
+    transcript hashed in one go or a page at a time gives the same value.
+    """
+    digest = previous_hash or ""
+    for message in messages:
+        data = f"{digest}\x1e{message['role']}\x1f{message['content']}"
+        digest = hashlib.sha256(data.encode("utf-8")).hexdigest()
+    return digest
+
+def summary_key(parameters, history_hash):
+    """Cache key of the summary of a transcript under the given parameters"""
+    return hashlib.sha256(f"{parameters}:{history_hash}".encode("utf-8")).hexdigest()
+
+class SummaryCache:
+    """
+    Persistent cache of history summaries in a local SQLite file
+
+    Entries are keyed by the hash of the transcript and of the summarization
+    parameters, so identical transcripts share a summary. The latest entry of
+    a patient is also found by phone number, so that only the messages added
+    since can be summarized on top of it.
+    """
+
+    # Evict every this many writes
+    EVICT_INTERVAL = 100
+
+    def __init__(self, path=SUMMARY_CACHE_PATH, max_entries=SUMMARY_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._stats = {"hits": 0, "misses": 0, "incremental": 0, "full": 0, "evictions": 0}
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "key TEXT NOT NULL, phone_number TEXT NOT NULL, parameters TEXT NOT NULL, "
+            "last_seq INTEGER NOT NULL, history_hash TEXT NOT NULL, increments INTEGER NOT NULL, "
+            "summary TEXT NOT NULL, accessed_at REAL NOT NULL, PRIMARY KEY (phone_number, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS summaries_key ON summaries (key)")
+        conn.execute("CREATE INDEX IF NOT EXISTS summaries_patient ON summaries (phone_number, parameters, last_seq)")
+        conn.execute("CREATE INDEX IF NOT EXISTS summaries_accessed_at ON summaries (accessed_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def count(self, key):
+        """Increment one of the hit/miss/incremental/full counters"""
+        with self._lock:
+            self._stats[key] += 1
+
+    def _touch(self, row):
+        if row is None:
+            return None
+        self._connect().execute(
+            "UPDATE summaries SET accessed_at = ? WHERE phone_number = ? AND key = ?",
+            (time.time(), row["phone_number"], row["key"])
+        )
+        return dict(row)
+
+    def get(self, key):
+        """Return an entry stored under a key, for any patient, or None"""
+        row = self._connect().execute("SELECT * FROM summaries WHERE key = ? LIMIT 1", (key,)).fetchone()
+        return self._touch(row)
+
+    def latest(self, phone_number, parameters):
+        """Return the patient's entry covering the most messages for these parameters, or None"""
+        row = self._connect().execute(
+            "SELECT * FROM summaries WHERE phone_number = ? AND parameters = ? ORDER BY last_seq DESC LIMIT 1",
+            (phone_number, parameters)
+        ).fetchone()
+        return self._touch(row)
+
+    def put(self, key, phone_number, parameters, last_seq, history_hash, increments, summary):
+        """Store a summary, evicting the least recently used entries beyond the size bound"""
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO summaries "
+            "(key, phone_number, parameters, last_seq, history_hash, increments, summary, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, phone_number, parameters, last_seq, history_hash, increments, summary, time.time())
+        )
+        # Older summaries of the patient are superseded by this one
+        conn.execute(
+            "DELETE FROM summaries WHERE phone_number = ? AND parameters = ? AND last_seq < ?",
+            (phone_number, parameters, last_seq)
+        )
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.EVICT_INTERVAL == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries beyond max_entries"""
+        cursor = self._connect().execute(
+            "DELETE FROM summaries WHERE rowid IN ("
+            "SELECT rowid FROM summaries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        if cursor.rowcount > 0:
+            with self._lock:
+                self._stats["evictions"] += cursor.rowcount
+            logger.info("Evicted %s cached summaries", cursor.rowcount)
+
+    def stats(self):
+        """Return hit, miss, incremental, full and eviction counters and the number of entries"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["entries"] = self._connect().execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        return stats
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_summary_cache():
+    """Create and return the process-wide summary cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SummaryCache()
+    return _cache
@@ -0,0 +1,29 @@
+-- Store conversation messages as rows instead of one JSON blob per user.
+-- Run after supabase_migration.sql. Safe to run more than once.
+CREATE TABLE IF NOT EXISTS messages (
+    seq BIGSERIAL PRIMARY KEY,
+    phone_number VARCHAR(20) NOT NULL REFERENCES users(phone_number) ON DELETE CASCADE,
+    role VARCHAR(16) NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Transcripts are always read per user in seq order
+CREATE INDEX IF NOT EXISTS messages_phone_number_seq_idx ON messages (phone_number, seq);
+
+-- Backfill from the medical_history JSON blobs, keeping each transcript in
+-- order. Users that already have messages are skipped, so re-running the
+-- migration does not duplicate them.
+INSERT INTO messages (phone_number, role, content, created_at)
+SELECT u.phone_number, m.value->>'role', m.value->>'content', u.updated_at
+FROM users u
+CROSS JOIN LATERAL jsonb_array_elements(u.medical_history::jsonb) WITH ORDINALITY AS m(value, position)
+WHERE left(btrim(u.medical_history), 1) = '['
+  AND m.value ? 'role'
+  AND m.value ? 'content'
+  AND NOT EXISTS (SELECT 1 FROM messages existing WHERE existing.phone_number = u.phone_number)
+ORDER BY u.phone_number, m.position;
+
+-- medical_history is no longer written by the application. It is kept for
+-- rollback and can be cleared once the backfill has been checked:
+-- UPDATE users SET medical_history = NULL;
@@ -4,6 +4,8 @@ CREATE TABLE IF NOT EXISTS users (
     name VARCHAR(100),
     age INTEGER,
     gender VARCHAR(10),
+    previous_health_issues TEXT,
+    surgeries TEXT,
     medical_history TEXT,
     language VARCHAR(10) DEFAULT 'en',
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
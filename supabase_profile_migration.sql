@@ -0,0 +1,5 @@
+-- Store the onboarding answers that were only kept in the session, so
+-- returning users aren't asked them again.
+-- Run after supabase_migration.sql. Safe to run more than once.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS previous_health_issues TEXT;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS surgeries TEXT;
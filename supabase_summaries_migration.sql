@@ -0,0 +1,11 @@
+-- Latest summary per patient, written by `python summarize_history.py --all --output table`.
+-- Run after supabase_messages_migration.sql.
+CREATE TABLE IF NOT EXISTS summaries (
+    phone_number VARCHAR(20) PRIMARY KEY REFERENCES users(phone_number) ON DELETE CASCADE,
+    summary TEXT NOT NULL,
+    last_seq BIGINT NOT NULL,
+    model VARCHAR(50),
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);